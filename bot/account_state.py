@@ -0,0 +1,110 @@
+"""
+Per-wallet account snapshots fed by the webData2 WS channel.
+
+webData2 pushes the full clearinghouse state (plus spot balances when the
+wallet holds any) for every subscribed wallet. Handlers, the delta-neutral
+monitor and the overview context read these snapshots first and only go to
+the REST info endpoint when a snapshot is older than ACCOUNT_STATE_MAX_AGE_SEC.
+REST results are stored back so repeated reads within the window stay local.
+"""
+import time
+
+from bot.config import settings
+from bot.services import (
+    extract_avg_entry_from_balance,
+    get_mid_price,
+    get_perps_state,
+    get_symbol_name,
+    get_user_state,
+)
+
+# wallet -> (updated_at, payload)
+_perps: dict[str, tuple[float, dict]] = {}
+_spot: dict[str, tuple[float, list]] = {}
+
+
+def update_from_web_data2(wallet: str, data: dict, now: float | None = None) -> None:
+    """Stores the clearinghouse/spot state carried by one webData2 message."""
+    wallet = wallet.lower()
+    now = time.time() if now is None else now
+    perps = data.get("clearinghouseState")
+    if isinstance(perps, dict):
+        _perps[wallet] = (now, perps)
+    spot = data.get("spotState")
+    if isinstance(spot, dict) and isinstance(spot.get("balances"), list):
+        _spot[wallet] = (now, spot["balances"])
+
+
+def _fresh(cache: dict, wallet: str, max_age: float | None):
+    hit = cache.get(wallet.lower())
+    ttl = settings.ACCOUNT_STATE_MAX_AGE_SEC if max_age is None else max_age
+    if hit and time.time() - hit[0] < ttl:
+        return hit[1]
+    return None
+
+
+def get_cached_perps_state(wallet: str, max_age: float | None = None) -> dict | None:
+    return _fresh(_perps, wallet, max_age)
+
+
+def get_cached_spot_balances(wallet: str, max_age: float | None = None) -> list | None:
+    return _fresh(_spot, wallet, max_age)
+
+
+async def get_account_perps_state(wallet: str, max_age: float | None = None):
+    """Clearinghouse state from the live snapshot, or REST when it is stale."""
+    cached = get_cached_perps_state(wallet, max_age)
+    if cached is not None:
+        return cached
+    state = await get_perps_state(wallet)
+    if isinstance(state, dict):
+        _perps[wallet.lower()] = (time.time(), state)
+    return state
+
+
+async def get_account_spot_balances(wallet: str, max_age: float | None = None) -> list[dict]:
+    """Spot balances from the live snapshot, or REST when it is stale."""
+    cached = get_cached_spot_balances(wallet, max_age)
+    if cached is not None:
+        return cached
+    state = await get_user_state(wallet)
+    if not isinstance(state, dict):
+        return []
+    balances = state.get("balances") if isinstance(state.get("balances"), list) else []
+    _spot[wallet.lower()] = (time.time(), balances)
+    return balances
+
+
+async def account_equity(wallet: str, ws=None) -> tuple[float, float] | None:
+    """
+    (equity, unrealized PnL) of a wallet from its account snapshot: perps
+    account value plus spot holdings at current mids. Returns None when
+    neither side of the account could be read.
+    """
+    perps = await get_account_perps_state(wallet)
+    spot = await get_account_spot_balances(wallet)
+    if not isinstance(perps, dict) and not spot:
+        return None
+
+    equity = upnl = 0.0
+    if isinstance(perps, dict):
+        equity += float((perps.get("marginSummary") or {}).get("accountValue", 0) or 0)
+        for p in perps.get("assetPositions", []):
+            upnl += float((p.get("position") or {}).get("unrealizedPnl", 0) or 0)
+    for b in spot or []:
+        coin, amount = b.get("coin"), float(b.get("total", 0) or 0)
+        if not coin or amount <= 0:
+            continue
+        sym = await get_symbol_name(coin, is_spot=True)
+        px = (ws.get_price(sym, coin) if ws else 0.0) or await get_mid_price(sym, coin)
+        equity += amount * px
+        entry = extract_avg_entry_from_balance(b)
+        if entry > 0 and px > 0 and sym != "USDC":
+            upnl += (px - entry) * amount
+    return equity, upnl
+
+
+def forget_wallet(wallet: str) -> None:
+    wallet = wallet.lower()
+    _perps.pop(wallet, None)
+    _spot.pop(wallet, None)
@@ -11,3 +11,15 @@ def tool_timeout() -> int:
 
 def pipeline_timeout() -> int:
     return int(getattr(settings, "AGENT_PIPELINE_TIMEOUT_SEC", 120) or 120)
+
+
+def market_stage_ttl() -> int:
+    return int(getattr(settings, "AGENT_MARKET_STAGE_TTL_MIN", 20) or 20) * 60
+
+
+def snapshot_ttl() -> int:
+    return int(getattr(settings, "AGENT_SNAPSHOT_TTL_SEC", 120) or 120)
+
+
+def sources_memo_ttl() -> int:
+    return int(getattr(settings, "AGENT_SOURCES_MEMO_TTL_MIN", 20) or 20) * 60
@@ -138,6 +138,20 @@ class PortfolioRelevantEvent:
     suggested_risk_focus: str
 
 
+@dataclass
+class MarketStage:
+    """Market-level half of an agent run, reused by every user's personalization."""
+    stage_id: str
+    mode: str
+    snapshot: MarketSnapshot = field(default_factory=MarketSnapshot)
+    regime: MarketRegime = field(default_factory=MarketRegime)
+    events: list[MarketEvent] = field(default_factory=list)
+    sources: list[SourceItem] = field(default_factory=list)
+    errors: list[dict[str, Any]] = field(default_factory=list)
+    used_tools: list[str] = field(default_factory=list)
+    created_at: float = field(default_factory=_now)
+
+
 @dataclass
 class FinalAgentReport:
     run_id: str
@@ -4,10 +4,19 @@ import asyncio
 import hashlib
 import json
 import logging
-from typing import Any
+import time
+from dataclasses import replace
+from typing import Any, Awaitable, Callable
 
-from bot.agent.config import pipeline_timeout
-from bot.agent.context import AgentRunContext, FinalAgentReport, MarketSnapshot
+from bot.agent.config import market_stage_ttl, pipeline_timeout, snapshot_ttl, sources_memo_ttl
+from bot.agent.context import (
+    AgentRunContext,
+    FinalAgentReport,
+    MarketSnapshot,
+    MarketStage,
+    PortfolioRelevantEvent,
+    to_plain,
+)
 from bot.agent.memory.event_store import EventStore
 from bot.agent.memory.run_store import RunStore
 from bot.agent.memory.source_cache import SourceCache
@@ -29,6 +38,74 @@ from bot.config import settings
 
 logger = logging.getLogger(__name__)
 
+_SYNTHESIS_CACHE_MAX = 256
+_STAGE_MEMO_MAX = 256
+
+
+class StageMemo:
+    """
+    In-process memo for agent stages (snapshot, sources, events, market
+    stage), each reused by any caller within its own TTL. Concurrent callers
+    that miss wait on the same build instead of each starting their own.
+    """
+
+    def __init__(self) -> None:
+        self._entries: dict[tuple, tuple[float, float, Any]] = {}  # key -> (stored_at, ttl, value)
+        self._inflight: dict[tuple, asyncio.Future] = {}
+
+    def fresh(self, key: tuple, ttl: float) -> Any | None:
+        entry = self._entries.get(key)
+        if entry and time.time() - entry[0] < ttl:
+            return entry[2]
+        return None
+
+    def put(self, key: tuple, value: Any, ttl: float) -> None:
+        now = time.time()
+        if len(self._entries) >= _STAGE_MEMO_MAX:
+            for old_key, (ts, old_ttl, _) in list(self._entries.items()):
+                if now - ts >= old_ttl:
+                    del self._entries[old_key]
+            if len(self._entries) >= _STAGE_MEMO_MAX:
+                del self._entries[min(self._entries, key=lambda k: self._entries[k][0])]
+        self._entries[key] = (now, ttl, value)
+
+    async def get(
+        self,
+        key: tuple,
+        ttl: float,
+        build: Callable[[], Awaitable[Any]],
+        refresh: bool = False,
+    ) -> tuple[Any, bool]:
+        """Returns (value, built) where built is True only for the caller that ran `build`."""
+        if not refresh:
+            value = self.fresh(key, ttl)
+            if value is not None:
+                return value, False
+        task = self._inflight.get(key)
+        built = task is None
+        if task is None:
+            task = asyncio.ensure_future(build())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t: self._inflight.pop(key, None))
+        value = await asyncio.shield(task)
+        if built:
+            self.put(key, value, ttl)
+        return value, built
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+stage_memo = StageMemo()
+
+# Synthesized outputs keyed by stage + the inputs that differ per user, so
+# users whose relevant exposure and settings match share one LLM call
+_synthesis_cache: dict[str, tuple[float, dict[str, Any]]] = {}
+
+
+def _stable_hash(value: Any) -> str:
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
 
 class AgentOrchestrator:
     def __init__(
@@ -38,12 +115,14 @@ class AgentOrchestrator:
         run_store: RunStore | None = None,
         event_store: EventStore | None = None,
         source_cache: SourceCache | None = None,
+        memo: StageMemo | None = None,
     ) -> None:
         self.registry = registry or self._default_registry()
         self.event_extractor = event_extractor or EventExtractor()
         self.run_store = run_store or RunStore()
         self.event_store = event_store or EventStore()
         self.source_cache = source_cache or SourceCache()
+        self.memo = memo or stage_memo
         self.hyperliquid = HyperliquidTool()
         self.farside = FarsideTool()
         self.fear_greed = FearGreedTool()
@@ -77,7 +156,7 @@ class AgentOrchestrator:
             timeout=pipeline_timeout(),
         )
 
-    async def _run(
+    def _context(
         self,
         mode: str,
         user_id=None,
@@ -85,8 +164,8 @@ class AgentOrchestrator:
         lang: str = "en",
         custom_prompt: str | None = None,
         style: str = "detailed",
-    ) -> FinalAgentReport:
-        context = AgentRunContext(
+    ) -> AgentRunContext:
+        return AgentRunContext(
             mode=mode,
             user_id=user_id,
             event_data=event_data,
@@ -96,31 +175,171 @@ class AgentOrchestrator:
             max_sources=int(getattr(settings, "AGENT_MAX_SOURCES_PER_RUN", 80) or 80),
             max_queries=int(getattr(settings, "AGENT_MAX_SEARCH_QUERIES", 12) or 12),
         )
-        snapshot = await self.collect_market_snapshot(context)
-        queries = self.plan_search_queries(context, snapshot)
-        raw_sources = await self.registry.run_collectors(context, queries)
-        sources = dedupe_sources(raw_sources)
-        scored = score_sources(sources)
-        top_sources = [item for item, _score in scored[: context.max_sources]]
-        events = await self.event_extractor.extract(context, top_sources)
+
+    async def _run(
+        self,
+        mode: str,
+        user_id=None,
+        event_data: dict[str, Any] | None = None,
+        lang: str = "en",
+        custom_prompt: str | None = None,
+        style: str = "detailed",
+    ) -> FinalAgentReport:
+        context = self._context(mode, user_id, event_data, lang, custom_prompt, style)
+        stage = await self.run_market_stage(context)
+        return await self.personalize(context, stage)
+
+    async def run_shared(
+        self,
+        user_id=None,
+        lang: str = "en",
+        custom_prompt: str | None = None,
+        style: str = "detailed",
+        mode: str = "overview",
+    ) -> FinalAgentReport:
+        """
+        Same report as run(), but the market stage comes from the shared cache
+        so only exposure, relevance and synthesis run per user. The stage
+        does not depend on language; the synthesis does.
+        """
+        async def pipeline() -> FinalAgentReport:
+            stage, _built = await self.memo.get(
+                ("stage", mode), market_stage_ttl(), lambda: self.run_market_stage(self._context(mode)),
+            )
+            context = self._context(mode, user_id, None, lang, custom_prompt, style)
+            context.errors.extend(stage.errors)
+            context.used_tools.extend(stage.used_tools)
+            return await self.personalize(context, stage)
+
+        return await asyncio.wait_for(pipeline(), timeout=pipeline_timeout())
+
+    async def refresh_market_stage(self, mode: str = "overview") -> MarketStage:
+        """
+        Scheduled refresh: recollects sources and re-extracts events, then
+        publishes the stage that run_shared() callers pick up.
+        """
+        async def build() -> MarketStage:
+            return await self.run_market_stage(self._context(mode), refresh=True)
+
+        stage, _built = await asyncio.wait_for(
+            self.memo.get(("stage", mode), market_stage_ttl(), build, refresh=True),
+            timeout=pipeline_timeout(),
+        )
+        return stage
+
+    async def _memoized(
+        self,
+        context: AgentRunContext,
+        key: tuple,
+        ttl: float,
+        build: Callable[[AgentRunContext], Awaitable[Any]],
+        refresh: bool = False,
+    ) -> tuple[Any, bool]:
+        """
+        Runs `build` on a scratch context and replays the errors and tools it
+        recorded onto `context`, so memo hits report the same as the build.
+        """
+        async def run_build():
+            scratch = replace(context, errors=[], used_tools=[])
+            value = await build(scratch)
+            return value, scratch.errors, scratch.used_tools
+
+        (value, errors, used_tools), built = await self.memo.get(key, ttl, run_build, refresh=refresh)
+        context.errors.extend(errors)
+        context.used_tools.extend(used_tools)
+        return value, built
+
+    async def run_market_stage(self, context: AgentRunContext, refresh: bool = False) -> MarketStage:
+        """
+        Snapshot, collectors, dedupe, scoring, event extraction and regime:
+        nothing user-specific. Each step is memoized for its own TTL.
+        """
+        scope = (context.mode, _stable_hash(context.event_data))
+
+        snapshot, _ = await self._memoized(
+            context, ("snapshot",), snapshot_ttl(), self.collect_market_snapshot,
+        )
+
+        async def collect(ctx: AgentRunContext) -> list:
+            queries = self.plan_search_queries(ctx, snapshot)
+            raw_sources = await self.registry.run_collectors(ctx, queries)
+            scored = score_sources(dedupe_sources(raw_sources))
+            return [item for item, _score in scored[: ctx.max_sources]]
+
+        top_sources, _ = await self._memoized(
+            context, ("sources", *scope), sources_memo_ttl(), collect, refresh=refresh,
+        )
+
+        async def extract(ctx: AgentRunContext) -> list:
+            return await self.event_extractor.extract(ctx, top_sources)
+
+        events_key = ("events", *scope, _stable_hash([s.url for s in top_sources]))
+        events, extracted = await self._memoized(
+            context, events_key, sources_memo_ttl(), extract, refresh=refresh,
+        )
         regime = classify_market_regime(snapshot, events)
-        exposure = await build_portfolio_exposure(user_id)
-        relevance = map_portfolio_relevance(events, exposure)
-        output = await synthesize_final_report(context, snapshot, regime, events, relevance, top_sources)
+        stage = MarketStage(
+            stage_id=context.run_id,
+            mode=context.mode,
+            snapshot=snapshot,
+            regime=regime,
+            events=events,
+            sources=top_sources,
+            errors=list(context.errors),
+            used_tools=list(context.used_tools),
+        )
+        if extracted:
+            # Memo hits were already persisted by the run that built them
+            await self.persist_stage(context, stage)
+        return stage
+
+    async def personalize(self, context: AgentRunContext, stage: MarketStage) -> FinalAgentReport:
+        """Portfolio exposure, relevance mapping and final synthesis for one user."""
+        exposure = await build_portfolio_exposure(context.user_id)
+        relevance = map_portfolio_relevance(stage.events, exposure)
+        output = await self._synthesize(context, stage, relevance)
         report = FinalAgentReport(
             run_id=context.run_id,
-            mode=mode,
+            mode=context.mode,
             output=output,
-            market_snapshot=snapshot,
-            market_regime=regime,
-            events=events,
-            sources=top_sources,
+            market_snapshot=stage.snapshot,
+            market_regime=stage.regime,
+            events=stage.events,
+            sources=stage.sources,
             errors=context.errors,
             used_tools=context.used_tools,
         )
         await self.persist(context, report)
         return report
 
+    async def _synthesize(
+        self,
+        context: AgentRunContext,
+        stage: MarketStage,
+        relevance: list[PortfolioRelevantEvent],
+    ) -> dict[str, Any]:
+        key = hashlib.sha1(json.dumps({
+            "stage": stage.stage_id,
+            "lang": context.lang,
+            "style": context.style,
+            "custom_prompt": context.custom_prompt,
+            "relevance": [to_plain(r) for r in relevance[:8]],
+        }, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        now = time.time()
+        hit = _synthesis_cache.get(key)
+        if hit and now - hit[0] < market_stage_ttl():
+            return dict(hit[1])
+
+        output = await synthesize_final_report(context, stage.snapshot, stage.regime, stage.events, relevance, stage.sources)
+        if len(_synthesis_cache) >= _SYNTHESIS_CACHE_MAX:
+            for old_key, (ts, _) in list(_synthesis_cache.items()):
+                if now - ts >= market_stage_ttl():
+                    del _synthesis_cache[old_key]
+            if len(_synthesis_cache) >= _SYNTHESIS_CACHE_MAX:
+                del _synthesis_cache[min(_synthesis_cache, key=lambda k: _synthesis_cache[k][0])]
+        _synthesis_cache[key] = (now, output)
+        return dict(output)
+
     async def collect_market_snapshot(self, context: AgentRunContext) -> MarketSnapshot:
         snapshot = MarketSnapshot()
         results = await asyncio.gather(
@@ -165,6 +384,20 @@ class AgentOrchestrator:
                     queries.append(f"{row['name']} crypto news today")
         return queries[: context.max_queries]
 
+    async def persist_stage(self, context: AgentRunContext, stage: MarketStage) -> None:
+        """Stores the stage's events and top sources once, however many users reuse it."""
+        try:
+            cache_tasks = []
+            by_tool: dict[str, list] = {}
+            for source in stage.sources:
+                by_tool.setdefault(source.source_type or "unknown", []).append(source)
+            for tool_name, sources in by_tool.items():
+                cache_tasks.append(self.source_cache.put_many(tool_name, sources[:20]))
+            await asyncio.gather(self.event_store.upsert_many(stage.events), *cache_tasks)
+        except Exception as exc:
+            logger.debug("Agent stage persistence failed", exc_info=True)
+            context.add_error("persist_agent_stage", exc)
+
     async def persist(self, context: AgentRunContext, report: FinalAgentReport) -> None:
         input_hash = hashlib.sha1(json.dumps({
             "mode": context.mode,
@@ -174,21 +407,7 @@ class AgentOrchestrator:
             "style": context.style,
         }, sort_keys=True, default=str).encode("utf-8")).hexdigest()
         try:
-            cache_tasks = []
-            by_tool: dict[str, list] = {}
-            for source in report.sources:
-                by_tool.setdefault(source.source_type or "unknown", []).append(source)
-            for tool_name, sources in by_tool.items():
-                cache_tasks.append(self.source_cache.put_many(tool_name, sources[:20]))
-            await asyncio.gather(
-                self.run_store.save(report, user_id=context.user_id, started_at=context.started_at, input_hash=input_hash),
-                self.event_store.upsert_many(report.events),
-                *cache_tasks,
-            )
+            await self.run_store.save(report, user_id=context.user_id, started_at=context.started_at, input_hash=input_hash)
         except Exception as exc:
             logger.debug("Agent persistence failed", exc_info=True)
             context.add_error("persist_agent_run", exc)
-
-
-async def refresh_agent_sources(mode: str = "overview", lang: str = "en") -> FinalAgentReport:
-    return await AgentOrchestrator().run(mode=mode, lang=lang)
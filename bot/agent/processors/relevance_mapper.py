@@ -4,7 +4,8 @@ import asyncio
 
 from bot.agent.context import MarketEvent, PortfolioExposure, PortfolioRelevantEvent
 from bot.database import db
-from bot.services import get_perps_state, get_spot_balances, get_symbol_name
+from bot.account_state import get_account_perps_state, get_account_spot_balances
+from bot.services import get_symbol_name
 
 
 def _norm_symbol(value: str) -> str:
@@ -18,7 +19,7 @@ async def build_portfolio_exposure(user_id: int | str | None) -> PortfolioExposu
     watchlist = [_norm_symbol(s) for s in (await db.get_watchlist(user_id) or [])]
     exposure = PortfolioExposure(wallets=wallets, watchlist=watchlist)
     states = await asyncio.gather(*[
-        asyncio.gather(get_spot_balances(wallet), get_perps_state(wallet), return_exceptions=True)
+        asyncio.gather(get_account_spot_balances(wallet), get_account_perps_state(wallet), return_exceptions=True)
         for wallet in wallets
     ], return_exceptions=True)
     for wallet, state_pair in zip(wallets, states):
@@ -311,29 +311,20 @@ def calculate_trade_stats(fills: list) -> dict:
         "net_pnl": net_pnl
     }
 
-def format_funding_heatmap(assets_ctx: list, universe: list) -> str:
+def format_funding_heatmap(market, universe: list | None = None) -> str:
     """
     Generates a text-based Heatmap of funding rates.
+    `market` is a MarketState, or the raw assetCtxs list together with `universe`.
     """
-    # Create list of (Symbol, APR)
-    data = []
-    
-    for idx, ctx in enumerate(assets_ctx):
-        if idx >= len(universe):
-            break
-        
-        name = universe[idx]["name"]
-        funding = float(ctx.get("funding", 0))
-        apr = funding * 24 * 365 * 100
-        data.append((name, apr))
-        
-    # Sort by APR descending
-    data.sort(key=lambda x: x[1], reverse=True)
-    
-    # Top 5 Highest
-    top = data[:5]
-    # Top 5 Lowest (Negative)
-    bottom = data[-5:]
+    state = _as_market_state(market, universe)
+    top, bottom = [], []
+    if state is not None:
+        # Ranked by APR descending
+        order = state.rank("funding_apr")
+        # Top 5 Highest
+        top = [(state.names[i], float(state.funding_apr[i])) for i in order[:5]]
+        # Top 5 Lowest (Negative)
+        bottom = [(state.names[i], float(state.funding_apr[i])) for i in order[-5:]]
     
     lines = ["🔥 <b>Highest Funding (APR)</b>"]
     for sym, apr in top:
@@ -807,123 +798,68 @@ def prepare_pnl_card_data(data: dict) -> dict:
         "is_positive": is_positive
     }
 
-def prepare_liquidity_data(assets_ctx: list, universe: list) -> dict:
+def _as_market_state(market, universe: list | None) -> "MarketState | None":
+    """Accepts a MarketState or the raw (assetCtxs, universe) pair."""
+    from bot.market_state import MarketState
+    if isinstance(market, MarketState):
+        return market
+    return MarketState.from_context([{"universe": universe or []}, market or []])
+
+def prepare_liquidity_data(market, universe: list | None = None) -> dict:
     """
     Prepares metrics for the Liquidity & Depth dashboard.
+    `market` is a MarketState, or the raw assetCtxs list together with `universe`.
     """
-    import pandas as pd
     from datetime import datetime
-    
-    data = []
-    total_oi = 0.0
-    
-    for i, u in enumerate(universe):
-        if i >= len(assets_ctx):
-            break
-        ctx = assets_ctx[i]
-        name = u["name"]
-        mark = float(ctx.get("markPx", 0))
-        oi = float(ctx.get("openInterest", 0)) * mark
-        total_oi += oi
-        
-        # Slippage calculation
-        # impactPxs is [bid_impact, ask_impact] for a specific notional (usually $100k)
-        impact_pxs = ctx.get("impactPxs")
-        slippage = 99.9 # Default to high slippage (no liquidity data)
-        
-        if impact_pxs and isinstance(impact_pxs, list) and len(impact_pxs) >= 2 and mark > 0:
-            try:
-                bid_impact = float(impact_pxs[0])
-                ask_impact = float(impact_pxs[1])
-                if bid_impact > 0 and ask_impact > 0:
-                    # Calculate simple slippage relative to mark
-                    slippage = (abs(ask_impact - mark) + abs(mark - bid_impact)) / (2 * mark) * 100
-                    # If impacts are exactly equal to mark, it's likely stale/placeholder data
-                    if slippage == 0:
-                        slippage = 99.9
-            except (ValueError, TypeError):
-                slippage = 99.9
-
-        # Day High/Low for Volatility
-        # Note: HL API might not give 1h H/L directly in meta, but we use 24h as proxy or check if available
-        # For now, let's use the 24h change as a simplified vol proxy or other metrics
-        
-        data.append({
-            "name": name, 
-            "slippage": slippage, 
-            "oi": oi,
-            "vol_proxy": abs(float(ctx.get("funding", 0)) * 10000) # Funding as volatility proxy
-        })
-        
-    df = pd.DataFrame(data)
-    if df.empty:
+
+    state = _as_market_state(market, universe)
+    if state is None:
         return {}
 
-    # Sorts
-    deepest = df.sort_values("slippage", ascending=True).head(8)
-    highest_vol = df.sort_values("vol_proxy", ascending=False).head(5)
-    highest_oi = df.sort_values("oi", ascending=False).head(5)
+    # Slippage (from impactPxs), funding vol proxy and rankings are derived once per state
+    m = state.metrics
+    names = state.names
+    deepest = state.rank("slippage", descending=False)[:8]
+    highest_vol = state.rank("vol_proxy")[:5]
+    highest_oi = state.rank("oi_usd")[:5]
 
     return {
         "date": datetime.now().strftime("%d %b %Y • %H:%M"),
-        "total_oi": f"{total_oi/1e6:,.1f}M",
-        "slippage_data": [{"name": r["name"], "slippage": round(r["slippage"], 3), "bar_width": min(100, r["slippage"]*200)} for _, r in deepest.iterrows()],
-        "vol_data": [{"name": r["name"], "vol": round(r["vol_proxy"], 2)} for _, r in highest_vol.iterrows()],
-        "oi_data": [{"name": r["name"], "oi": round(r["oi"]/1e6, 1)} for _, r in highest_oi.iterrows()],
-        "best_execution": deepest.iloc[0]["name"] if not deepest.empty else "N/A",
-        "worst_execution": df.sort_values("slippage", ascending=False).iloc[0]["name"] if not df.empty else "N/A"
+        "total_oi": f"{m.total_oi/1e6:,.1f}M",
+        "slippage_data": [{"name": names[i], "slippage": round(float(m.slippage[i]), 3), "bar_width": min(100, float(m.slippage[i])*200)} for i in deepest],
+        "vol_data": [{"name": names[i], "vol": round(float(m.vol_proxy[i]), 2)} for i in highest_vol],
+        "oi_data": [{"name": names[i], "oi": round(float(state.oi_usd[i])/1e6, 1)} for i in highest_oi],
+        "best_execution": names[deepest[0]],
+        "worst_execution": names[state.rank("slippage")[0]]
     }
 
-def prepare_modern_market_data(assets_ctx: list, universe: list, hlp_info: dict = None) -> dict:
+def prepare_modern_market_data(market, universe: list | None = None, hlp_info: dict = None) -> dict:
 
     """
     Prepares a structured dict for the HTML/CSS modern dashboard.
+    `market` is a MarketState, or the raw assetCtxs list together with `universe`.
     """
-    import pandas as pd
     from datetime import datetime
-    
-    data = []
-    global_vol = 0.0
-    total_oi = 0.0
-    
-    for i, u in enumerate(universe):
-        if i >= len(assets_ctx):
-            break
-        ctx = assets_ctx[i]
-        name = u["name"]
-        mark = float(ctx.get("markPx", 0))
-        oracle = float(ctx.get("oraclePx", mark))
-        prev_day = float(ctx.get("prevDayPx", 0) or mark)
-        funding = float(ctx.get("funding", 0)) * 24 * 365 * 100
-        vol = float(ctx.get("dayNtlVlm", 0))
-        oi = float(ctx.get("openInterest", 0)) * mark
-        
-        change_24h = ((mark - prev_day) / prev_day) * 100 if prev_day > 0 else 0.0
-        basis = ((mark - oracle) / oracle) * 100 if oracle > 0 else 0.0
-        efficiency = vol / oi if oi > 0 else 0
-        
-        global_vol += vol
-        total_oi += oi
-        
-        data.append({
-            "name": name, "price": mark, "change": change_24h,
-            "funding": funding, "vol": vol, "oi": oi,
-            "basis": basis, "efficiency": efficiency
-        })
-        
-    df = pd.DataFrame(data)
-    if df.empty:
+
+    state = _as_market_state(market, universe)
+    if state is None:
         return {}
 
-    # Sorts
-    gainers = df.sort_values("change", ascending=False).head(5)
-    losers = df.sort_values("change", ascending=True).head(5)
-    efficiency_top = df.sort_values("efficiency", ascending=False).head(5)
-    funding_map = df.sort_values("vol", ascending=False).head(25) # Show top 25 assets for heatmap grid
+    m = state.metrics
+    names = state.names
+    change, volume = state.change_24h, state.volume
+
+    def mover(i):
+        return {"name": names[i], "change": round(float(change[i]), 2), "price": pretty_float(float(state.mark[i])), "vol": round(float(volume[i])/1e6, 1)}
+
+    gainers = [mover(i) for i in state.rank("change_24h")[:5]]
+    losers = [mover(i) for i in state.rank("change_24h", descending=False)[:5]]
+    efficiency_top = state.rank("efficiency")[:5]
+    funding_map = state.rank("volume")[:25] # Show top 25 assets for heatmap grid
 
     # Sentiment Logic
-    avg_basis = df["basis"].mean()
-    avg_funding = df["funding"].mean()
+    avg_basis = m.avg_premium
+    avg_funding = m.avg_funding_apr
     sentiment = "NEUTRAL"
     
     if avg_basis > 0.1 or avg_funding > 80: 
@@ -961,58 +897,35 @@ def prepare_modern_market_data(assets_ctx: list, universe: list, hlp_info: dict
 
     return {
         "date": datetime.now().strftime("%d %b %Y • %H:%M"),
-        "global_volume": f"{global_vol/1e6:,.1f}M",
-        "total_oi": f"{total_oi/1e6:,.1f}M",
+        "global_volume": f"{m.global_volume/1e6:,.1f}M",
+        "total_oi": f"{m.total_oi/1e6:,.1f}M",
         "sentiment_label": sentiment,
         "avg_funding": round(avg_funding, 1),
         "avg_basis": round(avg_basis, 3),
-        "gainers": [{"name": r["name"], "change": round(r["change"], 2), "price": pretty_float(r["price"]), "vol": round(r["vol"]/1e6, 1)} for _, r in gainers.iterrows()],
-        "losers": [{"name": r["name"], "change": round(r["change"], 2), "price": pretty_float(r["price"]), "vol": round(r["vol"]/1e6, 1)} for _, r in losers.iterrows()],
-        "efficiency": [{"name": r["name"], "ratio": round(r["efficiency"], 1), "percent": min(100, r["efficiency"]*5)} for _, r in efficiency_top.iterrows()],
-        "funding_map": [{"name": r["name"], "apr": round(r["funding"], 1)} for _, r in funding_map.iterrows()],
+        "gainers": gainers,
+        "losers": losers,
+        "efficiency": [{"name": names[i], "ratio": round(float(m.efficiency[i]), 1), "percent": min(100, float(m.efficiency[i])*5)} for i in efficiency_top],
+        "funding_map": [{"name": names[i], "apr": round(float(state.funding_apr[i]), 1)} for i in funding_map],
         "hlp_price": hlp_price,
         "hlp_apr": hlp_apr
     }
 
-def prepare_coin_prices_data(assets_ctx: list, universe: list) -> dict:
+def prepare_coin_prices_data(market, universe: list | None = None) -> dict:
     """
     Prepares data for coin_prices.html
+    `market` is a MarketState, or the raw assetCtxs list together with `universe`.
     """
-    import pandas as pd
     from datetime import datetime
-    
-    data = []
-    for i, u in enumerate(universe):
-        if i >= len(assets_ctx):
-            break
-        ctx = assets_ctx[i]
-        name = u["name"]
-        mark = float(ctx.get("markPx", 0))
-        prev_day = float(ctx.get("prevDayPx", 0) or mark)
-        
-        change_24h = ((mark - prev_day) / prev_day) * 100 if prev_day > 0 else 0.0
-        
-        data.append({
-            "name": name,
-            "price": mark,
-            "change": change_24h,
-            "vol": float(ctx.get("dayNtlVlm", 0)) # To sort by volume
-        })
-        
-    df = pd.DataFrame(data)
-    if df.empty:
+
+    state = _as_market_state(market, universe)
+    if state is None:
         return {}
 
-    # Sort by Volume descending to show most relevant coins
-    df = df.sort_values("vol", ascending=False).head(33)
-    
-    coins = []
-    for _, row in df.iterrows():
-        coins.append({
-            "name": row["name"],
-            "price": pretty_float(row["price"]),
-            "change": round(row["change"], 2)
-        })
+    # Top 33 by volume to show most relevant coins
+    coins = [
+        {"name": state.names[i], "price": pretty_float(float(state.mark[i])), "change": round(float(state.change_24h[i]), 2)}
+        for i in state.rank("volume")[:33]
+    ]
 
     return {
         "date": datetime.now().strftime("%d %b %Y • %H:%M"),
@@ -1035,17 +948,21 @@ def prepare_terminal_dashboard_data_clean(
     """
     from datetime import datetime
     
-    # Sort positions by size (USD)
-    positions.sort(key=lambda x: abs(float(x.get("size_usd", 0))), reverse=True)
-    top_pos = positions[:5]
+    import heapq
+
+    # Largest positions by size (USD); only five are shown, so skip the full sort
+    top_pos = heapq.nlargest(5, positions, key=lambda x: abs(float(x.get("size_usd", 0))))
     
     # Format Assets
     total_assets_val = sum(a["value"] for a in assets)
     fmt_assets = []
-    for a in assets:
-        pct = (a["value"] / total_assets_val * 100) if total_assets_val > 0 else 0
-        if pct > 1:
-            fmt_assets.append({"name": a["name"], "percent": f"{pct:.1f}"})
+    if total_assets_val > 0:
+        # Anything at or below 1% of the total is hidden
+        cutoff = total_assets_val / 100
+        fmt_assets = [
+            {"name": a["name"], "percent": f"{a['value'] / total_assets_val * 100:.1f}"}
+            for a in assets if a["value"] > cutoff
+        ]
     
     # Format Positions
     fmt_positions = []
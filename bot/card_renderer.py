@@ -0,0 +1,331 @@
+"""
+Pillow backend for simple fixed-layout cards.
+
+Draws the layouts of bot/templates/pnl_card.html and account_flex.html
+without a browser. The output is not pixel-checked against the Chromium
+render; scripts/bench_render.py --compare-cards reports the difference.
+Static layers (background, grid, glow, logo, panels, localized labels) are
+cached per (template, size, scale, polarity, lang); each call only draws the
+dynamic text on a copy.
+"""
+import functools
+import os
+
+import matplotlib
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+from bot.locales import get_all_translations
+
+_FONT_DIR = os.path.join(matplotlib.get_data_path(), "fonts", "ttf")
+_FONTS = {
+    "regular": "DejaVuSans.ttf",
+    "bold": "DejaVuSans-Bold.ttf",
+    "mono": "DejaVuSansMono-Bold.ttf",
+}
+
+# Tailwind palette values used by the templates.
+BG = (5, 7, 10)
+WHITE = (255, 255, 255)
+SLATE_200 = (226, 232, 240)
+SLATE_400 = (148, 163, 184)
+SLATE_500 = (100, 116, 139)
+SLATE_600 = (71, 85, 105)
+SLATE_900 = (15, 23, 42)
+INDIGO_400 = (129, 140, 248)
+INDIGO_500 = (99, 102, 241)
+INDIGO_600 = (79, 70, 229)
+
+
+def _hex(value: str) -> tuple:
+    value = value.lstrip("#")
+    return tuple(int(value[i:i + 2], 16) for i in (0, 2, 4))
+
+
+@functools.lru_cache(maxsize=64)
+def _font(kind: str, size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(os.path.join(_FONT_DIR, _FONTS[kind]), size)
+
+
+class _Canvas:
+    """Drawing helpers that take CSS-pixel coordinates and apply the scale factor."""
+
+    def __init__(self, img: Image.Image, scale: float):
+        self.img = img
+        self.scale = scale
+        self.draw = ImageDraw.Draw(img, "RGBA")
+
+    def s(self, value: float) -> int:
+        return int(round(value * self.scale))
+
+    def font(self, kind: str, size: float) -> ImageFont.FreeTypeFont:
+        return _font(kind, max(1, self.s(size)))
+
+    def text_width(self, text: str, kind: str, size: float, spacing: float = 0) -> float:
+        f = self.font(kind, size)
+        if not spacing:
+            return f.getlength(text) / self.scale
+        return sum(f.getlength(ch) for ch in text) / self.scale + spacing * max(0, len(text) - 1)
+
+    def fit_size(self, text: str, kind: str, size: float, max_width: float, spacing: float = 0) -> float:
+        """Largest size <= `size` at which `text` fits in `max_width`."""
+        width = self.text_width(text, kind, size, spacing)
+        if width <= max_width:
+            return size
+        return size * max_width / width
+
+    def _draw_chars(self, draw, x, y, text, kind, size, fill, spacing):
+        f = self.font(kind, size)
+        if not spacing:
+            draw.text((self.s(x), self.s(y)), text, font=f, fill=fill, anchor="la")
+            return
+        for ch in text:
+            draw.text((self.s(x), self.s(y)), ch, font=f, fill=fill, anchor="la")
+            x += f.getlength(ch) / self.scale + spacing
+
+    def _aligned_x(self, x, width, align):
+        if align == "right":
+            return x - width
+        if align == "center":
+            return x - width / 2
+        return x
+
+    def text(self, x, y, text, kind, size, fill, spacing: float = 0, align: str = "left") -> float:
+        width = self.text_width(text, kind, size, spacing)
+        self._draw_chars(self.draw, self._aligned_x(x, width, align), y, text, kind, size, fill, spacing)
+        return width
+
+    def gradient_text(self, x, y, text, kind, size, top, bottom, spacing: float = 0, shadow: tuple | None = None) -> float:
+        """Text filled with a vertical gradient (CSS background-clip: text)."""
+        width = self.text_width(text, kind, size, spacing)
+        # Draw the glyph mask into a local box around the text, padded for the shadow blur.
+        pad = self.s(shadow[2]) * 3 if shadow else 0
+        ox, oy = self.s(x) - pad, self.s(y) - pad
+        mask = Image.new("L", (self.s(width + size) + 2 * pad, self.s(size * 1.4) + 2 * pad), 0)
+        self._draw_chars(ImageDraw.Draw(mask), x - ox / self.scale, y - oy / self.scale, text, kind, size, 255, spacing)
+        bbox = mask.getbbox()
+        if not bbox:
+            return width
+        if shadow:
+            color, offset, blur = shadow
+            glow = mask.filter(ImageFilter.GaussianBlur(self.s(blur))).point(lambda v: v * color[3] // 255)
+            self.img.paste(Image.new("RGB", glow.size, color[:3]), (ox, oy + self.s(offset)), glow)
+        w, h = bbox[2] - bbox[0], bbox[3] - bbox[1]
+        ramp = Image.linear_gradient("L").resize((w, h))
+        fill = Image.composite(Image.new("RGB", (w, h), bottom), Image.new("RGB", (w, h), top), ramp)
+        self.img.paste(fill, (ox + bbox[0], oy + bbox[1]), mask.crop(bbox))
+        return width
+
+    def rounded(self, box, radius, fill, outline=None):
+        x0, y0, x1, y1 = box
+        self.draw.rounded_rectangle(
+            (self.s(x0), self.s(y0), self.s(x1), self.s(y1)),
+            radius=self.s(radius),
+            fill=fill,
+            outline=outline,
+            width=max(1, self.s(1)) if outline else 0,
+        )
+
+    def pill(self, x_right, y, text, kind, size, text_color, fill, outline, pad_x=16, pad_y=8) -> float:
+        """Right-anchored rounded badge; returns its width."""
+        width = self.text_width(text, kind, size) + pad_x * 2
+        height = size * 1.5 + pad_y * 2
+        self.rounded((x_right - width, y, x_right, y + height), height / 2, fill, outline)
+        self.text(x_right - width + pad_x, y + pad_y + size * 0.15, text, kind, size, text_color)
+        return width
+
+
+def _grid(img: Image.Image, scale: float, step: int, alpha: float):
+    draw = ImageDraw.Draw(img, "RGBA")
+    a = int(255 * alpha)
+    width, height = img.size
+    line = max(1, int(round(scale)))
+    pos = 0.0
+    while pos < max(width, height):
+        p = int(round(pos))
+        draw.rectangle((0, p, width, p + line - 1), fill=(255, 255, 255, a))
+        draw.rectangle((p, 0, p + line - 1, height), fill=(255, 255, 255, a))
+        pos += step * scale
+
+
+def _radial_glow(img: Image.Image, center: tuple, radius: float, color: tuple, alpha: float):
+    """Blends `color` with alpha falling off linearly from `center` to `radius` (device px)."""
+    width, height = img.size
+    ys, xs = np.ogrid[:height, :width]
+    dist = np.sqrt((xs - center[0]) ** 2 + (ys - center[1]) ** 2) / radius
+    a = (np.clip(1.0 - dist, 0.0, 1.0) * alpha)[..., None]
+    base = np.asarray(img, dtype=np.float32)
+    out = base * (1 - a) + np.array(color, dtype=np.float32) * a
+    img.paste(Image.fromarray(out.astype(np.uint8)))
+
+
+def _radial_fill(width: int, height: int, inner: tuple, outer: tuple) -> Image.Image:
+    """Centered radial gradient reaching `outer` at the farthest corner."""
+    ys, xs = np.ogrid[:height, :width]
+    cx, cy = width / 2, height / 2
+    t = (np.sqrt((xs - cx) ** 2 + (ys - cy) ** 2) / np.hypot(cx, cy))[..., None]
+    out = np.array(inner, dtype=np.float32) * (1 - t) + np.array(outer, dtype=np.float32) * t
+    return Image.fromarray(out.astype(np.uint8))
+
+
+def _blurred_orb(img: Image.Image, scale: float, diameter: float, blur: float, color: tuple, opacity: float):
+    """CSS `filter: blur()` orb, blurred at quarter resolution to keep it cheap."""
+    width, height = img.size
+    k = 4
+    small = Image.new("L", (width // k, height // k), 0)
+    r = diameter * scale / 2 / k
+    cx, cy = small.size[0] / 2, small.size[1] / 2
+    ImageDraw.Draw(small).ellipse((cx - r, cy - r, cx + r, cy + r), fill=int(255 * opacity))
+    small = small.filter(ImageFilter.GaussianBlur(blur * scale / k))
+    mask = small.resize((width, height), Image.BILINEAR)
+    img.paste(Image.new("RGB", (width, height), color), (0, 0), mask)
+
+
+def _logo(c: _Canvas, x: float = 60, y: float = 60):
+    c.rounded((x, y, x + 48, y + 48), 12, INDIGO_600)
+    c.text(x + 24, y + 10, "V", "bold", 24, WHITE, align="center")
+
+
+# --- PNL CARD ---
+
+def _pnl_colors(is_positive: bool) -> dict:
+    if is_positive:
+        return {"accent": _hex("0ecb81"), "deep": _hex("059669"), "text": _hex("34d399")}
+    return {"accent": _hex("f6465d"), "deep": _hex("dc2626"), "text": _hex("fb7185")}
+
+
+@functools.lru_cache(maxsize=16)
+def _pnl_card_background(width: int, height: int, scale: float, is_positive: bool, lang: str) -> Image.Image:
+    t = get_all_translations(lang)
+    colors = _pnl_colors(is_positive)
+    img = Image.new("RGB", (int(width * scale), int(height * scale)), BG)
+    _grid(img, scale, 40, 0.03)
+    diag = np.hypot(img.size[0], img.size[1])
+    _radial_glow(img, (0, 0), diag / 2, colors["accent"], 0x15 / 255)
+    _radial_glow(img, img.size, diag / 2, INDIGO_500, 0x11 / 255)
+
+    c = _Canvas(img, scale)
+    _logo(c)
+    x = 124 + c.text(124, 60, "VELOX", "bold", 24, WHITE, spacing=-1.2) - 1.2
+    c.text(x, 60, "HL", "bold", 24, INDIGO_400, spacing=-1.2)
+    c.text(124, 92, "INSTITUTIONAL INTELLIGENCE", "bold", 8, SLATE_500, spacing=2.4)
+
+    c.text(60, 275, str(t.get("ui_roi", "ROI")).upper(), "bold", 12, SLATE_500, spacing=3)
+
+    c.rounded((60, 580, width - 60, 694), 24, (255, 255, 255, 8), (255, 255, 255, 20))
+    c.text(90, 610, str(t.get("ui_entry_price", "Entry Price")).upper(), "bold", 12, SLATE_500, spacing=3)
+    c.text(width - 90, 610, str(t.get("ui_mark_price", "Mark Price")).upper(), "bold", 12, SLATE_500, spacing=3, align="right")
+    c.text(width / 2, 726, "VELOX TERMINAL • POWERED BY HEDGE AI", "bold", 9, SLATE_600, spacing=4.5, align="center")
+    return img
+
+
+def paint_pnl_card(data: dict, lang: str = "ru", width: int = 800, height: int = 800, scale: float = 2) -> Image.Image:
+    t = get_all_translations(lang)
+    is_positive = bool(data.get("is_positive"))
+    colors = _pnl_colors(is_positive)
+    img = _pnl_card_background(width, height, scale, is_positive, lang).copy()
+    c = _Canvas(img, scale)
+
+    symbol_w = c.pill(width - 60, 60, str(data.get("symbol", "")).upper(), "bold", 16, WHITE, (255, 255, 255, 13), (255, 255, 255, 26))
+    c.pill(
+        width - 60 - symbol_w - 12, 60, f"{data.get('side', '')} {data.get('leverage', '')}X".upper(), "bold", 16,
+        colors["accent"], (*colors["accent"], 0x22), (*colors["accent"], 0x44),
+    )
+
+    roi = f"{data.get('roi', '')}%"
+    roi_size = c.fit_size(roi, "mono", 140, width - 120, spacing=-6)
+    c.gradient_text(60, 296, roi, "mono", roi_size, colors["accent"], colors["deep"], spacing=-6,
+                    shadow=((*colors["accent"], 0x33), 10, 20))
+
+    pnl = f"{'+' if is_positive else ''}${data.get('pnl', '')}"
+    pnl_w = c.text(60, 438, pnl, "bold", 36, colors["text"])
+    c.text(60 + pnl_w + 16, 455, str(t.get("ui_net_profit", "Net Profit")).upper(), "bold", 16, SLATE_500, spacing=3.2)
+
+    c.text(90, 632, f"${data.get('entry_price', '')}", "mono", 24, SLATE_200)
+    c.text(width - 90, 632, f"${data.get('mark_price', '')}", "mono", 24, SLATE_200, align="right")
+    return img
+
+
+# --- ACCOUNT FLEX ---
+
+def _flex_accent(is_positive: bool) -> tuple:
+    return _hex("10b981") if is_positive else _hex("f43f5e")
+
+
+def _wrap(c: _Canvas, text: str, kind: str, size: float, max_width: float) -> list[str]:
+    lines, current = [], ""
+    for word in text.split():
+        candidate = f"{current} {word}".strip()
+        if current and c.text_width(candidate, kind, size) > max_width:
+            lines.append(current)
+            current = word
+        else:
+            current = candidate
+    if current:
+        lines.append(current)
+    return lines
+
+
+@functools.lru_cache(maxsize=16)
+def _account_flex_background(width: int, height: int, scale: float, is_positive: bool, lang: str) -> Image.Image:
+    t = get_all_translations(lang)
+    img = _radial_fill(int(width * scale), int(height * scale), SLATE_900, BG)
+    _grid(img, scale, 40, 0.02)
+    _blurred_orb(img, scale, 600, 150, _flex_accent(is_positive), 0.12)
+
+    c = _Canvas(img, scale)
+    _logo(c)
+    x = 124 + c.text(124, 60, "VELOX ", "bold", 24, WHITE, spacing=-1.2) - 1.2
+    c.text(x, 60, "TERMINAL", "bold", 24, INDIGO_500, spacing=-1.2)
+    c.text(124, 92, "INSTITUTIONAL INTELLIGENCE", "bold", 8, SLATE_500, spacing=3.2)
+    c.text(width - 60, 60, str(t.get("ui_period", "Period")).upper(), "bold", 14, SLATE_500, spacing=3, align="right")
+
+    c.text(60, 308, str(t.get("ui_realized_pnl", "Realized PnL")).upper(), "bold", 14, SLATE_500, spacing=3)
+    blurb = str(t.get("ui_flex_blurb", "Performance metrics across all tracked sub-accounts."))
+    for i, line in enumerate(_wrap(c, blurb, "regular", 18, 448)):
+        c.text(60, 500 + i * 28, line, "regular", 18, SLATE_400)
+
+    c.text(width - 60, 686, "HYPERLIQUID L1", "bold", 20, INDIGO_400, spacing=-1, align="right")
+    c.text(width - 60, 718, "T.ME/VELOXHLBOT", "bold", 9, SLATE_500, spacing=0.9, align="right")
+    return img
+
+
+def paint_account_flex(data: dict, lang: str = "ru", width: int = 800, height: int = 800, scale: float = 2) -> Image.Image:
+    t = get_all_translations(lang)
+    is_positive = bool(data.get("is_positive"))
+    accent = _flex_accent(is_positive)
+    img = _account_flex_background(width, height, scale, is_positive, lang).copy()
+    c = _Canvas(img, scale)
+
+    period = str(data.get("period_label", "")).upper()
+    c.text(width - 60, 82, period, "bold", 18, INDIGO_400, spacing=-0.9, align="right")
+
+    label_w = c.text_width(str(t.get("ui_realized_pnl", "Realized PnL")).upper(), "bold", 14, spacing=3)
+    badge = f"{data.get('pnl_pct', '')}%"
+    badge_w = c.text_width(badge, "mono", 24) + 32
+    x0 = 60 + label_w + 16
+    c.rounded((x0, 294, x0 + badge_w, 342), 24, (*accent, 0x22), (*accent, 0x44))
+    c.text(x0 + 16, 302, badge, "mono", 24, accent)
+
+    pnl = f"{'+' if is_positive else ''}${data.get('abs_pnl', '')}"
+    size = c.fit_size(pnl, "mono", 110, width - 120, spacing=-5)
+    c.gradient_text(60, 370, pnl, "mono", size, WHITE, SLATE_400, spacing=-5)
+
+    account_label = str(t.get("ui_account", "Account")).upper()
+    date_label = str(t.get("ui_date", "Date")).upper()
+    wallet = str(data.get("wallet_label", ""))
+    date = str(data.get("date", ""))
+    col1 = max(c.text_width(account_label, "bold", 10, spacing=3), c.text_width(wallet, "bold", 16))
+    col2 = max(c.text_width(date_label, "bold", 10, spacing=3), c.text_width(date, "mono", 16))
+    c.rounded((60, 666, 60 + 32 + col1 + 40 + col2 + 32, 740), 30, (255, 255, 255, 8), (255, 255, 255, 20))
+    c.text(92, 682, account_label, "bold", 10, SLATE_500, spacing=3)
+    c.text(92, 700, wallet, "bold", 16, SLATE_200)
+    c.text(92 + col1 + 40, 682, date_label, "bold", 10, SLATE_500, spacing=3)
+    c.text(92 + col1 + 40, 700, date, "mono", 16, SLATE_200)
+    return img
+
+
+CARD_PAINTERS = {
+    "pnl_card.html": paint_pnl_card,
+    "account_flex.html": paint_account_flex,
+}
@@ -0,0 +1,152 @@
+"""
+Worker-process pool for the CPU-bound matplotlib/pandas functions in
+bot.analytics.
+
+Charts used to run on the event loop and stall WS ingestion and every other
+handler for hundreds of milliseconds. Here they run in spawned workers that
+import matplotlib, pandas and bot.analytics once at startup (including a
+throwaway figure to build the font cache). Results are memoized by a hash of
+the call's pickled inputs.
+"""
+import asyncio
+import copy
+import hashlib
+import io
+import logging
+import multiprocessing
+import pickle
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from bot.config import settings
+
+logger = logging.getLogger(__name__)
+
+# prepare_liquidity_data and the other prepare_* helpers stay out: they are
+# vectorized on the shared MarketState, cheaper inline than pickled to a worker.
+POOL_FUNCTIONS = frozenset({
+    "generate_pnl_chart",
+    "generate_portfolio_pie",
+    "generate_market_overview_image",
+    "generate_alpha_dashboard",
+    "generate_ecosystem_dashboard",
+})
+
+_executor: ProcessPoolExecutor | None = None
+_memo: "OrderedDict[str, tuple[float, str, object]]" = OrderedDict()
+
+
+def _warm_worker():
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import pandas  # noqa: F401
+    import bot.analytics  # noqa: F401
+
+    fig, ax = plt.subplots(figsize=(1, 1))
+    ax.plot([0, 1], [0, 1])
+    ax.set_title("warmup")
+    fig.savefig(io.BytesIO(), format="png")
+    plt.close(fig)
+
+
+def _noop() -> None:
+    return None
+
+
+def _call(name: str, args: tuple, kwargs: dict) -> tuple[str, object]:
+    from bot import analytics
+    result = getattr(analytics, name)(*args, **kwargs)
+    if isinstance(result, io.BytesIO):
+        return "bytes", result.getvalue()
+    return "value", result
+
+
+def _get_executor() -> ProcessPoolExecutor | None:
+    global _executor
+    if settings.CHART_WORKERS <= 0:
+        return None
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.CHART_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_warm_worker,
+        )
+    return _executor
+
+
+def _memo_key(name: str, args: tuple, kwargs: dict) -> str | None:
+    try:
+        payload = pickle.dumps((name, args, sorted(kwargs.items())), protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return None
+    return hashlib.sha1(payload).hexdigest()
+
+
+def _unwrap(kind: str, value):
+    if kind == "bytes":
+        return io.BytesIO(value)
+    return copy.deepcopy(value)
+
+
+def _remember(key: str, kind: str, value) -> None:
+    _memo[key] = (time.time(), kind, value)
+    _memo.move_to_end(key)
+    while len(_memo) > settings.CHART_CACHE_SIZE:
+        _memo.popitem(last=False)
+
+
+async def run_in_chart_pool(name: str, *args, **kwargs):
+    """
+    Runs `bot.analytics.<name>(*args, **kwargs)` in the chart pool and returns
+    its result (a fresh BytesIO for charts). Falls back to a thread when the
+    pool is disabled (CHART_WORKERS=0) or a worker died.
+    """
+    if name not in POOL_FUNCTIONS:
+        raise ValueError(f"{name} is not a chart pool function")
+
+    key = _memo_key(name, args, kwargs)
+    if key is not None:
+        hit = _memo.get(key)
+        if hit and time.time() - hit[0] < settings.CHART_CACHE_TTL_SEC:
+            _memo.move_to_end(key)
+            return _unwrap(hit[1], hit[2])
+
+    global _executor
+    executor = _get_executor()
+    kind, value = None, None
+    if executor is not None:
+        try:
+            loop = asyncio.get_running_loop()
+            kind, value = await loop.run_in_executor(executor, _call, name, args, kwargs)
+        except BrokenProcessPool:
+            logger.warning(f"Chart pool broken while running {name}, restarting it")
+            if _executor is executor:
+                _executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+    if kind is None:
+        kind, value = await asyncio.to_thread(_call, name, args, kwargs)
+
+    if key is not None and value is not None:
+        _remember(key, kind, value)
+    return _unwrap(kind, value)
+
+
+async def start_chart_pool() -> None:
+    """Spawns and warms every worker up front so the first chart is not slow."""
+    executor = _get_executor()
+    if executor is None:
+        return
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(loop.run_in_executor(executor, _noop) for _ in range(settings.CHART_WORKERS)))
+    logger.info(f"Chart pool ready with {settings.CHART_WORKERS} workers")
+
+
+def shutdown_chart_pool() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+    _memo.clear()
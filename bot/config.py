@@ -10,6 +10,22 @@ class Settings(BaseSettings):
     HYPERLIQUID_WS_URL: str = Field("wss://api.hyperliquid.xyz/ws", description="Hyperliquid Mainnet WS")
     HYPERLIQUID_API_URL: str = Field("https://api.hyperliquid.xyz", description="Hyperliquid Mainnet REST API")
 
+    # Wallet WS sharding
+    WS_WALLET_SHARDS: int = Field(2, description="Minimum wallet shard connections per WS process")
+    WS_MAX_WALLETS_PER_SHARD: int = Field(300, description="Wallets per shard connection before the ring grows")
+    WS_SHARD_SHRINK_FILL: float = Field(0.6, description="The ring only shrinks once the smaller ring would be at most this full (share of WS_MAX_WALLETS_PER_SHARD)")
+    WS_PROCESS_INDEX: int = Field(0, description="Index of this WS process (0 also sends market-wide alerts)")
+    WS_PROCESS_COUNT: int = Field(1, description="Number of WS processes splitting the tracked wallets")
+    WS_WALLET_SYNC_SEC: int = Field(300, description="Interval for rebalancing wallets onto shards (seconds)")
+    WS_SUBSCRIBE_RATE_PER_MIN: int = Field(1800, description="Outgoing WS frames per minute across all WS processes, split evenly between them (Hyperliquid allows 2000 per IP)")
+    WS_SUBSCRIBE_BURST: int = Field(60, description="WS frames that may be sent back to back before pacing, split evenly between WS processes")
+    WS_SEED_CONCURRENCY: int = Field(8, description="Concurrent REST open-order seeds while bringing wallets up")
+    WS_FILL_GAP_ALERT_MAX_AGE_MIN: int = Field(60, description="Fills caught up after a reconnect are only announced if newer than this (minutes)")
+    WS_MIDS_STALE_SEC: int = Field(15, description="Reconnect a price connection after this long without an allMids frame (seconds)")
+    WS_SHARD_STALE_SEC: int = Field(120, description="Reconnect a wallet shard after this long without any frame, pongs included (seconds)")
+    WS_PRICE_STANDBY: bool = Field(False, description="Keep a hot-standby allMids connection, deduplicated against the primary")
+    WS_PRICE_STANDBY_URL: str = Field("", description="WS URL for the price standby (empty: HYPERLIQUID_WS_URL)")
+
     # External APIs
     GEMINI_API_KEY: str = Field("", description="Google Gemini API Key")
     MARKET_OVERVIEW_ENABLE_SEARCH_NEWS: bool = Field(False, description="Enable Gemini Google Search enrichment for news digests")
@@ -34,6 +50,10 @@ class Settings(BaseSettings):
     AGENT_EVENT_TTL_HOURS: int = Field(48, description="Agent market event freshness TTL in hours")
     AGENT_LLM_MODEL: str = Field("gemma-4-31b-it", description="Gemini model for final agent report synthesis")
     AGENT_EVENT_EXTRACTOR_MODEL: str = Field("gemini-3.1-flash-lite-preview", description="Gemini model for event extraction")
+    AGENT_MARKET_STAGE_TTL_MIN: int = Field(20, description="Minutes one market-level agent stage (snapshot, sources, events, regime) is shared across users")
+    AGENT_SNAPSHOT_TTL_SEC: int = Field(120, description="Seconds the agent market snapshot is reused across runs")
+    AGENT_SOURCES_MEMO_TTL_MIN: int = Field(20, description="Minutes collected/scored agent sources and their extracted events are reused across runs")
+    AGENT_PIPELINE_INTERVAL_MIN: int = Field(15, description="Minutes between scheduled agent pipeline runs (source refresh and event extraction)")
     AGENT_PIPELINE_TIMEOUT_SEC: int = Field(120, description="Total agent pipeline timeout in seconds")
     AGENT_TOOL_TIMEOUT_SEC: int = Field(15, description="Per agent tool timeout in seconds")
 
@@ -55,6 +75,34 @@ class Settings(BaseSettings):
     
     # Renderer
     RENDER_CONCURRENCY: int = Field(5, description="Maximum number of concurrent Chromium renders allowed")
+    RENDER_PIL_TEMPLATES: str = Field("pnl_card.html,account_flex.html", description="Comma-separated templates drawn with the Pillow card backend instead of Chromium")
+    RENDER_BROADCAST_PROFILE: str = Field("jpeg", description="Output profile for scheduled/broadcast images (png, png8, webp, jpeg, preview)")
+    CHART_WORKERS: int = Field(2, description="Worker processes for matplotlib/pandas charts (0 runs them in a thread instead)")
+    CHART_CACHE_SIZE: int = Field(64, description="Maximum number of memoized chart pool results")
+    CHART_CACHE_TTL_SEC: int = Field(300, description="Seconds a memoized chart pool result stays valid")
+    MARKET_STATE_TTL_SEC: int = Field(15, description="Seconds a parsed metaAndAssetCtxs market state is shared before refetching")
+    ACCOUNT_STATE_MAX_AGE_SEC: int = Field(30, description="Seconds a webData2 account snapshot is trusted before falling back to REST")
+    MARKET_IMAGES_REFRESH_SEC: int = Field(60, description="How often the background job checks the perps snapshot for a new market image version")
+    MARKET_IMAGES_MAX_AGE_SEC: int = Field(900, description="Re-render market images after this many seconds even if the snapshot version is unchanged")
+    EQUITY_SAMPLE_INTERVAL_MIN: int = Field(5, description="Minutes between sampled equity / uPnL points per tracked wallet")
+    EQUITY_RAW_KEEP_HOURS: int = Field(48, description="Hours of full-resolution equity samples before they are downsampled to hourly")
+    EQUITY_HOURLY_KEEP_DAYS: int = Field(30, description="Days of hourly equity samples before they are downsampled to daily")
+    EQUITY_SAMPLE_KEEP_DAYS: int = Field(400, description="Days of (daily) equity samples kept in total")
+    DISPATCH_WINDOW_SEC: int = Field(300, description="Scheduled sends for one slot are spread over this many seconds by a stable per-user offset")
+    DISPATCH_SENDS_PER_SEC: float = Field(5.0, description="Scheduled per-user deliveries started per second, across all dispatch jobs")
+    DISPATCH_PREWARM_SEC: int = Field(90, description="Seconds before due schedules that shared report inputs are precomputed")
+    OVERVIEW_PREGEN_LEAD_MIN: int = Field(5, description="Minutes before their slot that scheduled overviews are generated and rendered (0 disables)")
+    OVERVIEW_PREGEN_CONCURRENCY: int = Field(3, description="Scheduled overviews generated ahead of time in parallel")
+    LEASES_ENABLED: bool = Field(False, description="Coordinate scheduled jobs, Telegram polling and the WS manager across several bot replicas with Mongo leases")
+    LEASE_TTL_SEC: int = Field(90, description="Seconds a job lease lasts without renewal before another replica may take it")
+    LEASE_PARTITIONS: int = Field(8, description="Lease partitions per-wallet background jobs are split into across replicas")
+    FILL_ARCHIVE_AFTER_DAYS: int = Field(180, description="Fills older than this many days move from Mongo to the on-disk archive")
+    FILL_ARCHIVE_DIR: str = Field("data/fill_archive", description="Directory of per-wallet, per-month compressed fill archives")
+    FILL_ARCHIVE_SHARED: bool = Field(False, description="FILL_ARCHIVE_DIR is storage every replica mounts; archiving stays off under LEASES_ENABLED without it")
+    EXPORT_WORKERS: int = Field(2, description="Background workers running queued trade-history exports")
+    EXPORT_MAX_PER_USER: int = Field(1, description="Queued or running exports allowed per user at once")
+    EXPORT_CHUNK_ROWS: int = Field(5000, description="Rows written per chunk when streaming an export file")
+    EXPORT_GZIP_MIN_ROWS: int = Field(20000, description="CSV exports with more rows than this are gzip-compressed")
 
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -1,8 +1,32 @@
+import asyncio
+import logging
 import motor.motor_asyncio
 import time
 from bson import ObjectId
+from pymongo import ReturnDocument
 from pymongo.errors import DuplicateKeyError
 from bot.config import settings
+from bot.fill_archive import archive_path, month_key, read_month, write_month
+from bot.schedules import SCHEDULE_DIGEST, SCHEDULE_MARKET_REPORT, SCHEDULE_OVERVIEW, dispatch_offset_ms, next_due_ms
+from bot.services import (
+    FILL_NUMERIC_FIELDS, apply_fill_to_ledger, ledger_avg_entry, new_ledger_position,
+    normalize_fill_numbers, replay_fills,
+)
+
+logger = logging.getLogger(__name__)
+
+def _fenced(flt: dict, update: dict, fence: tuple[str, int] | None) -> tuple[dict, dict]:
+    """
+    Adds a lease fence (bot.leases.current_fence) to a write: it only applies
+    while no newer grant of that lease has written the document, and records
+    its own token there.
+    """
+    if fence is None:
+        return flt, update
+    name, token = fence
+    field = f"fences.{name}"
+    flt = {**flt, "$or": [{field: {"$lte": int(token)}}, {field: {"$exists": False}}]}
+    return flt, {**update, "$set": {**update.get("$set", {}), field: int(token)}}
 
 class Database:
     def __init__(self, uri, db_name):
@@ -19,16 +43,37 @@ class Database:
         self.agent_runs = self.db.agent_runs
         self.market_events = self.db.market_events
         self.agent_source_cache = self.db.agent_source_cache
+        self.coin_ledgers = self.db.coin_ledgers  # Running size / avg cost / realized PnL per (wallet, coin)
+        self.equity_samples = self.db.equity_samples  # Sampled equity / uPnL time series per wallet, downsampled with age
+        self.fill_archives = self.db.fill_archives  # Manifest of archived fill files, one per (wallet, month)
+        self._archived_through: dict[str, int] = {}  # wallet -> newest archived fill time
+        self.schedules = self.db.schedules  # Per-user digest / market report / overview slots with an indexed next_due
+        self.job_leases = self.db.job_leases  # One lease per scheduled job / partition, shared by all replicas
+        self.fill_cursors = self.db.fill_cursors  # Last-seen userFills position per wallet (_id = wallet)
+        self.ws_ring = self.db.ws_ring  # Wallet-shard count every WS process builds its ring from
+        self.migrations = self.db.migrations  # Markers of one-off data migrations already applied (_id = name)
 
     async def init_db(self):
         """Initialize database indexes for performance and integrity."""
         # Unique index for fills to avoid duplicates
         await self.fills.create_index([("oid", 1)], unique=True)
+        await self.fills.create_index([("user", 1), ("coin", 1)])
+        await self.fills.create_index([("user", 1), ("time", 1)])
+        await self.migrate_fill_numbers()
+        await self.fill_archives.create_index([("wallet", 1), ("month", 1)], unique=True)
+        await self.fill_archives.create_index([("wallet", 1), ("max_time", -1)])
+        await self.coin_ledgers.create_index([("wallet", 1), ("coin", 1)], unique=True)
+        await self.equity_samples.create_index([("wallet", 1), ("ts", 1)], unique=True)
+        await self.equity_samples.create_index([("ts", 1)])
         # Indexes for frequent lookups
         await self.wallets.create_index([("user_id", 1), ("address", 1)], unique=True)
         await self.wallets.create_index([("address", 1)])
         await self.wallets.create_index([("user_id", 1)])
         await self.users.create_index([("user_id", 1)], unique=True)
+        await self.schedules.create_index([("user_id", 1), ("kind", 1), ("key", 1)], unique=True)
+        await self.schedules.create_index([("kind", 1), ("next_due", 1)])
+        if not await self.schedules.find_one({}):
+            await self.rebuild_all_schedules()
         await self.alerts.create_index([("user_id", 1)])
         await self.alerts.create_index([("symbol", 1)])
         await self.vault_snapshots.create_index([("user_id", 1), ("wallet", 1), ("vault_address", 1), ("snapshot_day", 1)], unique=True)
@@ -56,6 +101,7 @@ class Database:
                 "joined_at": time.time(),
                 "lang": "en"
             })
+            await self.sync_user_schedules(user_id)
 
     async def add_wallet(self, user_id, wallet_address):
         """Add a wallet to the separate wallets collection."""
@@ -163,37 +209,332 @@ class Database:
 
     # --- FILLS (PnL) ---
     async def save_fill(self, fill_data):
-        # Unique index on (coin, oid) is recommended in Mongo setup
-        await self.fills.update_one(
-            {"oid": fill_data["oid"]},
-            {"$set": fill_data},
-            upsert=True
-        )
+        await self.save_fills([fill_data])
+
+    async def save_fills(self, fills: list[dict]) -> int:
+        """
+        Stores fills (upsert by oid) and folds the newly stored ones into their
+        coin ledgers, oldest first. A coin that gets a fill older than its
+        ledger is replayed once after the batch instead of once per fill, so a
+        newest-first snapshot import stays linear. Returns fills stored.
+        """
+        stale: set[tuple[str, str]] = set()
+        stored = 0
+        for fill_data in sorted((normalize_fill_numbers(f) for f in fills), key=lambda f: f.get("time", 0)):
+            user = str(fill_data.get("user") or "").lower()
+            archived_through = await self.get_archived_through(user) if user else 0
+            if archived_through and fill_data.get("time", 0) <= archived_through:
+                # Replay of a fill that already moved to the archive; re-inserting it would double the ledger
+                continue
+            # Unique index on (coin, oid) is recommended in Mongo setup
+            result = await self.fills.update_one(
+                {"oid": fill_data["oid"]},
+                {"$set": fill_data},
+                upsert=True
+            )
+            # Only newly stored fills move the ledger; replays of known fills are no-ops
+            if result.upserted_id is None or not user or not fill_data.get("coin"):
+                continue
+            stored += 1
+            key = (user, fill_data["coin"])
+            if key not in stale and not await self._apply_fill_to_ledger(fill_data):
+                stale.add(key)
+        for wallet, coin in sorted(stale):
+            await self.rebuild_coin_ledger(wallet, coin)
+        return stored
+
+    async def _find_fills(self, wallet, time_cond: dict | None = None, coin: str | None = None) -> list[dict]:
+        """
+        Fills from Mongo plus any archived months overlapping `time_cond` (a
+        Mongo-style range on `time`). The Mongo copy wins if a fill is in both.
+        """
+        wallet = wallet.lower()
+        query = {"user": wallet}
+        if time_cond:
+            query["time"] = time_cond
+        if coin is not None:
+            query["coin"] = coin
+        fills = await self.fills.find(query).to_list(length=None)
+        archived = await self._read_archived_fills(wallet, time_cond, coin)
+        if not archived:
+            return fills
+        hot_oids = {f.get("oid") for f in fills}
+        return [f for f in archived if f.get("oid") not in hot_oids] + fills
 
     async def get_fills_range(self, wallet, start_ts, end_ts):
-        cursor = self.fills.find({
-            "user": wallet.lower(),
-            "time": {"$gte": start_ts * 1000, "$lt": end_ts * 1000}
-        })
-        return await cursor.to_list(length=None)
+        return await self._find_fills(wallet, {"$gte": start_ts * 1000, "$lt": end_ts * 1000})
 
     async def get_fills_before(self, wallet, ts):
-        cursor = self.fills.find({
-            "user": wallet.lower(),
-            "time": {"$lt": ts * 1000}
-        })
-        return await cursor.to_list(length=None)
+        return await self._find_fills(wallet, {"$lt": ts * 1000})
 
     async def get_fills_by_coin(self, wallet, coin):
-        cursor = self.fills.find({
-            "user": wallet.lower(), 
-            "coin": coin
-        })
-        return await cursor.to_list(length=None)
+        return await self._find_fills(wallet, coin=coin)
 
     async def get_fills(self, wallet, start_ts, end_ts):
         return await self.get_fills_range(wallet, start_ts, end_ts)
+
+    async def migrate_fill_numbers(self) -> int:
+        """
+        One-off cast of fills stored before amounts were numeric. A marker is
+        written once it completes, so later starts skip the collection scans;
+        an interrupted run is simply repeated (the casts are idempotent).
+        """
+        if await self.migrations.find_one({"_id": "fill_numbers"}):
+            return 0
+        migrated = 0
+        for field in (*FILL_NUMERIC_FIELDS, "time"):
+            target = "long" if field == "time" else "double"
+            result = await self.fills.update_many(
+                {field: {"$type": "string"}},
+                [{"$set": {field: {"$convert": {"input": f"${field}", "to": target, "onError": 0, "onNull": 0}}}}]
+            )
+            migrated += result.modified_count
+        await self.migrations.update_one(
+            {"_id": "fill_numbers"},
+            {"$set": {"applied_at": time.time(), "modified": migrated}},
+            upsert=True
+        )
+        return migrated
+
+    async def get_fill_totals(self, wallet, start_ms: int, end_ms: int) -> dict[str, dict]:
+        """Per-coin bought/sold notional, fees and fill count in [start_ms, end_ms), summed by Mongo."""
+        is_buy = {"$in": [{"$toLower": "$side"}, ["b", "buy", "bid"]]}
+        notional = {"$multiply": ["$sz", "$px"]}
+        pipeline = [
+            {"$match": {"user": wallet.lower(), "time": {"$gte": int(start_ms), "$lt": int(end_ms)}}},
+            {"$group": {
+                "_id": "$coin",
+                "bought": {"$sum": {"$cond": [is_buy, notional, 0]}},
+                "sold": {"$sum": {"$cond": [is_buy, 0, notional]}},
+                "fees": {"$sum": {"$ifNull": ["$fee", 0]}},
+                "fills": {"$sum": 1},
+            }},
+        ]
+        docs = await self.fills.aggregate(pipeline).to_list(length=None)
+        return {d["_id"]: {k: d[k] for k in ("bought", "sold", "fees", "fills")} for d in docs}
+
+    # --- FILL ARCHIVE (cold tier) ---
+    async def get_archived_through(self, wallet) -> int:
+        """Time of the newest archived fill of `wallet` (0 if none); cached after the first lookup."""
+        wallet = wallet.lower()
+        if wallet not in self._archived_through:
+            doc = await self.fill_archives.find_one({"wallet": wallet}, sort=[("max_time", -1)])
+            self._archived_through[wallet] = int(doc["max_time"]) if doc else 0
+        return self._archived_through[wallet]
+
+    async def _read_archived_fills(self, wallet, time_cond: dict | None = None, coin: str | None = None) -> list[dict]:
+        time_cond = time_cond or {}
+        query = {"wallet": wallet}
+        low = time_cond.get("$gte", time_cond.get("$gt"))
+        high = time_cond.get("$lte", time_cond.get("$lt"))
+        if low is not None:
+            query["max_time"] = {"$gte": int(low)}
+        if high is not None:
+            query["min_time"] = {"$lte": int(high)}
+        if coin is not None:
+            query["coins"] = coin
+        manifests = await self.fill_archives.find(query).to_list(length=None)
+        if not manifests:
+            return []
+
+        checks = {
+            "$gte": lambda t, v: t >= v, "$gt": lambda t, v: t > v,
+            "$lte": lambda t, v: t <= v, "$lt": lambda t, v: t < v,
+        }
+        out = []
+        for manifest in sorted(manifests, key=lambda m: m["month"]):
+            try:
+                month_fills = await asyncio.to_thread(read_month, manifest["path"])
+            except FileNotFoundError:
+                logger.error(
+                    f"Archived fills of {wallet} for {manifest['month']} are missing at {manifest['path']}; "
+                    f"FILL_ARCHIVE_DIR must be the same storage on every replica"
+                )
+                raise
+            for fill in month_fills:
+                t = fill.get("time", 0)
+                if coin is not None and fill.get("coin") != coin:
+                    continue
+                if all(checks[op](t, v) for op, v in time_cond.items()):
+                    out.append(fill)
+        return out
+
+    async def list_wallets_with_fills_before(self, before_ms: int) -> list[str]:
+        return await self.fills.distinct("user", {"time": {"$lt": int(before_ms)}})
+
+    async def archive_wallet_fills(self, wallet, before_ms: int, base_dir: str) -> int:
+        """
+        Moves `wallet`'s fills older than `before_ms` into per-month files under
+        `base_dir`. Each month is written and recorded in the manifest before
+        its fills are deleted from Mongo, so a crash leaves them in both tiers
+        (reads dedupe by oid) rather than in neither. Returns fills moved.
+        """
+        wallet = wallet.lower()
+        fills = await self.fills.find({"user": wallet, "time": {"$lt": int(before_ms)}}).to_list(length=None)
+        by_month: dict[str, list[dict]] = {}
+        for fill in fills:
+            by_month.setdefault(month_key(int(fill.get("time", 0))), []).append(fill)
+
+        moved = 0
+        for month, batch in sorted(by_month.items()):
+            path = archive_path(base_dir, wallet, month)
+            stats = await asyncio.to_thread(write_month, path, batch)
+            await self.fill_archives.update_one(
+                {"wallet": wallet, "month": month},
+                {"$set": {"path": path, **stats, "updated_at": time.time()}},
+                upsert=True
+            )
+            self._archived_through[wallet] = max(self._archived_through.get(wallet, 0), stats["max_time"])
+            result = await self.fills.delete_many({"_id": {"$in": [f["_id"] for f in batch]}})
+            moved += result.deleted_count
+        return moved
         
+    # --- COIN LEDGER ---
+    async def _apply_fill_to_ledger(self, fill_data, retries: int = 3) -> bool:
+        """
+        Folds a freshly stored fill into its (wallet, coin) ledger. The `fills`
+        counter doubles as a version for optimistic concurrency. Returns False
+        when the coin needs a full replay instead: no ledger yet, a fill older
+        than the ledger's last one, or lost races.
+        """
+        wallet, coin = str(fill_data["user"]).lower(), fill_data["coin"]
+        fill_time = int(float(fill_data.get("time", 0) or 0))
+        for _ in range(retries):
+            doc = await self.coin_ledgers.find_one({"wallet": wallet, "coin": coin})
+            if not doc or fill_time < int(doc.get("last_fill_time", 0)):
+                return False
+            pos = {k: doc.get(k, v) for k, v in new_ledger_position().items()}
+            apply_fill_to_ledger(pos, fill_data)
+            result = await self.coin_ledgers.update_one(
+                {"wallet": wallet, "coin": coin, "fills": doc.get("fills", 0)},
+                {"$set": {**pos, "updated_at": time.time()}}
+            )
+            if result.matched_count:
+                return True
+        return False
+
+    async def rebuild_coin_ledger(self, wallet, coin) -> dict:
+        """Replays every stored fill of one coin; used for backfill and out-of-order fills."""
+        wallet = wallet.lower()
+        pos = replay_fills(await self.get_fills_by_coin(wallet, coin))
+        doc = {"wallet": wallet, "coin": coin, **pos, "updated_at": time.time()}
+        await self.coin_ledgers.replace_one({"wallet": wallet, "coin": coin}, doc, upsert=True)
+        return doc
+
+    async def get_coin_ledger(self, wallet, coin) -> dict:
+        doc = await self.coin_ledgers.find_one({"wallet": wallet.lower(), "coin": coin})
+        if doc is None:
+            doc = await self.rebuild_coin_ledger(wallet, coin)
+        return doc
+
+    async def _backfill_ledgers(self, wallet, have: set[str]) -> list[dict]:
+        """Builds the ledgers of coins that have stored or archived fills but no ledger yet."""
+        coins = set(await self.fills.distinct("coin", {"user": wallet}))
+        coins.update(await self.fill_archives.distinct("coins", {"wallet": wallet}))
+        return [await self.rebuild_coin_ledger(wallet, coin) for coin in sorted(coins - have)]
+
+    async def get_wallet_ledgers(self, wallet) -> list[dict]:
+        wallet = wallet.lower()
+        docs = await self.coin_ledgers.find({"wallet": wallet}).to_list(length=None)
+        docs.extend(await self._backfill_ledgers(wallet, {d["coin"] for d in docs}))
+        return docs
+
+    async def get_ledger_period_totals(self, wallet, since_day: str) -> list[dict]:
+        """
+        Per-coin realized PnL and flow from the ledgers' per-day buckets after
+        `since_day` (YYYY-MM-DD), plus the running qty/cost. Only these totals
+        leave the server, not the ledgers' day maps.
+        """
+        wallet = wallet.lower()
+        days = {"$filter": {
+            "input": {"$objectToArray": {"$ifNull": ["$days", {}]}},
+            "cond": {"$gt": ["$$this.k", since_day]},
+        }}
+        pipeline = [
+            {"$match": {"wallet": wallet}},
+            {"$project": {"_id": 0, "coin": 1, "qty": 1, "cost": 1, "days": days}},
+            {"$project": {
+                "coin": 1, "qty": 1, "cost": 1,
+                "bought": {"$sum": "$days.v.bought"},
+                "sold": {"$sum": "$days.v.sold"},
+                "realized": {"$sum": "$days.v.realized"},
+            }},
+        ]
+        docs = await self.coin_ledgers.aggregate(pipeline).to_list(length=None)
+        if await self._backfill_ledgers(wallet, {d["coin"] for d in docs}):
+            # Some coins had fills but no ledger yet: aggregate again with them built
+            docs = await self.coin_ledgers.aggregate(pipeline).to_list(length=None)
+        return docs
+
+    async def get_avg_entry(self, wallet, coin) -> float:
+        """Moving-average entry price of a wallet's current holding of `coin`."""
+        return ledger_avg_entry(await self.get_coin_ledger(wallet, coin))
+
+    # --- EQUITY SAMPLES ---
+    async def save_equity_sample(self, wallet, ts_ms: int, equity: float, upnl: float = 0.0):
+        await self.equity_samples.update_one(
+            {"wallet": wallet.lower(), "ts": int(ts_ms)},
+            {"$set": {"equity": float(equity), "upnl": float(upnl), "res": 0}},
+            upsert=True
+        )
+
+    async def get_equity_series(self, wallet, start_ms: int, end_ms: int | None = None) -> list[list]:
+        """[[ts_ms, equity], ...] sorted by time; an indexed range read."""
+        ts_range = {"$gte": int(start_ms)}
+        if end_ms is not None:
+            ts_range["$lte"] = int(end_ms)
+        cursor = self.equity_samples.find({"wallet": wallet.lower(), "ts": ts_range}).sort("ts", 1)
+        return [[d["ts"], d["equity"]] for d in await cursor.to_list(length=None)]
+
+    async def get_equity_sample_near(self, wallet, ts_ms: int, tolerance_ms: int):
+        """Closest sample within `tolerance_ms` of `ts_ms`: one indexed probe each side."""
+        wallet, ts_ms = wallet.lower(), int(ts_ms)
+        before = await self.equity_samples.find_one(
+            {"wallet": wallet, "ts": {"$lte": ts_ms, "$gte": ts_ms - tolerance_ms}},
+            sort=[("ts", -1)]
+        )
+        after = await self.equity_samples.find_one(
+            {"wallet": wallet, "ts": {"$gt": ts_ms, "$lte": ts_ms + tolerance_ms}},
+            sort=[("ts", 1)]
+        )
+        found = [d for d in (before, after) if d]
+        return min(found, key=lambda d: abs(d["ts"] - ts_ms)) if found else None
+
+    async def get_latest_equity_sample(self, wallet):
+        return await self.equity_samples.find_one({"wallet": wallet.lower()}, sort=[("ts", -1)])
+
+    async def compact_equity_samples(self, wallet, older_than_ms: int, bucket_ms: int) -> int:
+        """
+        Downsamples samples older than `older_than_ms` to the last point of each
+        `bucket_ms` bucket. The cutoff is aligned to a bucket boundary so a
+        bucket is only ever compacted once. Returns the number of points dropped.
+        """
+        wallet = wallet.lower()
+        cutoff = int(older_than_ms) // bucket_ms * bucket_ms
+        docs = await self.equity_samples.find(
+            {"wallet": wallet, "ts": {"$lt": cutoff}, "res": {"$lt": bucket_ms}}
+        ).to_list(length=None)
+        if not docs:
+            return 0
+        keep = {}
+        for doc in docs:
+            bucket = doc["ts"] // bucket_ms
+            if bucket not in keep or doc["ts"] > keep[bucket]["ts"]:
+                keep[bucket] = doc
+        keep_ids = [d["_id"] for d in keep.values()]
+        drop_ids = [d["_id"] for d in docs if keep[d["ts"] // bucket_ms] is not d]
+        if drop_ids:
+            await self.equity_samples.delete_many({"_id": {"$in": drop_ids}})
+        await self.equity_samples.update_many({"_id": {"$in": keep_ids}}, {"$set": {"res": bucket_ms}})
+        return len(drop_ids)
+
+    async def list_equity_sample_wallets(self) -> list[str]:
+        return await self.equity_samples.distinct("wallet")
+
+    async def prune_equity_samples(self, before_ms: int) -> int:
+        result = await self.equity_samples.delete_many({"ts": {"$lt": int(before_ms)}})
+        return result.deleted_count
+
     # --- ALERTS ---
     async def add_alert(self, user_id: int, symbol: str, target: float, direction: str, alert_type: str = "price"):
         """
@@ -257,6 +598,14 @@ class Database:
             {"$set": settings_dict},
             upsert=True
         )
+        if "market_alert_times" in settings_dict:
+            await self.sync_user_schedules(user_id)
+
+    async def save_delta_state(self, user_id, state: dict, fence: tuple[str, int] | None = None) -> bool:
+        """Stores the delta-neutral monitor state; False when a newer lease grant already wrote it."""
+        flt, update = _fenced({"user_id": user_id}, {"$set": {"delta_state": state}}, fence)
+        res = await self.users.update_one(flt, update)
+        return res.matched_count == 1
 
     async def get_user_settings(self, user_id):
         user = await self.users.find_one({"user_id": user_id})
@@ -376,8 +725,10 @@ class Database:
 
     async def get_digest_settings(self, user_id: int) -> dict:
         user = await self.users.find_one({"user_id": user_id}, {"digest_settings": 1})
+        return self._merge_digest_settings(user.get("digest_settings", {}) if user else {})
+
+    def _merge_digest_settings(self, raw) -> dict:
         defaults = self._digest_defaults()
-        raw = user.get("digest_settings", {}) if user else {}
         if not isinstance(raw, dict):
             raw = {}
 
@@ -403,6 +754,7 @@ class Database:
             {"$set": {f"digest_settings.{digest_key}.enabled": new_value}},
             upsert=True
         )
+        await self.sync_user_schedules(user_id)
         return new_value
 
     async def set_digest_time(self, user_id: int, digest_key: str, time_str: str):
@@ -411,6 +763,7 @@ class Database:
             {"$set": {f"digest_settings.{digest_key}.time": str(time_str)}},
             upsert=True
         )
+        await self.sync_user_schedules(user_id)
 
     # --- VAULT REPORT SETTINGS ---
     async def get_vault_report_settings(self, user_id: int) -> dict:
@@ -500,10 +853,12 @@ class Database:
         return new_value
 
     # --- VAULT SNAPSHOTS ---
-    async def upsert_vault_snapshot(self, user_id: int, wallet: str, vault_address: str, equity: float, snapshot_ts: int | None = None):
+    async def upsert_vault_snapshot(self, user_id: int, wallet: str, vault_address: str, equity: float, snapshot_ts: int | None = None,
+                                    fence: tuple[str, int] | None = None) -> bool:
+        """Upserts the day's snapshot; False when a newer lease grant already wrote it."""
         ts = int(snapshot_ts if snapshot_ts is not None else time.time())
         day = time.strftime("%Y-%m-%d", time.gmtime(ts))
-        await self.vault_snapshots.update_one(
+        flt, update = _fenced(
             {
                 "user_id": user_id,
                 "wallet": wallet.lower(),
@@ -515,8 +870,14 @@ class Database:
                 "snapshot_ts": ts,
                 "updated_at": int(time.time())
             }},
-            upsert=True
+            fence
         )
+        try:
+            await self.vault_snapshots.update_one(flt, update, upsert=True)
+        except DuplicateKeyError:
+            # The day's document exists with a newer fence: the upsert collided on the unique key
+            return False
+        return True
 
     async def get_latest_vault_snapshot_before(self, user_id: int, wallet: str, vault_address: str, before_ts: int):
         return await self.vault_snapshots.find_one(
@@ -529,26 +890,38 @@ class Database:
             sort=[("snapshot_ts", -1)]
         )
 
+    async def get_vault_snapshot_bases(self, user_id: int, before_ts: int) -> dict[tuple[str, str], float]:
+        """Latest equity at or before `before_ts` for every (wallet, vault) of a user, in one aggregation."""
+        pipeline = [
+            {"$match": {"user_id": user_id, "snapshot_ts": {"$lte": int(before_ts)}}},
+            {"$sort": {"snapshot_ts": -1}},
+            {"$group": {
+                "_id": {"wallet": "$wallet", "vault": "$vault_address"},
+                "equity": {"$first": "$equity"},
+            }},
+        ]
+        docs = await self.vault_snapshots.aggregate(pipeline).to_list(length=None)
+        return {(d["_id"]["wallet"], d["_id"]["vault"]): float(d.get("equity") or 0) for d in docs}
+
+    def _overview_defaults(self) -> dict:
+        return {
+            "schedules": ["06:00", "18:00"], # Default Morning & Evening
+            "style": "detailed",
+            "prompt_override": None,
+            "enabled": True
+        }
+
     async def get_overview_settings(self, user_id: int) -> dict:
         """
         Get Market Overview settings for a user.
         Returns dict with defaults if not found.
         """
         user = await self.users.find_one({"user_id": user_id})
-        if not user:
-            return {
-                "schedules": ["06:00", "18:00"], # Default Morning & Evening
-                "style": "detailed",
-                "prompt_override": None,
-                "enabled": True
-            }
-        
-        return user.get("overview", {
-            "schedules": ["06:00", "18:00"],
-            "style": "detailed",
-            "prompt_override": None,
-            "enabled": True
-        })
+        return self.overview_settings_of(user) if user else self._overview_defaults()
+
+    def overview_settings_of(self, user: dict) -> dict:
+        """Overview settings stored on an already loaded user doc."""
+        return user.get("overview", self._overview_defaults())
 
     async def update_overview_settings(self, user_id: int, settings: dict):
         """
@@ -563,6 +936,117 @@ class Database:
             }},
             upsert=True
         )
+        await self.sync_user_schedules(user_id)
+
+    # --- SCHEDULES (next-due index) ---
+    def _schedule_specs(self, user: dict) -> list[dict]:
+        """Every slot a user doc asks for, as {kind, key, spec, repeat}."""
+        out = []
+        for target, cfg in self._merge_digest_settings(user.get("digest_settings", {})).items():
+            if cfg.get("enabled"):
+                spec = {k: cfg[k] for k in ("time", "day_of_week", "day") if cfg.get(k) is not None}
+                out.append({"kind": SCHEDULE_DIGEST, "key": target, "spec": spec, "repeat": True})
+
+        for entry in user.get("market_alert_times", []) or []:
+            t = entry["t"] if isinstance(entry, dict) else entry
+            repeat = bool(entry.get("r", True)) if isinstance(entry, dict) else True
+            out.append({"kind": SCHEDULE_MARKET_REPORT, "key": str(t), "spec": {"time": str(t)}, "repeat": repeat})
+
+        overview = self.overview_settings_of(user)
+        if overview.get("enabled"):
+            for t in overview.get("schedules", []) or []:
+                out.append({"kind": SCHEDULE_OVERVIEW, "key": str(t), "spec": {"time": str(t)}, "repeat": True})
+        return out
+
+    async def sync_user_schedules(self, user_id, now_ms: int | None = None):
+        """
+        Brings a user's schedule rows in line with their settings. Unchanged
+        slots keep their next_due; new or edited ones get the next slot after now.
+        """
+        now_ms = int(time.time() * 1000) if now_ms is None else int(now_ms)
+        window_ms = max(0, settings.DISPATCH_WINDOW_SEC) * 1000
+        user = await self.users.find_one({"user_id": user_id})
+        existing = {
+            (d["kind"], d["key"]): d
+            for d in await self.schedules.find({"user_id": user_id}).to_list(length=None)
+        }
+        for item in self._schedule_specs(user) if user else []:
+            item["offset_ms"] = dispatch_offset_ms(user_id, item["kind"], item["key"], window_ms)
+            current = existing.pop((item["kind"], item["key"]), None)
+            if current and all(current.get(k) == item[k] for k in ("spec", "repeat", "offset_ms")):
+                continue
+            due = next_due_ms(item["spec"], now_ms, item["offset_ms"])
+            if due is None:
+                if current:
+                    existing[(item["kind"], item["key"])] = current
+                continue
+            await self.schedules.update_one(
+                {"user_id": user_id, "kind": item["kind"], "key": item["key"]},
+                {"$set": {"spec": item["spec"], "repeat": item["repeat"], "offset_ms": item["offset_ms"], "next_due": due}},
+                upsert=True
+            )
+        if existing:
+            await self.schedules.delete_many({"_id": {"$in": [d["_id"] for d in existing.values()]}})
+
+    async def rebuild_all_schedules(self):
+        """One-off backfill of the schedule index from every user's settings."""
+        async for user in self.users.find({}, {"user_id": 1}):
+            if user.get("user_id") is not None:
+                await self.sync_user_schedules(user["user_id"])
+
+    async def claim_due_schedules(self, kind: str, now_ms: int, grace_ms: int) -> list[dict]:
+        """
+        Advances every `kind` schedule due at `now_ms` to its next slot and
+        returns the ones this caller claimed that are at most `grace_ms` late.
+        The conditional update on the old next_due makes each slot fire once
+        even with overlapping runs; slots missed for longer (downtime) are
+        skipped rather than sent late. One-off slots are deleted when claimed.
+        """
+        now_ms = int(now_ms)
+        due = await self.schedules.find({"kind": kind, "next_due": {"$lte": now_ms}}).to_list(length=None)
+        claimed, late = [], 0
+        for doc in due:
+            guard = {"_id": doc["_id"], "next_due": doc["next_due"]}
+            if doc.get("repeat", True):
+                following = next_due_ms(doc.get("spec", {}), now_ms, doc.get("offset_ms", 0))
+                if following is None:
+                    result = await self.schedules.delete_one(guard)
+                    won = result.deleted_count == 1
+                else:
+                    result = await self.schedules.update_one(guard, {"$set": {"next_due": following}})
+                    won = result.matched_count == 1
+            else:
+                result = await self.schedules.delete_one(guard)
+                won = result.deleted_count == 1
+            if won and doc["next_due"] >= now_ms - grace_ms:
+                claimed.append(doc)
+            elif won:
+                late += 1
+        if late:
+            logger.warning(f"Dropped {late} {kind} slots more than {grace_ms // 1000}s late")
+        return claimed
+
+    async def has_schedule_due_by(self, kind: str, until_ms: int, key: str | None = None) -> bool:
+        """Whether any `kind` (and `key`) slot is due at or before `until_ms`."""
+        query = {"kind": kind, "next_due": {"$lte": int(until_ms)}}
+        if key is not None:
+            query["key"] = key
+        return await self.schedules.find_one(query, {"_id": 1}) is not None
+
+    async def get_schedules_due_between(self, kind: str, after_ms: int, until_ms: int) -> list[dict]:
+        """`kind` rows whose next_due falls in (after_ms, until_ms], i.e. not yet claimable."""
+        query = {"kind": kind, "next_due": {"$gt": int(after_ms), "$lte": int(until_ms)}}
+        return await self.schedules.find(query).to_list(length=None)
+
+    async def remove_market_alert_time(self, user_id, time_str: str):
+        """Drops a fired one-off market report time from the user's settings."""
+        await self.users.update_one(
+            {"user_id": user_id},
+            {"$pull": {"market_alert_times": {"t": time_str}}}
+        )
+
+    async def get_users_by_ids(self, user_ids, projection: dict | None = None) -> list[dict]:
+        return await self.users.find({"user_id": {"$in": list(user_ids)}}, projection).to_list(length=None)
 
     # --- HEDGE SETTINGS ---
     async def get_hedge_settings(self, user_id: int) -> dict:
@@ -662,6 +1146,90 @@ class Database:
     async def get_agent_source_cache(self, cache_key: str):
         return await self.agent_source_cache.find_one({"cache_key": cache_key, "expires_at": {"$gt": time.time()}})
 
+    # --- JOB LEASES ---
+    async def acquire_lease(self, name: str, owner: str, ttl_ms: int, slot: int | None = None, now_ms: int | None = None) -> dict | None:
+        """
+        Grants lease `name` to `owner`, or extends it when `owner` already
+        holds it. A new grant (free, expired or released lease) bumps the
+        grant token; an extension keeps it. With a `slot`, the lease is
+        only granted while that slot has not been completed. Returns the lease
+        document, or None when another replica holds it.
+        """
+        now_ms = int(time.time() * 1000) if now_ms is None else int(now_ms)
+        slot_open = {"$or": [{"done_slot": {"$lt": int(slot)}}, {"done_slot": {"$exists": False}}]} if slot is not None else {}
+        held = await self.job_leases.find_one_and_update(
+            {"_id": name, "owner": owner, "expires_at": {"$gt": now_ms}, **slot_open},
+            {"$set": {"expires_at": now_ms + int(ttl_ms), "slot": slot}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if held:
+            return held
+        try:
+            return await self.job_leases.find_one_and_update(
+                {"_id": name, "expires_at": {"$lte": now_ms}, **slot_open},
+                {"$set": {"owner": owner, "expires_at": now_ms + int(ttl_ms), "slot": slot}, "$inc": {"token": 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # The lease exists and is held (or its slot is done): the upsert collided on _id
+            return None
+
+    async def renew_lease(self, name: str, owner: str, token: int, ttl_ms: int) -> bool:
+        """Extends a lease only while `token` is still the current grant."""
+        res = await self.job_leases.update_one(
+            {"_id": name, "owner": owner, "token": token},
+            {"$set": {"expires_at": int(time.time() * 1000) + int(ttl_ms)}}
+        )
+        return res.matched_count == 1
+
+    async def release_lease(self, name: str, owner: str, token: int, done_slot: int | None = None) -> bool:
+        """Frees a lease, recording `done_slot` as completed; a superseded token changes nothing."""
+        update = {"expires_at": 0}
+        if done_slot is not None:
+            update["done_slot"] = int(done_slot)
+        res = await self.job_leases.update_one({"_id": name, "owner": owner, "token": token}, {"$set": update})
+        return res.matched_count == 1
+
+    async def holds_lease(self, name: str, token: int, now_ms: int | None = None) -> bool:
+        now_ms = int(time.time() * 1000) if now_ms is None else int(now_ms)
+        return await self.job_leases.find_one({"_id": name, "token": token, "expires_at": {"$gt": now_ms}}) is not None
+
+    # --- FILL CURSORS ---
+    async def get_fill_cursor(self, wallet: str) -> dict | None:
+        return await self.fill_cursors.find_one({"_id": wallet.lower()})
+
+    async def set_fill_cursor(self, wallet: str, cursor: dict):
+        await self.fill_cursors.update_one(
+            {"_id": wallet.lower()},
+            {"$set": {**cursor, "updated_at": int(time.time() * 1000)}},
+            upsert=True
+        )
+
+    # --- WS RING ---
+    async def agree_ws_shard_count(self, wanted: int, shrink_to: int | None = None) -> int:
+        """
+        Raises the shared wallet-shard count to `wanted` when it is lower and
+        returns the stored count, so every WS process sizes its ring alike.
+        With `shrink_to` below the stored count it is lowered to that by a
+        compare-and-set on the count just read, so a concurrent grow wins.
+        """
+        doc = await self.ws_ring.find_one_and_update(
+            {"_id": "wallets"},
+            {"$max": {"shard_count": int(wanted)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        stored = int(doc["shard_count"])
+        if shrink_to is None or shrink_to >= stored:
+            return stored
+        doc = await self.ws_ring.find_one_and_update(
+            {"_id": "wallets", "shard_count": stored},
+            {"$set": {"shard_count": int(shrink_to)}},
+            return_document=ReturnDocument.AFTER,
+        ) or await self.ws_ring.find_one({"_id": "wallets"})
+        return int(doc["shard_count"])
+
     # --- WALLET STATES (Ledger Tracking) ---
     async def get_all_watched_addresses(self):
         """Get list of unique wallet addresses currently being watched."""
@@ -2,14 +2,13 @@ import asyncio
 import time
 from collections import defaultdict
 
+from bot.account_state import get_account_perps_state, get_account_spot_balances
 from bot.locales import _t
+from bot.market_state import MarketState, get_market_state
 from bot.utils import format_money, pretty_float
 from bot.services import (
     extract_avg_entry_from_balance,
     get_mid_price,
-    get_perps_context,
-    get_perps_state,
-    get_spot_balances,
     get_symbol_name,
     get_user_funding,
 )
@@ -61,41 +60,6 @@ def _delta_icon(delta_pct: float) -> str:
     return "✅"
 
 
-def _extract_perps_ctx_map(ctx) -> dict[str, dict]:
-    universe = []
-    asset_ctxs = []
-    if isinstance(ctx, list) and len(ctx) == 2:
-        raw_universe = ctx[0]
-        asset_ctxs = ctx[1] if isinstance(ctx[1], list) else []
-        if isinstance(raw_universe, dict):
-            universe = raw_universe.get("universe", [])
-        elif isinstance(raw_universe, list):
-            universe = raw_universe
-    elif isinstance(ctx, dict):
-        universe = ctx.get("universe", [])
-        asset_ctxs = ctx.get("assetCtxs", [])
-
-    out: dict[str, dict] = {}
-    if not isinstance(universe, list) or not isinstance(asset_ctxs, list):
-        return out
-
-    for i, u in enumerate(universe):
-        if i >= len(asset_ctxs):
-            break
-        if not isinstance(u, dict):
-            continue
-        sym = _normalize_symbol(u.get("name"))
-        if not sym:
-            continue
-        a = asset_ctxs[i] if isinstance(asset_ctxs[i], dict) else {}
-        out[sym] = {
-            "markPx": _safe_float(a.get("markPx", 0)),
-            "funding": _safe_float(a.get("funding", 0)),
-            "openInterest": _safe_float(a.get("openInterest", 0)),
-        }
-    return out
-
-
 def _new_coin_bucket(symbol: str) -> dict:
     return {
         "symbol": symbol,
@@ -133,8 +97,8 @@ def _new_coin_bucket(symbol: str) -> dict:
 
 async def _fetch_wallet_data(wallet: str):
     return await asyncio.gather(
-        get_spot_balances(wallet),
-        get_perps_state(wallet),
+        get_account_spot_balances(wallet),
+        get_account_perps_state(wallet),
         get_user_funding(wallet),
         return_exceptions=True,
     )
@@ -143,13 +107,16 @@ async def _fetch_wallet_data(wallet: str):
 async def collect_delta_neutral_snapshot(
     wallets: list[str],
     ws=None,
-    perps_ctx=None,
+    market_state: MarketState | None = None,
 ) -> dict:
     now_ts = int(time.time())
     now_ms = now_ts * 1000
 
-    perps_ctx = perps_ctx if perps_ctx is not None else await get_perps_context()
-    ctx_map = _extract_perps_ctx_map(perps_ctx)
+    market_state = market_state if market_state is not None else await get_market_state()
+
+    def market_row(sym_norm: str) -> dict:
+        row = market_state.get(sym_norm) if market_state else None
+        return row or {}
 
     wallet_payloads = await asyncio.gather(
         *(_fetch_wallet_data(w) for w in wallets),
@@ -178,7 +145,7 @@ async def collect_delta_neutral_snapshot(
                 px = _safe_float(ws.get_price(sym_norm, original_id))
 
         if px <= 0:
-            px = _safe_float(ctx_map.get(sym_norm, {}).get("markPx", 0))
+            px = _safe_float(market_row(sym_norm).get("mark", 0))
 
         if px <= 0:
             px = _safe_float(await get_mid_price(sym_raw, original_id))
@@ -287,14 +254,15 @@ async def collect_delta_neutral_snapshot(
     delta_usd_total = 0.0
 
     for sym, bucket in coins.items():
-        bucket["funding_current"] = _safe_float(ctx_map.get(sym, {}).get("funding", 0))
+        row = market_row(sym)
+        bucket["funding_current"] = _safe_float(row.get("funding", 0))
         mark = _safe_float(bucket.get("price", 0))
         if mark <= 0:
-            mark = _safe_float(ctx_map.get(sym, {}).get("markPx", 0))
+            mark = _safe_float(row.get("mark", 0))
             if mark > 0:
                 bucket["price"] = mark
 
-        oi = _safe_float(ctx_map.get(sym, {}).get("openInterest", 0))
+        oi = _safe_float(row.get("open_interest", 0))
         bucket["oi_usd"] = oi * bucket["price"] if bucket["price"] > 0 else 0.0
 
         events = bucket.get("_funding_events", [])
@@ -0,0 +1,72 @@
+"""
+Read side of the locally sampled equity time series.
+
+A scheduler job stores one equity / uPnL point per tracked wallet every
+EQUITY_SAMPLE_INTERVAL_MIN from the live account snapshots. Older points are
+downsampled to hourly and then daily buckets. Digests and PnL views answer
+period changes and charts from indexed range reads here. They only fetch the
+heavy `portfolio` payload when the local series is stale or too short.
+"""
+import time
+
+from bot.config import settings
+from bot.database import db
+
+HOUR_MS = 3_600_000
+DAY_MS = 86_400_000
+
+# The chart falls back to the full portfolio history until the local series covers this much
+CHART_MIN_SPAN_MS = 30 * DAY_MS
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _window_tolerance(window_ms: int) -> int:
+    # Older windows land on hourly/daily downsampled points
+    return max(2 * HOUR_MS, window_ms // 24)
+
+
+async def latest_equity(wallet: str):
+    """Latest sample if the sampler is keeping up with this wallet, else None."""
+    latest = await db.get_latest_equity_sample(wallet)
+    if not latest:
+        return None
+    if latest["ts"] < _now_ms() - 2 * settings.EQUITY_SAMPLE_INTERVAL_MIN * 60_000:
+        return None
+    return latest
+
+
+async def equity_changes(wallet: str, windows_ms: list[int]) -> tuple[float, dict[int, float]] | None:
+    """
+    (current equity, {window_ms: equity change}) from local samples, or None
+    if the series is stale or is missing a point for any requested window.
+    """
+    latest = await latest_equity(wallet)
+    if not latest:
+        return None
+    current = float(latest["equity"])
+    changes = {}
+    for window in windows_ms:
+        past = await db.get_equity_sample_near(wallet, latest["ts"] - window, _window_tolerance(window))
+        if not past:
+            return None
+        changes[window] = current - float(past["equity"])
+    return current, changes
+
+
+async def equity_as_of(wallet: str, ts_ms: int) -> float | None:
+    """Sampled equity nearest to `ts_ms`, within the resolution its age was downsampled to."""
+    past = await db.get_equity_sample_near(wallet, ts_ms, _window_tolerance(_now_ms() - int(ts_ms)))
+    return float(past["equity"]) if past else None
+
+
+async def equity_history(wallet: str, start_ms: int = 0, min_span_ms: int = CHART_MIN_SPAN_MS) -> list[list] | None:
+    """Local [[ts, equity], ...] since `start_ms`, or None when it spans less than `min_span_ms`."""
+    if not await latest_equity(wallet):
+        return None
+    series = await db.get_equity_series(wallet, start_ms)
+    if len(series) < 2 or series[-1][0] - series[0][0] < min_span_ms:
+        return None
+    return series
@@ -0,0 +1,298 @@
+"""
+Background trade-history exports.
+
+Exports run as queued jobs on a small worker pool, with a cap on how many a
+single user may have queued or running. Rows are produced lazily and written
+to a temp file in chunks from a thread, so the handler returns at once and
+no whole-file string is ever held in memory. Output is CSV (gzip-compressed
+past EXPORT_GZIP_MIN_ROWS or on request) or Parquet when pyarrow is
+installed. Symbols resolve from one preloaded map instead of an await per
+row. The API only returns recent fills, so older ones are filled in from the
+stored history, archived months included. Finished files are sent to the
+chat and then deleted.
+"""
+import asyncio
+import csv
+import datetime
+import gzip
+import importlib.util
+import itertools
+import logging
+import os
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from aiogram.types import FSInputFile
+
+from bot.config import settings
+from bot.database import db
+from bot.services import (
+    get_symbol_map, get_user_fills, get_user_funding, get_user_ledger,
+    get_user_portfolio, portfolio_window
+)
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("csv", "gz", "parquet")
+
+HISTORY_COLUMNS = (
+    ("Timestamp", int), ("Date", str), ("Equity", float), ("PnL (Cumulative)", float),
+    ("Cash Flow", float), ("Funding", float), ("Type", str),
+)
+FILLS_COLUMNS = (
+    ("Time", str), ("Symbol", str), ("Side", str), ("Price", float), ("Size", float),
+    ("Value", float), ("Fee", float), ("Realized PnL", float), ("Trade ID", str),
+    ("Liquidity", str), ("Type", str),
+)
+
+
+def parquet_available() -> bool:
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def _fmt_ts(ts) -> str:
+    return datetime.datetime.fromtimestamp(ts / 1000).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def history_rows(portf, ledger: list, funding: list) -> list[tuple]:
+    """Equity samples, ledger updates and funding payments as time-sorted rows."""
+    data = portfolio_window(portf, "allTime") if portf else {}
+    history, pnl_history = data.get("accountValueHistory", []), data.get("pnlHistory", [])
+    pnl_map = {p[0]: p[1] for p in pnl_history} if pnl_history else {}
+
+    rows = [(p[0], p[1], pnl_map.get(p[0], "0"), 0, 0, "Equity Sample") for p in history]
+    for l in ledger:
+        delta = l.get("delta", {})
+        rows.append((l.get("time", 0), "", "", delta.get("amount", 0), 0, f"Ledger: {delta.get('type', 'update')}"))
+    for f in funding:
+        rows.append((f.get("time", 0), "", "", 0, f.get("delta", {}).get("amount", 0), "Funding Payment"))
+    rows.sort(key=lambda r: r[0])
+    return [(ts, _fmt_ts(ts), equity, pnl, cash, fund, kind) for ts, equity, pnl, cash, fund, kind in rows]
+
+
+def fill_rows(fills: list, funding: list, symbols: dict[str, str]):
+    """Fills and funding payments, newest first, yielded one row at a time."""
+    combined = [(f.get("time", 0), False, f) for f in fills]
+    combined += [(f.get("time", 0), True, f) for f in funding]
+    combined.sort(key=lambda x: x[0], reverse=True)
+
+    for ts, is_funding, f in combined:
+        try:
+            if is_funding:
+                delta = f.get("delta", {})
+                coin = delta.get("coin", "")
+                px, sz = float(delta.get("fundingRate", 0)), float(delta.get("szi", 0))
+                yield (_fmt_ts(ts), coin, "Funding", px, sz, "0.00", 0, delta.get("amount", 0), f.get("hash", ""), "", "Funding")
+            else:
+                coin = f.get("coin", "")
+                if coin.startswith("@"):
+                    coin = symbols.get(coin, coin)
+                px, sz = float(f.get("px", 0)), float(f.get("sz", 0))
+                side = f.get("dir", "") or ("Buy" if f.get("side", "") == "B" else "Sell")
+                yield (_fmt_ts(ts), coin, side, px, sz, f"{px * sz:.2f}", f.get("fee", 0), f.get("closedPnl", 0), f.get("tid", ""), f.get("liquidity", ""), "Fill")
+        except Exception:
+            continue
+
+
+def _coerce(value, kind):
+    if kind is str:
+        return "" if value is None else str(value)
+    try:
+        return kind(float(value)) if value not in ("", None) else None
+    except (TypeError, ValueError):
+        return None
+
+
+def write_rows(path: str, columns: tuple, rows, fmt: str, chunk_rows: int | None = None) -> int:
+    """Streams `rows` into `path` in chunks; returns the number of rows written. Runs in a thread."""
+    chunk_rows = chunk_rows or settings.EXPORT_CHUNK_ROWS
+    rows = iter(rows)
+    written = 0
+
+    if fmt == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        types = {int: pa.int64(), float: pa.float64(), str: pa.string()}
+        schema = pa.schema([(name, types[kind]) for name, kind in columns])
+        with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+            while chunk := list(itertools.islice(rows, chunk_rows)):
+                cols = {name: [_coerce(r[i], kind) for r in chunk] for i, (name, kind) in enumerate(columns)}
+                writer.write_table(pa.Table.from_pydict(cols, schema=schema))
+                written += len(chunk)
+        return written
+
+    opener = gzip.open if fmt == "gz" else open
+    with opener(path, "wt", newline="", encoding="utf-8") as fh:
+        writer = csv.writer(fh)
+        writer.writerow([name for name, _ in columns])
+        while chunk := list(itertools.islice(rows, chunk_rows)):
+            writer.writerows(chunk)
+            written += len(chunk)
+    return written
+
+
+def _resolve_format(requested: str, row_count: int) -> str:
+    if requested == "parquet" and not parquet_available():
+        logger.warning("Parquet export requested but pyarrow is not installed, using gzip CSV")
+        return "gz"
+    if requested == "csv" and row_count > settings.EXPORT_GZIP_MIN_ROWS:
+        return "gz"
+    return requested
+
+
+def _filename(base: str, fmt: str) -> str:
+    return f"{base}.parquet" if fmt == "parquet" else (f"{base}.csv.gz" if fmt == "gz" else f"{base}.csv")
+
+
+async def _stored_fills_before(wallet: str, api_fills: list) -> list:
+    """Stored fills (both tiers) older than the oldest one the API returned."""
+    oldest_ms = min((int(f.get("time", 0)) for f in api_fills), default=None)
+    try:
+        if oldest_ms is None:
+            return await db.get_fills_before(wallet, time.time())
+        return await db.get_fills_before(wallet, oldest_ms / 1000)
+    except Exception as e:
+        logger.warning(f"Stored fills unavailable for export of {wallet}: {e}")
+        return []
+
+
+async def build_wallet_export(wallet: str, workdir: str, fmt: str = "csv", symbols: dict | None = None) -> list[tuple[str, str, str]]:
+    """Writes one wallet's history and fills files; returns [(path, filename, caption)]."""
+    portf, fills, funding, ledger = await asyncio.gather(
+        get_user_portfolio(wallet), get_user_fills(wallet), get_user_funding(wallet), get_user_ledger(wallet),
+        return_exceptions=True
+    )
+    portf = None if isinstance(portf, Exception) else portf
+    fills = [] if isinstance(fills, Exception) or not isinstance(fills, list) else fills
+    funding = [] if isinstance(funding, Exception) or not isinstance(funding, list) else funding
+    ledger = [] if isinstance(ledger, Exception) or not isinstance(ledger, list) else ledger
+    fills = fills + await _stored_fills_before(wallet, fills)
+
+    hist = history_rows(portf, ledger, funding)
+    if not hist and not fills:
+        return []
+    if symbols is None:
+        symbols = await get_symbol_map()
+
+    out = []
+    hist_fmt = _resolve_format(fmt, len(hist))
+    hist_name = _filename(f"history_{wallet[:6]}", hist_fmt)
+    hist_path = os.path.join(workdir, hist_name)
+    await asyncio.to_thread(write_rows, hist_path, HISTORY_COLUMNS, hist, hist_fmt)
+    out.append((hist_path, hist_name, f"📊 Equity & Ledger History: {wallet[:6]}"))
+
+    fills_fmt = _resolve_format(fmt, len(fills) + len(funding))
+    fills_name = _filename(f"fills_{wallet[:6]}", fills_fmt)
+    fills_path = os.path.join(workdir, fills_name)
+    await asyncio.to_thread(write_rows, fills_path, FILLS_COLUMNS, fill_rows(fills, funding, symbols), fills_fmt)
+    out.append((fills_path, fills_name, f"📝 Trade & Transaction History: {wallet[:6]}"))
+    return out
+
+
+@dataclass
+class ExportJob:
+    chat_id: int
+    user_id: int
+    wallets: list[str]
+    fmt: str = "csv"
+    status_msg: object | None = field(default=None, repr=False)
+
+
+async def _set_status(job: ExportJob, text: str | None):
+    if job.status_msg is None:
+        return
+    try:
+        if text is None:
+            await job.status_msg.delete()
+        else:
+            await job.status_msg.edit_text(text)
+    except Exception:
+        pass
+
+
+async def run_export_job(bot, job: ExportJob):
+    symbols = await get_symbol_map()
+    workdir = tempfile.mkdtemp(prefix="velox_export_")
+    try:
+        found_any = False
+        for wallet in job.wallets:
+            await _set_status(job, f"⏳ Exporting {wallet[:6]}... (History & Fills)")
+            for path, filename, caption in await build_wallet_export(wallet, workdir, job.fmt, symbols):
+                found_any = True
+                await bot.send_document(job.chat_id, FSInputFile(path, filename=filename), caption=caption)
+        await _set_status(job, None if found_any else "❌ No data found for any tracked wallets.")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+class ExportQueue:
+    """FIFO of export jobs served by EXPORT_WORKERS tasks, capped per user."""
+
+    def __init__(self):
+        self._queue: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+        self._active: dict[int, int] = defaultdict(int)
+
+    def has_capacity(self, user_id: int) -> bool:
+        return self._active.get(user_id, 0) < settings.EXPORT_MAX_PER_USER
+
+    def reserve(self, user_id: int) -> bool:
+        """Takes one of the user's export slots up front; False when they are all in use."""
+        if not self.has_capacity(user_id):
+            return False
+        self._active[user_id] += 1
+        return True
+
+    def release(self, user_id: int):
+        """Gives back a slot taken by `reserve` once its job finished or was never queued."""
+        self._active[user_id] -= 1
+        if self._active[user_id] <= 0:
+            self._active.pop(user_id, None)
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._workers = [w for w in self._workers if not w.done()]
+        while len(self._workers) < max(1, settings.EXPORT_WORKERS):
+            self._workers.append(asyncio.create_task(self._worker()))
+
+    async def submit(self, bot, job: ExportJob, reserved: bool = False) -> bool:
+        """
+        Queues `job`; False when the user is already at their export limit.
+        With `reserved` the job runs on a slot the caller already took.
+        """
+        if not reserved and not self.reserve(job.user_id):
+            return False
+        self._ensure_workers()
+        await self._queue.put((bot, job))
+        return True
+
+    async def _worker(self):
+        while True:
+            bot, job = await self._queue.get()
+            try:
+                await run_export_job(bot, job)
+            except Exception as e:
+                logger.exception(f"Export job for {job.chat_id} failed: {e}")
+                await _set_status(job, "❌ Export failed, please try again later.")
+            finally:
+                self.release(job.user_id)
+                self._queue.task_done()
+
+    async def join(self):
+        if self._queue is not None:
+            await self._queue.join()
+
+    def shutdown(self):
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+        self._queue = None
+        self._active.clear()
+
+
+export_queue = ExportQueue()
@@ -0,0 +1,99 @@
+"""
+Cold tier for old fills: one compressed columnar file per wallet and month.
+
+Files are numpy `.npz` archives with one array per field. Numeric fields are
+float64 columns with NaN for missing values. Every other field is kept as a
+JSON-encoded string column, so bools, nulls and nested values round-trip
+unchanged. Writes merge with an existing month file (newest copy of an `oid`
+wins) and replace it atomically. The Mongo manifest in `fill_archives` records
+what each file holds. All functions here are blocking and meant for
+asyncio.to_thread.
+"""
+import datetime
+import json
+import os
+
+import numpy as np
+
+from bot.services import FILL_NUMERIC_FIELDS
+
+NUMERIC_FIELDS = (*FILL_NUMERIC_FIELDS, "time", "oid", "tid")
+INT_FIELDS = ("time", "oid", "tid")
+
+
+def month_key(ts_ms: int) -> str:
+    return datetime.datetime.fromtimestamp(ts_ms / 1000, datetime.timezone.utc).strftime("%Y-%m")
+
+
+def archive_path(base_dir: str, wallet: str, month: str) -> str:
+    return os.path.join(base_dir, wallet.lower(), f"{month}.npz")
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def encode_columns(fills: list[dict]) -> dict[str, np.ndarray]:
+    keys = sorted({k for f in fills for k in f if k != "_id"})
+    columns = {}
+    for key in keys:
+        values = [f.get(key) for f in fills]
+        if key in NUMERIC_FIELDS and all(v is None or _is_number(v) for v in values):
+            columns[f"n:{key}"] = np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64)
+        else:
+            columns[f"s:{key}"] = np.array(["" if key not in f else json.dumps(f[key]) for f in fills], dtype=np.str_)
+    return columns
+
+
+def decode_columns(columns) -> list[dict]:
+    names = list(columns.keys())
+    if not names:
+        return []
+    rows = [{} for _ in range(len(columns[names[0]]))]
+    for name in names:
+        kind, key = name.split(":", 1)
+        col = columns[name]
+        for row, value in zip(rows, col.tolist()):
+            if kind == "n":
+                if value != value:  # NaN: field absent on this fill
+                    continue
+                row[key] = int(value) if key in INT_FIELDS else value
+            elif value != "":
+                row[key] = json.loads(value)
+    return rows
+
+
+def read_month(path: str, missing_ok: bool = False) -> list[dict]:
+    """
+    Fills stored in the month file at `path`. A missing file raises
+    FileNotFoundError unless `missing_ok`: the manifest says it exists, so
+    returning nothing would silently drop that month's fills.
+    """
+    if missing_ok and not os.path.exists(path):
+        return []
+    with np.load(path, allow_pickle=False) as data:
+        return decode_columns({name: data[name] for name in data.files})
+
+
+def write_month(path: str, fills: list[dict]) -> dict:
+    """
+    Merges `fills` into the month file at `path` and returns manifest stats
+    (rows, min_time, max_time, coins).
+    """
+    merged = {}
+    for f in read_month(path, missing_ok=True) + [dict(f) for f in fills]:
+        f.pop("_id", None)
+        merged[f.get("oid", id(f))] = f
+    rows = sorted(merged.values(), key=lambda f: f.get("time", 0))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp.npz"
+    np.savez_compressed(tmp, **encode_columns(rows))
+    os.replace(tmp, path)
+    times = [int(f.get("time", 0)) for f in rows]
+    return {
+        "rows": len(rows),
+        "min_time": min(times) if times else 0,
+        "max_time": max(times) if times else 0,
+        "coins": sorted({f["coin"] for f in rows if f.get("coin")}),
+    }
@@ -0,0 +1,64 @@
+"""
+Per-wallet last-seen cursors over the userFills stream.
+
+A cursor is the newest fill time seen for a wallet plus the keys of the fills
+at exactly that time (several fills can share a millisecond). Only fills that
+sort after the cursor are new, so the snapshot replayed on every
+(re)subscribe is deduped in memory. The cursor is advanced and stored before
+fills are announced, which sends each fill notification at most once.
+"""
+from dataclasses import dataclass, field
+
+
+def fill_key(fill: dict) -> str:
+    tid = fill.get("tid")
+    if tid is not None:
+        return f"t{tid}"
+    return f"{fill.get('hash')}:{fill.get('oid')}:{fill.get('time')}"
+
+
+def fill_time(fill: dict) -> int:
+    try:
+        return int(fill.get("time") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+@dataclass
+class FillCursor:
+    time: int = 0
+    keys: set[str] = field(default_factory=set)
+
+    def is_new(self, fill: dict) -> bool:
+        ts = fill_time(fill)
+        return ts > self.time or (ts == self.time and fill_key(fill) not in self.keys)
+
+    def advance(self, fills: list[dict]) -> bool:
+        """Moves the cursor past `fills`; returns whether it changed."""
+        changed = False
+        for fill in fills:
+            ts = fill_time(fill)
+            if ts > self.time:
+                self.time, self.keys = ts, {fill_key(fill)}
+                changed = True
+            elif ts == self.time and fill_key(fill) not in self.keys:
+                self.keys.add(fill_key(fill))
+                changed = True
+        return changed
+
+    def new_fills(self, fills: list[dict]) -> list[dict]:
+        """Fills after the cursor, oldest first, each once."""
+        seen, fresh = set(), []
+        for fill in sorted(fills, key=fill_time):
+            key = fill_key(fill)
+            if key not in seen and self.is_new(fill):
+                seen.add(key)
+                fresh.append(fill)
+        return fresh
+
+    def to_doc(self) -> dict:
+        return {"time": self.time, "keys": sorted(self.keys)}
+
+    @classmethod
+    def from_doc(cls, doc: dict) -> "FillCursor":
+        return cls(int(doc.get("time") or 0), set(doc.get("keys") or []))
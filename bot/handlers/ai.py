@@ -18,6 +18,7 @@ from bot.services import (
     get_perps_context, get_fear_greed_index, pretty_float
 )
 from bot.market_overview import market_overview
+from bot.market_state import get_market_state
 from bot.rss_engine import rss_engine
 from bot.renderer import render_html_to_image
 from bot.handlers._common import (
@@ -178,79 +179,44 @@ async def _send_ai_overview(bot, chat_id, user_id, status_msg=None, back_target=
         # ... existing logic ...
         # (skipping for brevity in research, but implementation must be full)
         # Fetch data in parallel
-        ctx, fng = await asyncio.gather(
-            get_perps_context(),
+        state, fng = await asyncio.gather(
+            get_market_state(),
             get_fear_greed_index(),
             return_exceptions=True
         )
         # Use cached RSS articles (refreshed by scheduler every 15 min)
         news = rss_engine.get_cached_articles(limit=200)
 
-        if isinstance(ctx, Exception) or not ctx:
+        if isinstance(state, Exception) or not state:
             raise ValueError("Failed to fetch market context")
-        
-        universe = ctx[0]["universe"] if isinstance(ctx[0], dict) and "universe" in ctx[0] else ctx[0]
-        asset_ctxs = ctx[1]
 
         # Process Market Data for Prompt
         market_data = {}
-        total_volume = sum(float(ac.get("dayNtlVlm", 0)) for ac in asset_ctxs)
-        total_oi = sum(float(ac.get("openInterest", 0)) * float(ac.get("markPx", 0)) for ac in asset_ctxs)
-
-        market_data["global_volume"] = pretty_float(total_volume, 0)
-        market_data["total_oi"] = pretty_float(total_oi, 0)
+        market_data["global_volume"] = pretty_float(float(state.volume.sum()), 0)
+        market_data["total_oi"] = pretty_float(float(state.oi_usd.sum()), 0)
 
         for sym in ["BTC", "ETH"]:
-            idx = next((i for i, u in enumerate(universe) if (u["name"] if isinstance(u, dict) else u) == sym), -1)
-            if idx != -1 and idx < len(asset_ctxs):
-                ac = asset_ctxs[idx]
-                p = float(ac.get("markPx", 0))
-                prev = float(ac.get("prevDayPx", 0) or p)
-                change = ((p - prev)/prev)*100 if prev else 0
-                market_data[sym] = {"price": pretty_float(p), "change": round(change, 2)}
+            row = state.get(sym)
+            if row:
+                market_data[sym] = {"price": pretty_float(row["mark"]), "change": round(row["change_24h"], 2)}
             else:
                 market_data[sym] = {"price": "0", "change": 0.0}
 
         market_data["etf_flows"] = {"btc_flow": 0, "eth_flow": 0}
 
-        movers = []
-        for i in range(min(len(universe), len(asset_ctxs))):
-            ac = asset_ctxs[i]
-            p = float(ac.get("markPx", 0))
-            prev = float(ac.get("prevDayPx", 0) or p)
-            change = ((p - prev)/prev)*100 if prev else 0
-            u_name = universe[i]["name"] if isinstance(universe[i], dict) else universe[i]
-            movers.append({"name": u_name, "change": round(change, 2)})
-
-        movers.sort(key=lambda x: x["change"], reverse=True)
+        movers = [{"name": state.names[i], "change": round(float(state.change_24h[i]), 2)} for i in state.top("change_24h", len(state))]
         market_data["top_gainers"] = movers[:5]
         market_data["top_losers"] = movers[-5:][::-1]
 
-        def get_change(idx):
-            if idx >= len(asset_ctxs):
-                return 0
-            ac = asset_ctxs[idx]
-            p = float(ac.get("markPx", 0))
-            prev = float(ac.get("prevDayPx", 0) or p)
-            return ((p - prev)/prev)*100 if prev else 0
+        gainer, loser = int(state.change_24h.argmax()), int(state.change_24h.argmin())
+        top_gainer, top_gainer_pct = state.names[gainer], float(state.change_24h[gainer])
+        top_loser, top_loser_pct = state.names[loser], float(state.change_24h[loser])
 
-        mover_indices = [(i, get_change(i)) for i in range(len(universe))]
-        mover_indices.sort(key=lambda x: x[1], reverse=True)
-        
-        top_gainer = (universe[mover_indices[0][0]]["name"] if isinstance(universe[mover_indices[0][0]], dict) else universe[mover_indices[0][0]])
-        top_gainer_pct = mover_indices[0][1]
-        top_loser = (universe[mover_indices[-1][0]]["name"] if isinstance(universe[mover_indices[-1][0]], dict) else universe[mover_indices[-1][0]])
-        top_loser_pct = mover_indices[-1][1]
-        
-        vol_indices = [(i, float(asset_ctxs[i].get("dayNtlVlm", 0))) for i in range(len(universe)) if i < len(asset_ctxs)]
-        vol_indices.sort(key=lambda x: x[1], reverse=True)
-        top_vol = (universe[vol_indices[0][0]]["name"] if isinstance(universe[vol_indices[0][0]], dict) else universe[vol_indices[0][0]])
-        top_vol_val = vol_indices[0][1]
-        
-        fund_indices = [(i, float(asset_ctxs[i].get("funding", 0))) for i in range(len(universe)) if i < len(asset_ctxs)]
-        fund_indices.sort(key=lambda x: x[1], reverse=True)
-        top_fund = (universe[fund_indices[0][0]]["name"] if isinstance(universe[fund_indices[0][0]], dict) else universe[fund_indices[0][0]])
-        top_fund_val = fund_indices[0][1] * 100 * 24 * 365 # APR
+        vol_idx = int(state.volume.argmax())
+        top_vol, top_vol_val = state.names[vol_idx], float(state.volume[vol_idx])
+
+        fund_idx = int(state.funding.argmax())
+        top_fund, top_fund_val = state.names[fund_idx], float(state.funding_apr[fund_idx]) # APR
 
         user_config = await db.get_overview_settings(user_id)
         
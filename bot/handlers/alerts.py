@@ -9,8 +9,9 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from bot.database import db
 from bot.locales import _t
 from bot.services import (
-    get_mid_price, pretty_float, get_perps_context
+    get_mid_price, pretty_float
 )
+from bot.market_state import get_market_state
 from bot.handlers._common import (
     smart_edit, _back_kb, _ensure_billing_quota, _settings_kb
 )
@@ -228,16 +229,14 @@ async def process_alert_target(message: Message, state: FSMContext):
     back_target = data.get("back_target", "cb_settings")
     if not await _ensure_billing_quota(message, message.chat.id, lang, "alerts", len(await db.get_user_alerts(message.chat.id)), "billing_feature_alerts"):
         return
-    ctx = await get_perps_context()
-    universe = ctx[0].get("universe", []) if isinstance(ctx[0], dict) else ctx[0]
-    asset_ctxs = ctx[1]
-    idx = next((i for i, u in enumerate(universe) if (u["name"] if isinstance(u, dict) else u) == symbol), -1)
+    state = await get_market_state()
+    row = state.get(symbol) if state else None
     current_val = 0.0
-    if idx != -1 and idx < len(asset_ctxs):
+    if row:
         if a_type == "funding":
-            current_val = float(asset_ctxs[idx].get("funding", 0)) * 24 * 365 * 100
+            current_val = row["funding_apr"]
         else:
-            current_val = float(asset_ctxs[idx].get("openInterest", 0)) * float(asset_ctxs[idx].get("markPx", 0)) / 1e6
+            current_val = row["oi_usd"] / 1e6
     direction = "above" if target > current_val else "below"
     await db.add_alert(message.chat.id, symbol, target, direction, a_type)
     success_msg = _t(lang, "funding_alert_set" if a_type == "funding" else "oi_alert_set", symbol=symbol, dir="📈" if direction == "above" else "📉", val=target)
@@ -272,11 +271,9 @@ async def cmd_f_alert(message: Message):
     target = float(args[2].replace(",", "."))
     if not await _ensure_billing_quota(message, message.chat.id, lang, "alerts", len(await db.get_user_alerts(message.chat.id)), "billing_feature_alerts"):
         return
-    ctx = await get_perps_context()
-    universe = ctx[0].get("universe", []) if isinstance(ctx[0], dict) else ctx[0]
-    asset_ctxs = ctx[1]
-    idx = next((i for i, u in enumerate(universe) if (u["name"] if isinstance(u, dict) else u) == symbol), -1)
-    curr = float(asset_ctxs[idx].get("funding", 0)) * 24 * 365 * 100 if idx != -1 else 0.0
+    state = await get_market_state()
+    row = state.get(symbol) if state else None
+    curr = row["funding_apr"] if row else 0.0
     direction = "above" if target > curr else "below"
     await db.add_alert(message.chat.id, symbol, target, direction, "funding")
     await message.answer(_t(lang, "funding_alert_set", symbol=symbol, dir="📈" if direction == "above" else "📉", val=target), parse_mode="HTML")
@@ -292,11 +289,9 @@ async def cmd_oi_alert(message: Message):
     target = float(args[2].replace(",", "."))
     if not await _ensure_billing_quota(message, message.chat.id, lang, "alerts", len(await db.get_user_alerts(message.chat.id)), "billing_feature_alerts"):
         return
-    ctx = await get_perps_context()
-    universe = ctx[0].get("universe", []) if isinstance(ctx[0], dict) else ctx[0]
-    asset_ctxs = ctx[1]
-    idx = next((i for i, u in enumerate(universe) if (u["name"] if isinstance(u, dict) else u) == symbol), -1)
-    curr = float(asset_ctxs[idx].get("openInterest", 0)) * float(asset_ctxs[idx].get("markPx", 0)) / 1e6 if idx != -1 else 0.0
+    state = await get_market_state()
+    row = state.get(symbol) if state else None
+    curr = row["oi_usd"] / 1e6 if row else 0.0
     direction = "above" if target > curr else "below"
     await db.add_alert(message.chat.id, symbol, target, direction, "oi")
     await message.answer(_t(lang, "oi_alert_set", symbol=symbol, dir="📈" if direction == "above" else "📉", val=target), parse_mode="HTML")
@@ -9,15 +9,18 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from bot.database import db
 from bot.locales import _t
 from bot.services import (
-    get_mid_price, get_perps_context, get_hlp_info, get_fear_greed_index,
-    get_symbol_name, get_spot_balances, get_perps_state, extract_avg_entry_from_balance
+    get_mid_price, get_hlp_info, get_fear_greed_index,
+    get_symbol_name, extract_avg_entry_from_balance
 )
+from bot.account_state import get_account_perps_state, get_account_spot_balances
 from bot.utils import pretty_float
 from bot.analytics import (
     prepare_modern_market_data, prepare_liquidity_data, prepare_coin_prices_data,
-    generate_market_overview_image, prepare_terminal_dashboard_data_clean
+    prepare_terminal_dashboard_data_clean
 )
 from bot.renderer import render_html_to_image
+from bot.market_state import get_market_state
+from bot.chart_pool import run_in_chart_pool
 from bot.handlers._common import (
     smart_edit, smart_edit_media, _back_kb, _get_billing_state, _ensure_billing_quota, _consume_billing_usage,
     BILLING_USAGE_OVERVIEW, _build_delta_neutral_dashboard, _ensure_billing_feature
@@ -37,21 +40,16 @@ async def cb_market(call: CallbackQuery):
     watchlist = await db.get_watchlist(call.message.chat.id)
     if not watchlist:
         watchlist = ["BTC", "ETH"]
-    ctx = await get_perps_context()
-    universe = (ctx[0].get("universe", []) if isinstance(ctx[0], dict) else ctx[0]) if ctx else []
-    asset_ctxs = ctx[1] if ctx else []
+    state = await get_market_state()
     lines = []
     for sym in watchlist:
-        idx = next((i for i, u in enumerate(universe) if (u["name"] if isinstance(u, dict) else u) == sym), -1)
-        price, funding_rate, volume, ac = 0.0, 0.0, 0.0, {}
-        if idx != -1 and idx < len(asset_ctxs):
-            ac = asset_ctxs[idx]
-            price = float(ac.get("markPx", 0))
-            funding_rate = float(ac.get("funding", 0))
-            volume = float(ac.get("dayNtlVlm", 0))
+        row = (state.get(sym) if state else None) or {}
+        price = row.get("mark", 0.0)
+        funding_rate = row.get("funding", 0.0)
+        volume = row.get("volume", 0.0)
+        change_24h = row.get("change_24h", 0.0)
         if price == 0:
             price = (ws.get_price(sym) if ws else 0.0) or await get_mid_price(sym)
-        change_24h = ((price - float(ac.get("prevDayPx", 0 or price))) / float(ac.get("prevDayPx", 0 or price))) * 100 if float(ac.get("prevDayPx", 0 or price)) > 0 else 0.0
         lines.append(
             f"🔹 <b>{sym}</b>: ${pretty_float(price, 4)} ({'🟢' if change_24h >= 0 else '🔴'} {change_24h:+.2f}%)\n"
             f"   F: {funding_rate*100:.4f}% ({funding_rate*24*365*100:.1f}% APR) | Vol: ${pretty_float(volume/1e6, 1)}M"
@@ -70,8 +68,8 @@ async def cb_heatmap_sort(call: CallbackQuery):
     sort_by = parts[1]
     back_target = ":".join(parts[2:]) if len(parts) > 2 else "sub:market"
     await call.answer(f"Sorting by {sort_by}...")
-    lang, ctx = await db.get_lang(call.message.chat.id), await get_perps_context()
-    buf = generate_market_overview_image(ctx[1], ctx[0].get("universe", []) if isinstance(ctx[0], dict) else ctx[0], sort_by=sort_by)
+    lang, state = await db.get_lang(call.message.chat.id), await get_market_state()
+    buf = await run_in_chart_pool("generate_market_overview_image", state.asset_ctxs, state.universe, sort_by=sort_by) if state else None
     kb = InlineKeyboardBuilder()
     for s in ["vol", "funding", "oi", "change"]:
         if s != sort_by:
@@ -319,7 +317,7 @@ async def cb_terminal(call: CallbackQuery):
     total_equity, total_upnl, total_margin_used, total_withdrawable, total_ntl = 0.0, 0.0, 0.0, 0.0, 0.0
     combined_assets, combined_positions = [], []
     for wallet in wallets:
-        spot_bals, perps_state = await get_spot_balances(wallet), await get_perps_state(wallet)
+        spot_bals, perps_state = await get_account_spot_balances(wallet), await get_account_perps_state(wallet)
         if spot_bals:
             for b in spot_bals:
                 coin_id, amount = b.get("coin"), float(b.get("total", 0) or 0)
@@ -332,8 +330,7 @@ async def cb_terminal(call: CallbackQuery):
                 entry = extract_avg_entry_from_balance(b)
                 if not entry or entry <= 0:
                     try:
-                        fills = await db.get_fills_by_coin(wallet, coin_id)
-                        entry = sum(float(f['px'])*float(f['sz']) for f in fills)/sum(float(f['sz']) for f in fills) if fills else 0.0
+                        entry = await db.get_avg_entry(wallet, coin_id)
                     except Exception:
                         entry = 0.0
                 if entry > 0 and px > 0:
@@ -8,15 +8,17 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from bot.database import db
 from bot.locales import _t
 from bot.services import (
-    get_symbol_name, get_mid_price, get_spot_balances, 
-    get_perps_state, get_user_portfolio,
-    extract_avg_entry_from_balance, get_user_vault_equities
+    get_symbol_name, get_mid_price, get_user_portfolio,
+    extract_avg_entry_from_balance, get_user_vault_equities, history_value_at
 )
 from bot.analytics import (
-    generate_pnl_chart, generate_pnl_card, prepare_portfolio_composition_data,
+    generate_pnl_card, prepare_portfolio_composition_data,
     prepare_pnl_card_data, prepare_positions_table_data
 )
 from bot.renderer import render_html_to_image
+from bot.chart_pool import run_in_chart_pool
+from bot.account_state import get_account_perps_state, get_account_spot_balances
+from bot.equity_series import DAY_MS, equity_changes, equity_history
 from bot.handlers._common import (
     smart_edit, smart_edit_media, _back_kb, _pagination_kb,
     _ensure_billing_feature, _consume_billing_usage, BILLING_USAGE_SHARE_PNL
@@ -40,7 +42,7 @@ async def cb_balance(call: CallbackQuery):
         return
     msg_parts, ws = [], getattr(call.message.bot, "ws_manager", None)
     for wallet in wallets:
-        spot_bals, perps_state, vault_equities = await get_spot_balances(wallet), await get_perps_state(wallet), await get_user_vault_equities(wallet)
+        spot_bals, perps_state, vault_equities = await get_account_spot_balances(wallet), await get_account_perps_state(wallet), await get_user_vault_equities(wallet)
         wallet_lines, wallet_total = [], 0.0
         if spot_bals:
             for b in spot_bals:
@@ -54,9 +56,7 @@ async def cb_balance(call: CallbackQuery):
                 entry = extract_avg_entry_from_balance(b)
                 if not entry or entry <= 0:
                     try:
-                        coin_fills = await db.get_fills_by_coin(wallet, coin_id)
-                        from bot.services import calc_avg_entry_from_fills
-                        entry = calc_avg_entry_from_fills(coin_fills)
+                        entry = await db.get_avg_entry(wallet, coin_id)
                     except Exception: entry = 0.0
                 pnl_str = ""
                 if entry > 0 and px > 0:
@@ -109,7 +109,7 @@ async def cb_portfolio_chart(call: CallbackQuery):
     context = parts[1] if len(parts) > 1 else "portfolio"
     lang, wallets, ws, assets_map = await db.get_lang(call.message.chat.id), await db.list_wallets(call.message.chat.id), getattr(call.message.bot, "ws_manager", None), {}
     for wallet in wallets:
-        spot_bals = await get_spot_balances(wallet)
+        spot_bals = await get_account_spot_balances(wallet)
         if spot_bals:
             for b in spot_bals:
                 coin_id, amount = b.get("coin"), float(b.get("total", 0) or 0)
@@ -117,7 +117,7 @@ async def cb_portfolio_chart(call: CallbackQuery):
                 name = await get_symbol_name(coin_id, is_spot=True)
                 px = (ws.get_price(name, coin_id) if ws else 0.0) or await get_mid_price(name, coin_id)
                 assets_map[name] = assets_map.get(name, 0) + (amount * px)
-        perps_state = await get_perps_state(wallet)
+        perps_state = await get_account_perps_state(wallet)
         if perps_state and "marginSummary" in perps_state:
              assets_map["USDC (Margin)"] = assets_map.get("USDC (Margin)", 0) + float(perps_state["marginSummary"].get("accountValue", 0) or 0)
     if not assets_map:
@@ -144,7 +144,7 @@ async def cb_positions(call: CallbackQuery):
         await smart_edit(call, _t(lang, "need_wallet"), reply_markup=_back_kb(lang, back_target))
         return
     for wallet in wallets:
-        state = await get_perps_state(wallet)
+        state = await get_account_perps_state(wallet)
         if not state: continue
         for p in state.get("assetPositions", []):
             pos = p.get("position", {})
@@ -183,7 +183,7 @@ async def cb_positions_img(call: CallbackQuery):
     lang, wallets, combined_positions, ws = await db.get_lang(call.message.chat.id), await db.list_wallets(call.message.chat.id), [], getattr(call.message.bot, "ws_manager", None)
     if not wallets: return
     for wallet in wallets:
-        state = await get_perps_state(wallet)
+        state = await get_account_perps_state(wallet)
         if state:
             for p in state.get("assetPositions", []):
                 pos = p.get("position", {})
@@ -195,7 +195,7 @@ async def cb_positions_img(call: CallbackQuery):
                 pnl = (mark - entry) * szi if mark else 0.0
                 roi = (pnl / (abs(szi) * entry / leverage)) * 100 if (leverage and szi and entry) else 0.0
                 combined_positions.append({"symbol": sym, "side": "LONG" if szi > 0 else "SHORT", "leverage": leverage, "size_usd": abs(szi * mark), "entry": entry, "mark": mark, "liq": liq, "pnl": pnl, "roi": roi})
-        spot_bals = await get_spot_balances(wallet)
+        spot_bals = await get_account_spot_balances(wallet)
         if spot_bals:
             for b in spot_bals:
                 coin_id, amount = b.get("coin"), float(b.get("total", 0) or 0)
@@ -204,7 +204,7 @@ async def cb_positions_img(call: CallbackQuery):
                 px = (ws.get_price(name, coin_id) if ws else 0.0) or await get_mid_price(name, coin_id)
                 entry = extract_avg_entry_from_balance(b)
                 if not entry or entry <= 0:
-                    try: entry = calc_avg_entry_from_fills(await db.get_fills_by_coin(wallet, coin_id))
+                    try: entry = await db.get_avg_entry(wallet, coin_id)
                     except Exception: entry = 0.0
                 spot_pnl = (px - entry) * amount if (entry > 0 and px > 0) else 0.0
                 combined_positions.append({"symbol": name, "side": "SPOT", "leverage": "SPOT", "size_usd": amount * px, "entry": entry, "mark": px, "liq": 0.0, "pnl": spot_pnl, "roi": ((px / entry) - 1) * 100 if entry > 0 else 0.0})
@@ -241,7 +241,7 @@ async def cb_share_pnl_menu(call: CallbackQuery):
     except Exception: page = 0
     kb, ws, has_pos = InlineKeyboardBuilder(), getattr(call.message.bot, "ws_manager", None), False
     for wallet in wallets:
-        state = await get_perps_state(wallet)
+        state = await get_account_perps_state(wallet)
         if not state: continue
         for p in state.get("assetPositions", []):
             pos = p.get("position", {})
@@ -271,7 +271,7 @@ async def cb_share_pnl(call: CallbackQuery):
     await call.answer(f"Generating card for {symbol}...")
     wallets, ws, target_pos = await db.list_wallets(call.message.chat.id), getattr(call.message.bot, "ws_manager", None), None
     for wallet in wallets:
-        state = await get_perps_state(wallet)
+        state = await get_account_perps_state(wallet)
         if not state: continue
         for p in state.get("assetPositions", []):
             pos = p.get("position", {})
@@ -308,7 +308,7 @@ async def cb_orders(call: CallbackQuery):
         orders = await get_open_orders(wallet)
         orders = orders.get("orders", []) if isinstance(orders, dict) else orders
         if not orders: continue
-        wallet_data[wallet] = {"spot": await get_spot_balances(wallet), "perps": await get_perps_state(wallet)}
+        wallet_data[wallet] = {"spot": await get_account_spot_balances(wallet), "perps": await get_account_perps_state(wallet)}
         for o in orders: o["wallet"] = wallet; all_orders.append(o)
     if not all_orders:
         await smart_edit(call, _t(lang, "orders_title") + "\n\n" + _t(lang, "no_open_orders"), reply_markup=_back_kb(lang, back_target)); return
@@ -358,7 +358,7 @@ async def cb_pnl(call: CallbackQuery):
     ws, g_spot_eq, g_perps_eq, g_spot_upnl, g_perps_upnl, wallet_cards = getattr(call.message.bot, "ws_manager", None), 0.0, 0.0, 0.0, 0.0, []
     for wallet in wallets:
         w_spot_eq, w_spot_upnl, w_perps_eq, w_perps_upnl = 0.0, 0.0, 0.0, 0.0
-        spot_bals = await get_spot_balances(wallet)
+        spot_bals = await get_account_spot_balances(wallet)
         if spot_bals:
             for b in spot_bals:
                 coin, amount = b.get("coin"), float(b.get("total", 0) or 0)
@@ -368,10 +368,10 @@ async def cb_pnl(call: CallbackQuery):
                 w_spot_eq += amount * px
                 entry = extract_avg_entry_from_balance(b) or (lambda: 0.0)()
                 if not entry:
-                    try: entry = calc_avg_entry_from_fills(await db.get_fills_by_coin(wallet, coin))
+                    try: entry = await db.get_avg_entry(wallet, coin)
                     except Exception: entry = 0.0
                 if entry > 0 and px > 0: w_spot_upnl += (px - entry) * amount
-        perps_state = await get_perps_state(wallet)
+        perps_state = await get_account_perps_state(wallet)
         if perps_state:
             if "marginSummary" in perps_state: w_perps_eq = float(perps_state["marginSummary"].get("accountValue", 0) or 0)
             for p in perps_state.get("assetPositions", []):
@@ -381,16 +381,21 @@ async def cb_pnl(call: CallbackQuery):
                     sym = await get_symbol_name(coin_id, is_spot=False)
                     mark = (ws.get_price(sym, coin_id) if ws else 0.0) or await get_mid_price(sym, coin_id)
                     if mark: w_perps_upnl += (mark - entry_px) * szi
-        portf, pnl_stats = await get_user_portfolio(wallet), ""
-        history_points = portf.get("data", {}).get("accountValueHistory", []) if isinstance(portf, dict) else (portf if isinstance(portf, list) else [])
-        if history_points and len(history_points) > 1:
-            try:
+        pnl_stats, get_change = "", None
+        local = await equity_changes(wallet, [DAY_MS, DAY_MS * 7, DAY_MS * 30])
+        if local:
+            get_change = local[1].get
+        else:
+            portf = await get_user_portfolio(wallet)
+            history_points = portf.get("data", {}).get("accountValueHistory", []) if isinstance(portf, dict) else (portf if isinstance(portf, list) else [])
+            if history_points and len(history_points) > 1:
                 history_points.sort(key=lambda x: x[0])
                 now_ms = history_points[-1][0]
                 def get_change(delta):
-                    t = now_ms - delta
-                    c = min(history_points, key=lambda x: abs(x[0] - t))
-                    return (float(history_points[-1][1]) - float(c[1])) if abs(c[0] - t) <= 86400000 * 2 else 0.0
+                    c = history_value_at(history_points, now_ms - delta, 86400000 * 2)
+                    return (float(history_points[-1][1]) - float(c[1])) if c else 0.0
+        if get_change:
+            try:
                 pnl_stats = f"\n   24h: {'🟢' if get_change(86400000)>=0 else '🔴'} ${pretty_float(get_change(86400000), 2)} | 7d: {'🟢' if get_change(86400000*7)>=0 else '🔴'} ${pretty_float(get_change(86400000*7), 2)} | 30d: {'🟢' if get_change(86400000*30)>=0 else '🔴'} ${pretty_float(get_change(86400000*30), 2)}"
             except Exception: pass
         g_spot_eq += w_spot_eq; g_perps_eq += w_perps_eq; g_spot_upnl += w_spot_upnl; g_perps_upnl += w_perps_upnl
@@ -415,20 +420,26 @@ async def cb_pnl_graph(call: CallbackQuery):
     if not wallets:
         await smart_edit(call, _t(lang, "need_wallet"), reply_markup=_back_kb(lang)); return
     aggregated_history = {}
-    for wallet in wallets:
-        portf = await get_user_portfolio(wallet)
-        if not portf: continue
-        h = []
-        if isinstance(portf, list):
-            target = next((i[1] for i in portf if isinstance(i, list) and len(i) == 2 and i[0] == "allTime"), None)
-            if not target and portf and isinstance(portf[0], list): target = portf[0][1]
-            h = target.get("accountValueHistory", []) if target else []
-        elif isinstance(portf, dict): h = portf.get("data", {}).get("accountValueHistory", [])
-        for ts, equity in h: aggregated_history[ts] = aggregated_history.get(ts, 0.0) + float(equity)
+    # Local sampled series when every wallet has enough of it, else the portfolio endpoint
+    local_series = [await equity_history(wallet) for wallet in wallets]
+    if all(local_series):
+        for series in local_series:
+            for ts, equity in series: aggregated_history[ts] = aggregated_history.get(ts, 0.0) + float(equity)
+    else:
+        for wallet in wallets:
+            portf = await get_user_portfolio(wallet)
+            if not portf: continue
+            h = []
+            if isinstance(portf, list):
+                target = next((i[1] for i in portf if isinstance(i, list) and len(i) == 2 and i[0] == "allTime"), None)
+                if not target and portf and isinstance(portf[0], list): target = portf[0][1]
+                h = target.get("accountValueHistory", []) if target else []
+            elif isinstance(portf, dict): h = portf.get("data", {}).get("accountValueHistory", [])
+            for ts, equity in h: aggregated_history[ts] = aggregated_history.get(ts, 0.0) + float(equity)
     if not aggregated_history:
         await call.message.answer("📭 No history data for graph."); return
     try:
-        buf = generate_pnl_chart([[ts, val] for ts, val in sorted(aggregated_history.items())], "Total Portfolio" if len(wallets) > 1 else wallets[0])
+        buf = await run_in_chart_pool("generate_pnl_chart", [[ts, val] for ts, val in sorted(aggregated_history.items())], "Total Portfolio" if len(wallets) > 1 else wallets[0])
         await smart_edit_media(call, BufferedInputFile(buf.read(), filename="pnl_chart.png"), "📈 <b>Equity History & Drawdown</b>", reply_markup=_back_kb(lang, f"cb_pnl:{context}"))
     except Exception as e:
         logger.error(f"Error rendering chart: {e}")
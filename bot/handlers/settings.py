@@ -10,13 +10,14 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from bot.database import db
 from bot.locales import _t
 from bot.services import (
-    pretty_float, get_user_portfolio
+    pretty_float, get_user_portfolio, history_value_at, portfolio_window
 )
 from bot.handlers._common import (
     smart_edit, smart_edit_media, _back_kb, _settings_kb, _ensure_billing_feature,
     _ensure_billing_quota, _valid_hhmm, _build_digest_settings_ui, DIGEST_TARGETS
 )
 from bot.handlers.states import SettingsStates
+from bot.equity_series import equity_as_of
 
 router = Router(name="settings")
 logger = logging.getLogger(__name__)
@@ -342,7 +343,7 @@ async def cb_flex_gen(call: CallbackQuery):
         portf = await get_user_portfolio(wallet)
         if not portf:
             continue
-        target_data = next((i[1] for i in portf if isinstance(i, list) and len(i) == 2 and i[0] == "allTime"), portf[0][1] if portf and isinstance(portf[0], list) else portf.get("data", {}) if isinstance(portf, dict) else {})
+        target_data = portfolio_window(portf, "allTime")
         equity_hist, pnl_hist = target_data.get("accountValueHistory", []), target_data.get("pnlHistory", [])
         if not equity_hist or not pnl_hist:
             continue
@@ -351,9 +352,11 @@ async def cb_flex_gen(call: CallbackQuery):
         if period == "all":
             p_start, e_start = 0.0, float(equity_hist[0][1]) - float(pnl_hist[0][1])
         else:
-            closest_p = min(pnl_hist, key=lambda x: abs(x[0] - target_time))
+            closest_p = history_value_at(pnl_hist, target_time)
             p_start = float(closest_p[1])
-            e_start = float(min(equity_hist, key=lambda x: abs(x[0] - closest_p[0]))[1])
+            e_start = await equity_as_of(wallet, target_time)
+            if e_start is None:
+                e_start = float(history_value_at(equity_hist, closest_p[0])[1])
         total_period_pnl += (float(pnl_hist[-1][1]) - p_start)
         total_start_equity += max(0, (float(equity_hist[-1][1]) - float(pnl_hist[-1][1])) if period == "all" else e_start)
         has_data = True
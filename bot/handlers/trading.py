@@ -10,8 +10,9 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from bot.database import db
 from bot.locales import _t
 from bot.services import (
-    get_symbol_name, get_mid_price, get_perps_state, get_user_fills, get_user_funding
+    get_symbol_name, get_mid_price, get_user_fills, get_user_funding
 )
+from bot.account_state import get_account_perps_state
 from bot.analytics import calculate_trade_stats
 from bot.handlers._common import (
     smart_edit, _back_kb
@@ -87,7 +88,7 @@ async def cb_risk_check(call: CallbackQuery):
     if not wallets:
         return
     for wallet in wallets:
-        state = await get_perps_state(wallet)
+        state = await get_account_perps_state(wallet)
         if not state:
             continue
         if "marginSummary" in state:
@@ -0,0 +1,227 @@
+"""
+Mongo-backed job leases so several bot replicas can run side by side.
+
+Each scheduled job (or partition of one) has a lease document in
+`job_leases` holding its owner replica, an expiry and a grant token that
+grows with every grant. Slot leases run a job once per period bucket across
+replicas: the lease is granted only until the bucket is marked done. Sticky
+leases (no period) stay with one replica while it keeps running the job,
+for jobs that share in-process state, and `hold_sticky` keeps long-running
+services (Telegram polling, the WS manager) on one replica with the others
+on standby. While a job runs its lease is renewed; if the renewal finds the
+token superseded, the job is cancelled and `lease_is_current()` turns False.
+
+The grant token is also a fencing token for the job's side effects, so a
+replica that stalls past its TTL cannot repeat what the new owner already
+did. Database writes of leased jobs pass `current_fence()` and only apply
+while no newer grant of the same lease has written the document, and the bot
+handed to a leased job is a `FencedBot` that checks the lease before every
+Telegram send. Only a send already on the wire when the lease lapses can
+still go out; Telegram takes no token.
+
+Leases only apply when LEASES_ENABLED is set; a single replica runs every
+job directly.
+"""
+import asyncio
+import contextvars
+import hashlib
+import logging
+import os
+import socket
+import time
+import uuid
+from dataclasses import dataclass
+from functools import wraps
+
+from bot.config import settings
+from bot.database import db
+
+logger = logging.getLogger(__name__)
+
+_BOOT_ID = uuid.uuid4().hex[:6]
+
+
+def replica_id() -> str:
+    """This process's lease owner name (the pid keeps forked workers apart)."""
+    return f"{socket.gethostname()}:{os.getpid()}:{_BOOT_ID}"
+
+
+@dataclass
+class Lease:
+    name: str
+    owner: str
+    token: int
+    slot: int | None = None
+
+
+_current_lease: contextvars.ContextVar[Lease | None] = contextvars.ContextVar("current_lease", default=None)
+_held: dict[str, Lease] = {}  # leases this process holds right now, by name
+
+
+def partition_of(key, partitions: int) -> int:
+    """Stable partition of `key`, the same on every replica."""
+    if partitions <= 1:
+        return 0
+    digest = hashlib.sha1(str(key).encode()).digest()
+    return int.from_bytes(digest[:8], "big") % partitions
+
+
+def current_slot(period_sec: int, now: float | None = None) -> int:
+    return int((time.time() if now is None else now) // max(int(period_sec), 1))
+
+
+async def lease_is_current() -> bool:
+    """False when the running job's lease has passed to another replica (always True outside a lease)."""
+    lease = _current_lease.get()
+    if lease is None:
+        return True
+    return await db.holds_lease(lease.name, lease.token)
+
+
+def current_fence() -> tuple[str, int] | None:
+    """(lease name, grant token) of the running job for fenced writes; None outside a lease."""
+    lease = _current_lease.get()
+    return None if lease is None else (lease.name, lease.token)
+
+
+def holds_locally(name: str) -> bool:
+    """Whether this process currently runs under lease `name`."""
+    return name in _held
+
+
+class FencedBot:
+    """
+    The bot as leased jobs see it: every `send_*` call first checks that the
+    job's lease is still current and is dropped (returning None) when it is
+    not. Everything else passes through.
+    """
+
+    def __init__(self, bot):
+        self._bot = bot
+
+    def __getattr__(self, name):
+        attr = getattr(self._bot, name)
+        if not name.startswith("send_") or not callable(attr):
+            return attr
+
+        @wraps(attr)
+        async def fenced_send(*args, **kwargs):
+            if not await lease_is_current():
+                lease = _current_lease.get()
+                logger.warning(f"Lease {lease.name} (token {lease.token}) lost, dropping {name}")
+                return None
+            return await attr(*args, **kwargs)
+        return fenced_send
+
+
+async def _keep_renewed(lease: Lease, ttl_ms: int, task: asyncio.Future):
+    while not task.done():
+        await asyncio.sleep(ttl_ms / 3000)
+        try:
+            renewed = await db.renew_lease(lease.name, lease.owner, lease.token, ttl_ms)
+        except Exception as e:
+            logger.warning(f"Lease {lease.name} renewal failed: {e}")
+            continue
+        if not renewed:
+            logger.warning(f"Lease {lease.name} (token {lease.token}) was taken over, cancelling the job.")
+            task.cancel()
+            return
+
+
+async def run_leased(name: str, fn, period_sec: int | None = None, ttl_sec: int | None = None, owner: str | None = None) -> bool:
+    """
+    Runs `fn()` if this replica wins lease `name`: once per `period_sec`
+    bucket, or sticky to one replica when `period_sec` is None. Returns
+    whether it ran to completion here.
+    """
+    owner = owner or replica_id()
+    ttl_ms = int(float(ttl_sec or settings.LEASE_TTL_SEC) * 1000)
+    slot = current_slot(period_sec) if period_sec else None
+    doc = await db.acquire_lease(name, owner, ttl_ms, slot=slot)
+    if not doc:
+        return False
+    lease = Lease(name, owner, int(doc["token"]), slot)
+
+    reset = _current_lease.set(lease)
+    try:
+        task = asyncio.ensure_future(fn())
+    finally:
+        _current_lease.reset(reset)
+    keeper = asyncio.create_task(_keep_renewed(lease, ttl_ms, task))
+    _held[name] = lease
+    try:
+        await task
+    except asyncio.CancelledError:
+        if keeper.done():  # cancelled by a lost lease, not by shutdown
+            return False
+        raise
+    finally:
+        keeper.cancel()
+        if _held.get(name) is lease:
+            del _held[name]
+
+    if slot is not None:
+        await db.release_lease(name, owner, lease.token, done_slot=slot)
+    return True
+
+
+async def run_partitioned(name: str, items: list, fn, period_sec: int, key=lambda item: item, owner: str | None = None) -> int:
+    """
+    Splits `items` into LEASE_PARTITIONS stable partitions and runs
+    `fn(part)` for each partition whose lease this replica wins this period.
+    Replicas that finish early pick up partitions nobody has started.
+    Returns the number of items processed here.
+    """
+    if not settings.LEASES_ENABLED:
+        await fn(items)
+        return len(items)
+    partitions = max(settings.LEASE_PARTITIONS, 1)
+    parts: dict[int, list] = {}
+    for item in items:
+        parts.setdefault(partition_of(key(item), partitions), []).append(item)
+    done = 0
+    for index in sorted(parts):
+        part = parts[index]
+        if await run_leased(f"{name}:p{index}", lambda part=part: fn(part), period_sec=period_sec, owner=owner):
+            done += len(part)
+    return done
+
+
+async def hold_sticky(name: str, fn, retry_sec: float | None = None, owner: str | None = None):
+    """
+    Runs the long-lived `fn()` only while this replica holds sticky lease
+    `name`. Other replicas wait on standby and take over once the holder
+    stops renewing; a holder that loses the lease has `fn()` cancelled and
+    goes back to waiting. Runs `fn()` directly when leases are off.
+    """
+    if not settings.LEASES_ENABLED:
+        return await fn()
+    retry_sec = retry_sec or settings.LEASE_TTL_SEC / 3
+    waiting = False
+    while True:
+        if await run_leased(name, fn, owner=owner):
+            return
+        if not waiting:
+            logger.info(f"Lease {name} is held by another replica, standing by.")
+        waiting = True
+        await asyncio.sleep(retry_sec)
+
+
+def leased_job(func, period_sec: int | None = None, name: str | None = None):
+    """
+    Wraps a scheduler job so it runs under lease `name` (default: the job
+    name) when LEASES_ENABLED is on. Jobs sharing a sticky `name` stay on the
+    same replica. The job's bot argument is swapped for a FencedBot.
+    """
+    lease_name = name or func.__name__
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        if not settings.LEASES_ENABLED:
+            return await func(*args, **kwargs)
+        args = tuple(FencedBot(a) if hasattr(a, "send_message") else a for a in args)
+        try:
+            await run_leased(lease_name, lambda: func(*args, **kwargs), period_sec=period_sec)
+        except Exception as e:
+            logger.exception(f"Leased job {func.__name__} failed: {e}")
+    return wrapper
@@ -7,6 +7,9 @@ from bot.handlers import main_router
 from bot.ws_manager import WSManager
 from bot.scheduler import setup_scheduler
 from bot.services import close_session
+from bot.chart_pool import start_chart_pool, shutdown_chart_pool
+from bot.exporter import export_queue
+from bot.leases import hold_sticky
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -40,11 +43,11 @@ async def main():
     ws_manager = WSManager(bot)
     bot.ws_manager = ws_manager
     
-    # Start WS Manager in background
-    ws_task = asyncio.create_task(ws_manager.start())
-    
     # Setup Scheduler
     scheduler = setup_scheduler(bot)
+
+    # Warm chart worker processes in the background
+    asyncio.create_task(start_chart_pool())
     
     # Set Bot Commands
     from aiogram.types import BotCommand
@@ -63,23 +66,33 @@ async def main():
     ]
     await bot.set_my_commands(commands)
     
-    # Start Polling
-    logger.info("Starting bot...")
-    try:
-        await dp.start_polling(bot)
-    except Exception as e:
-        logger.error(f"Bot polling error: {e}")
-    finally:
-        logger.info("Shutting down...")
-        ws_manager.running = False
-        if ws_task:
+    async def serve():
+        # Start WS Manager in background, then poll
+        ws_task = asyncio.create_task(ws_manager.start())
+        try:
+            await dp.start_polling(bot)
+        except Exception as e:
+            logger.error(f"Bot polling error: {e}")
+        finally:
+            ws_manager.running = False
             ws_task.cancel()
             try:
                 await ws_task
             except asyncio.CancelledError:
                 pass
-        
+
+    # Telegram allows one getUpdates poller per token and WS alerts must go out
+    # once, so with LEASES_ENABLED only the replica holding the lease of WS
+    # process 0 polls and runs the WS manager; the others run leased jobs and
+    # stand by to take over. Extra WS processes (bot.ws_worker) lease their own index.
+    logger.info("Starting bot...")
+    try:
+        await hold_sticky(f"ws:p{settings.WS_PROCESS_INDEX}", serve)
+    finally:
+        logger.info("Shutting down...")
         scheduler.shutdown(wait=False)
+        shutdown_chart_pool()
+        export_queue.shutdown()
         await bot.session.close()
         await close_session()
         logger.info("Bot session closed. Goodbye!")
@@ -203,7 +203,8 @@ class MarketOverview:
         return s
 
     async def _build_user_context_snapshot(self, wallets: list[str]) -> dict:
-        from bot.services import get_spot_balances, get_perps_state, get_symbol_name
+        from bot.account_state import get_account_perps_state, get_account_spot_balances
+        from bot.services import get_symbol_name
 
         if not wallets:
             return {
@@ -216,7 +217,7 @@ class MarketOverview:
             }
 
         results = await asyncio.gather(*[
-            asyncio.gather(get_spot_balances(wallet), get_perps_state(wallet), return_exceptions=True)
+            asyncio.gather(get_account_spot_balances(wallet), get_account_perps_state(wallet), return_exceptions=True)
             for wallet in wallets
         ])
 
@@ -513,6 +514,15 @@ Provide a concise summary with key bullet points."""
         """
         from bot.agent import AgentOrchestrator
 
+        if mode == "overview" and not event_data:
+            # Scheduled and on-demand overviews share one market stage per period
+            return await AgentOrchestrator().run_shared(
+                user_id=user_id,
+                lang=lang,
+                custom_prompt=custom_prompt,
+                style=style,
+            )
+
         report = await AgentOrchestrator().run(
             mode=mode,
             user_id=user_id,
@@ -0,0 +1,257 @@
+"""
+Parsed, versioned view of Hyperliquid's `metaAndAssetCtxs` response.
+
+The raw payload is two parallel arrays (universe, assetCtxs) of string
+fields. `MarketState` parses it once per refresh into numeric columns and a
+symbol -> index map, so consumers look assets up in O(1) instead of scanning
+the universe and re-casting strings on every access.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from functools import cached_property
+
+import numpy as np
+
+from bot.config import settings
+from bot.services import get_perps_context
+
+logger = logging.getLogger(__name__)
+
+
+def split_perps_context(ctx) -> tuple[list, list]:
+    """Returns (universe, asset_ctxs) from either the list or dict response shape."""
+    universe, asset_ctxs = [], []
+    if isinstance(ctx, dict):
+        universe = ctx.get("universe", [])
+        asset_ctxs = ctx.get("assetCtxs", [])
+    elif isinstance(ctx, list) and len(ctx) == 2:
+        universe = ctx[0].get("universe", []) if isinstance(ctx[0], dict) else ctx[0]
+        asset_ctxs = ctx[1]
+    if not isinstance(universe, list) or not isinstance(asset_ctxs, list):
+        return [], []
+    return universe, asset_ctxs
+
+
+def _num(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+# Slippage reported when impact prices are missing or look like placeholders
+NO_LIQUIDITY_SLIPPAGE = 99.9
+
+
+@dataclass(frozen=True, eq=False)
+class MarketMetrics:
+    """Derived per-asset columns and market-wide aggregates, computed in one vectorized pass."""
+    slippage: np.ndarray    # percent, average of bid/ask impact distance from mark
+    efficiency: np.ndarray  # 24h volume / OI notional
+    vol_proxy: np.ndarray   # |hourly funding| in bps
+    global_volume: float
+    total_oi: float
+    avg_funding_apr: float
+    avg_premium: float
+
+
+@dataclass(frozen=True, eq=False)
+class MarketState:
+    """
+    Column-oriented perps market snapshot. Row `i` of every column belongs to
+    `names[i]`; `universe` and `asset_ctxs` keep the raw payload for the few
+    consumers that still need untouched fields.
+    """
+    version: int
+    fetched_at: float
+    names: tuple[str, ...]
+    index: dict[str, int]
+    index_upper: dict[str, int]
+    mark: np.ndarray
+    oracle: np.ndarray
+    prev_day: np.ndarray
+    funding: np.ndarray        # hourly rate, decimal
+    funding_apr: np.ndarray    # percent
+    open_interest: np.ndarray  # contracts
+    oi_usd: np.ndarray
+    change_24h: np.ndarray     # percent
+    volume: np.ndarray         # 24h notional, USD
+    premium: np.ndarray        # mark over oracle, percent
+    impact_bid: np.ndarray
+    impact_ask: np.ndarray
+    universe: list
+    asset_ctxs: list
+    _ranks: dict = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_context(cls, ctx, version: int = 0, fetched_at: float | None = None) -> MarketState | None:
+        universe, asset_ctxs = split_perps_context(ctx)
+        n = min(len(universe), len(asset_ctxs))
+        if n == 0:
+            return None
+
+        names = []
+        cols = np.zeros((8, n), dtype=float)
+        for i in range(n):
+            u = universe[i]
+            ac = asset_ctxs[i] if isinstance(asset_ctxs[i], dict) else {}
+            names.append(u.get("name", "") if isinstance(u, dict) else str(u))
+            impact = ac.get("impactPxs")
+            if not isinstance(impact, list) or len(impact) < 2:
+                impact = (0, 0)
+            cols[0, i] = _num(ac.get("markPx"))
+            cols[1, i] = _num(ac.get("oraclePx"))
+            cols[2, i] = _num(ac.get("prevDayPx"))
+            cols[3, i] = _num(ac.get("funding"))
+            cols[4, i] = _num(ac.get("openInterest"))
+            cols[5, i] = _num(ac.get("dayNtlVlm"))
+            cols[6, i] = _num(impact[0])
+            cols[7, i] = _num(impact[1])
+
+        mark, oracle, prev_day, funding, open_interest, volume, impact_bid, impact_ask = cols
+        # Missing oracle/previous-day prices fall back to mark, as the dashboards always did
+        oracle = np.where(oracle > 0, oracle, mark)
+        prev_day = np.where(prev_day > 0, prev_day, mark)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            change_24h = np.where(prev_day > 0, (mark - prev_day) / prev_day * 100, 0.0)
+            premium = np.where(oracle > 0, (mark - oracle) / oracle * 100, 0.0)
+
+        index: dict[str, int] = {}
+        index_upper: dict[str, int] = {}
+        for i, name in enumerate(names):
+            index.setdefault(name, i)
+            index_upper.setdefault(name.upper(), i)
+
+        return cls(
+            version=version,
+            fetched_at=time.time() if fetched_at is None else fetched_at,
+            names=tuple(names),
+            index=index,
+            index_upper=index_upper,
+            mark=mark,
+            oracle=oracle,
+            prev_day=prev_day,
+            funding=funding,
+            funding_apr=funding * 24 * 365 * 100,
+            open_interest=open_interest,
+            oi_usd=open_interest * mark,
+            change_24h=change_24h,
+            volume=volume,
+            premium=premium,
+            impact_bid=impact_bid,
+            impact_ask=impact_ask,
+            universe=universe[:n],
+            asset_ctxs=asset_ctxs[:n],
+        )
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, symbol) -> bool:
+        return symbol in self.index
+
+    def locate(self, symbol: str) -> int | None:
+        """Row index for a symbol; falls back to a case-insensitive match (kPEPE vs KPEPE)."""
+        i = self.index.get(symbol)
+        if i is None and symbol:
+            i = self.index_upper.get(str(symbol).upper())
+        return i
+
+    def get(self, symbol: str) -> dict | None:
+        """Plain-float row for one symbol, or None if it is not listed."""
+        i = self.locate(symbol)
+        if i is None:
+            return None
+        return {
+            "name": self.names[i],
+            "mark": float(self.mark[i]),
+            "prev_day": float(self.prev_day[i]),
+            "change_24h": float(self.change_24h[i]),
+            "funding": float(self.funding[i]),
+            "funding_apr": float(self.funding_apr[i]),
+            "open_interest": float(self.open_interest[i]),
+            "oi_usd": float(self.oi_usd[i]),
+            "volume": float(self.volume[i]),
+            "premium": float(self.premium[i]),
+        }
+
+    @cached_property
+    def metrics(self) -> MarketMetrics:
+        mark, bid, ask = self.mark, self.impact_bid, self.impact_ask
+        has_impact = (bid > 0) & (ask > 0) & (mark > 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            slippage = np.where(has_impact, (np.abs(ask - mark) + np.abs(mark - bid)) / (2 * mark) * 100, NO_LIQUIDITY_SLIPPAGE)
+            efficiency = np.where(self.oi_usd > 0, self.volume / self.oi_usd, 0.0)
+        # Impacts exactly at mark are stale/placeholder data
+        slippage[slippage == 0] = NO_LIQUIDITY_SLIPPAGE
+        return MarketMetrics(
+            slippage=slippage,
+            efficiency=efficiency,
+            vol_proxy=np.abs(self.funding * 10000),
+            global_volume=float(self.volume.sum()),
+            total_oi=float(self.oi_usd.sum()),
+            avg_funding_apr=float(self.funding_apr.mean()),
+            avg_premium=float(self.premium.mean()),
+        )
+
+    def column(self, name: str) -> np.ndarray:
+        """A raw column (mark, volume, ...) or a derived one (slippage, efficiency, vol_proxy)."""
+        values = getattr(self, name, None)
+        if not isinstance(values, np.ndarray):
+            values = getattr(self.metrics, name)
+        return values
+
+    def rank(self, name: str, descending: bool = True) -> np.ndarray:
+        """
+        Row indices ordered by a column, computed once per state. The sort is
+        stable, so ties keep universe order in both directions.
+        """
+        key = (name, descending)
+        order = self._ranks.get(key)
+        if order is None:
+            values = self.column(name)
+            order = np.argsort(-values if descending else values, kind="stable")
+            self._ranks[key] = order
+        return order
+
+    def top(self, column: str, n: int, ascending: bool = False) -> list[int]:
+        """Row indices of the `n` largest (or smallest) values of a column."""
+        return [int(i) for i in self.rank(column, descending=not ascending)[:n]]
+
+
+# --- SHARED INSTANCE ---
+
+_state: MarketState | None = None
+_state_lock = asyncio.Lock()
+
+
+async def get_market_state(max_age: float | None = None) -> MarketState | None:
+    """
+    Returns the shared MarketState, refetching metaAndAssetCtxs when it is
+    older than `max_age` (MARKET_STATE_TTL_SEC by default). Concurrent callers
+    share one fetch; on a failed fetch the previous state is returned.
+    """
+    global _state
+    ttl = settings.MARKET_STATE_TTL_SEC if max_age is None else max_age
+    current = _state
+    if current is not None and time.time() - current.fetched_at < ttl:
+        return current
+
+    async with _state_lock:
+        current = _state
+        if current is not None and time.time() - current.fetched_at < ttl:
+            return current
+        try:
+            ctx = await get_perps_context()
+        except Exception as e:
+            logger.warning(f"Market state refresh failed: {e}")
+            return current
+        fresh = MarketState.from_context(ctx, version=(current.version + 1) if current else 1)
+        if fresh is None:
+            return current
+        _state = fresh
+        return fresh
@@ -18,6 +18,78 @@ _browser = None
 _browser_lock = asyncio.Lock()
 _render_semaphore = asyncio.Semaphore(settings.RENDER_CONCURRENCY)
 
+# Output profiles selectable per call site.
+#   format:  png | jpeg | webp
+#   scale:   device scale factor (2 = retina, 1 = preview)
+#   quality: lossy encoders only
+#   colors:  palette-quantize PNG output to this many colors
+OUTPUT_PROFILES = {
+    "png": {"format": "png", "scale": 2},
+    "png8": {"format": "png", "scale": 2, "colors": 256},
+    "webp": {"format": "webp", "scale": 2, "quality": 85},
+    "jpeg": {"format": "jpeg", "scale": 2, "quality": 88},
+    "preview": {"format": "jpeg", "scale": 1, "quality": 75},
+}
+
+_EXTENSIONS = {"png": "png", "jpeg": "jpg", "webp": "webp"}
+
+
+def get_output_profile(name: str) -> dict:
+    profile = OUTPUT_PROFILES.get(name)
+    if profile is None:
+        raise ValueError(f"Unknown render output profile: {name}")
+    return profile
+
+
+def image_filename(stem: str, profile: str = "png") -> str:
+    """Filename with the extension matching the profile's encoding."""
+    return f"{stem}.{_EXTENSIONS[get_output_profile(profile)['format']]}"
+
+
+def _save_image(img, profile: dict) -> bytes:
+    """Encodes a PIL image according to an output profile."""
+    from PIL import Image
+
+    out = io.BytesIO()
+    if profile["format"] == "webp":
+        img.convert("RGB").save(out, format="WEBP", quality=profile.get("quality", 85), method=4)
+    elif profile["format"] == "jpeg":
+        img.convert("RGB").save(out, format="JPEG", quality=profile.get("quality", 88))
+    elif profile.get("colors"):
+        img = img.convert("RGB").quantize(colors=profile["colors"], method=Image.Quantize.MEDIANCUT)
+        img.save(out, format="PNG", optimize=True)
+    else:
+        img.save(out, format="PNG", compress_level=3)
+    return out.getvalue()
+
+
+def _encode_image(png_bytes: bytes, profile: dict) -> bytes:
+    """
+    Re-encodes a PNG screenshot for profiles Chromium cannot produce directly
+    (WebP, palette PNG). CPU-bound; run it off the event loop.
+    """
+    from PIL import Image
+
+    if profile["format"] != "webp" and not profile.get("colors"):
+        return png_bytes
+    return _save_image(Image.open(io.BytesIO(png_bytes)), profile)
+
+
+def _is_card_template(template_name: str) -> bool:
+    """Whether the template is routed to the Pillow card backend (RENDER_PIL_TEMPLATES)."""
+    configured = {name.strip() for name in (settings.RENDER_PIL_TEMPLATES or "").split(",") if name.strip()}
+    if template_name not in configured:
+        return False
+    # Imported here so matplotlib/numpy only load in processes that draw cards
+    from bot.card_renderer import CARD_PAINTERS
+    return template_name in CARD_PAINTERS
+
+
+def _paint_card(template_name: str, data: dict, lang: str, width: int, height: int, profile: dict) -> bytes:
+    from bot.card_renderer import CARD_PAINTERS
+    img = CARD_PAINTERS[template_name](data, lang=lang, width=width, height=height, scale=profile["scale"])
+    return _save_image(img, profile)
+
 
 async def _get_browser():
     global _playwright, _browser
@@ -32,22 +104,37 @@ async def _get_browser():
         )
         return _browser
 
-async def render_html_to_image(template_name: str, data: dict, width: int = 800, height: int = 800, lang: str = "ru") -> io.BytesIO:
+def render_template_html(template_name: str, data: dict, lang: str = "ru") -> str:
     """
-    Renders an HTML template with Jinja2 and takes a screenshot using Playwright.
+    Renders an HTML template with Jinja2 (no browser involved).
     """
     template_path = os.path.join(TEMPLATE_DIR, template_name)
     with open(template_path, "r", encoding="utf-8") as f:
         template_html = f.read()
-    
+
     # Inject translations
     data["t"] = get_all_translations(lang)
-    
-    # Render HTML with data
+
     template = Template(template_html)
     template.globals.update(abs=abs, min=min, max=max)
-    rendered_html = template.render(**data)
-    
+    return template.render(**data)
+
+async def render_html_to_image(template_name: str, data: dict, width: int = 800, height: int = 800, lang: str = "ru", profile: str = "png") -> io.BytesIO:
+    """
+    Renders an HTML template with Jinja2 and takes a screenshot using Playwright.
+    `profile` selects the output encoding and scale (see OUTPUT_PROFILES).
+    """
+    output = get_output_profile(profile)
+    if _is_card_template(template_name):
+        try:
+            image_bytes = await asyncio.to_thread(_paint_card, template_name, data, lang, width, height, output)
+            return io.BytesIO(image_bytes)
+        except Exception as e:
+            logger.warning("Card backend failed for %s, falling back to Chromium: %s", template_name, e)
+
+    rendered_html = render_template_html(template_name, data, lang)
+
+    image_bytes = None
     last_error = None
     for attempt in range(2):
         context = None
@@ -56,7 +143,7 @@ async def render_html_to_image(template_name: str, data: dict, width: int = 800,
                 browser = await _get_browser()
                 context = await browser.new_context(
                     viewport={"width": width, "height": height},
-                    device_scale_factor=2,  # Higher quality (Retina)
+                    device_scale_factor=output["scale"],
                 )
                 page = await context.new_page()
 
@@ -69,8 +156,11 @@ async def render_html_to_image(template_name: str, data: dict, width: int = 800,
                     pass
                 await page.wait_for_timeout(250)
 
-                image_bytes = await page.screenshot(type="png", full_page=False, timeout=15000)
-                return io.BytesIO(image_bytes)
+                if output["format"] == "jpeg":
+                    image_bytes = await page.screenshot(type="jpeg", quality=output["quality"], full_page=False, timeout=15000)
+                else:
+                    image_bytes = await page.screenshot(type="png", full_page=False, timeout=15000)
+                break
         except Exception as e:
             last_error = e
             logger.warning("Image render attempt %s failed: %s", attempt + 1, e)
@@ -90,4 +180,22 @@ async def render_html_to_image(template_name: str, data: dict, width: int = 800,
                     await context.close()
                 except Exception:
                     pass
-    raise RuntimeError(f"Failed to render image {template_name}: {last_error}")
+    if image_bytes is None:
+        raise RuntimeError(f"Failed to render image {template_name}: {last_error}")
+    if output["format"] == "webp" or output.get("colors"):
+        image_bytes = await asyncio.to_thread(_encode_image, image_bytes, output)
+    return io.BytesIO(image_bytes)
+
+
+async def render_bundle(jobs: dict[str, tuple[str, dict]], width: int = 800, height: int = 800, lang: str = "ru", profile: str = "png") -> dict[str, io.BytesIO]:
+    """
+    Renders several templates concurrently and returns {name: image}.
+    jobs: {name: (template_name, data)}. Wall time is bounded by the slowest
+    image (and RENDER_CONCURRENCY) instead of the sum; fails if any image fails.
+    """
+    names = list(jobs)
+    results = await asyncio.gather(*(
+        render_html_to_image(template_name, dict(data), width=width, height=height, lang=lang, profile=profile)
+        for template_name, data in (jobs[name] for name in names)
+    ))
+    return dict(zip(names, results))
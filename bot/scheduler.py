@@ -4,14 +4,20 @@ from bot.database import db
 from bot.config import HLP_VAULT_ADDR, DIGEST_TARGETS, settings
 from bot.utils import _vault_display_name, pretty_float
 from bot.services import (
-    get_spot_balances, get_user_portfolio, get_perps_context, 
-    get_hlp_info, _is_buy, calc_avg_entry_from_fills, get_all_assets_meta,
+    get_spot_balances, get_user_portfolio, get_mid_price,
+    get_hlp_info, ledger_avg_entry, get_all_assets_meta,
+    history_value_at,
     get_fear_greed_index, get_user_vault_equities
 )
-from bot.analytics import prepare_modern_market_data
+from bot.analytics import prepare_modern_market_data, prepare_coin_prices_data, prepare_liquidity_data
+from bot.market_state import MarketState, get_market_state
+from bot.account_state import account_equity
+from bot.equity_series import DAY_MS, HOUR_MS, equity_changes
+from bot.leases import current_fence, holds_locally, lease_is_current, leased_job, run_partitioned
+from bot.schedules import SCHEDULE_DIGEST, SCHEDULE_MARKET_REPORT, SCHEDULE_OVERVIEW
 from bot.market_overview import market_overview
 from bot.rss_engine import rss_engine
-from bot.renderer import render_html_to_image
+from bot.renderer import image_filename, render_bundle, render_html_to_image
 from bot.delta_neutral import (
     collect_delta_neutral_snapshot,
     apply_delta_monitoring,
@@ -19,6 +25,7 @@ from bot.delta_neutral import (
 )
 import datetime
 import asyncio
+import collections
 import logging
 import time
 import markdown
@@ -41,39 +48,80 @@ def safe_job(func):
             logger.exception(f"Scheduler job {func.__name__} failed: {e}")
     return wrapper
 
-# In-memory caches
-_digest_cache: dict = {}
-_digest_cache_ts: float = 0
+# How late a claimed schedule slot may be and still go out; slots missed for
+# longer, e.g. during downtime, are skipped. A paced run holds up the next one,
+# so the grace is stretched to the longest recent run (_DispatchPacer.grace_ms)
+SCHEDULE_GRACE_DIGEST_MIN = 5
+SCHEDULE_GRACE_MARKET_REPORT_MIN = 5
+SCHEDULE_GRACE_OVERVIEW_MIN = 10
+
+class _DispatchPacer:
+    """Spaces per-user scheduled deliveries at DISPATCH_SENDS_PER_SEC across all dispatch jobs."""
+
+    def __init__(self):
+        self._next_at = 0.0
+        self._lock = asyncio.Lock()
+        self.recent_runs: collections.deque[float] = collections.deque(maxlen=20)  # seconds per dispatch run
+
+    def grace_ms(self, grace_min: int) -> int:
+        """`grace_min`, or the longest recent dispatch run plus a minute if that is longer."""
+        longest = max(self.recent_runs, default=0.0)
+        return int(max(grace_min * 60, longest + 60) * 1000)
+
+    async def wait(self):
+        interval = 1.0 / max(settings.DISPATCH_SENDS_PER_SEC, 0.1)
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next_at - now
+            self._next_at = max(now, self._next_at) + interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+_dispatch_pacer = _DispatchPacer()
+
+def paced_dispatch(func):
+    """Records how long a schedule dispatch run took, for the claim grace."""
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.monotonic()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _dispatch_pacer.recent_runs.append(time.monotonic() - started)
+    return wrapper
+
+# Inputs every user of one slot shares, kept for the length of a dispatch window
+_shared_inputs: dict[str, tuple[float, object]] = {}
 
+async def _shared_input(name: str, fetch):
+    ttl = settings.DISPATCH_WINDOW_SEC + settings.DISPATCH_PREWARM_SEC
+    hit = _shared_inputs.get(name)
+    if hit and time.time() - hit[0] < ttl:
+        return hit[1]
+    value = await fetch()
+    if value:
+        _shared_inputs[name] = (time.time(), value)
+    return value
+
+# In-memory caches
 _market_images_cache: dict[str, bytes] = {}
 _market_images_ts: float = 0
+_market_images_lock = asyncio.Lock()
 
 _overview_cache: dict[str, tuple[dict, bytes, float]] = {} # key: hash(prompt+style+lang) -> (ai_data, image_bytes, ts)
 
-async def _refresh_digest_cache():
-    global _digest_cache, _digest_cache_ts
-    if time.time() - _digest_cache_ts < 300 and _digest_cache:
-        return
-    
-    try:
-        # Load users with digest settings and billing info
-        users = await db.users.find(
-            {"digest_settings": {"$exists": True}},
-            {"user_id": 1, "digest_settings": 1, "billing": 1, "lang": 1}
-        ).to_list(None)
-        _digest_cache = {u["user_id"]: u for u in users}
-        _digest_cache_ts = time.time()
-        logger.info(f"Digest cache refreshed: {len(_digest_cache)} users")
-    except Exception as e:
-        logger.error(f"Failed to refresh digest cache: {e}")
+async def _get_users(user_ids: set[int | str] | None = None) -> list[dict]:
+    """All users, or only `user_ids` when a dispatch targets a few of them."""
+    if user_ids is None:
+        return await db.get_all_users()
+    return await db.get_users_by_ids(user_ids)
 
-
-async def _get_user_wallet_pairs() -> list[tuple[int | str, str]]:
+async def _get_user_wallet_pairs(user_ids: set[int | str] | None = None) -> list[tuple[int | str, str]]:
     """Return deduplicated (user_id, wallet) pairs from current + legacy storage."""
     pairs: set[tuple[int | str, str]] = set()
 
     # Primary source: dedicated wallets collection
-    cursor = db.wallets.find({})
+    cursor = db.wallets.find({} if user_ids is None else {"user_id": {"$in": list(user_ids)}})
     async for w_doc in cursor:
         user_id = w_doc.get("user_id")
         wallet = w_doc.get("address")
@@ -81,7 +129,7 @@ async def _get_user_wallet_pairs() -> list[tuple[int | str, str]]:
             pairs.add((user_id, wallet.lower()))
 
     # Legacy source: users.wallet_address
-    users = await db.get_all_users()
+    users = await _get_users(user_ids)
     for user in users:
         user_id = user.get("user_id")
         wallet = user.get("wallet_address")
@@ -121,10 +169,69 @@ async def collect_vault_snapshots(bot=None):
                 continue
             equity = float(item.get("equity", 0) or 0)
             try:
-                await db.upsert_vault_snapshot(user_id, wallet, vault, equity, now_ts)
+                if not await db.upsert_vault_snapshot(user_id, wallet, vault, equity, now_ts, fence=current_fence()):
+                    logger.warning("Vault snapshots were taken over by a newer lease grant, stopping.")
+                    return
             except Exception as e:
                 logger.debug(f"Vault snapshot upsert failed for {wallet}/{vault}: {e}")
 
+@safe_job
+async def sample_wallet_equity(bot=None):
+    """Record one equity / uPnL point per tracked wallet from the live account snapshots."""
+    wallets = sorted({wallet for _, wallet in await _get_user_wallet_pairs()})
+    ws = getattr(bot, "ws_manager", None)
+    now_ms = int(time.time() * 1000)  # shared ts so multi-wallet series line up
+    sem = asyncio.Semaphore(8)
+
+    saved = 0
+
+    async def sample(wallet):
+        nonlocal saved
+        async with sem:
+            try:
+                point = await account_equity(wallet, ws)
+                if point:
+                    await db.save_equity_sample(wallet, now_ms, *point)
+                    saved += 1
+            except Exception as e:
+                logger.debug(f"Equity sample failed for {wallet}: {e}")
+
+    async def sample_part(part):
+        await asyncio.gather(*(sample(w) for w in part))
+
+    # Replicas split the wallets by partition lease
+    mine = await run_partitioned("sample_wallet_equity", wallets, sample_part, settings.EQUITY_SAMPLE_INTERVAL_MIN * 60)
+    logger.debug(f"Equity samples: {saved}/{mine} wallets")
+
+@safe_job
+async def downsample_equity_samples(bot=None):
+    """Compact aged equity samples to hourly, then daily points, and drop expired ones."""
+    now_ms = int(time.time() * 1000)
+    dropped = 0
+    for wallet in await db.list_equity_sample_wallets():
+        dropped += await db.compact_equity_samples(wallet, now_ms - settings.EQUITY_RAW_KEEP_HOURS * HOUR_MS, HOUR_MS)
+        dropped += await db.compact_equity_samples(wallet, now_ms - settings.EQUITY_HOURLY_KEEP_DAYS * DAY_MS, DAY_MS)
+    pruned = await db.prune_equity_samples(now_ms - settings.EQUITY_SAMPLE_KEEP_DAYS * DAY_MS)
+    logger.info(f"Equity samples downsampled: dropped {dropped}, pruned {pruned}")
+
+@safe_job
+async def archive_old_fills(bot=None):
+    """Move fills past FILL_ARCHIVE_AFTER_DAYS from Mongo into the per-wallet monthly archive files."""
+    if settings.LEASES_ENABLED and not settings.FILL_ARCHIVE_SHARED:
+        # Any replica reads the files back through the shared manifest, so a
+        # replica-local directory would lose the fills for all the others
+        logger.error("Fill archiving is off: with LEASES_ENABLED, FILL_ARCHIVE_DIR must be shared storage (FILL_ARCHIVE_SHARED)")
+        return
+    before_ms = int(time.time() * 1000) - settings.FILL_ARCHIVE_AFTER_DAYS * DAY_MS
+    moved = 0
+    for wallet in await db.list_wallets_with_fills_before(before_ms):
+        try:
+            moved += await db.archive_wallet_fills(wallet, before_ms, settings.FILL_ARCHIVE_DIR)
+        except Exception as e:
+            logger.warning(f"Fill archive failed for {wallet}: {e}")
+    if moved:
+        logger.info(f"Archived {moved} fills older than {settings.FILL_ARCHIVE_AFTER_DAYS}d")
+
 async def _send_vault_periodic_summary(bot, period: str, days: int, target_user_ids: set[int | str] | None = None):
     period = period.lower()
     if period not in ("weekly", "monthly"):
@@ -133,7 +240,7 @@ async def _send_vault_periodic_summary(bot, period: str, days: int, target_user_
     logger.info(f"Generating {period} vault summary...")
     now_ts = int(time.time())
     start_ts = now_ts - (days * 24 * 60 * 60)
-    users = await db.get_all_users()
+    users = await _get_users(target_user_ids)
 
     for user in users:
         user_id = user.get("user_id")
@@ -141,6 +248,7 @@ async def _send_vault_periodic_summary(bot, period: str, days: int, target_user_
             continue
         if target_user_ids is not None and user_id not in target_user_ids:
             continue
+        await _dispatch_pacer.wait()
 
         lang = user.get("lang", "ru")
         vault_reports = user.get("vault_reports", {})
@@ -163,6 +271,7 @@ async def _send_vault_periodic_summary(bot, period: str, days: int, target_user_
         sections = []
         total_equity = 0.0
         total_change = 0.0
+        base_equities = await db.get_vault_snapshot_bases(user_id, start_ts)
 
         for wallet, tracked_vaults in wanted_by_wallet.items():
             try:
@@ -184,9 +293,8 @@ async def _send_vault_periodic_summary(bot, period: str, days: int, target_user_
                 current_equity = current_map.get(vault, 0.0)
                 total_equity += current_equity
 
-                base_doc = await db.get_latest_vault_snapshot_before(user_id, wallet, vault, start_ts)
-                if base_doc:
-                    base_equity = float(base_doc.get("equity", 0) or 0)
+                base_equity = base_equities.get((wallet.lower(), vault.lower()))
+                if base_equity is not None:
                     diff = current_equity - base_equity
                     pct = (diff / base_equity) * 100 if base_equity > 0 else 0.0
                     icon = "🟢" if diff >= 0 else "🔴"
@@ -198,7 +306,7 @@ async def _send_vault_periodic_summary(bot, period: str, days: int, target_user_
                 wallet_lines.append(
                     f"• <b>{_vault_display_name(vault)}</b>: ${pretty_float(current_equity, 2)} | Δ {diff_text}"
                 )
-                await db.upsert_vault_snapshot(user_id, wallet, vault, current_equity, now_ts)
+                await db.upsert_vault_snapshot(user_id, wallet, vault, current_equity, now_ts, fence=current_fence())
 
             if wallet_lines:
                 sections.append(
@@ -233,7 +341,7 @@ async def send_monthly_vault_summary(bot, target_user_ids: set[int | str] | None
 async def send_daily_hlp_digest(bot, target_user_ids: set[int | str] | None = None):
     """Send a compact HLP snapshot for users who enabled HLP daily and have HLP allocation."""
     logger.info("Generating daily HLP digest...")
-    pairs = await _get_user_wallet_pairs()
+    pairs = await _get_user_wallet_pairs(target_user_ids)
     if not pairs:
         return
 
@@ -241,7 +349,7 @@ async def send_daily_hlp_digest(bot, target_user_ids: set[int | str] | None = No
     for user_id, wallet in pairs:
         user_wallets.setdefault(user_id, []).append(wallet)
 
-    users = await db.get_all_users()
+    users = await _get_users(target_user_ids)
     now_ts = int(time.time())
     periods = {
         "24h": now_ts - 86400,
@@ -249,7 +357,7 @@ async def send_daily_hlp_digest(bot, target_user_ids: set[int | str] | None = No
         "30d": now_ts - (30 * 86400)
     }
 
-    hlp_info = await get_hlp_info()
+    hlp_info = await _shared_input("hlp_info", get_hlp_info)
     summary = hlp_info.get("summary", {}) if isinstance(hlp_info, dict) else {}
     share_px = float(summary.get("sharePx", 0) or 0)
     account_value = float(summary.get("accountValue", 0) or 0)
@@ -266,6 +374,7 @@ async def send_daily_hlp_digest(bot, target_user_ids: set[int | str] | None = No
         wallets = user_wallets.get(user_id, [])
         if not wallets:
             continue
+        await _dispatch_pacer.wait()
 
         lang = user.get("lang", "ru")
         digest_settings = await db.get_digest_settings(user_id)
@@ -298,7 +407,7 @@ async def send_daily_hlp_digest(bot, target_user_ids: set[int | str] | None = No
                 current_hlp_by_wallet[wallet] = wallet_hlp
                 total_hlp_equity += wallet_hlp
                 wallet_lines.append(f"• <code>{wallet[:6]}...{wallet[-4:]}</code>: ${pretty_float(wallet_hlp, 2)}")
-                await db.upsert_vault_snapshot(user_id, wallet, HLP_VAULT_ADDR, wallet_hlp, now_ts)
+                await db.upsert_vault_snapshot(user_id, wallet, HLP_VAULT_ADDR, wallet_hlp, now_ts, fence=current_fence())
 
         if total_hlp_equity <= 0:
             continue
@@ -353,24 +462,43 @@ async def send_daily_hlp_digest(bot, target_user_ids: set[int | str] | None = No
         except Exception as e:
             logger.error(f"Failed to send daily HLP digest to {user_id}: {e}")
 
+async def _claim_due(kind: str, grace_min: int) -> list[dict]:
+    # A replica whose job lease passed to another one stops claiming. This is a
+    # check, not a fence: the conditional update on next_due is what keeps two
+    # claimers from both taking a slot
+    if not await lease_is_current():
+        return []
+    return await db.claim_due_schedules(kind, int(time.time() * 1000), _dispatch_pacer.grace_ms(grace_min))
+
+@safe_job
+async def prewarm_dispatch_inputs(bot=None):
+    """Precompute the shared inputs of schedules coming due within DISPATCH_PREWARM_SEC."""
+    until_ms = int(time.time() * 1000) + settings.DISPATCH_PREWARM_SEC * 1000
+    warm = []
+    if await db.has_schedule_due_by(SCHEDULE_MARKET_REPORT, until_ms):
+        warm += [_get_market_images(), get_fear_greed_index()]
+    if await db.has_schedule_due_by(SCHEDULE_OVERVIEW, until_ms):
+        warm += [get_market_state(), get_fear_greed_index(), _shared_input("etf_flows", market_overview.fetch_etf_flows)]
+    if await db.has_schedule_due_by(SCHEDULE_DIGEST, until_ms, key="hlp_daily"):
+        warm.append(_shared_input("hlp_info", get_hlp_info))
+    if warm:
+        await asyncio.gather(*warm, return_exceptions=True)
+
 @safe_job
+@paced_dispatch
 async def send_scheduled_digests(bot):
-    """Check user digest settings every 5 minutes and dispatch due digests."""
-    await _refresh_digest_cache()
-    now = datetime.datetime.now(datetime.timezone.utc)
-    
-    # Check window of last 5 minutes to avoid missing any if interval is */5
-    times_to_check = [(now - datetime.timedelta(minutes=i)).strftime("%H:%M") for i in range(5)]
-    now_dow = now.strftime("%a").lower()[:3]  # mon..sun
-    now_dom = now.day
-
-    due_portfolio_daily: set[int | str] = set()
-    due_portfolio_weekly: set[int | str] = set()
-    due_hlp_daily: set[int | str] = set()
-    due_vault_weekly: set[int | str] = set()
-    due_vault_monthly: set[int | str] = set()
-
-    for user_id, u in _digest_cache.items():
+    """Dispatch the digests whose next-due slot has come, then advance them."""
+    claimed = await _claim_due(SCHEDULE_DIGEST, SCHEDULE_GRACE_DIGEST_MIN)
+    if not claimed:
+        return
+
+    due: dict[str, set[int | str]] = {target: set() for target in DIGEST_TARGETS}
+    users = await db.get_users_by_ids({d["user_id"] for d in claimed}, {"user_id": 1, "digest_settings": 1, "billing": 1})
+    users_by_id = {u["user_id"]: u for u in users}
+    for doc in claimed:
+        u = users_by_id.get(doc["user_id"])
+        if not u or doc["key"] not in due:
+            continue
         # Subscription and plan config
         sub = u.get("billing", {}).get("subscription", {})
         plan = normalize_plan(sub.get("plan") if sub else None)
@@ -384,121 +512,130 @@ async def send_scheduled_digests(bot):
         enabled_targets = [target for target in DIGEST_TARGETS if bool(cfg.get(target, {}).get("enabled", False))]
         if digest_slots is not None:
             enabled_targets = enabled_targets[:digest_slots]
-        enabled_target_set = set(enabled_targets)
-
-        pd = cfg.get("portfolio_daily", {})
-        if "portfolio_daily" in enabled_target_set and pd.get("time") in times_to_check:
-            due_portfolio_daily.add(user_id)
-
-        pw = cfg.get("portfolio_weekly", {})
-        if "portfolio_weekly" in enabled_target_set and pw.get("time") in times_to_check and str(pw.get("day_of_week", "sun")).lower() == now_dow:
-            due_portfolio_weekly.add(user_id)
-
-        hd = cfg.get("hlp_daily", {})
-        if "hlp_daily" in enabled_target_set and hd.get("time") in times_to_check:
-            due_hlp_daily.add(user_id)
-
-        vw = cfg.get("vault_weekly", {})
-        if "vault_weekly" in enabled_target_set and vw.get("time") in times_to_check and str(vw.get("day_of_week", "sun")).lower() == now_dow:
-            due_vault_weekly.add(user_id)
-
-        vm = cfg.get("vault_monthly", {})
-        vm_day = int(vm.get("day", 1) or 1)
-        if "vault_monthly" in enabled_target_set and vm.get("time") in times_to_check and vm_day == now_dom:
-            due_vault_monthly.add(user_id)
-
-    if due_portfolio_daily:
-        await send_daily_digest(bot, target_user_ids=due_portfolio_daily)
-    if due_hlp_daily:
-        await send_daily_hlp_digest(bot, target_user_ids=due_hlp_daily)
-    if due_portfolio_weekly:
-        await send_weekly_summary(bot, target_user_ids=due_portfolio_weekly)
-    if due_vault_weekly:
-        await send_weekly_vault_summary(bot, target_user_ids=due_vault_weekly)
-    if due_vault_monthly:
-        await send_monthly_vault_summary(bot, target_user_ids=due_vault_monthly)
-
-async def _get_market_images() -> dict:
+        if doc["key"] in enabled_targets:
+            due[doc["key"]].add(doc["user_id"])
+
+    if due["portfolio_daily"]:
+        await send_daily_digest(bot, target_user_ids=due["portfolio_daily"])
+    if due["hlp_daily"]:
+        await send_daily_hlp_digest(bot, target_user_ids=due["hlp_daily"])
+    if due["portfolio_weekly"]:
+        await send_weekly_summary(bot, target_user_ids=due["portfolio_weekly"])
+    if due["vault_weekly"]:
+        await send_weekly_vault_summary(bot, target_user_ids=due["vault_weekly"])
+    if due["vault_monthly"]:
+        await send_monthly_vault_summary(bot, target_user_ids=due["vault_monthly"])
+
+def _market_images_version(state: MarketState) -> str:
+    """
+    Fingerprint of a market state at the precision the market images
+    display: 24h change to 0.1%, funding APR to 1% and volume/OI to two
+    significant digits. Ticks below that do not bump the version.
+    """
+    rows = [
+        f"{name}:{change:.1f}:{apr:.0f}:{vol:.2g}:{oi:.2g}"
+        for name, change, apr, vol, oi in zip(
+            state.names, state.change_24h.tolist(), state.funding_apr.tolist(),
+            state.volume.tolist(), state.oi_usd.tolist()
+        )
+    ]
+    return hashlib.sha1("|".join(rows).encode()).hexdigest()[:16]
+
+async def _build_market_images(force: bool = False) -> dict:
+    """
+    Fetches the perps context and re-renders the market image set when its
+    version changed (or the set is older than MARKET_IMAGES_MAX_AGE_SEC).
+    The finished set replaces `_market_images_cache` in a single assignment,
+    so readers never see a half-built set.
+    """
     global _market_images_cache, _market_images_ts
-    if time.time() - _market_images_ts < 300 and _market_images_cache:
-        return _market_images_cache
-
-    # Fetch market data once
-    ctx, hlp_info = await asyncio.gather(
-        get_perps_context(),
+    state, hlp_info = await asyncio.gather(
+        get_market_state(),
         get_hlp_info(),
         return_exceptions=True
     )
-    
-    if isinstance(ctx, Exception) or not ctx or not isinstance(ctx, list) or len(ctx) != 2:
-        return {}
-        
+
+    if isinstance(state, Exception) or not state:
+        return _market_images_cache
+
     if isinstance(hlp_info, Exception):
         hlp_info = None
-        
-    universe = ctx[0]
-    if isinstance(universe, dict) and "universe" in universe:
-        universe = universe["universe"]
-        
-    asset_ctxs = ctx[1]
-    
+
+    version = _market_images_version(state)
+    age = time.time() - _market_images_ts
+    if (
+        not force
+        and _market_images_cache
+        and _market_images_cache.get("version") == version
+        and age < settings.MARKET_IMAGES_MAX_AGE_SEC
+    ):
+        return _market_images_cache
+
     # Prepare data for templates
-    from bot.analytics import prepare_liquidity_data, prepare_coin_prices_data
-    data_alpha = prepare_modern_market_data(asset_ctxs, universe, hlp_info)
-    data_liq = prepare_liquidity_data(asset_ctxs, universe)
-    data_prices = prepare_coin_prices_data(asset_ctxs, universe)
-    
+    data_alpha = prepare_modern_market_data(state, hlp_info=hlp_info)
+    data_liq = prepare_liquidity_data(state)
+    data_prices = prepare_coin_prices_data(state)
+
     if not data_alpha:
-        return {}
+        return _market_images_cache
 
     # Render images
-    buf_alpha = await render_html_to_image("market_stats.html", data_alpha)
-    buf_liq = await render_html_to_image("liquidity_stats.html", data_liq)
-    buf_heat = await render_html_to_image("funding_heatmap.html", data_alpha)
-    buf_prices = await render_html_to_image("coin_prices.html", data_prices)
-    
+    profile = settings.RENDER_BROADCAST_PROFILE
+    images = await render_bundle({
+        "img_alpha": ("market_stats.html", data_alpha),
+        "img_liq": ("liquidity_stats.html", data_liq),
+        "img_heat": ("funding_heatmap.html", data_alpha),
+        "img_prices": ("coin_prices.html", data_prices),
+    }, profile=profile)
+
     _market_images_cache = {
-        "img_alpha": buf_alpha.read(),
-        "img_liq": buf_liq.read(),
-        "img_heat": buf_heat.read(),
-        "img_prices": buf_prices.read(),
+        **{name: buf.read() for name, buf in images.items()},
         "data_alpha": data_alpha,
-        "universe": universe,
-        "asset_ctxs": asset_ctxs
+        "state": state,
+        "profile": profile,
+        "version": version,
     }
     _market_images_ts = time.time()
+    logger.info(f"Market images refreshed (version {version}, previous age {age:.0f}s)")
     return _market_images_cache
 
 @safe_job
+async def refresh_market_images(bot=None):
+    """Keeps the market image set warm; re-renders only on a new snapshot version."""
+    if _market_images_lock.locked():
+        return
+    async with _market_images_lock:
+        await _build_market_images()
+
+async def _get_market_images() -> dict:
+    """
+    Returns the ready market image set. Only renders inline on a cold start
+    (or when the background refresher has stalled for 3x the max age).
+    """
+    stale = time.time() - _market_images_ts > settings.MARKET_IMAGES_MAX_AGE_SEC * 3
+    if _market_images_cache and not stale:
+        return _market_images_cache
+
+    async with _market_images_lock:
+        # Another caller may have finished the build while we waited
+        stale = time.time() - _market_images_ts > settings.MARKET_IMAGES_MAX_AGE_SEC * 3
+        if _market_images_cache and not stale:
+            return _market_images_cache
+        return await _build_market_images(force=stale)
+
+@safe_job
+@paced_dispatch
 async def send_market_reports(bot):
-    """Checks all users and sends scheduled market reports."""
+    """Sends the market reports whose next-due slot has come."""
     now_utc = datetime.datetime.now(datetime.timezone.utc).strftime("%H:%M")
-    
-    users = await db.get_all_users()
-    users_to_alert = []
-    
-    for user in users:
-        alert_times = user.get("market_alert_times", [])
-        should_send = False
-        new_alert_times = []
-        modified = False
-        
-        for t_entry in alert_times:
-            t = t_entry["t"] if isinstance(t_entry, dict) else t_entry
-            is_repeat = t_entry.get("r", True) if isinstance(t_entry, dict) else True
-            
-            if t == now_utc:
-                should_send = True
-                if not is_repeat:
-                    modified = True
-                    continue 
-            new_alert_times.append(t_entry)
-            
-        if should_send:
-            users_to_alert.append(user)
-            if modified:
-                await db.update_user_settings(user["user_id"], {"market_alert_times": new_alert_times})
-            
+
+    claimed = await _claim_due(SCHEDULE_MARKET_REPORT, SCHEDULE_GRACE_MARKET_REPORT_MIN)
+    for doc in claimed:
+        if not doc.get("repeat", True):
+            await db.remove_market_alert_time(doc["user_id"], doc["key"])
+    if not claimed:
+        return
+    users_to_alert = await db.get_users_by_ids({d["user_id"] for d in claimed}, {"user_id": 1, "lang": 1})
     if not users_to_alert:
         return
         
@@ -510,25 +647,23 @@ async def send_market_reports(bot):
         return
 
     data_alpha = m_cache["data_alpha"]
-    universe = m_cache["universe"]
-    asset_ctxs = m_cache["asset_ctxs"]
+    state: MarketState = m_cache["state"]
+    fng = await get_fear_greed_index()
     
     for user in users_to_alert:
+        await _dispatch_pacer.wait()
         chat_id = user["user_id"]
         lang = user.get("lang", "ru")
         
         major_symbols = ["BTC", "ETH", "SOL", "HYPE"]
         majors_text = ""
         for sym in major_symbols:
-            idx = next((i for i, u in enumerate(universe) if u["name"] == sym), -1)
-            if idx != -1:
-                ac = asset_ctxs[idx]
-                price = float(ac.get("markPx", 0))
-                prev = float(ac.get("prevDayPx", 0) or price)
-                change = ((price - prev) / prev) * 100 if prev > 0 else 0.0
-                funding = float(ac.get("funding", 0)) * 24 * 365 * 100
-                oi = float(ac.get("openInterest", 0)) * price / 1e6
-                vol = float(ac.get("dayNtlVlm", 0)) / 1e6
+            row = state.get(sym)
+            if row:
+                price, change = row["mark"], row["change_24h"]
+                funding = row["funding_apr"]
+                oi = row["oi_usd"] / 1e6
+                vol = row["volume"] / 1e6
                 icon = "🟢" if change >= 0 else "🔴"
                 majors_text += f"🔹 <b>{sym}</b>: ${pretty_float(price)} ({icon} {change:+.2f}%)\n   ├ F: <code>{funding:+.1f}% APR</code>\n   └ OI: <b>${oi:.1f}M</b> | Vol: <b>${vol:.1f}M</b>\n\n"
 
@@ -538,16 +673,12 @@ async def send_market_reports(bot):
             for sym in watchlist:
                 if sym in major_symbols:
                     continue
-                idx = next((i for i, u in enumerate(universe) if u["name"] == sym), -1)
-                if idx != -1:
-                    ac = asset_ctxs[idx]
-                    price = float(ac.get("markPx", 0))
-                    prev = float(ac.get("prevDayPx", 0) or price)
-                    change = ((price - prev) / prev) * 100 if prev > 0 else 0.0
+                row = state.get(sym)
+                if row:
+                    price, change = row["mark"], row["change_24h"]
                     watchlist_lines.append(f"• {sym}: ${pretty_float(price)} ({'🟢' if change >= 0 else '🔴'} {change:+.2f}%)")
         
         watchlist_text = f"⭐ <b>{_t(lang, 'market_report_watchlist')}</b>:\n" + "\n".join(watchlist_lines) + "\n\n" if watchlist_lines else ""
-        fng = await get_fear_greed_index()
         fng_text = f"🧠 <b>Fear & Greed:</b> {fng['emoji']} <b>{fng['value']}</b> ({fng['classification']}) {'📈' if fng['change'] > 0 else ('📉' if fng['change'] < 0 else '➖')} {fng['change']:+d}\n\n" if fng else ""
 
         text_report = (
@@ -560,64 +691,68 @@ async def send_market_reports(bot):
             from aiogram.utils.keyboard import InlineKeyboardBuilder
             from aiogram.types import InlineKeyboardButton
             kb = InlineKeyboardBuilder().row(InlineKeyboardButton(text=_t(lang, "btn_main_menu"), callback_data="cb_menu"))
+            profile = m_cache.get("profile", "png")
             media = [
-                InputMediaPhoto(media=BufferedInputFile(m_cache["img_prices"], filename="prices.png")),
-                InputMediaPhoto(media=BufferedInputFile(m_cache["img_heat"], filename="heatmap.png")),
-                InputMediaPhoto(media=BufferedInputFile(img_alpha if 'img_alpha' in m_cache else m_cache["img_alpha"], filename="alpha.png")),
-                InputMediaPhoto(media=BufferedInputFile(m_cache["img_liq"], filename="liquidity.png"))
+                InputMediaPhoto(media=BufferedInputFile(m_cache["img_prices"], filename=image_filename("prices", profile))),
+                InputMediaPhoto(media=BufferedInputFile(m_cache["img_heat"], filename=image_filename("heatmap", profile))),
+                InputMediaPhoto(media=BufferedInputFile(m_cache["img_alpha"], filename=image_filename("alpha", profile))),
+                InputMediaPhoto(media=BufferedInputFile(m_cache["img_liq"], filename=image_filename("liquidity", profile)))
             ]
             await bot.send_media_group(chat_id, media)
             await bot.send_message(chat_id, text_report, reply_markup=kb.as_markup(), parse_mode="HTML")
         except Exception as e:
             logger.error(f"Failed to send market report to {chat_id}: {e}")
 
+async def _digest_equity_24h(wallet: str) -> tuple[float, float] | None:
+    """(current, 24h-ago) equity: local samples first, then the portfolio history."""
+    local = await equity_changes(wallet, [DAY_MS])
+    if local:
+        current_val, changes = local
+        return current_val, current_val - changes[DAY_MS]
+
+    portf = await get_user_portfolio(wallet)
+    if not portf or not isinstance(portf, dict):
+        return None
+        
+    data = portf.get("data", {})
+    history = data.get("accountValueHistory", [])
+    
+    if not history:
+        return None
+    
+    # Sort and Find 24h change
+    history.sort(key=lambda x: x[0])
+    
+    current_val = float(history[-1][1])
+    now_ms = history[-1][0]
+    target_ms = now_ms - 86400000
+    
+    # 24h-ago equity: a bisect over the history
+    start_val = 0.0
+    if history[0][0] > target_ms:
+        # History shorter than 24h: compare against its oldest point
+        start_val = float(history[0][1])
+    else:
+        closest = history_value_at(history, target_ms, 3600000 * 6)
+        if closest:
+            start_val = float(closest[1])
+    return current_val, start_val
+
 async def send_daily_digest(bot, target_user_ids: set[int | str] | None = None):
     """Generate and send daily digest (Equity PnL) to all users."""
     logger.info("Generating daily digest...")
-    user_wallet_pairs = await _get_user_wallet_pairs()
+    user_wallet_pairs = await _get_user_wallet_pairs(target_user_ids)
 
     for chat_id, wallet in user_wallet_pairs:
         if target_user_ids is not None and chat_id not in target_user_ids:
             continue
+        await _dispatch_pacer.wait()
         
         lang = await db.get_lang(chat_id)
-        portf = await get_user_portfolio(wallet)
-        if not portf or not isinstance(portf, dict):
-            continue
-            
-        data = portf.get("data", {})
-        history = data.get("accountValueHistory", [])
-        
-        if not history:
+        equity = await _digest_equity_24h(wallet)
+        if not equity:
             continue
-        
-        # Sort and Find 24h change
-        history.sort(key=lambda x: x[0])
-        
-        current_val = float(history[-1][1])
-        now_ms = history[-1][0]
-        target_ms = now_ms - 86400000
-        
-        # Find closest point to 24h ago
-        start_val = 0.0
-        found = False
-        for ts, val in history:
-            if abs(ts - target_ms) < 3600000 * 2: # tolerance 2h
-                start_val = float(val)
-                found = True
-                break
-        
-        if not found and history:
-            # Fallback if history is short?
-            # Or just take oldest if history < 24h
-            if history[0][0] > target_ms:
-                start_val = float(history[0][1])
-            else:
-                # If we have history but missed the window, scan again closer
-                # Actually linear scan is fine, finding closest
-                closest = min(history, key=lambda x: abs(x[0] - target_ms))
-                if abs(closest[0] - target_ms) < 3600000 * 6: # 6h tolerance
-                    start_val = float(closest[1])
+        current_val, start_val = equity
         
         if start_val == 0:
             continue
@@ -647,53 +782,36 @@ async def send_daily_digest(bot, target_user_ids: set[int | str] | None = None):
         except Exception as e:
             logger.error(f"Failed to send digest to {chat_id}: {e}")
 
+def _weekly_window(now: datetime.datetime) -> tuple[str, int, int]:
+    """
+    Last 7 UTC days including today, as (since_day, start_ms, end_ms): ledger
+    day buckets after `since_day` and fills in [start_ms, end_ms) cover the
+    same span, so weekly flow and realized PnL agree.
+    """
+    first_day = (now - datetime.timedelta(days=6)).replace(hour=0, minute=0, second=0, microsecond=0)
+    since_day = (first_day - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+    return since_day, int(first_day.timestamp() * 1000), int(now.timestamp() * 1000)
+
 async def send_weekly_summary(bot, target_user_ids: set[int | str] | None = None):
     """Generate and send weekly summary to all users."""
     logger.info("Generating weekly summary...")
-    user_wallet_pairs = await _get_user_wallet_pairs()
+    user_wallet_pairs = await _get_user_wallet_pairs(target_user_ids)
     
-    end_time = time.time()
-    start_time = end_time - (7 * 24 * 60 * 60) # 7 days ago
+    since_day, start_ms, end_ms = _weekly_window(datetime.datetime.now(datetime.timezone.utc))
     
     for chat_id, wallet in user_wallet_pairs:
         if target_user_ids is not None and chat_id not in target_user_ids:
             continue
+        await _dispatch_pacer.wait()
         
-        fills = await db.get_fills(wallet, start_time, end_time)
-
-        # Realized PnL (weekly): compute per-coin moving average cost, accumulate sell pnl.
-        realized_pnl = 0.0
-        total_bought_val = 0.0
-        total_sold_val = 0.0
-        per_coin_qty: dict[str, float] = {}
-        per_coin_cost: dict[str, float] = {}
-
-        fills_sorted = sorted(fills, key=lambda x: float(x.get("time", 0)))
-        for fill in fills_sorted:
-            coin = fill.get("coin")
-            if not isinstance(coin, str) or not coin:
-                continue
-
-            sz = float(fill.get("sz", 0) or 0)
-            px = float(fill.get("px", 0) or 0)
-            val = sz * px
-            side = str(fill.get("side", ""))
-
-            if _is_buy(side):
-                total_bought_val += val
-                per_coin_qty[coin] = per_coin_qty.get(coin, 0.0) + sz
-                per_coin_cost[coin] = per_coin_cost.get(coin, 0.0) + val
-            else:
-                total_sold_val += val
-                qty = per_coin_qty.get(coin, 0.0)
-                cost = per_coin_cost.get(coin, 0.0)
-                if qty <= 0:
-                    continue
-                sell_sz = min(sz, qty)
-                avg_cost = cost / qty if qty else 0.0
-                realized_pnl += sell_sz * (px - avg_cost)
-                per_coin_qty[coin] = qty - sell_sz
-                per_coin_cost[coin] = cost - avg_cost * sell_sz
+        # Weekly flow: per-coin notional summed server-side over the numeric fill fields.
+        # Realized PnL: per-day buckets of the incremental coin ledgers, realized
+        # against each coin's full-history moving average cost.
+        fill_totals = await db.get_fill_totals(wallet, start_ms, end_ms)
+        total_bought_val = sum(t["bought"] for t in fill_totals.values())
+        total_sold_val = sum(t["sold"] for t in fill_totals.values())
+        ledger_by_coin = {doc.get("coin"): doc for doc in await db.get_ledger_period_totals(wallet, since_day)}
+        realized_pnl = sum(doc.get("realized", 0.0) for doc in ledger_by_coin.values())
 
         net_flow = total_sold_val - total_bought_val
 
@@ -710,16 +828,15 @@ async def send_weekly_summary(bot, target_user_ids: set[int | str] | None = None
                 if not coin or amount <= 0:
                     continue
 
-                price = 0.0
-                if hasattr(bot, "ws_manager"):
-                    price = bot.ws_manager.get_price(coin)
+                # Replicas on standby run no WS manager, so fall back to REST mids
+                price = (bot.ws_manager.get_price(coin) if hasattr(bot, "ws_manager") else 0.0) or await get_mid_price(coin)
                 val = amount * price
                 total_current_value += val
 
                 avg_entry = 0.0
                 try:
-                    coin_fills = await db.get_fills_by_coin(wallet, coin)
-                    avg_entry = calc_avg_entry_from_fills(coin_fills)
+                    ledger = ledger_by_coin.get(coin)
+                    avg_entry = ledger_avg_entry(ledger) if ledger else await db.get_avg_entry(wallet, coin)
                 except Exception:
                     avg_entry = 0.0
 
@@ -760,7 +877,7 @@ async def send_weekly_summary(bot, target_user_ids: set[int | str] | None = None
         except Exception as e:
             logger.error(f"Failed to send summary to {chat_id}: {e}")
 
-async def _get_cached_overview(market_data, news, period_label, cfg, lang, p_universe, p_assets, fng) -> tuple[dict, bytes]:
+async def _get_cached_overview(market_data, news, period_label, cfg, lang, state: MarketState, fng) -> tuple[dict, bytes]:
     global _overview_cache
     prompt_override = cfg.get("prompt_override") or "default"
     style = cfg.get("style", "detailed")
@@ -777,17 +894,10 @@ async def _get_cached_overview(market_data, news, period_label, cfg, lang, p_uni
         ai_data = {"summary": str(ai_data), "sentiment": "Neutral", "next_event": "N/A"}
 
     # Prepare Render Data
-    def get_change(idx):
-        if idx >= len(p_assets):
-            return 0
-        ac = p_assets[idx]
-        p = float(ac.get("markPx", 0))
-        prev = float(ac.get("prevDayPx", 0) or p)
-        return ((p - prev)/prev)*100 if prev else 0
-
-    mover_indices = sorted([(i, get_change(i)) for i in range(len(p_universe))], key=lambda x: x[1], reverse=True)
-    vol_indices = sorted([(i, float(p_assets[i].get("dayNtlVlm", 0))) for i in range(len(p_universe)) if i < len(p_assets)], key=lambda x: x[1], reverse=True)
-    fund_indices = sorted([(i, float(p_assets[i].get("funding", 0))) for i in range(len(p_universe)) if i < len(p_assets)], key=lambda x: x[1], reverse=True)
+    gainer = int(state.change_24h.argmax())
+    loser = int(state.change_24h.argmin())
+    top_vol = int(state.volume.argmax())
+    top_fund = int(state.funding.argmax())
 
     render_data = {
         "period_label": period_label, "date": datetime.datetime.now().strftime("%d %b %H:%M"),
@@ -795,118 +905,202 @@ async def _get_cached_overview(market_data, news, period_label, cfg, lang, p_uni
         "sentiment": ai_data.get("sentiment", "Neutral"),
         "fng": fng if fng and not isinstance(fng, Exception) else {"value": 0, "classification": "N/A"},
         "gemini_model": "Velox Engine",
-        "top_gainer": {"sym": p_universe[mover_indices[0][0]]["name"], "val": mover_indices[0][1]},
-        "top_loser": {"sym": p_universe[mover_indices[-1][0]]["name"], "val": mover_indices[-1][1]},
-        "top_vol": {"sym": p_universe[vol_indices[0][0]]["name"], "val": f"${vol_indices[0][1]/1e6:.0f}M"},
-        "top_fund": {"sym": p_universe[fund_indices[0][0]]["name"], "val": f"{fund_indices[0][1]*100*24*365:.0f}%"}
+        "top_gainer": {"sym": state.names[gainer], "val": float(state.change_24h[gainer])},
+        "top_loser": {"sym": state.names[loser], "val": float(state.change_24h[loser])},
+        "top_vol": {"sym": state.names[top_vol], "val": f"${state.volume[top_vol]/1e6:.0f}M"},
+        "top_fund": {"sym": state.names[top_fund], "val": f"{state.funding_apr[top_fund]:.0f}%"}
     }
-    img_buf = await render_html_to_image("market_overview.html", render_data, width=1000, height=1000)
+    img_buf = await render_html_to_image("market_overview.html", render_data, width=1000, height=1000, profile=settings.RENDER_BROADCAST_PROFILE)
     img_bytes = img_buf.read()
     
     _overview_cache[cache_key] = (ai_data, img_bytes, time.time())
     return ai_data, img_bytes
 
-@safe_job
-async def send_scheduled_overviews(bot):
-    """Checks user schedules for Market Overview and sends report with AI cache."""
-    now_utc = datetime.datetime.now(datetime.timezone.utc).strftime("%H:%M")
-    users = await db.get_all_users()
-    users_to_send = []
-    for u in users:
-        overview_settings = await db.get_overview_settings(u["user_id"])
-        if overview_settings.get("enabled") and now_utc in overview_settings.get("schedules", []):
-            users_to_send.append((u["user_id"], overview_settings, u.get("lang", "en")))
-    if not users_to_send:
-        return
-
-    logger.info(f"Sending Market Overview to {len(users_to_send)} users.")
-    p_ctx = await get_perps_context()
-    p_universe = []
-    p_assets = []
-    if isinstance(p_ctx, dict):
-        p_universe = p_ctx.get("universe", [])
-        p_assets = p_ctx.get("assetCtxs", [])
-    elif isinstance(p_ctx, list) and len(p_ctx) == 2:
-        p_universe = p_ctx[0].get("universe", []) if isinstance(p_ctx[0], dict) else p_ctx[0]
-        p_assets = p_ctx[1]
-    
+def _overview_period_label(hour: int) -> str:
+    if 5 <= hour < 12:
+        return "MORNING BRIEF"
+    if 12 <= hour < 17:
+        return "MID-DAY UPDATE"
+    if 17 <= hour < 22:
+        return "EVENING WRAP"
+    return "MARKET UPDATE"
+
+def _overview_slot_key(doc: dict, cfg: dict, lang: str) -> tuple:
+    """A pregenerated overview is only delivered for the same slot and personalization inputs."""
+    return (doc["user_id"], doc["key"], int(doc["next_due"]), lang, cfg.get("style", "detailed"), cfg.get("prompt_override") or "")
+
+def _overview_slot_time(doc: dict) -> datetime.datetime:
+    """The slot's nominal HH:MM, without the user's dispatch offset."""
+    slot_ms = int(doc["next_due"]) - int(doc.get("offset_ms", 0) or 0)
+    return datetime.datetime.fromtimestamp(slot_ms / 1000, datetime.timezone.utc)
+
+async def _overview_inputs() -> dict:
+    """Market inputs of the non-agent overview, shared by every user of a slot."""
+    state = await get_market_state()
     res = {}
     for sym in ["BTC", "ETH"]:
-        idx = next((i for i, u in enumerate(p_universe) if u.get("name") == sym), -1)
-        if idx != -1 and idx < len(p_assets):
-            ac = p_assets[idx]
-            p = float(ac.get("markPx", 0))
-            prev = float(ac.get("prevDayPx", 0) or p)
-            res[sym] = {"price": pretty_float(p), "change": round(((p - prev)/prev)*100 if prev else 0, 2)}
+        row = state.get(sym) if state else None
+        if row:
+            res[sym] = {"price": pretty_float(row["mark"]), "change": round(row["change_24h"], 2)}
         else:
             res[sym] = {"price": "0", "change": 0.0}
-    
+
     # Use cached RSS articles (refreshed by refresh_news_cache job)
     news = rss_engine.get_cached_articles(limit=200)
-    flow, fng = await asyncio.gather(market_overview.fetch_etf_flows(), get_fear_greed_index(), return_exceptions=True)
+    flow, fng = await asyncio.gather(
+        _shared_input("etf_flows", market_overview.fetch_etf_flows), get_fear_greed_index(), return_exceptions=True
+    )
     market_data = {**res, "btc_etf_flow": flow.get("btc_flow", 0) if not isinstance(flow, Exception) else 0, "eth_etf_flow": flow.get("eth_flow", 0) if not isinstance(flow, Exception) else 0}
+    return {"state": state, "res": res, "news": news, "market_data": market_data, "fng": fng}
 
-    h = int(now_utc.split(":")[0])
-    period_label = "MORNING BRIEF" if 5 <= h < 12 else ("MID-DAY UPDATE" if 12 <= h < 17 else ("EVENING WRAP" if 17 <= h < 22 else "MARKET UPDATE"))
-
-    for user_id, cfg, lang in users_to_send:
+async def _build_overview(user_id, cfg: dict, lang: str, slot: datetime.datetime) -> dict:
+    """Generates and renders one user's overview as {"photo", "caption", "text"}, ready to send."""
+    period_label = _overview_period_label(slot.hour)
+    if settings.AGENT_ENABLED:
         try:
-            if settings.AGENT_ENABLED:
-                try:
-                    report = await market_overview.generate_agentic_overview(
-                        user_id=user_id,
-                        lang=lang,
-                        custom_prompt=cfg.get("prompt_override"),
-                        style=cfg.get("style", "detailed"),
-                    )
-                    output = report.output if isinstance(report.output, dict) else {}
-                    btc_d = {
-                        "price": pretty_float(float(report.market_snapshot.majors.get("BTC", {}).get("price", 0) or 0)),
-                        "change": float(report.market_snapshot.majors.get("BTC", {}).get("change", 0) or 0),
-                    }
-                    eth_d = {
-                        "price": pretty_float(float(report.market_snapshot.majors.get("ETH", {}).get("price", 0) or 0)),
-                        "change": float(report.market_snapshot.majors.get("ETH", {}).get("change", 0) or 0),
-                    }
-                    top_gainer = (report.market_snapshot.top_gainers or [{"name": "N/A", "change": 0}])[0]
-                    top_loser = (report.market_snapshot.top_losers or [{"name": "N/A", "change": 0}])[0]
-                    top_vol = (report.market_snapshot.highest_volume or [{"name": "N/A", "volume": 0}])[0]
-                    top_fund = (report.market_snapshot.highest_funding or [{"name": "N/A", "funding": 0}])[0]
-                    render_data = {
-                        "period_label": period_label,
-                        "date": datetime.datetime.now().strftime("%d %b %H:%M"),
-                        "btc": btc_d,
-                        "eth": eth_d,
-                        "sentiment": output.get("sentiment", "Neutral"),
-                        "fng": report.market_snapshot.fear_greed or {"value": 0, "classification": "N/A"},
-                        "gemini_model": "Velox Agent",
-                        "top_gainer": {"sym": top_gainer.get("name", "N/A"), "val": top_gainer.get("change", 0)},
-                        "top_loser": {"sym": top_loser.get("name", "N/A"), "val": top_loser.get("change", 0)},
-                        "top_vol": {"sym": top_vol.get("name", "N/A"), "val": f"${float(top_vol.get('volume', 0) or 0)/1e6:.0f}M"},
-                        "top_fund": {"sym": top_fund.get("name", "N/A"), "val": f"{float(top_fund.get('funding', 0) or 0)*100*24*365:.0f}%"},
-                    }
-                    img_buf = await render_html_to_image("market_overview.html", render_data, width=1000, height=1000, lang=lang)
-                    header = f"<b>BTC: ${btc_d.get('price', '0')} ({'🟢' if btc_d.get('change', 0) >= 0 else '🔴'} {btc_d.get('change', 0):+.2f}%)</b>\n<b>ETH: ${eth_d.get('price', '0')} ({'🟢' if eth_d.get('change', 0) >= 0 else '🔴'} {eth_d.get('change', 0):+.2f}%)</b>"
-                    await bot.send_photo(user_id, BufferedInputFile(img_buf.read(), filename="overview.png"), caption=f"{header}\n\n<b>VELOX AI ({period_label})</b>", parse_mode="HTML")
-                    summary = html.escape(str(output.get("summary", "")))
-                    notes = output.get("actionable_notes", [])
-                    if isinstance(notes, list) and notes:
-                        summary += "\n\n<b>Actionable notes</b>\n" + "\n".join(f"• {html.escape(str(n))}" for n in notes[:5])
-                    if summary.strip():
-                        await bot.send_message(user_id, summary[:3900], parse_mode="HTML")
-                    continue
-                except Exception as agent_exc:
-                    logger.error(f"Scheduled agent overview failed for {user_id}, falling back: {agent_exc}", exc_info=True)
-
-            ai_data, img_bytes = await _get_cached_overview(market_data, news if not isinstance(news, Exception) else [], period_label, cfg, lang, p_universe, p_assets, fng)
-            btc_d, eth_d = res.get("BTC", {}), res.get("ETH", {})
+            report = await market_overview.generate_agentic_overview(
+                user_id=user_id,
+                lang=lang,
+                custom_prompt=cfg.get("prompt_override"),
+                style=cfg.get("style", "detailed"),
+            )
+            output = report.output if isinstance(report.output, dict) else {}
+            btc_d = {
+                "price": pretty_float(float(report.market_snapshot.majors.get("BTC", {}).get("price", 0) or 0)),
+                "change": float(report.market_snapshot.majors.get("BTC", {}).get("change", 0) or 0),
+            }
+            eth_d = {
+                "price": pretty_float(float(report.market_snapshot.majors.get("ETH", {}).get("price", 0) or 0)),
+                "change": float(report.market_snapshot.majors.get("ETH", {}).get("change", 0) or 0),
+            }
+            top_gainer = (report.market_snapshot.top_gainers or [{"name": "N/A", "change": 0}])[0]
+            top_loser = (report.market_snapshot.top_losers or [{"name": "N/A", "change": 0}])[0]
+            top_vol = (report.market_snapshot.highest_volume or [{"name": "N/A", "volume": 0}])[0]
+            top_fund = (report.market_snapshot.highest_funding or [{"name": "N/A", "funding": 0}])[0]
+            render_data = {
+                "period_label": period_label,
+                "date": slot.strftime("%d %b %H:%M"),
+                "btc": btc_d,
+                "eth": eth_d,
+                "sentiment": output.get("sentiment", "Neutral"),
+                "fng": report.market_snapshot.fear_greed or {"value": 0, "classification": "N/A"},
+                "gemini_model": "Velox Agent",
+                "top_gainer": {"sym": top_gainer.get("name", "N/A"), "val": top_gainer.get("change", 0)},
+                "top_loser": {"sym": top_loser.get("name", "N/A"), "val": top_loser.get("change", 0)},
+                "top_vol": {"sym": top_vol.get("name", "N/A"), "val": f"${float(top_vol.get('volume', 0) or 0)/1e6:.0f}M"},
+                "top_fund": {"sym": top_fund.get("name", "N/A"), "val": f"{float(top_fund.get('funding', 0) or 0)*100*24*365:.0f}%"},
+            }
+            img_buf = await render_html_to_image("market_overview.html", render_data, width=1000, height=1000, lang=lang, profile=settings.RENDER_BROADCAST_PROFILE)
             header = f"<b>BTC: ${btc_d.get('price', '0')} ({'🟢' if btc_d.get('change', 0) >= 0 else '🔴'} {btc_d.get('change', 0):+.2f}%)</b>\n<b>ETH: ${eth_d.get('price', '0')} ({'🟢' if eth_d.get('change', 0) >= 0 else '🔴'} {eth_d.get('change', 0):+.2f}%)</b>"
-            await bot.send_photo(user_id, BufferedInputFile(img_bytes, filename="overview.png"), caption=f"{header}\n\n<b>VELOX AI ({period_label})</b>", parse_mode="HTML")
-            report_text = re.sub(r'\*(.*?)\*', r'<i>\1</i>', re.sub(r'\*\*(.*?)\*\*', r'<b>\1</b>', html.escape(ai_data.get("summary", ""))))
-            if report_text.strip():
-                await bot.send_message(user_id, report_text, parse_mode="HTML")
+            summary = html.escape(str(output.get("summary", "")))
+            notes = output.get("actionable_notes", [])
+            if isinstance(notes, list) and notes:
+                summary += "\n\n<b>Actionable notes</b>\n" + "\n".join(f"• {html.escape(str(n))}" for n in notes[:5])
+            return {"photo": img_buf.read(), "caption": f"{header}\n\n<b>VELOX AI ({period_label})</b>", "text": summary[:3900]}
+        except Exception as agent_exc:
+            logger.error(f"Scheduled agent overview failed for {user_id}, falling back: {agent_exc}", exc_info=True)
+
+    inputs = await _shared_input("overview_inputs", _overview_inputs)
+    news = inputs["news"]
+    ai_data, img_bytes = await _get_cached_overview(inputs["market_data"], news if not isinstance(news, Exception) else [], period_label, cfg, lang, inputs["state"], inputs["fng"])
+    btc_d, eth_d = inputs["res"].get("BTC", {}), inputs["res"].get("ETH", {})
+    header = f"<b>BTC: ${btc_d.get('price', '0')} ({'🟢' if btc_d.get('change', 0) >= 0 else '🔴'} {btc_d.get('change', 0):+.2f}%)</b>\n<b>ETH: ${eth_d.get('price', '0')} ({'🟢' if eth_d.get('change', 0) >= 0 else '🔴'} {eth_d.get('change', 0):+.2f}%)</b>"
+    report_text = re.sub(r'\*(.*?)\*', r'<i>\1</i>', re.sub(r'\*\*(.*?)\*\*', r'<b>\1</b>', html.escape(ai_data.get("summary", ""))))
+    return {"photo": img_bytes, "caption": f"{header}\n\n<b>VELOX AI ({period_label})</b>", "text": report_text}
+
+async def _deliver_overview(bot, user_id, item: dict):
+    await bot.send_photo(user_id, BufferedInputFile(item["photo"], filename=image_filename("overview", settings.RENDER_BROADCAST_PROFILE)), caption=item["caption"], parse_mode="HTML")
+    if item["text"].strip():
+        await bot.send_message(user_id, item["text"], parse_mode="HTML")
+
+# Overviews generated ahead of their slot, keyed by _overview_slot_key
+_pregenerated_overviews: dict[tuple, dict] = {}
+_pregen_tasks: dict[tuple, asyncio.Task] = {}
+
+async def _take_pregenerated_overview(key: tuple) -> dict | None:
+    """The pregenerated overview for `key`, waiting for it if generation is still running."""
+    item = _pregenerated_overviews.pop(key, None)
+    if item is not None:
+        return item
+    task = _pregen_tasks.get(key)
+    if task is None:
+        return None
+    try:
+        await asyncio.shield(task)
+    except Exception:
+        return None
+    return _pregenerated_overviews.pop(key, None)
+
+@safe_job
+async def pregenerate_overviews(bot=None):
+    """Generates and renders overviews for slots due within OVERVIEW_PREGEN_LEAD_MIN, so delivery only sends."""
+    lead_ms = settings.OVERVIEW_PREGEN_LEAD_MIN * 60_000
+    if lead_ms <= 0:
+        return
+    now_ms = int(time.time() * 1000)
+    # Slots that were claimed without picking up their copy (user changed settings, send failed)
+    stale_before = now_ms - _dispatch_pacer.grace_ms(SCHEDULE_GRACE_OVERVIEW_MIN)
+    for key in [k for k in _pregenerated_overviews if k[2] < stale_before]:
+        del _pregenerated_overviews[key]
+
+    upcoming = await db.get_schedules_due_between(SCHEDULE_OVERVIEW, now_ms, now_ms + lead_ms)
+    if not upcoming:
+        return
+    users = await db.get_users_by_ids({d["user_id"] for d in upcoming}, {"user_id": 1, "lang": 1, "overview": 1})
+    users_by_id = {u["user_id"]: u for u in users}
+    sem = asyncio.Semaphore(max(settings.OVERVIEW_PREGEN_CONCURRENCY, 1))
+
+    async def generate(key: tuple, doc: dict, cfg: dict, lang: str):
+        async with sem:
+            _pregenerated_overviews[key] = await _build_overview(doc["user_id"], cfg, lang, _overview_slot_time(doc))
+
+    tasks = []
+    for doc in upcoming:
+        u = users_by_id.get(doc["user_id"])
+        if not u:
+            continue
+        cfg, lang = db.overview_settings_of(u), u.get("lang", "en")
+        key = _overview_slot_key(doc, cfg, lang)
+        if key in _pregenerated_overviews or key in _pregen_tasks:
+            continue
+        task = asyncio.create_task(generate(key, doc, cfg, lang))
+        _pregen_tasks[key] = task
+        task.add_done_callback(lambda _t, key=key: _pregen_tasks.pop(key, None))
+        tasks.append(task)
+    if not tasks:
+        return
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    failed = sum(1 for r in results if isinstance(r, Exception))
+    logger.info(f"Pregenerated {len(tasks) - failed}/{len(tasks)} market overviews ahead of their slots.")
+
+@safe_job
+@paced_dispatch
+async def send_scheduled_overviews(bot):
+    """Delivers due Market Overviews, pregenerated when possible, generated inline otherwise."""
+    claimed = await _claim_due(SCHEDULE_OVERVIEW, SCHEDULE_GRACE_OVERVIEW_MIN)
+    if not claimed:
+        return
+    users = await db.get_users_by_ids({d["user_id"] for d in claimed}, {"user_id": 1, "lang": 1, "overview": 1})
+    users_by_id = {u["user_id"]: u for u in users}
+    due = [(doc, users_by_id[doc["user_id"]]) for doc in claimed if doc["user_id"] in users_by_id]
+    if not due:
+        return
+
+    logger.info(f"Sending Market Overview to {len(due)} users.")
+    inline = 0
+    for doc, u in due:
+        user_id, cfg, lang = u["user_id"], db.overview_settings_of(u), u.get("lang", "en")
+        await _dispatch_pacer.wait()
+        try:
+            item = await _take_pregenerated_overview(_overview_slot_key(doc, cfg, lang))
+            if item is None:
+                inline += 1
+                item = await _build_overview(user_id, cfg, lang, _overview_slot_time(doc))
+            await _deliver_overview(bot, user_id, item)
         except Exception as e:
             logger.error(f"Failed to send overview to {user_id}: {e}")
+    if inline:
+        logger.info(f"{inline}/{len(due)} market overviews were generated at delivery time.")
 
 
 @safe_job
@@ -925,7 +1119,7 @@ async def run_delta_neutral_alerts(bot):
         return
 
     ws = getattr(bot, "ws_manager", None)
-    perps_ctx = await get_perps_context()
+    market_state = await get_market_state()
     now_ts = int(time.time())
     sem = asyncio.Semaphore(5)
 
@@ -939,10 +1133,12 @@ async def run_delta_neutral_alerts(bot):
 
         async with sem:
             try:
-                snapshot = await collect_delta_neutral_snapshot(wallets, ws=ws, perps_ctx=perps_ctx)
+                snapshot = await collect_delta_neutral_snapshot(wallets, ws=ws, market_state=market_state)
                 prev_state = user.get("delta_state", {})
                 alerts, new_state = apply_delta_monitoring(snapshot, previous_state=prev_state, now_ts=now_ts, interval_hours=0.5, emit_alerts=True)
-                await db.update_user_settings(user_id, {"delta_state": new_state})
+                if not await db.save_delta_state(user_id, new_state, fence=current_fence()):
+                    # A newer run of this job already moved the state on (and alerted)
+                    return
                 if alerts:
                     lang = user.get("lang", "ru")
                     msg = format_alert_digest(alerts, lang=lang)
@@ -962,8 +1158,13 @@ async def health_check(bot):
         
         # WS Health
         ws = getattr(bot, "ws_manager", None)
-        if not ws or not ws.running:
+        if settings.LEASES_ENABLED and not holds_locally(f"ws:p{settings.WS_PROCESS_INDEX}"):
+            logger.info("Health Check: WS Manager on standby (lease held by another replica)")
+        elif not ws or not ws.running:
             logger.critical("Health Check: WS Manager NOT RUNNING")
+        else:
+            logger.info(f"Health Check: WS bring-up {ws.bringup_stats()}")
+            logger.info(f"Health Check: WS freshness {ws.freshness_stats()}")
         
         # Playwright check (basic render test)
         # try:
@@ -991,42 +1192,52 @@ async def refresh_news_cache(bot):
     logger.info(f"RSS cache refreshed: {len(articles)} articles, age={rss_engine.cache_age_seconds:.0f}s")
 
 @safe_job
-async def refresh_agent_sources(bot=None):
-    """Best-effort agent source/search refresh."""
+async def run_agent_pipeline(bot=None):
+    """
+    Best-effort agent refresh: one market stage run recollects sources and
+    extracts events, and overviews reuse it until the next run.
+    """
     if not settings.AGENT_ENABLED:
         return
     from bot.agent.orchestrator import AgentOrchestrator
 
-    report = await AgentOrchestrator().run(mode="overview", lang="en")
-    logger.info(f"Agent source refresh complete: {len(report.sources)} sources, {len(report.events)} events")
-
-@safe_job
-async def extract_agent_market_events(bot=None):
-    """Best-effort market event extraction refresh."""
-    if not settings.AGENT_ENABLED:
-        return
-    from bot.agent.orchestrator import AgentOrchestrator
-
-    report = await AgentOrchestrator().run(mode="overview", lang="en")
-    logger.info(f"Agent event extraction complete: {len(report.events)} events")
+    stage = await AgentOrchestrator().refresh_market_stage(mode="overview")
+    logger.info(f"Agent pipeline refresh complete: {len(stage.sources)} sources, {len(stage.events)} events")
 
 def setup_scheduler(bot):
     scheduler = AsyncIOScheduler()
 
-    # Digest dispatcher: every 5 minutes with cache and window check
+    # With LEASES_ENABLED, replicas share the jobs through Mongo leases: shared
+    # jobs run once per period bucket, the overview jobs (which share the
+    # in-process agent stage and pregenerated overviews) stick to one replica,
+    # and wallet jobs split by partition inside the job. Cache warmers, market
+    # images, RSS and health checks serve local state and run on every replica.
+
+    # Schedule dispatchers read only due rows, so they run every minute to
+    # follow the per-user offsets spread over DISPATCH_WINDOW_SEC
     scheduler.add_job(
-        send_scheduled_digests,
+        leased_job(send_scheduled_digests, 60),
         'cron',
-        minute='*/5',
+        minute='*',
         args=[bot],
         misfire_grace_time=120,
         max_instances=1,
         jitter=10
     )
 
+    scheduler.add_job(
+        prewarm_dispatch_inputs,
+        'interval',
+        seconds=60,
+        args=[bot],
+        misfire_grace_time=60,
+        max_instances=1,
+        coalesce=True
+    )
+
     # Vault snapshots: daily at 00:15 UTC with 30-min grace for "retry"
     scheduler.add_job(
-        collect_vault_snapshots,
+        leased_job(collect_vault_snapshots, 86400),
         'cron',
         hour=0,
         minute=15,
@@ -1036,9 +1247,52 @@ def setup_scheduler(bot):
         jitter=10
     )
 
+    # Equity samples from live account snapshots, plus hourly downsampling
+    scheduler.add_job(
+        sample_wallet_equity,
+        'interval',
+        minutes=settings.EQUITY_SAMPLE_INTERVAL_MIN,
+        args=[bot],
+        misfire_grace_time=120,
+        max_instances=1,
+        coalesce=True
+    )
+
+    scheduler.add_job(
+        leased_job(downsample_equity_samples, 3600),
+        'cron',
+        minute=7,
+        args=[bot],
+        misfire_grace_time=1800,
+        max_instances=1
+    )
+
+    scheduler.add_job(
+        leased_job(archive_old_fills, 86400),
+        'cron',
+        hour=3,
+        minute=40,
+        args=[bot],
+        misfire_grace_time=3600,
+        max_instances=1
+    )
+
+    # Market images: background refresh keyed on the perps snapshot version,
+    # first run immediately so reports never render on the request path
+    scheduler.add_job(
+        refresh_market_images,
+        'interval',
+        seconds=settings.MARKET_IMAGES_REFRESH_SEC,
+        args=[bot],
+        next_run_time=datetime.datetime.now(),
+        misfire_grace_time=60,
+        max_instances=1,
+        coalesce=True
+    )
+
     # Market Reports: Every minute with cache and low jitter
     scheduler.add_job(
-        send_market_reports,
+        leased_job(send_market_reports, 60),
         'cron',
         minute='*',
         args=[bot],
@@ -1047,20 +1301,30 @@ def setup_scheduler(bot):
         jitter=5
     )
 
-    # Market Overview: Hourly with AI cache
+    # Market Overview: due slots with AI cache
+    scheduler.add_job(
+        leased_job(pregenerate_overviews, name="overviews"),
+        'interval',
+        seconds=60,
+        args=[bot],
+        misfire_grace_time=60,
+        max_instances=1,
+        coalesce=True
+    )
+
     scheduler.add_job(
-        send_scheduled_overviews,
+        leased_job(send_scheduled_overviews, name="overviews"),
         'cron',
-        minute=0,
+        minute='*',
         args=[bot],
-        misfire_grace_time=600,
+        misfire_grace_time=120,
         max_instances=1,
-        jitter=30
+        jitter=10
     )
 
     # Delta-neutral alerts: every 30 mins with semaphore
     scheduler.add_job(
-        run_delta_neutral_alerts,
+        leased_job(run_delta_neutral_alerts, 1800),
         'cron',
         minute='*/30',
         args=[bot],
@@ -1102,24 +1366,14 @@ def setup_scheduler(bot):
     )
 
     scheduler.add_job(
-        refresh_agent_sources,
+        leased_job(run_agent_pipeline, name="overviews"),
         'cron',
-        minute='*/30',
+        minute=f'*/{settings.AGENT_PIPELINE_INTERVAL_MIN}',
         args=[bot],
         misfire_grace_time=300,
         max_instances=1,
         jitter=30
     )
-
-    scheduler.add_job(
-        extract_agent_market_events,
-        'cron',
-        minute='*/20',
-        args=[bot],
-        misfire_grace_time=300,
-        max_instances=1,
-        jitter=20
-    )
     
     scheduler.start()
     return scheduler
@@ -0,0 +1,72 @@
+"""
+Next-due times for user schedules (digests, market reports, overviews).
+
+Each schedule is stored in the `schedules` collection with a precomputed
+`next_due` (epoch ms) indexed per kind, so the minute jobs only read the
+rows that are due and advance them, instead of scanning every user and
+comparing HH:MM strings. Specs are {"time": "HH:MM"} plus an optional
+"day_of_week" (mon..sun) for weekly or "day" (1-31) for monthly schedules.
+All times are UTC.
+
+Each row also carries a stable per-user `offset_ms` inside the dispatch
+window, so users who all picked 09:00 are served across 09:00-09:05
+instead of in one burst.
+"""
+import datetime
+import hashlib
+
+SCHEDULE_DIGEST = "digest"
+SCHEDULE_MARKET_REPORT = "market_report"
+SCHEDULE_OVERVIEW = "overview"
+
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+
+def parse_hhmm(value) -> tuple[int, int] | None:
+    try:
+        hour, minute = (int(p) for p in str(value).strip().split(":"))
+    except (TypeError, ValueError):
+        return None
+    if 0 <= hour <= 23 and 0 <= minute <= 59:
+        return hour, minute
+    return None
+
+
+def next_due(spec: dict, after: datetime.datetime) -> datetime.datetime | None:
+    """First slot matching `spec` strictly after `after` (UTC), or None for an invalid spec."""
+    hhmm = parse_hhmm(spec.get("time"))
+    if hhmm is None:
+        return None
+    after = after.astimezone(datetime.timezone.utc)
+    weekday = str(spec["day_of_week"]).lower()[:3] if spec.get("day_of_week") else None
+    if weekday is not None and weekday not in WEEKDAYS:
+        return None
+    day = int(spec["day"]) if spec.get("day") else None
+
+    start = after.replace(hour=hhmm[0], minute=hhmm[1], second=0, microsecond=0)
+    # 62 days covers every monthly day (a day 31 slot may skip a month)
+    for offset in range(63):
+        slot = start + datetime.timedelta(days=offset)
+        if slot <= after:
+            continue
+        if weekday is not None and WEEKDAYS[slot.weekday()] != weekday:
+            continue
+        if day is not None and slot.day != day:
+            continue
+        return slot
+    return None
+
+
+def dispatch_offset_ms(user_id, kind: str, key: str, window_ms: int) -> int:
+    """Stable offset in [0, window_ms) for one user's slot."""
+    if window_ms <= 0:
+        return 0
+    digest = hashlib.sha1(f"{user_id}:{kind}:{key}".encode()).digest()
+    return int.from_bytes(digest[:8], "big") % window_ms
+
+
+def next_due_ms(spec: dict, after_ms: int, offset_ms: int = 0) -> int | None:
+    """Next slot plus `offset_ms` that falls strictly after `after_ms`."""
+    after = datetime.datetime.fromtimestamp((after_ms - offset_ms) / 1000, datetime.timezone.utc)
+    slot = next_due(spec, after)
+    return int(slot.timestamp() * 1000) + offset_ms if slot else None
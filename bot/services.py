@@ -1,7 +1,9 @@
 import aiohttp
 import logging
 import asyncio
+import bisect
 import time
+import datetime
 from bot.config import settings, HLP_VAULT_ADDR
 from bot.utils import pretty_float
 
@@ -104,6 +106,11 @@ async def ensure_symbol_mapping():
     _SYMBOL_CACHE["last_update"] = now
     logger.info(f"Refreshed symbol mapping. Spot: {len(new_spot)}, Perp: {len(new_perp)}")
 
+async def get_symbol_map(is_spot: bool = True) -> dict[str, str]:
+    """Snapshot of the id -> name mapping, for resolving many symbols without awaiting per row."""
+    await ensure_symbol_mapping()
+    return dict(_SYMBOL_CACHE["spot"] if is_spot else _SYMBOL_CACHE["perp"])
+
 async def get_symbol_name(token_id: str | int, is_spot: bool = False) -> str:
     """Resolves a token ID (or index) to its symbol name."""
     await ensure_symbol_mapping()
@@ -156,35 +163,127 @@ def _is_buy(side: str) -> bool:
     s = side.lower()
     return s in ("buy", "bid", "b")
 
-def calc_avg_entry_from_fills(fills: list[dict]) -> float:
-    """Calculates weighted average entry price from a list of fills."""
-    if not fills:
-        return 0.0
+# Days of per-day flow kept on each coin ledger (enough for weekly/monthly windows)
+LEDGER_DAYS_KEEP = 35
 
-    fills_sorted = sorted(fills, key=lambda x: float(x.get("time", 0)))
-    qty = 0.0
-    cost = 0.0
-    for f in fills_sorted:
-        sz = float(f.get("sz", 0) or 0)
-        px = float(f.get("px", 0) or 0)
-        side = str(f.get("side", ""))
-        
-        if _is_buy(side):
-            qty += sz
-            cost += sz * px
-        else:
-            if qty <= 0:
-                continue
-            # Weighted average reduction
-            sell_sz = min(sz, qty)
-            avg_cost = cost / qty if qty > 0 else 0.0
-            qty -= sell_sz
-            cost -= avg_cost * sell_sz
+# Fill fields stored as numbers so Mongo can aggregate them server-side
+FILL_NUMERIC_FIELDS = ("sz", "px", "fee", "closedPnl", "startPosition")
+
+def normalize_fill_numbers(fill: dict) -> dict:
+    """Copy of a WS/REST fill with its string amounts cast to floats and `time` to int ms."""
+    out = dict(fill)
+    for key in FILL_NUMERIC_FIELDS:
+        if key in out:
+            try:
+                out[key] = float(out[key] or 0)
+            except (TypeError, ValueError):
+                out[key] = 0.0
+    if "time" in out:
+        out["time"] = int(float(out["time"] or 0))
+    return out
 
+def new_ledger_position() -> dict:
+    """Empty moving-average position for one (wallet, coin)."""
+    return {
+        "qty": 0.0,
+        "cost": 0.0,
+        "realized_pnl": 0.0,
+        "bought_val": 0.0,
+        "sold_val": 0.0,
+        "fills": 0,
+        "last_fill_time": 0,
+        "days": {},
+    }
+
+def apply_fill_to_ledger(pos: dict, fill: dict) -> float:
+    """
+    Folds one fill into a moving-average position in place and returns the PnL
+    it realized. Buys add to quantity and cost; sells reduce both at the
+    current average cost, and sells beyond the held quantity are ignored.
+    """
+    sz = float(fill.get("sz", 0) or 0)
+    px = float(fill.get("px", 0) or 0)
+    fill_time = int(float(fill.get("time", 0) or 0))
+    val = sz * px
+    realized = 0.0
+
+    day_key = datetime.datetime.fromtimestamp(fill_time / 1000, datetime.timezone.utc).strftime("%Y-%m-%d")
+    day = pos["days"].setdefault(day_key, {"bought": 0.0, "sold": 0.0, "realized": 0.0})
+
+    if _is_buy(str(fill.get("side", ""))):
+        pos["qty"] += sz
+        pos["cost"] += val
+        pos["bought_val"] += val
+        day["bought"] += val
+    else:
+        pos["sold_val"] += val
+        day["sold"] += val
+        qty = pos["qty"]
+        if qty > 0:
+            sell_sz = min(sz, qty)
+            avg_cost = pos["cost"] / qty
+            realized = sell_sz * (px - avg_cost)
+            pos["qty"] = qty - sell_sz
+            pos["cost"] -= avg_cost * sell_sz
+            pos["realized_pnl"] += realized
+            day["realized"] += realized
+
+    pos["fills"] += 1
+    pos["last_fill_time"] = max(pos["last_fill_time"], fill_time)
+    if len(pos["days"]) > LEDGER_DAYS_KEEP:
+        for old in sorted(pos["days"])[:-LEDGER_DAYS_KEEP]:
+            del pos["days"][old]
+    return realized
+
+def ledger_avg_entry(pos: dict | None) -> float:
+    if not pos:
+        return 0.0
+    qty, cost = float(pos.get("qty", 0) or 0), float(pos.get("cost", 0) or 0)
     if qty > 0 and cost > 0:
         return cost / qty
     return 0.0
 
+def replay_fills(fills: list[dict]) -> dict:
+    """Builds a ledger position from scratch by replaying fills in time order."""
+    pos = new_ledger_position()
+    for f in sorted(fills, key=lambda x: float(x.get("time", 0))):
+        apply_fill_to_ledger(pos, f)
+    return pos
+
+def portfolio_window(portf, window: str = "allTime") -> dict:
+    """Picks one window's data out of a `portfolio` response (list of [name, data] or legacy dict)."""
+    if isinstance(portf, dict):
+        return portf.get("data", {}) or {}
+    if isinstance(portf, list):
+        windows = [i for i in portf if isinstance(i, list) and len(i) == 2]
+        for name, data in windows:
+            if name == window and isinstance(data, dict):
+                return data
+        if windows and isinstance(windows[0][1], dict):
+            return windows[0][1]
+    return {}
+
+def history_value_at(points: list, ts_ms: float, tolerance_ms: float | None = None):
+    """
+    Nearest [ts, value] point to `ts_ms` in a time-sorted history via bisect,
+    or None when the history is empty or the nearest point is further than
+    `tolerance_ms` away.
+    """
+    if not points:
+        return None
+    i = bisect.bisect_left(points, ts_ms, key=lambda p: p[0])
+    candidates = points[max(0, i - 1):i + 1]
+    best = min(candidates, key=lambda p: abs(p[0] - ts_ms))
+    if tolerance_ms is not None and abs(best[0] - ts_ms) > tolerance_ms:
+        return None
+    return best
+
+def calc_avg_entry_from_fills(fills: list[dict]) -> float:
+    """Calculates weighted average entry price from a list of fills."""
+    if not fills:
+        return 0.0
+    return ledger_avg_entry(replay_fills(fills))
+
 def extract_avg_entry_from_balance(balance: dict) -> float:
     """Best-effort: try to use avg/entry provided by clearinghouse state.
     Works for both Spot balances and Perps positions.
@@ -431,6 +530,31 @@ async def get_user_fills(wallet_address: str):
             logger.error(f"Error fetching fills: {resp.status}")
             return []
 
+# Most fills userFillsByTime answers per request; longer windows are paged
+USER_FILLS_PAGE_SIZE = 2000
+
+async def get_user_fills_by_time(wallet_address: str, start_time: int, end_time: int = None):
+    """
+    One page of user fills between two ms timestamps, oldest first (at most
+    USER_FILLS_PAGE_SIZE). Returns None on an HTTP error so callers can tell
+    a failed page from an empty window.
+    """
+    url = f"{settings.HYPERLIQUID_API_URL}/info"
+    payload = {
+        "type": "userFillsByTime",
+        "user": wallet_address,
+        "startTime": int(start_time)
+    }
+    if end_time:
+        payload["endTime"] = int(end_time)
+    session = await get_session()
+    if True:
+        async with session.post(url, json=payload) as resp:
+            if resp.status == 200:
+                return await resp.json()
+            logger.error(f"Error fetching fills by time: {resp.status}")
+            return None
+
 async def get_user_funding(wallet_address: str, start_time: int = None):
     """Fetch user funding history."""
     url = f"{settings.HYPERLIQUID_API_URL}/info"
@@ -1,6 +1,7 @@
 import asyncio
 import json
 import logging
+import math
 import time
 import html
 import websockets
@@ -10,9 +11,13 @@ from bot.config import settings
 from bot.database import db
 from bot.locales import _t
 from bot.handlers._common import format_money
-from bot.services import get_open_orders, get_spot_meta, normalize_spot_coin, pretty_float, get_symbol_name, get_perps_context, get_hlp_info
-from bot.renderer import render_html_to_image
+from bot.services import USER_FILLS_PAGE_SIZE, get_open_orders, get_user_fills_by_time, get_spot_meta, normalize_spot_coin, pretty_float, get_symbol_name, get_hlp_info
+from bot.market_state import get_market_state
+from bot.account_state import forget_wallet, update_from_web_data2
+from bot.renderer import image_filename, render_bundle
 from bot.analytics import prepare_modern_market_data, prepare_liquidity_data
+from bot.fill_cursors import FillCursor, fill_time
+from bot.ws_shards import AlertLatency, FrameLimiter, Freshness, HashRing, WalletShard, node_name, node_process, alert_sent, ping_loop, track_alerts, watch_freshness
 from aiogram.types import BufferedInputFile, InputMediaPhoto
 
 logger = logging.getLogger(__name__)
@@ -27,6 +32,9 @@ class WSManager:
         # Data caches
         self.mid_prices = {}  # symbol/id -> price
         self.open_orders = defaultdict(list)  # wallet -> [orders]
+        self.fill_cursors: dict[str, FillCursor] = {}  # wallet -> last-seen fill (see bot.fill_cursors)
+        self._fill_locks = defaultdict(asyncio.Lock)
+        self._fill_gaps: set[str] = set()  # wallets whose REST catch-up stopped short of the stream
         self.tracked_wallets = set()
         
         # All known symbols (Spot + Perps)
@@ -66,47 +74,180 @@ class WSManager:
         self.whale_cache = deque(maxlen=20) # Dedup recent large trades
         self.whale_subscribers_cache = [] # List of user docs
 
+        # Wallet shards: user channels live on their own connections, this
+        # process runs the shards whose ring node carries its process index
+        self.process_index = settings.WS_PROCESS_INDEX
+        self.process_count = max(settings.WS_PROCESS_COUNT, 1)
+        self.shard_count = 0
+        self.ring = HashRing([])
+        # Configured floor until the first sync_wallets reads the shared count
+        self._build_ring(max(settings.WS_WALLET_SHARDS, 1))
+        self.shards: dict[str, WalletShard] = {}  # node -> shard run by this process
+        self.wallet_nodes: dict[str, str] = {}  # wallet -> node, for wallets this process owns
+        self.wallet_sync_task = None
+        self._wallet_lock = asyncio.Lock()
+        # Bring-up: one frame budget and one REST seeding pool for every connection of this process.
+        # The per-IP frame cap is shared by all WS processes, so each gets an even share
+        self.frame_limiter = FrameLimiter(settings.WS_SUBSCRIBE_RATE_PER_MIN // self.process_count,
+                                          settings.WS_SUBSCRIBE_BURST // self.process_count)
+        self._seed_slots = asyncio.Semaphore(max(settings.WS_SEED_CONCURRENCY, 1))
+        self._connect_started: float | None = None
+        self.first_mids_sec: float | None = None  # prices flowing again after the last (re)connect
+        self.price_alerts = AlertLatency("price")
+        self.standby_alerts = AlertLatency("price standby")
+        # Stalled-connection detection, and the optional hot-standby price connection
+        self.freshness = Freshness()
+        self.standby_freshness = Freshness()
+        self.price_standby_enabled = settings.WS_PRICE_STANDBY
+        self.standby_task = None
+        self._recent_mids = deque(maxlen=32)  # digests of allMids frames already handled
+
+    @property
+    def is_primary_process(self) -> bool:
+        """Market-wide alerts (prices, watchlist, whales, listings) are sent by process 0 only."""
+        return self.process_index == 0
+
+    def owns(self, wallet: str) -> bool:
+        if self.process_count == 1:
+            return True
+        node = self.ring.node_for(wallet.lower())
+        return node is not None and node_process(node) == self.process_index
+
+    def _wanted_shards(self, wallet_count: int, fill: float = 1.0) -> int:
+        """Shards per process for `wallet_count` wallets with each shard at most `fill` full."""
+        per_process = math.ceil(wallet_count / self.process_count)
+        return max(settings.WS_WALLET_SHARDS, math.ceil(per_process / max(settings.WS_MAX_WALLETS_PER_SHARD * fill, 1)), 1)
+
+    def _build_ring(self, shard_count: int):
+        if shard_count == self.shard_count:
+            return
+        self.shard_count = shard_count
+        self.ring = HashRing([node_name(p, i) for p in range(self.process_count) for i in range(shard_count)])
+        logger.info(f"WS wallet ring: {shard_count} shards x {self.process_count} processes")
+
+    def _shard(self, node: str) -> WalletShard:
+        shard = self.shards.get(node)
+        if shard is None:
+            shard = WalletShard(node, self.ws_url, self.handle_message, prepare=self._prepare_wallet,
+                                limiter=self.frame_limiter, stale_sec=settings.WS_SHARD_STALE_SEC)
+            self.shards[node] = shard
+            if self.running:
+                shard.start()
+        return shard
+
+    async def _place_wallet(self, wallet: str):
+        node = self.ring.node_for(wallet)
+        current = self.wallet_nodes.get(wallet)
+        if node == current:
+            return
+        if current is not None:
+            await self.shards[current].remove(wallet)
+            self.wallet_nodes.pop(wallet, None)
+        if node is None or node_process(node) != self.process_index:
+            if current is not None:  # moved to another process
+                self.untrack_wallet(wallet)
+            return
+        self.tracked_wallets.add(wallet)
+        self.wallet_nodes[wallet] = node
+        await self._shard(node).add(wallet)
+
+    async def sync_wallets(self, wallets: set[str]):
+        """
+        Rebalances the shards onto `wallets` (every tracked wallet, across all
+        processes): new wallets are subscribed on their shard, removed ones
+        unsubscribed, and a resized ring moves only the wallets whose node changed.
+        """
+        wallets = {w.lower() for w in wallets if w}
+        async with self._wallet_lock:
+            # The shard count lives in Mongo so every process builds the same
+            # ring; only this full sync resizes it. Any process grows it, and
+            # process 0 shrinks it once the smaller ring would be at most
+            # WS_SHARD_SHRINK_FILL full, so a short spike does not flap it
+            shrink_to = self._wanted_shards(len(wallets), settings.WS_SHARD_SHRINK_FILL) if self.is_primary_process else None
+            self._build_ring(await db.agree_ws_shard_count(self._wanted_shards(len(wallets)), shrink_to))
+            for wallet in set(self.wallet_nodes) - wallets:
+                await self.shards[self.wallet_nodes.pop(wallet)].remove(wallet)
+                self.untrack_wallet(wallet)
+            for wallet in sorted(wallets):
+                await self._place_wallet(wallet)
+            # Shards dropped from a shrunk ring have handed their wallets on
+            for node in [n for n in self.shards if n not in self.ring.nodes]:
+                await self.shards.pop(node).stop()
+
+    async def _load_wallets(self) -> set[str]:
+        wallets = set()
+        for user in await db.get_all_users():
+            # Legacy primary wallet
+            if user.get("wallet_address"):
+                wallets.add(user["wallet_address"].lower())
+        cursor = db.wallets.find({}, {"address": 1})
+        async for w_doc in cursor:
+            if w_doc.get("address"):
+                wallets.add(w_doc["address"].lower())
+        return wallets
+
+    async def _wallet_sync_loop(self):
+        while self.running:
+            try:
+                await self.sync_wallets(await self._load_wallets())
+            except Exception as e:
+                logger.error(f"Wallet shard sync error: {e}")
+            await asyncio.sleep(settings.WS_WALLET_SYNC_SEC)
+
     async def fire_hedge_insight(self, chat_id, user_id, context_type, event_data, reply_to_id=None):
         from bot.handlers import _send_hedge_insight
         asyncio.create_task(_send_hedge_insight(self.bot, chat_id, user_id, context_type, event_data, reply_to_id))
 
     async def start(self):
+        """Runs the price feed, wallet shards and alert loops until stopped or cancelled."""
         self.running = True
+        try:
+            await self._run()
+        finally:
+            # Also on cancellation (e.g. a lost replica lease), so no shard keeps alerting
+            self.running = False
+            await self._stop_tasks()
+
+    async def _run(self):
         backoff = 5
-        
+
         # Start background tasks
         self.alerts_refresh_task = asyncio.create_task(self._refresh_alerts_loop())
-        self.whale_task = asyncio.create_task(self._whale_assets_loop())
-        self.listing_check_task = asyncio.create_task(self._listing_monitor_loop())
+        if self.is_primary_process:
+            self.whale_task = asyncio.create_task(self._whale_assets_loop())
+            self.listing_check_task = asyncio.create_task(self._listing_monitor_loop())
         self.ledger_task = asyncio.create_task(self._ledger_loop())
-        
+        for shard in self.shards.values():
+            shard.start()
+        self.wallet_sync_task = asyncio.create_task(self._wallet_sync_loop())
+        if self.price_standby_enabled:
+            self.standby_task = asyncio.create_task(self._price_standby_loop())
+
+        # Alerts raised while handling the main connection's frames are timed against it
+        track_alerts(self.price_alerts)
         while self.running:
+            self._connect_started = time.monotonic()
+            self.first_mids_sec = None
+            self.price_alerts.reset(self._connect_started)
+            watchdog = None
             try:
                 async with websockets.connect(self.ws_url) as ws:
                     self.ws = ws
                     logger.info("Connected to Hyperliquid WS")
                     backoff = 5
-                    self.ready_event.set()
 
                     # Reset whale subscriptions state on new connection
                     self.top_assets = set()
 
-                    await self._load_universe()
-                    
-                    # Initial subscriptions
+                    # Prices first so price alerts resume before the REST/DB loading below
                     await self.subscribe_all_mids()
+                    self.ready_event.set()
+
+                    await self._load_universe()
                     
-                    # Load and subscribe users
+                    # Wallet channels live on the shard connections (see sync_wallets)
                     users = await db.get_all_users()
                     for user in users:
-                        # Legacy primary wallet
-                        wallet = user.get("wallet_address")
-                        if wallet:
-                            self.track_wallet(wallet)
-                            await self._seed_open_orders(wallet)
-                            await self.subscribe_user(wallet)
-                            await asyncio.sleep(0.05) # Small delay to prevent rate limit
-
                         chat_id = user.get("chat_id") or user.get("user_id")
                         if chat_id:
                             wl = user.get("watchlist")
@@ -125,22 +266,20 @@ class WSManager:
                         for sym in symbols:
                             if isinstance(sym, str) and sym:
                                 self.watch_subscribers[sym.upper()].add(chat_id)
-                    
-                    # Also load from dedicated wallets collection
-                    cursor = db.wallets.find({})
-                    async for w_doc in cursor:
-                        wallet = w_doc.get("address")
-                        if wallet:
-                            self.track_wallet(wallet)
-                            await self._seed_open_orders(wallet)
-                            await self.subscribe_user(wallet)
-                            await asyncio.sleep(0.05)
-                            
+
                     # Start Ping loop
                     self.ping_task = asyncio.create_task(self._ping_loop())
 
+                    # A connection that stays open but stops sending prices is closed and reopened at once
+                    self.freshness.reset()
+                    watchdog = asyncio.create_task(
+                        watch_freshness(ws, self.freshness, {"allMids": settings.WS_MIDS_STALE_SEC}, "main")
+                    )
+
                     async for message in ws:
-                        await self.handle_message(json.loads(message))
+                        data = json.loads(message)
+                        self.freshness.touch(data.get("channel"))
+                        await self.handle_message(data)
                         
             except Exception as e:
                 logger.error(f"WS Connection error: {e}")
@@ -150,11 +289,71 @@ class WSManager:
             finally:
                 if self.ping_task:
                     self.ping_task.cancel()
-        
-        if self.alerts_refresh_task:
-            self.alerts_refresh_task.cancel()
-        if self.whale_task:
-            self.whale_task.cancel()
+                if watchdog:
+                    watchdog.cancel()
+
+    async def _stop_tasks(self):
+        for task in (self.alerts_refresh_task, self.whale_task, self.listing_check_task, self.ledger_task,
+                     self.wallet_sync_task, self.standby_task):
+            if task:
+                task.cancel()
+        for shard in self.shards.values():
+            await shard.stop()
+
+    async def _price_standby_loop(self):
+        """
+        Hot-standby allMids connection. Its frames go through handle_message
+        like the primary's; whichever connection delivers a frame first wins
+        and the copy from the other is dropped, so prices keep flowing while
+        the primary reconnects.
+        """
+        backoff = 5
+        url = settings.WS_PRICE_STANDBY_URL or self.ws_url
+        track_alerts(self.standby_alerts)
+        while self.running:
+            ping_task = watchdog = None
+            self.standby_alerts.reset(time.monotonic())
+            try:
+                async with websockets.connect(url) as ws:
+                    logger.info("Connected price standby WS")
+                    backoff = 5
+                    await ws.send(json.dumps({
+                        "method": "subscribe",
+                        "subscription": {"type": "allMids"}
+                    }))
+                    self.standby_freshness.reset()
+                    ping_task = asyncio.create_task(ping_loop(ws, "price standby"))
+                    watchdog = asyncio.create_task(
+                        watch_freshness(ws, self.standby_freshness, {"allMids": settings.WS_MIDS_STALE_SEC}, "price standby")
+                    )
+                    async for message in ws:
+                        data = json.loads(message)
+                        self.standby_freshness.touch(data.get("channel"))
+                        if data.get("channel") == "allMids":
+                            await self.handle_message(data)
+            except Exception as e:
+                logger.error(f"Price standby WS error: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 120)
+            finally:
+                for task in (ping_task, watchdog):
+                    if task:
+                        task.cancel()
+
+    def _seen_mids(self, mids: dict) -> bool:
+        """True for an allMids frame already handled from the other price connection."""
+        digest = hash(frozenset(mids.items()))
+        if digest in self._recent_mids:
+            return True
+        self._recent_mids.append(digest)
+        return False
+
+    def freshness_stats(self) -> dict:
+        """Seconds since the last allMids frame on each price connection."""
+        stats = {"mids_age": round(self.freshness.age("allMids"), 1)}
+        if self.price_standby_enabled:
+            stats["standby_mids_age"] = round(self.standby_freshness.age("allMids"), 1)
+        return stats
 
     async def _whale_assets_loop(self):
         """Periodically subscribe to trades for top volume assets."""
@@ -162,21 +361,10 @@ class WSManager:
             try:
                 await self.ready_event.wait()
 
-                ctx = await get_perps_context()
-                if ctx and isinstance(ctx, list) and len(ctx) == 2:
-                    universe = ctx[0]["universe"]
-                    asset_ctxs = ctx[1]
-                    
+                state = await get_market_state()
+                if state:
                     # Sort by volume (dayNtlVlm)
-                    # asset_ctxs is same order as universe
-                    combined = []
-                    for i, u in enumerate(universe):
-                        if i < len(asset_ctxs):
-                            vol = float(asset_ctxs[i].get("dayNtlVlm", 0))
-                            combined.append((u["name"], vol))
-                    
-                    combined.sort(key=lambda x: x[1], reverse=True)
-                    top_20 = [x[0] for x in combined[:20]]
+                    top_20 = [state.names[i] for i in state.top("volume", 20)]
                     
                     # Subscribe to new ones
                     new_assets = set(top_20)
@@ -303,6 +491,31 @@ class WSManager:
             return None
         return normalize_spot_coin(str(coin))
 
+    async def _prepare_wallet(self, wallet: str):
+        # Orders cached from the previous connection remain the baseline for
+        # "new order" alerts, so a reconnect subscribes without REST seeding
+        if wallet in self.open_orders:
+            return
+        async with self._seed_slots:
+            await self._seed_open_orders(wallet)
+
+    def bringup_stats(self) -> dict:
+        """
+        Seconds from each connection's last connect attempt until prices
+        flowed, its first snapshot arrived, all its wallets were subscribed
+        and the first alert its frames caused was sent (None: not yet).
+        """
+        return {
+            "mids": self.first_mids_sec,
+            "first_alert": self.price_alerts.first_alert_sec,
+            "standby_first_alert": self.standby_alerts.first_alert_sec,
+            "shards": {
+                node: {"first_snapshot": shard.first_snapshot_sec, "ready": shard.ready_sec,
+                       "first_alert": shard.alerts.first_alert_sec, "wallets": len(shard.wallets)}
+                for node, shard in self.shards.items()
+            },
+        }
+
     async def _seed_open_orders(self, wallet: str):
         try:
             data = await get_open_orders(wallet)
@@ -441,6 +654,8 @@ class WSManager:
 
     def track_wallet(self, wallet: str):
         wallet = wallet.lower()
+        if not self.owns(wallet):
+            return
         self.tracked_wallets.add(wallet)
         logger.info(f"Now tracking wallet: {wallet}")
 
@@ -448,6 +663,9 @@ class WSManager:
         wallet = wallet.lower()
         self.tracked_wallets.discard(wallet)
         self.open_orders.pop(wallet, None)
+        self.fill_cursors.pop(wallet, None)
+        self._fill_locks.pop(wallet, None)
+        forget_wallet(wallet)
         keys_to_remove = [k for k in self.alert_cooldowns if k[0] == wallet]
         for k in keys_to_remove:
             del self.alert_cooldowns[k]
@@ -457,25 +675,12 @@ class WSManager:
         return list(self.open_orders.get(wallet.lower(), []))
 
     async def subscribe_user(self, wallet):
-        if not self.ws:
-            return
+        """Subscribes Fills, Orders and WebData2 (liquidation monitor, account snapshots) on the wallet's shard."""
         wallet = wallet.lower()
-        # User Fills
-        await self.ws.send(json.dumps({
-            "method": "subscribe",
-            "subscription": {"type": "userFills", "user": wallet}
-        }))
-        # Open Orders
-        await self.ws.send(json.dumps({
-            "method": "subscribe",
-            "subscription": {"type": "openOrders", "user": wallet}
-        }))
-        # WebData2 (Clearinghouse state) for Liquidation Monitor
-        await self.ws.send(json.dumps({
-            "method": "subscribe",
-            "subscription": {"type": "webData2", "user": wallet}
-        }))
-        logger.info(f"Subscribed to updates (Fills, Orders, WebData2) for {wallet}")
+        async with self._wallet_lock:
+            await self._place_wallet(wallet)
+        if wallet in self.wallet_nodes:
+            logger.info(f"Subscribed to updates (Fills, Orders, WebData2) for {wallet} on shard {self.wallet_nodes[wallet]}")
 
     async def subscribe_all_mids(self):
         if not self.ws:
@@ -491,7 +696,10 @@ class WSManager:
         msg_data = data.get("data", {})
         
         if channel == "allMids":
-            await self.handle_mids(msg_data.get("mids", {}))
+            mids = msg_data.get("mids", {})
+            if self.price_standby_enabled and self._seen_mids(mids):
+                return
+            await self.handle_mids(mids)
         elif channel == "userFills":
             await self.handle_fills(msg_data)
         elif channel == "openOrders":
@@ -559,8 +767,14 @@ class WSManager:
             self.mid_prices[coin] = float(price)
 
         self.last_mids_update_ts = time.time()
-        await self._update_market_history_and_alerts()
+        if self.first_mids_sec is None and self._connect_started is not None:
+            self.first_mids_sec = time.monotonic() - self._connect_started
+            logger.info(f"Prices live {self.first_mids_sec:.2f}s after connect")
+        # Proximity alerts follow this process's own wallets; the rest are market-wide
         await self.check_proximity()
+        if not self.is_primary_process:
+            return
+        await self._update_market_history_and_alerts()
         await self._check_custom_alerts() 
         
         # Periodically refresh asset context for Funding/OI alerts
@@ -570,13 +784,10 @@ class WSManager:
 
     async def _check_market_stats_alerts(self):
         """Check funding and OI alerts using metaAndAssetCtxs."""
-        ctx = await get_perps_context()
-        if not ctx or not isinstance(ctx, list) or len(ctx) != 2:
+        state = await get_market_state()
+        if not state:
             return
         
-        universe = ctx[0].get("universe", [])
-        asset_ctxs = ctx[1]
-        
         for alert in self.active_alerts:
             a_type = alert.get("type", "price")
             if a_type not in ("funding", "oi"):
@@ -595,17 +806,14 @@ class WSManager:
                 continue
             
             # Find data
-            idx = next((i for i, u in enumerate(universe) if u["name"] == sym), -1)
-            if idx == -1 or idx >= len(asset_ctxs):
+            idx = state.index.get(sym)
+            if idx is None:
                 continue
             
-            data = asset_ctxs[idx]
-            current_val = 0.0
-            
             if a_type == "funding":
-                current_val = float(data.get("funding", 0)) * 24 * 365 * 100 # APR
+                current_val = float(state.funding_apr[idx]) # APR
             else: # oi
-                current_val = float(data.get("openInterest", 0)) * float(data.get("markPx", 1)) / 1e6 # $M
+                current_val = float(state.oi_usd[idx]) / 1e6 # $M
                 
             triggered = (direction == "above" and current_val >= target) or \
                         (direction == "below" and current_val <= target)
@@ -701,26 +909,18 @@ class WSManager:
         
         # Add market context if available
         try:
-            ctx, hlp_info = await asyncio.gather(
-                get_perps_context(),
+            state, hlp_info = await asyncio.gather(
+                get_market_state(),
                 get_hlp_info(),
                 return_exceptions=True
             )
             
-            if not isinstance(ctx, Exception) and ctx and isinstance(ctx, list) and len(ctx) == 2:
-                universe = ctx[0].get("universe", [])
-                asset_ctxs = ctx[1]
-                
+            if not isinstance(state, Exception) and state:
                 # Find current asset data
                 asset_data = None
-                for i, u in enumerate(universe):
-                    if u["name"] == symbol:
-                        c = asset_ctxs[i]
-                        funding = float(c.get("funding", 0)) * 24 * 365 * 100
-                        vol = float(c.get("dayNtlVlm", 0))
-                        change = ((float(c.get("markPx", 0)) - float(c.get("prevDayPx", 0))) / float(c.get("prevDayPx", 1))) * 100
-                        asset_data = f"📊 <b>{symbol} Stats:</b>\n• 24h Change: <code>{change:+.2f}%</code>\n• Funding: <code>{funding:.1f}% APR</code>\n• 24h Vol: <b>${vol/1e6:.1f}M</b>"
-                        break
+                row = state.get(symbol)
+                if row:
+                    asset_data = f"📊 <b>{symbol} Stats:</b>\n• 24h Change: <code>{row['change_24h']:+.2f}%</code>\n• Funding: <code>{row['funding_apr']:.1f}% APR</code>\n• 24h Vol: <b>${row['volume']/1e6:.1f}M</b>"
                 
                 if asset_data:
                     msg += asset_data + "\n\n"
@@ -728,19 +928,23 @@ class WSManager:
                 # Generate 3 images
                 if isinstance(hlp_info, Exception):
                     hlp_info = None
-                data_alpha = prepare_modern_market_data(asset_ctxs, universe, hlp_info)
-                data_liq = prepare_liquidity_data(asset_ctxs, universe)
+                data_alpha = prepare_modern_market_data(state, hlp_info=hlp_info)
+                data_liq = prepare_liquidity_data(state)
                 
-                buf_alpha = await render_html_to_image("market_stats.html", data_alpha)
-                buf_liq = await render_html_to_image("liquidity_stats.html", data_liq)
-                buf_heat = await render_html_to_image("funding_heatmap.html", data_alpha)
+                profile = settings.RENDER_BROADCAST_PROFILE
+                images = await render_bundle({
+                    "alpha": ("market_stats.html", data_alpha),
+                    "liquidity": ("liquidity_stats.html", data_liq),
+                    "heatmap": ("funding_heatmap.html", data_alpha),
+                }, profile=profile)
                 
                 media = [
-                    InputMediaPhoto(media=BufferedInputFile(buf_heat.read(), filename="heatmap.png"), caption=msg, parse_mode="HTML"),
-                    InputMediaPhoto(media=BufferedInputFile(buf_alpha.read(), filename="alpha.png")),
-                    InputMediaPhoto(media=BufferedInputFile(buf_liq.read(), filename="liquidity.png"))
+                    InputMediaPhoto(media=BufferedInputFile(images["heatmap"].read(), filename=image_filename("heatmap", profile)), caption=msg, parse_mode="HTML"),
+                    InputMediaPhoto(media=BufferedInputFile(images["alpha"].read(), filename=image_filename("alpha", profile))),
+                    InputMediaPhoto(media=BufferedInputFile(images["liquidity"].read(), filename=image_filename("liquidity", profile)))
                 ]
                 await self.bot.send_media_group(user_id, media)
+                alert_sent()
                 # Send button after media group
                 sent_msg = await self.bot.send_message(user_id, _t(lang, "btn_main_menu"), reply_markup=markup)
                 if sent_msg:
@@ -756,6 +960,7 @@ class WSManager:
         # Fallback to plain text if image generation fails
         try:
             await self.bot.send_message(user_id, msg, reply_markup=markup, parse_mode="HTML")
+            alert_sent()
         except Exception as e:
             logger.error(f"Failed to send alert to {user_id}: {e}")
 
@@ -986,6 +1191,7 @@ class WSManager:
             msg += f"Wallet: <code>{wallet[:6]}...{wallet[-4:]}</code>"
             try:
                 sent_msg = await self.bot.send_message(chat_id, msg, parse_mode="HTML")
+                alert_sent()
                 if sent_msg:
                     await self.fire_hedge_insight(chat_id, chat_id, "proximity", {
                         "coin": safe_coin,
@@ -997,31 +1203,89 @@ class WSManager:
             except Exception as e:
                 logger.error(f"Failed to send alert to {chat_id}: {e}")
 
+    async def _fill_cursor(self, wallet: str) -> FillCursor | None:
+        cursor = self.fill_cursors.get(wallet)
+        if cursor is None:
+            doc = await db.get_fill_cursor(wallet)
+            if doc:
+                cursor = self.fill_cursors[wallet] = FillCursor.from_doc(doc)
+        return cursor
+
+    async def _fetch_fill_gap(self, wallet: str, start: int, end: int) -> tuple[list, bool]:
+        """
+        REST fills in [start, end], paged with startTime = the newest time of
+        the previous page. Returns (fills, complete); when a page fails the
+        fills only cover the contiguous window from `start`.
+        """
+        fills = []
+        while True:
+            try:
+                page = await get_user_fills_by_time(wallet, start, end)
+            except Exception as e:
+                logger.warning(f"Failed to fetch fill gap for {wallet}: {e}")
+                page = None
+            if page is None:
+                return fills, False
+            fills.extend(page)
+            newest = max((fill_time(f) for f in page), default=end)
+            if len(page) < USER_FILLS_PAGE_SIZE or newest >= end:
+                return fills, True
+            # Fills sharing `newest` may spill onto the next page; the cursor drops the repeats
+            start = newest if newest > start else start + 1
+
+    async def _gap_fills(self, wallet: str, cursor: FillCursor, frame: list) -> list:
+        """
+        Fills after `cursor` from a resubscribe snapshot (or a live frame while
+        an earlier gap is still open). Only when the frame does not reach back
+        to the cursor is the missing window fetched over REST; if that stops
+        short, only the contiguous part is returned and the wallet stays in
+        `_fill_gaps` so the next frame retries from the advanced cursor.
+        """
+        fills = list(frame)
+        oldest = min((fill_time(f) for f in fills), default=None)
+        if oldest is None or oldest <= cursor.time:
+            self._fill_gaps.discard(wallet)
+            return cursor.new_fills(fills)
+        fetched, complete = await self._fetch_fill_gap(wallet, cursor.time, oldest)
+        if not complete:
+            self._fill_gaps.add(wallet)
+            logger.warning(f"Fill gap for {wallet} fetched only to {max((fill_time(f) for f in fetched), default=cursor.time)} of {oldest}; retrying on the next frame")
+            return cursor.new_fills(fetched)
+        self._fill_gaps.discard(wallet)
+        return cursor.new_fills(fills + fetched)
+
     async def handle_fills(self, data):
         user_wallet = data.get("user")
         if user_wallet:
             user_wallet = user_wallet.lower()
         
         fills = data.get("fills", [])
+        is_snapshot = data.get("isSnapshot")
+        alert_after = 0
         
-        if data.get("isSnapshot"):
-            logger.info(f"Received snapshot for {user_wallet} with {len(fills)} fills (no alerts)")
-            for fill in fills:
-                fill_with_user = dict(fill)
-                fill_with_user["user"] = user_wallet
-                await db.save_fill(fill_with_user)
-            return
-        
-        users = await db.get_users_by_wallet(user_wallet)
-        for user in users:
-            chat_id = user.get('chat_id')
-            lang = "ru"
-            try:
-                if chat_id:
-                    lang = await db.get_lang(chat_id)
-            except Exception:
-                lang = "ru"
-            
+        async with self._fill_locks[user_wallet]:
+            cursor = await self._fill_cursor(user_wallet)
+            if cursor is None:
+                cursor = self.fill_cursors[user_wallet] = FillCursor()
+                if is_snapshot:
+                    # First sight of this wallet: import its history, alert nothing
+                    logger.info(f"Received snapshot for {user_wallet} with {len(fills)} fills (no alerts)")
+                    await db.save_fills([{**fill, "user": user_wallet} for fill in fills])
+                    cursor.advance(fills)
+                    await db.set_fill_cursor(user_wallet, cursor.to_doc())
+                    return
+            if is_snapshot or user_wallet in self._fill_gaps:
+                # Resubscribe replay (or a gap left open): only fills missed while disconnected go on
+                fills = await self._gap_fills(user_wallet, cursor, fills)
+                if fills:
+                    logger.info(f"Catching up {len(fills)} fills for {user_wallet} since {cursor.time}")
+                alert_after = int(time.time() * 1000) - settings.WS_FILL_GAP_ALERT_MAX_AGE_MIN * 60_000
+            else:
+                fills = cursor.new_fills(fills)
+            if not fills:
+                return
+
+            valid = []
             for fill in fills:
                 coin = fill.get("coin")
                 side = fill.get("side")
@@ -1034,10 +1298,6 @@ class WSManager:
                     logger.warning(f"Skipping incomplete fill: {fill}")
                     continue
                 
-                usd_value = px * sz
-                fee = float(fill.get("fee", 0))
-                closed_pnl = float(fill.get("closedPnl", 0))
-                
                 # Resolve symbol name safely (async)
                 is_spot_guess = str(coin).startswith("@") or (isinstance(coin, str) and "/" in coin)
                 sym_name = await get_symbol_name(coin, is_spot=is_spot_guess)
@@ -1052,6 +1312,35 @@ class WSManager:
                 fill_with_user = dict(fill)
                 fill_with_user["user"] = user_wallet
                 await db.save_fill(fill_with_user)
+                if fill_time(fill) >= alert_after:
+                    valid.append((fill, sym_name))
+
+            # The cursor is stored before anything is sent, so no fill is announced twice
+            cursor.advance(fills)
+            await db.set_fill_cursor(user_wallet, cursor.to_doc())
+
+        if valid:
+            await self._notify_fills(user_wallet, valid)
+
+    async def _notify_fills(self, user_wallet: str, fills: list):
+        users = await db.get_users_by_wallet(user_wallet)
+        for user in users:
+            chat_id = user.get('chat_id')
+            lang = "ru"
+            try:
+                if chat_id:
+                    lang = await db.get_lang(chat_id)
+            except Exception:
+                lang = "ru"
+            
+            for fill, sym_name in fills:
+                coin = fill.get("coin")
+                side = fill.get("side")
+                px = float(fill.get("px") or 0)
+                sz = float(fill.get("sz") or 0)
+                usd_value = px * sz
+                fee = float(fill.get("fee", 0))
+                closed_pnl = float(fill.get("closedPnl", 0))
                 
                 # Check for liquidation
                 is_liq = fill.get("liquidation", False) or fill.get("isLiquidation", False)
@@ -1120,6 +1409,7 @@ class WSManager:
                 
                 try:
                     sent_msg = await self.bot.send_message(chat_id, msg, reply_markup=kb.as_markup(), parse_mode="HTML")
+                    alert_sent()
                     # Fire Hedge Insight
                     if sent_msg:
                         await self.fire_hedge_insight(chat_id, chat_id, "liquidation" if is_liq else "fills", {
@@ -1222,6 +1512,7 @@ class WSManager:
             return
             
         user_wallet = user_wallet.lower()
+        update_from_web_data2(user_wallet, data)
         
         clearinghouse_state = data.get("clearinghouseState", {})
         margin_summary = clearinghouse_state.get("marginSummary", {})
@@ -1359,7 +1650,7 @@ class WSManager:
         while self.running:
             try:
                 await self.ready_event.wait()
-                wallets = await db.get_all_watched_addresses()
+                wallets = [w for w in await db.get_all_watched_addresses() if self.owns(w)]
                 
                 tasks = [asyncio.create_task(_process_wallet(w)) for w in wallets]
                 if tasks:
@@ -0,0 +1,283 @@
+"""
+Wallet-partitioned Hyperliquid websocket connections.
+
+Tracked wallets are spread over shard connections with a consistent-hash
+ring, so each connection carries a bounded number of user subscriptions
+(userFills, openOrders, webData2) and reconnects and resubscribes on its
+own. On (re)connect a shard brings its wallets up as a pipeline: wallets
+are prepared (REST seeding) concurrently and each one's subscribe frames
+go out as soon as it is ready, paced by a FrameLimiter shared by all the
+connections of the process. A connection that stays open but goes silent
+is closed by watch_freshness and reconnects at once. Ring nodes are named "<process>:<shard>", which lets several
+processes split the wallets: a process only runs the shards whose node
+carries its WS_PROCESS_INDEX. Resizing the ring moves only the wallets
+whose node changed.
+"""
+import asyncio
+import bisect
+import contextvars
+import hashlib
+import json
+import logging
+import time
+
+import websockets
+
+logger = logging.getLogger(__name__)
+
+USER_CHANNELS = ("userFills", "openOrders", "webData2")
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.sha1(value.encode()).digest()[:8], "big")
+
+
+def node_name(process: int, shard: int) -> str:
+    return f"{process}:{shard}"
+
+
+def node_process(node: str) -> int:
+    return int(node.split(":", 1)[0])
+
+
+class HashRing:
+    """Consistent-hash ring with virtual nodes."""
+
+    def __init__(self, nodes: list[str], vnodes: int = 64):
+        self.nodes = list(nodes)
+        self._points: list[tuple[int, str]] = sorted(
+            (_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes)
+        )
+        self._keys = [point for point, _ in self._points]
+
+    def node_for(self, key: str) -> str | None:
+        if not self._points:
+            return None
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._points)
+        return self._points[index][1]
+
+
+class Freshness:
+    """Last frame time per channel on one connection ("*" is any frame, pongs included)."""
+
+    def __init__(self):
+        self.seen: dict[str, float] = {}
+        self.opened = time.monotonic()
+
+    def reset(self):
+        self.seen.clear()
+        self.opened = time.monotonic()
+
+    def touch(self, channel: str | None):
+        now = time.monotonic()
+        self.seen["*"] = now
+        if channel:
+            self.seen[channel] = now
+
+    def age(self, channel: str = "*") -> float:
+        return time.monotonic() - self.seen.get(channel, self.opened)
+
+
+class AlertLatency:
+    """Seconds from a connection's connect attempt to the first alert its frames led to."""
+
+    def __init__(self, label: str):
+        self.label = label
+        self.started: float | None = None
+        self.first_alert_sec: float | None = None
+
+    def reset(self, started: float):
+        self.started = started
+        self.first_alert_sec = None
+
+    def sent(self):
+        if self.first_alert_sec is None and self.started is not None:
+            self.first_alert_sec = time.monotonic() - self.started
+            logger.info(f"WS {self.label}: first alert {self.first_alert_sec:.2f}s after connect")
+
+
+# The connection whose frame is being handled; tasks spawned from the handler inherit it
+_alert_source: contextvars.ContextVar[AlertLatency | None] = contextvars.ContextVar("ws_alert_source", default=None)
+
+
+def track_alerts(latency: AlertLatency):
+    """Attributes alerts sent from the current task (and tasks it spawns) to `latency`."""
+    _alert_source.set(latency)
+
+
+def alert_sent():
+    """Called after an alert went out; times it against the connection that caused it."""
+    latency = _alert_source.get()
+    if latency is not None:
+        latency.sent()
+
+
+async def watch_freshness(ws, freshness: Freshness, limits: dict[str, float], label: str):
+    """
+    Closes `ws` once a channel in `limits` has been silent for longer than
+    its limit (seconds). The reader's `async for` then ends normally and its
+    loop reconnects without waiting out an error backoff.
+    """
+    interval = max(min(limits.values()) / 3, 0.05)
+    while True:
+        await asyncio.sleep(interval)
+        for channel, limit in limits.items():
+            age = freshness.age(channel)
+            if age > limit:
+                logger.warning(f"WS {label}: no {channel} frame for {age:.1f}s, reconnecting")
+                await ws.close()
+                return
+
+
+async def ping_loop(ws, label: str):
+    while True:
+        await asyncio.sleep(50)
+        try:
+            await ws.send(json.dumps({"method": "ping"}))
+        except Exception as e:
+            logger.debug(f"WS {label} ping failed: {e}")
+
+
+class FrameLimiter:
+    """Token bucket for outgoing websocket frames (Hyperliquid caps messages per IP, not per connection)."""
+
+    def __init__(self, per_min: int, burst: int):
+        self.rate = max(per_min, 1) / 60
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, frames: int = 1):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= frames:
+                    self.tokens -= frames
+                    return
+                await asyncio.sleep((frames - self.tokens) / self.rate)
+
+
+class WalletShard:
+    """One websocket carrying the user channels of the wallets hashed to it."""
+
+    def __init__(self, node: str, url: str, on_message, prepare=None, limiter: FrameLimiter | None = None,
+                 stale_sec: float | None = None):
+        self.node = node
+        self.url = url
+        self.on_message = on_message
+        self.prepare = prepare  # awaited per wallet before it is subscribed (e.g. REST seeding)
+        self.limiter = limiter
+        self.stale_sec = stale_sec  # reconnect after this long without any frame (None: never)
+        self.freshness = Freshness()
+        self.wallets: set[str] = set()
+        self.subscribed: set[str] = set()
+        self.ws = None
+        self.running = False
+        self.task: asyncio.Task | None = None
+        self.connects = 0
+        # Bring-up timings of the last connection, from the start of the connect attempt
+        self.ready_sec: float | None = None  # every wallet subscribed
+        # First user-channel frame: the subscription snapshot, so the shard is
+        # served again; it is not an alert (those follow with the next update)
+        self.first_snapshot_sec: float | None = None
+        self.alerts = AlertLatency(f"shard {node}")
+
+    def start(self):
+        self.running = True
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    async def add(self, wallet: str):
+        self.wallets.add(wallet)
+        if self.ws is not None:
+            await self._subscribe(wallet)
+
+    async def remove(self, wallet: str):
+        self.wallets.discard(wallet)
+        if self.ws is not None and wallet in self.subscribed:
+            self.subscribed.discard(wallet)
+            for channel in USER_CHANNELS:
+                await self.ws.send(json.dumps({
+                    "method": "unsubscribe",
+                    "subscription": {"type": channel, "user": wallet}
+                }))
+
+    async def _subscribe(self, wallet: str):
+        if wallet in self.subscribed:
+            return
+        ws = self.ws
+        self.subscribed.add(wallet)
+        if self.prepare:
+            await self.prepare(wallet)
+        if self.limiter:
+            await self.limiter.acquire(len(USER_CHANNELS))
+        if self.ws is not ws or wallet not in self.wallets:
+            # Reconnected or removed while waiting; the new connection resubscribes
+            if self.ws is ws:
+                self.subscribed.discard(wallet)
+            return
+        for channel in USER_CHANNELS:
+            await ws.send(json.dumps({
+                "method": "subscribe",
+                "subscription": {"type": channel, "user": wallet}
+            }))
+
+    async def _bring_up(self, started: float):
+        wallets = list(self.wallets)
+        results = await asyncio.gather(*(self._subscribe(w) for w in wallets), return_exceptions=True)
+        failed = sum(1 for r in results if isinstance(r, Exception))
+        self.ready_sec = time.monotonic() - started
+        logger.info(f"WS shard {self.node} subscribed {len(wallets) - failed}/{len(wallets)} wallets in {self.ready_sec:.2f}s")
+
+    async def _run(self):
+        backoff = 5
+        track_alerts(self.alerts)
+        while self.running:
+            ping_task = None
+            bring_up = None
+            watchdog = None
+            started = time.monotonic()
+            try:
+                async with websockets.connect(self.url) as ws:
+                    self.ws = ws
+                    self.subscribed = set()
+                    self.connects += 1
+                    self.ready_sec = self.first_snapshot_sec = None
+                    self.alerts.reset(started)
+                    self.freshness.reset()
+                    backoff = 5
+                    # Frames are read while the wallets are still being brought up
+                    bring_up = asyncio.create_task(self._bring_up(started))
+                    ping_task = asyncio.create_task(ping_loop(ws, f"shard {self.node}"))
+                    if self.stale_sec:
+                        watchdog = asyncio.create_task(watch_freshness(ws, self.freshness, {"*": self.stale_sec}, f"shard {self.node}"))
+                    async for message in ws:
+                        data = json.loads(message)
+                        self.freshness.touch(data.get("channel"))
+                        if self.first_snapshot_sec is None and data.get("channel") in USER_CHANNELS:
+                            self.first_snapshot_sec = time.monotonic() - started
+                            logger.info(f"WS shard {self.node}: first snapshot {self.first_snapshot_sec:.2f}s after connect")
+                        await self.on_message(data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"WS shard {self.node} connection error: {e}")
+                self.ws = None
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 120)
+            finally:
+                self.ws = None
+                for task in (ping_task, bring_up, watchdog):
+                    if task:
+                        task.cancel()
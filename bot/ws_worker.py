@@ -0,0 +1,45 @@
+import asyncio
+import logging
+from aiogram import Bot
+from bot.config import settings
+from bot.database import db
+from bot.leases import hold_sticky
+from bot.ws_manager import WSManager
+from bot.services import close_session
+
+# Extra WS process: runs the wallet shards for WS_PROCESS_INDEX and sends their
+# alerts. Polling, the scheduler and market-wide alerts stay with bot.main.
+# With LEASES_ENABLED, replicas started with the same index hold the same
+# "ws:p<index>" lease, so only one of them connects at a time.
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+async def main():
+    if not settings.BOT_TOKEN or ":" not in settings.BOT_TOKEN:
+        logger.error("Invalid BOT_TOKEN provided in environment!")
+        return
+
+    try:
+        await db.init_db()
+        await db.client.admin.command('ping')
+    except Exception as e:
+        logger.error(f"Failed to connect to MongoDB: {e}")
+        return
+
+    bot = Bot(token=settings.BOT_TOKEN)
+    ws_manager = WSManager(bot)
+    bot.ws_manager = ws_manager
+
+    logger.info(f"Starting WS worker {settings.WS_PROCESS_INDEX}/{settings.WS_PROCESS_COUNT}...")
+    try:
+        await hold_sticky(f"ws:p{settings.WS_PROCESS_INDEX}", ws_manager.start)
+    finally:
+        ws_manager.running = False
+        await bot.session.close()
+        await close_session()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,119 @@
+"""
+Microbenchmark for the market table builders in bot/analytics.py.
+
+Times MarketState parsing, the one-off vectorized metrics/rank pass, and each
+table builder sliced from a warm state, then compares building all market
+tables from one shared snapshot against the old pattern where every builder
+re-parses the raw metaAndAssetCtxs lists.
+
+Usage:
+    python scripts/bench_market_tables.py
+    python scripts/bench_market_tables.py --assets 250 1000 --iterations 200 --json tables.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+# Settings require a bot token; the benchmark never talks to Telegram.
+os.environ.setdefault("BOT_TOKEN", "bench")
+
+from bench_render import percentile, synthetic_market  # noqa: E402
+from bot.analytics import (  # noqa: E402
+    format_funding_heatmap,
+    prepare_coin_prices_data,
+    prepare_liquidity_data,
+    prepare_modern_market_data,
+)
+from bot.market_state import MarketState  # noqa: E402
+
+BUILDERS = {
+    "liquidity": prepare_liquidity_data,
+    "modern_market": prepare_modern_market_data,
+    "coin_prices": prepare_coin_prices_data,
+    "funding_heatmap": format_funding_heatmap,
+}
+
+RANKED_COLUMNS = [
+    ("slippage", False), ("slippage", True), ("vol_proxy", True), ("oi_usd", True),
+    ("change_24h", True), ("change_24h", False), ("efficiency", True),
+    ("volume", True), ("funding_apr", True),
+]
+
+
+def _time(fn, iterations: int) -> list[float]:
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def _row(case: str, assets: int, samples: list[float]) -> dict:
+    return {
+        "case": case,
+        "assets": assets,
+        "mean_ms": statistics.fmean(samples),
+        "p50_ms": percentile(samples, 50),
+        "p95_ms": percentile(samples, 95),
+    }
+
+
+def bench(n_assets: int, iterations: int) -> list[dict]:
+    universe, ctxs = synthetic_market(n_assets)
+    raw = [{"universe": universe}, ctxs]
+    warm = MarketState.from_context(raw)
+
+    def derive():
+        state = MarketState.from_context(raw)
+        state.metrics
+        for column, descending in RANKED_COLUMNS:
+            state.rank(column, descending)
+
+    def all_shared():
+        state = MarketState.from_context(raw)
+        for builder in BUILDERS.values():
+            builder(state)
+
+    def all_raw():
+        for builder in BUILDERS.values():
+            builder(ctxs, universe)
+
+    rows = [
+        _row("parse", n_assets, _time(lambda: MarketState.from_context(raw), iterations)),
+        _row("parse+metrics+ranks", n_assets, _time(derive, iterations)),
+    ]
+    for name, builder in BUILDERS.items():
+        rows.append(_row(f"{name} (warm state)", n_assets, _time(lambda b=builder: b(warm), iterations)))
+    rows.append(_row("all tables, shared snapshot", n_assets, _time(all_shared, iterations)))
+    rows.append(_row("all tables, re-parse per builder", n_assets, _time(all_raw, iterations)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the columnar market table builders.")
+    parser.add_argument("--assets", nargs="*", type=int, default=[50, 250, 500])
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--json", dest="json_path", help="Write raw results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for n in args.assets:
+        results.extend(bench(n, args.iterations))
+
+    print(f"{'case':36} {'assets':>6} {'mean':>9} {'p50':>9} {'p95':>9}")
+    for r in results:
+        print(f"{r['case']:36} {r['assets']:>6} {r['mean_ms']:>8.3f}ms {r['p50_ms']:>8.3f}ms {r['p95_ms']:>8.3f}ms")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
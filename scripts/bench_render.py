@@ -0,0 +1,328 @@
+"""
+Offline render benchmark for bot/templates.
+
+Renders every HTML template with synthetic fixture data at several sizes and
+reports latency percentiles, throughput under concurrency and output size.
+No network or database access is needed beyond what Chromium itself does.
+
+Usage:
+    python scripts/bench_render.py
+    python scripts/bench_render.py --templates pnl_card market_stats --sizes small large
+    python scripts/bench_render.py --iterations 20 --concurrency 1 4 8 --json bench.json
+    python scripts/bench_render.py --profiles png jpeg webp preview
+    python scripts/bench_render.py --compare-cards
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+# Settings require a bot token; the benchmark never talks to Telegram.
+os.environ.setdefault("BOT_TOKEN", "bench")
+
+from bot.analytics import (  # noqa: E402
+    prepare_account_flex_data,
+    prepare_coin_prices_data,
+    prepare_liquidity_data,
+    prepare_modern_market_data,
+    prepare_orders_table_data,
+    prepare_pnl_card_data,
+    prepare_portfolio_composition_data,
+    prepare_positions_table_data,
+    prepare_terminal_dashboard_data_clean,
+)
+
+# Number of assets / positions / orders in each fixture size.
+SIZES = {
+    "small": {"assets": 20, "positions": 2, "orders": 3, "holdings": 3},
+    "medium": {"assets": 120, "positions": 10, "orders": 15, "holdings": 8},
+    "large": {"assets": 250, "positions": 40, "orders": 60, "holdings": 20},
+}
+
+# template -> (width, height) as used by the bot call sites.
+TEMPLATES = {
+    "account_flex.html": (800, 800),
+    "coin_prices.html": (800, 800),
+    "funding_heatmap.html": (800, 800),
+    "liquidity_stats.html": (800, 800),
+    "market_overview.html": (1000, 1000),
+    "market_stats.html": (800, 800),
+    "orders_table.html": (800, 800),
+    "pnl_card.html": (800, 800),
+    "portfolio_composition.html": (800, 800),
+    "positions_table.html": (800, 800),
+    "terminal_dashboard.html": (1000, 600),
+}
+
+MAJORS = ["BTC", "ETH", "SOL", "HYPE", "XRP", "DOGE", "AVAX", "LINK"]
+
+
+def synthetic_market(n_assets: int, seed: int = 7) -> tuple[list, list]:
+    """Builds a (universe, assetCtxs) pair shaped like metaAndAssetCtxs."""
+    rng = random.Random(seed)
+    universe, ctxs = [], []
+    for i in range(n_assets):
+        name = MAJORS[i] if i < len(MAJORS) else f"C{i:03d}"
+        mark = rng.uniform(0.01, 100000) if i < len(MAJORS) else rng.uniform(0.0001, 50)
+        prev = mark / (1 + rng.uniform(-0.15, 0.15))
+        spread = mark * rng.uniform(0.0001, 0.01)
+        universe.append({"name": name, "szDecimals": 2, "maxLeverage": 50})
+        ctxs.append({
+            "markPx": str(mark),
+            "oraclePx": str(mark * (1 + rng.uniform(-0.002, 0.002))),
+            "prevDayPx": str(prev),
+            "funding": str(rng.uniform(-0.0002, 0.0004)),
+            "dayNtlVlm": str(rng.uniform(1e4, 5e9)),
+            "openInterest": str(rng.uniform(1e2, 1e7)),
+            "impactPxs": [str(mark - spread), str(mark + spread)],
+        })
+    return universe, ctxs
+
+
+def _synthetic_positions(n: int, rng: random.Random) -> list:
+    out = []
+    for i in range(n):
+        entry = rng.uniform(0.1, 70000)
+        mark = entry * (1 + rng.uniform(-0.2, 0.2))
+        lev = rng.choice([1, 3, 5, 10, 20])
+        szi = rng.uniform(0.01, 50) * rng.choice([1, -1])
+        pnl = (mark - entry) * szi
+        out.append({
+            "symbol": MAJORS[i % len(MAJORS)] if i < len(MAJORS) else f"C{i:03d}",
+            "side": "LONG" if szi > 0 else "SHORT",
+            "leverage": lev,
+            "size_usd": abs(szi * mark),
+            "entry": entry,
+            "mark": mark,
+            "liq": entry * (0.5 if szi > 0 else 1.5),
+            "pnl": pnl,
+            "roi": pnl / (abs(szi) * entry / lev) * 100,
+        })
+    return out
+
+
+def build_fixtures(size: str, seed: int = 7) -> dict[str, dict]:
+    """Returns {template_name: render data} for one fixture size."""
+    spec = SIZES[size]
+    rng = random.Random(seed)
+    universe, ctxs = synthetic_market(spec["assets"], seed)
+    positions = _synthetic_positions(spec["positions"], rng)
+    holdings = [{"name": f"H{i}", "value": rng.uniform(10, 50000)} for i in range(spec["holdings"])]
+    orders = [{
+        "symbol": f"C{i:03d}",
+        "is_spot": i % 3 == 0,
+        "side": rng.choice(["B", "A"]),
+        "sz": str(rng.uniform(0.1, 100)),
+        "limitPx": str(rng.uniform(1, 1000)),
+        "mark_px": str(rng.uniform(1, 1000)),
+    } for i in range(spec["orders"])]
+
+    data_alpha = prepare_modern_market_data(ctxs, universe, {"summary": {"sharePx": "1.42", "accountValue": "350000000"}, "dayPnl": "120000"})
+    gainer = max(data_alpha["gainers"], key=lambda r: r["change"])
+    loser = min(data_alpha["losers"], key=lambda r: r["change"])
+    return {
+        "account_flex.html": prepare_account_flex_data(1234.56, 12.3, "24H", True, "Net Worth"),
+        "coin_prices.html": prepare_coin_prices_data(ctxs, universe),
+        "funding_heatmap.html": dict(data_alpha),
+        "liquidity_stats.html": prepare_liquidity_data(ctxs, universe),
+        "market_overview.html": {
+            "period_label": "MORNING BRIEF",
+            "date": "01 Jan 09:00",
+            "btc": {"price": "97,000", "change": 1.25},
+            "eth": {"price": "3,100", "change": -0.8},
+            "sentiment": "Bullish",
+            "fng": {"value": 64, "classification": "Greed"},
+            "gemini_model": "Velox Engine",
+            "top_gainer": {"sym": gainer["name"], "val": gainer["change"]},
+            "top_loser": {"sym": loser["name"], "val": loser["change"]},
+            "top_vol": {"sym": "BTC", "val": "$2400M"},
+            "top_fund": {"sym": "HYPE", "val": "38%"},
+        },
+        "market_stats.html": dict(data_alpha),
+        "orders_table.html": prepare_orders_table_data("Main", orders),
+        "pnl_card.html": prepare_pnl_card_data({"symbol": "BTC", "side": "LONG", "leverage": 10, "entry": 95000, "mark": 97000, "roi": 21.05, "pnl": 2000}),
+        "portfolio_composition.html": prepare_portfolio_composition_data(holdings),
+        "positions_table.html": prepare_positions_table_data("Main", list(positions)),
+        "terminal_dashboard.html": prepare_terminal_dashboard_data_clean(
+            wallet_label="Main",
+            wallet_address="0x" + "ab" * 20,
+            total_equity=250000.0,
+            upnl=sum(p["pnl"] for p in positions),
+            margin_usage=42.0,
+            leverage=3.1,
+            withdrawable=50000.0,
+            assets=holdings,
+            positions=list(positions),
+        ),
+    }
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Nearest-rank percentile; values need not be sorted."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[k]
+
+
+async def _render_once(render, template: str, data: dict, profile: str = "png") -> tuple[float, int]:
+    width, height = TEMPLATES[template]
+    start = time.perf_counter()
+    buf = await render(template, dict(data), width=width, height=height, lang="en", profile=profile)
+    return time.perf_counter() - start, len(buf.getvalue())
+
+
+async def bench_template(render, template: str, data: dict, iterations: int, concurrency: list[int], profile: str = "png") -> dict:
+    # Warm-up: excludes browser launch and first-paint font fetches.
+    await _render_once(render, template, data, profile)
+
+    latencies, sizes = [], []
+    for _ in range(iterations):
+        elapsed, nbytes = await _render_once(render, template, data, profile)
+        latencies.append(elapsed * 1000)
+        sizes.append(nbytes)
+
+    throughput = {}
+    for level in concurrency:
+        total = max(level, iterations)
+        sem = asyncio.Semaphore(level)
+
+        async def worker():
+            async with sem:
+                return await _render_once(render, template, data, profile)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(total)))
+        throughput[level] = total / (time.perf_counter() - start)
+
+    return {
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": statistics.fmean(latencies),
+        "bytes": int(statistics.median(sizes)),
+        "throughput_rps": throughput,
+    }
+
+
+async def run(templates: list[str], sizes: list[str], iterations: int, concurrency: list[int], profiles: list[str]) -> list[dict]:
+    from bot.renderer import render_html_to_image
+
+    results = []
+    for size in sizes:
+        fixtures = build_fixtures(size)
+        for template in templates:
+            for profile in profiles:
+                stats = await bench_template(render_html_to_image, template, fixtures[template], iterations, concurrency, profile)
+                results.append({"template": template, "size": size, "profile": profile, **stats})
+                tput = " ".join(f"c{c}={r:.1f}/s" for c, r in stats["throughput_rps"].items())
+                print(
+                    f"{template:<28} {size:<7} {profile:<8} p50={stats['p50_ms']:7.1f}ms p95={stats['p95_ms']:7.1f}ms "
+                    f"p99={stats['p99_ms']:7.1f}ms out={stats['bytes'] / 1024:7.1f}KB {tput}",
+                    flush=True,
+                )
+    return results
+
+
+# Pillow cards and their Chromium renders are compared downscaled to
+# COMPARE_SIZE so font substitution and antialiasing count little, layout
+# and colour do. The number is for eyeballing; no tolerance is enforced.
+COMPARE_SIZE = (100, 100)
+
+
+def card_diff_pct(a, b) -> float:
+    """Mean absolute difference of two images at COMPARE_SIZE, in percent (0 = identical)."""
+    from PIL import Image, ImageChops, ImageStat
+
+    a = a.convert("RGB").resize(COMPARE_SIZE, Image.Resampling.BOX)
+    b = b.convert("RGB").resize(COMPARE_SIZE, Image.Resampling.BOX)
+    return statistics.fmean(ImageStat.Stat(ImageChops.difference(a, b)).mean) / 255 * 100
+
+
+async def compare_card(template: str, data: dict, lang: str = "en") -> dict:
+    """Renders one Pillow-backed card both ways and measures the difference."""
+    import io
+
+    from PIL import Image
+
+    from bot import renderer
+
+    width, height = TEMPLATES[template]
+    start = time.perf_counter()
+    card = await asyncio.to_thread(
+        renderer._paint_card, template, dict(data), lang, width, height, renderer.get_output_profile("png")
+    )
+    card_ms = (time.perf_counter() - start) * 1000
+
+    saved = renderer.settings.RENDER_PIL_TEMPLATES
+    renderer.settings.RENDER_PIL_TEMPLATES = ""
+    try:
+        start = time.perf_counter()
+        html = await renderer.render_html_to_image(template, dict(data), width=width, height=height, lang=lang)
+        html_ms = (time.perf_counter() - start) * 1000
+    finally:
+        renderer.settings.RENDER_PIL_TEMPLATES = saved
+
+    diff = card_diff_pct(Image.open(io.BytesIO(card)), Image.open(html))
+    return {"template": template, "lang": lang, "card_ms": card_ms, "html_ms": html_ms, "mean_abs_diff_pct": diff}
+
+
+async def compare_cards() -> list[dict]:
+    """
+    Renders every Pillow-backed card both ways and reports the difference
+    against the Chromium version.
+    """
+    from bot.card_renderer import CARD_PAINTERS
+
+    fixtures = build_fixtures("small")
+    results = []
+    for template in CARD_PAINTERS:
+        for lang in ("en", "ru"):
+            result = await compare_card(template, fixtures[template], lang)
+            results.append(result)
+            print(
+                f"{template:<28} {lang} card={result['card_ms']:7.1f}ms html={result['html_ms']:7.1f}ms "
+                f"diff={result['mean_abs_diff_pct']:5.2f}%",
+                flush=True,
+            )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HTML template rendering.")
+    parser.add_argument("--templates", nargs="*", default=[t.removesuffix(".html") for t in TEMPLATES])
+    parser.add_argument("--sizes", nargs="*", default=list(SIZES), choices=list(SIZES))
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--concurrency", nargs="*", type=int, default=[1, 2, 4, 8])
+    parser.add_argument("--profiles", nargs="*", default=["png"], help="Output profiles from bot.renderer.OUTPUT_PROFILES")
+    parser.add_argument("--compare-cards", action="store_true", help="Compare Pillow card output with Chromium instead of benchmarking")
+    parser.add_argument("--json", dest="json_path", help="Write raw results to this file")
+    args = parser.parse_args()
+
+    if args.compare_cards:
+        results = asyncio.run(compare_cards())
+        if args.json_path:
+            with open(args.json_path, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+        return
+
+    templates = [t if t.endswith(".html") else f"{t}.html" for t in args.templates]
+    unknown = [t for t in templates if t not in TEMPLATES]
+    if unknown:
+        parser.error(f"unknown templates: {', '.join(unknown)}")
+
+    results = asyncio.run(run(templates, args.sizes, args.iterations, args.concurrency, args.profiles))
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,188 @@
+import itertools
 import os
+from types import SimpleNamespace
 
 os.environ.setdefault("BOT_TOKEN", "test-token")
 os.environ.setdefault("GEMINI_API_KEY", "")
+
+# Shared in-memory Motor stand-in for the Database tests. Tests import it with
+# `from conftest import FakeCollection` and swap it in for real collections.
+
+_OPS = {
+    "$lt": lambda a, b: a is not None and a < b,
+    "$lte": lambda a, b: a is not None and a <= b,
+    "$gt": lambda a, b: a is not None and a > b,
+    "$gte": lambda a, b: a is not None and a >= b,
+    "$ne": lambda a, b: a != b,
+    "$in": lambda a, b: a in b,
+    "$nin": lambda a, b: a not in b,
+}
+
+
+_MISSING = object()
+
+
+def _lookup(doc: dict, key: str):
+    """Value at a dotted path, or _MISSING."""
+    for part in key.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return _MISSING
+        doc = doc[part]
+    return doc
+
+
+def _get(doc: dict, key: str):
+    value = _lookup(doc, key)
+    return None if value is _MISSING else value
+
+
+def _set(doc: dict, key: str, value) -> None:
+    *parents, last = key.split(".")
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    doc[last] = value
+
+
+def match_filter(doc: dict, flt: dict | None) -> bool:
+    """Mongo filter semantics for the operators the Database queries use."""
+    for key, cond in (flt or {}).items():
+        if key == "$or":
+            if not any(match_filter(doc, c) for c in cond):
+                return False
+        elif key == "$and":
+            if not all(match_filter(doc, c) for c in cond):
+                return False
+        elif isinstance(cond, dict):
+            for op, arg in cond.items():
+                if op == "$exists":
+                    if (_lookup(doc, key) is not _MISSING) != arg:
+                        return False
+                elif not _OPS[op](_get(doc, key), arg):
+                    return False
+        elif isinstance(_get(doc, key), list):
+            if cond not in _get(doc, key):
+                return False
+        elif _get(doc, key) != cond:
+            return False
+    return True
+
+
+def apply_update(doc: dict, update: dict, inserting: bool = False) -> dict:
+    for key, value in update.get("$set", {}).items():
+        _set(doc, key, value)
+    if inserting:
+        for key, value in update.get("$setOnInsert", {}).items():
+            _set(doc, key, value)
+    for key, inc in update.get("$inc", {}).items():
+        _set(doc, key, (_get(doc, key) or 0) + inc)
+    for key, value in update.get("$max", {}).items():
+        current = _get(doc, key)
+        _set(doc, key, value if current is None else max(current, value))
+    return doc
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction=1):
+        self.docs.sort(key=lambda d: d.get(key), reverse=direction < 0)
+        return self
+
+    def limit(self, n):
+        if n:
+            self.docs = self.docs[:n]
+        return self
+
+    async def to_list(self, length=None):
+        return list(self.docs if length is None else self.docs[:length])
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for doc in self.docs:
+            yield doc
+
+
+class FakeCollection:
+    """Motor collection over a list of dicts; `reads` counts find/find_one calls."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, docs=None):
+        self.docs = [dict(d) for d in docs or []]
+        self.reads = 0
+
+    def _matching(self, flt):
+        return [d for d in self.docs if match_filter(d, flt)]
+
+    async def find_one(self, flt=None, projection=None, sort=None):
+        self.reads += 1
+        cursor = FakeCursor([dict(d) for d in self._matching(flt)])
+        for key, direction in reversed(sort or []):
+            cursor.sort(key, direction)
+        return cursor.docs[0] if cursor.docs else None
+
+    def find(self, flt=None, projection=None):
+        self.reads += 1
+        return FakeCursor([dict(d) for d in self._matching(flt)])
+
+    async def distinct(self, field, flt=None):
+        values = set()
+        for d in self._matching(flt):
+            value = d.get(field)
+            if value is not None:
+                values.update(value if isinstance(value, list) else [value])
+        return sorted(values)
+
+    async def insert_one(self, doc):
+        doc = {"_id": next(self._ids), **doc}
+        self.docs.append(doc)
+        return SimpleNamespace(inserted_id=doc["_id"])
+
+    async def update_one(self, flt, update, upsert=False):
+        for d in self.docs:
+            if match_filter(d, flt):
+                apply_update(d, update)
+                return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+        if not upsert:
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+        doc = {"_id": next(self._ids), **{k: v for k, v in flt.items() if not k.startswith("$") and not isinstance(v, dict)}}
+        self.docs.append(apply_update(doc, update, inserting=True))
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=doc["_id"])
+
+    async def find_one_and_update(self, flt, update, upsert=False, return_document=None):
+        """Returns the document after the update (callers pass ReturnDocument.AFTER)."""
+        result = await self.update_one(flt, update, upsert=upsert)
+        if result.upserted_id is not None:
+            return dict(next(d for d in self.docs if d["_id"] == result.upserted_id))
+        return await self.find_one(flt) if result.matched_count else None
+
+    async def update_many(self, flt, update):
+        matched = self._matching(flt)
+        for d in matched:
+            apply_update(d, update)
+        return SimpleNamespace(matched_count=len(matched), modified_count=len(matched))
+
+    async def replace_one(self, flt, doc, upsert=False):
+        for i, d in enumerate(self.docs):
+            if match_filter(d, flt):
+                self.docs[i] = {"_id": d.get("_id"), **doc}
+                return SimpleNamespace(matched_count=1, upserted_id=None)
+        if upsert:
+            self.docs.append({"_id": next(self._ids), **doc})
+            return SimpleNamespace(matched_count=0, upserted_id=self.docs[-1]["_id"])
+        return SimpleNamespace(matched_count=0, upserted_id=None)
+
+    async def delete_one(self, flt):
+        for i, d in enumerate(self.docs):
+            if match_filter(d, flt):
+                del self.docs[i]
+                return SimpleNamespace(deleted_count=1)
+        return SimpleNamespace(deleted_count=0)
+
+    async def delete_many(self, flt):
+        keep = [d for d in self.docs if not match_filter(d, flt)]
+        deleted, self.docs = len(self.docs) - len(keep), keep
+        return SimpleNamespace(deleted_count=deleted)
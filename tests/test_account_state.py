@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+import bot.account_state as account_state
+from bot.ws_manager import WSManager
+
+WALLET = "0xAbC"
+
+
+def _web_data2(account_value="1000", spot=True):
+    data = {
+        "user": WALLET,
+        "clearinghouseState": {
+            "marginSummary": {"accountValue": account_value, "totalMarginUsed": "100"},
+            "assetPositions": [{"position": {"coin": "BTC", "szi": "0.1", "entryPx": "60000"}}],
+        },
+    }
+    if spot:
+        data["spotState"] = {"balances": [{"coin": "HYPE", "total": "12"}]}
+    return data
+
+
+@pytest.fixture(autouse=True)
+def clean_cache(monkeypatch):
+    monkeypatch.setattr(account_state, "_perps", {})
+    monkeypatch.setattr(account_state, "_spot", {})
+    monkeypatch.setattr(account_state.settings, "ACCOUNT_STATE_MAX_AGE_SEC", 30)
+
+
+@pytest.fixture
+def rest_calls(monkeypatch):
+    calls = []
+
+    async def fake_perps(wallet):
+        calls.append(("perps", wallet))
+        return {"marginSummary": {"accountValue": "5"}, "assetPositions": []}
+
+    async def fake_spot(wallet):
+        calls.append(("spot", wallet))
+        return {"balances": [{"coin": "USDC", "total": "5"}]}
+
+    monkeypatch.setattr(account_state, "get_perps_state", fake_perps)
+    monkeypatch.setattr(account_state, "get_user_state", fake_spot)
+    return calls
+
+
+def test_web_data2_snapshot_is_served_without_rest(rest_calls):
+    ws = WSManager(bot=None)
+    asyncio.run(ws.handle_web_data2(_web_data2()))
+
+    async def read():
+        return await account_state.get_account_perps_state("0xabc"), await account_state.get_account_spot_balances(WALLET)
+
+    perps, spot = asyncio.run(read())
+    assert perps["marginSummary"]["accountValue"] == "1000"
+    assert spot == [{"coin": "HYPE", "total": "12"}]
+    assert rest_calls == []
+
+    ws.untrack_wallet(WALLET)
+    assert account_state.get_cached_perps_state(WALLET) is None
+
+
+def test_stale_snapshot_falls_back_to_rest_and_is_refreshed(rest_calls):
+    account_state.update_from_web_data2(WALLET, _web_data2(spot=False), now=0)
+
+    async def read_twice():
+        first = await account_state.get_account_perps_state(WALLET)
+        second = await account_state.get_account_perps_state(WALLET)
+        spot = await account_state.get_account_spot_balances(WALLET)
+        return first, second, spot
+
+    first, second, spot = asyncio.run(read_twice())
+    assert first is second
+    assert first["marginSummary"]["accountValue"] == "5"
+    assert spot == [{"coin": "USDC", "total": "5"}]
+    assert rest_calls == [("perps", WALLET), ("spot", WALLET)]
+
+
+def test_failed_rest_spot_fetch_is_not_cached(monkeypatch):
+    calls = []
+
+    async def failing_spot(wallet):
+        calls.append(wallet)
+        return None
+
+    monkeypatch.setattr(account_state, "get_user_state", failing_spot)
+    assert asyncio.run(account_state.get_account_spot_balances(WALLET)) == []
+    assert asyncio.run(account_state.get_account_spot_balances(WALLET)) == []
+    assert len(calls) == 2
@@ -1,5 +1,8 @@
 import asyncio
 
+import pytest
+
+from bot.agent import orchestrator as orchestrator_module
 from bot.agent.context import AgentRunContext, MarketEvent, MarketRegime, MarketSnapshot, SourceItem
 from bot.agent.orchestrator import AgentOrchestrator
 from bot.agent.processors.risk_synthesizer import deterministic_report, normalize_report_output, synthesize_final_report
@@ -43,6 +46,12 @@ class NoopSourceCache:
         return None
 
 
+@pytest.fixture(autouse=True)
+def fresh_stage_memo(monkeypatch):
+    monkeypatch.setattr(orchestrator_module, "stage_memo", orchestrator_module.StageMemo())
+    monkeypatch.setattr(orchestrator_module, "_synthesis_cache", {})
+
+
 def test_orchestrator_run_completes_and_tolerates_failing_tool(monkeypatch):
     registry = ToolRegistry()
     registry.register(GoodTool())
@@ -134,6 +143,112 @@ def test_orchestrator_propagates_generation_settings(monkeypatch):
     }
 
 
+def test_run_shared_builds_market_stage_once_for_many_users(monkeypatch):
+    from bot.agent.context import PortfolioExposure
+
+    class CountingTool(GoodTool):
+        calls = 0
+
+        async def collect(self, context, queries=None):
+            CountingTool.calls += 1
+            await asyncio.sleep(0)
+            return await super().collect(context, queries)
+
+    registry = ToolRegistry()
+    registry.register(CountingTool())
+    orch = AgentOrchestrator(
+        registry=registry,
+        event_extractor=FakeExtractor(),
+        run_store=NoopRunStore(),
+        event_store=NoopEventStore(),
+        source_cache=NoopSourceCache(),
+    )
+    synth_calls = []
+
+    async def fake_snapshot(context):
+        return MarketSnapshot()
+
+    async def fake_exposure(user_id):
+        # Users 1 and 2 hold the same book, user 3 holds nothing relevant
+        return PortfolioExposure(watchlist=["BTC"] if user_id in (1, 2) else [])
+
+    async def fake_synthesize(context, snapshot, regime, events, relevance, sources):
+        synth_calls.append((context.user_id, context.lang))
+        return {"summary": f"{context.lang}:{len(relevance)}"}
+
+    monkeypatch.setattr(orch, "collect_market_snapshot", fake_snapshot)
+    monkeypatch.setattr("bot.agent.orchestrator.build_portfolio_exposure", fake_exposure)
+    monkeypatch.setattr("bot.agent.orchestrator.synthesize_final_report", fake_synthesize)
+
+    async def scenario():
+        first = await asyncio.gather(*(orch.run_shared(user_id=uid) for uid in (1, 2, 3)))
+        later = await orch.run_shared(user_id=1, lang="ru")
+        return first, later
+
+    first, later = asyncio.run(scenario())
+    assert CountingTool.calls == 1
+    assert [r.output["summary"] for r in first] == ["en:1", "en:1", "en:0"]
+    assert len({r.run_id for r in first}) == 3
+    assert later.output["summary"] == "ru:1"
+    # Same stage and same relevant exposure share one synthesis per language
+    assert len(synth_calls) == 3
+
+
+def test_stage_memo_reuses_sources_and_events_until_refresh(monkeypatch):
+    from bot.agent.context import PortfolioExposure
+
+    calls = {"collect": 0, "extract": 0, "snapshot": 0, "persist": 0}
+
+    class CountingTool(GoodTool):
+        async def collect(self, context, queries=None):
+            calls["collect"] += 1
+            return await super().collect(context, queries)
+
+    class CountingExtractor(FakeExtractor):
+        async def extract(self, context, sources):
+            calls["extract"] += 1
+            return await super().extract(context, sources)
+
+    class CountingEventStore:
+        async def upsert_many(self, events):
+            calls["persist"] += 1
+
+    registry = ToolRegistry()
+    registry.register(CountingTool())
+    registry.register(FailingTool())
+    orch = AgentOrchestrator(
+        registry=registry,
+        event_extractor=CountingExtractor(),
+        run_store=NoopRunStore(),
+        event_store=CountingEventStore(),
+        source_cache=NoopSourceCache(),
+    )
+
+    async def fake_snapshot(context):
+        calls["snapshot"] += 1
+        return MarketSnapshot()
+
+    async def fake_exposure(user_id):
+        return PortfolioExposure()
+
+    monkeypatch.setattr(orch, "collect_market_snapshot", fake_snapshot)
+    monkeypatch.setattr("bot.agent.orchestrator.build_portfolio_exposure", fake_exposure)
+
+    async def scenario():
+        first = await orch.run(mode="overview")
+        second = await orch.run(mode="overview")
+        stage = await orch.refresh_market_stage(mode="overview")
+        shared = await orch.run_shared(user_id=5)
+        return first, second, stage, shared
+
+    first, second, stage, shared = asyncio.run(scenario())
+    assert calls == {"collect": 2, "extract": 2, "snapshot": 1, "persist": 2}
+    # Memo hits still report the collector errors of the run that built them
+    assert any(err["tool"] == "failing" for err in second.errors)
+    assert len(second.events) == len(first.events) == 1
+    assert shared.events == stage.events
+
+
 def test_synthesizer_includes_generation_settings_in_prompt(monkeypatch):
     captured = {}
 
@@ -246,3 +361,22 @@ def test_normalize_report_output_removes_links_from_text_fields_only():
     assert output["next_event"] == "Watch"
     assert output["actionable_notes"] == ["Check funding"]
     assert output["sources"] == [{"title": "Source title", "url": "https://example.com/a", "source": "Example"}]
+
+
+def test_stage_memo_evicts_expired_entries_and_stays_capped(monkeypatch):
+    memo = orchestrator_module.StageMemo()
+    clock = [1000.0]
+    monkeypatch.setattr(orchestrator_module.time, "time", lambda: clock[0])
+    monkeypatch.setattr(orchestrator_module, "_STAGE_MEMO_MAX", 4)
+
+    for i in range(4):
+        memo.put(("sources", i), i, ttl=10 if i < 2 else 100)
+    clock[0] += 50
+    memo.put(("sources", 4), 4, ttl=100)
+    # The two expired entries went first
+    assert set(memo._entries) == {("sources", 2), ("sources", 3), ("sources", 4)}
+
+    for i in range(5, 9):
+        memo.put(("sources", i), i, ttl=100)
+    assert len(memo._entries) == 4
+    assert memo.fresh(("sources", 8), 100) == 8 and memo.fresh(("sources", 2), 100) is None
@@ -1,25 +1,33 @@
 import asyncio
 import datetime
+import time
 from io import BytesIO
 
 import bot.scheduler as scheduler
 from bot.agent.context import FinalAgentReport, MarketSnapshot
+from bot.market_state import MarketState
 
 
 def test_send_scheduled_overviews_uses_agent_when_enabled(monkeypatch):
     now_utc = datetime.datetime.now(datetime.timezone.utc).strftime("%H:%M")
     called = {}
 
-    async def fake_get_all_users():
-        return [{"user_id": 123, "lang": "en"}]
-
-    async def fake_get_overview_settings(user_id):
-        return {
-            "enabled": True,
-            "schedules": [now_utc],
-            "prompt_override": "Focus on risk.",
-            "style": "brief",
-        }
+    async def fake_claim_due_schedules(kind, now_ms, grace_ms):
+        assert kind == "overview"
+        return [{"user_id": 123, "kind": kind, "key": now_utc, "next_due": now_ms, "repeat": True}]
+
+    async def fake_get_users_by_ids(user_ids, projection=None):
+        assert set(user_ids) == {123}
+        return [{
+            "user_id": 123,
+            "lang": "en",
+            "overview": {
+                "enabled": True,
+                "schedules": [now_utc],
+                "prompt_override": "Focus on risk.",
+                "style": "brief",
+            },
+        }]
 
     async def fake_get_perps_context():
         return {
@@ -30,6 +38,9 @@ def test_send_scheduled_overviews_uses_agent_when_enabled(monkeypatch):
             ],
         }
 
+    async def fake_get_market_state(max_age=None):
+        return MarketState.from_context(await fake_get_perps_context())
+
     async def fake_fetch_etf_flows():
         return {"btc_flow": 0, "eth_flow": 0}
 
@@ -74,9 +85,9 @@ def test_send_scheduled_overviews_uses_agent_when_enabled(monkeypatch):
             self.messages.append((args, kwargs))
 
     monkeypatch.setattr(scheduler.settings, "AGENT_ENABLED", True, raising=False)
-    monkeypatch.setattr(scheduler.db, "get_all_users", fake_get_all_users)
-    monkeypatch.setattr(scheduler.db, "get_overview_settings", fake_get_overview_settings)
-    monkeypatch.setattr(scheduler, "get_perps_context", fake_get_perps_context)
+    monkeypatch.setattr(scheduler.db, "claim_due_schedules", fake_claim_due_schedules)
+    monkeypatch.setattr(scheduler.db, "get_users_by_ids", fake_get_users_by_ids)
+    monkeypatch.setattr(scheduler, "get_market_state", fake_get_market_state)
     monkeypatch.setattr(scheduler.rss_engine, "get_cached_articles", lambda limit=200: [])
     monkeypatch.setattr(scheduler.market_overview, "fetch_etf_flows", fake_fetch_etf_flows)
     monkeypatch.setattr(scheduler, "get_fear_greed_index", fake_fear_greed)
@@ -91,3 +102,55 @@ def test_send_scheduled_overviews_uses_agent_when_enabled(monkeypatch):
     assert called["style"] == "brief"
     assert bot.photos
     assert bot.messages
+
+
+def test_pregenerated_overview_is_delivered_without_generating(monkeypatch):
+    slot_ms = int(time.time() * 1000) + 120_000
+    doc = {"user_id": 7, "kind": "overview", "key": "09:00", "next_due": slot_ms, "offset_ms": 0, "repeat": True}
+    user = {"user_id": 7, "lang": "en", "overview": {"enabled": True, "schedules": ["09:00"], "style": "brief"}}
+    generated = []
+
+    async def fake_due_between(kind, after_ms, until_ms):
+        assert after_ms < slot_ms <= until_ms
+        return [doc]
+
+    async def fake_claim_due_schedules(kind, now_ms, grace_ms):
+        return [dict(doc)]
+
+    async def fake_get_users_by_ids(user_ids, projection=None):
+        return [user]
+
+    async def fake_build_overview(user_id, cfg, lang, slot):
+        generated.append((user_id, cfg["style"], slot.strftime("%H:%M")))
+        await asyncio.sleep(0)
+        return {"photo": b"png", "caption": "caption", "text": "summary"}
+
+    class FakeBot:
+        def __init__(self):
+            self.sent = []
+
+        async def send_photo(self, user_id, photo, caption=None, parse_mode=None):
+            self.sent.append((user_id, caption))
+
+        async def send_message(self, user_id, text, parse_mode=None):
+            self.sent.append((user_id, text))
+
+    monkeypatch.setattr(scheduler.settings, "OVERVIEW_PREGEN_LEAD_MIN", 5)
+    monkeypatch.setattr(scheduler.db, "get_schedules_due_between", fake_due_between)
+    monkeypatch.setattr(scheduler.db, "claim_due_schedules", fake_claim_due_schedules)
+    monkeypatch.setattr(scheduler.db, "get_users_by_ids", fake_get_users_by_ids)
+    monkeypatch.setattr(scheduler, "_build_overview", fake_build_overview)
+    monkeypatch.setattr(scheduler, "_pregenerated_overviews", {})
+
+    async def scenario():
+        bot = FakeBot()
+        await scheduler.pregenerate_overviews(bot)
+        await scheduler.pregenerate_overviews(bot)  # already generated for this slot
+        await scheduler.send_scheduled_overviews(bot)
+        return bot
+
+    bot = asyncio.run(scenario())
+    slot = datetime.datetime.fromtimestamp(slot_ms / 1000, datetime.timezone.utc).strftime("%H:%M")
+    assert generated == [(7, "brief", slot)]
+    assert bot.sent == [(7, "caption"), (7, "summary")]
+    assert scheduler._pregenerated_overviews == {}
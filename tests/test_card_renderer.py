@@ -0,0 +1,60 @@
+import asyncio
+import importlib.util
+import io
+import os
+
+from PIL import Image, ImageChops
+
+import bot.renderer as renderer
+from bot.analytics import prepare_account_flex_data, prepare_pnl_card_data
+from bot.card_renderer import paint_account_flex, paint_pnl_card
+
+_BENCH_PATH = os.path.join(os.path.dirname(__file__), "..", "scripts", "bench_render.py")
+_spec = importlib.util.spec_from_file_location("bench_render", _BENCH_PATH)
+bench_render = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(bench_render)
+
+
+def _pnl_data(roi: float, pnl: float) -> dict:
+    return prepare_pnl_card_data({"symbol": "BTC", "side": "LONG", "leverage": 10, "entry": 95000, "mark": 97000, "roi": roi, "pnl": pnl})
+
+
+def test_painters_honour_size_and_scale():
+    assert paint_pnl_card(_pnl_data(12.5, 100), lang="en", scale=2).size == (1600, 1600)
+    flex = prepare_account_flex_data(-50.0, -1.5, "7D", False, "Main")
+    assert paint_account_flex(flex, lang="ru", scale=1).size == (800, 800)
+
+
+def test_polarity_changes_output():
+    up = paint_pnl_card(_pnl_data(12.5, 100), lang="en", scale=1)
+    down = paint_pnl_card(_pnl_data(-12.5, -100), lang="en", scale=1)
+    assert ImageChops.difference(up, down).getbbox() is not None
+
+
+def test_background_cache_is_not_mutated():
+    first = paint_pnl_card(_pnl_data(1.0, 1), lang="en", scale=1)
+    paint_pnl_card(_pnl_data(999.0, 99999), lang="en", scale=1)
+    again = paint_pnl_card(_pnl_data(1.0, 1), lang="en", scale=1)
+    assert ImageChops.difference(first, again).getbbox() is None
+
+
+def test_render_routes_card_templates_without_browser(monkeypatch):
+    monkeypatch.setattr(renderer.settings, "RENDER_PIL_TEMPLATES", "pnl_card.html", raising=False)
+
+    async def no_browser():
+        raise AssertionError("Chromium must not be used for card templates")
+
+    monkeypatch.setattr(renderer, "_get_browser", no_browser)
+    buf = asyncio.run(renderer.render_html_to_image("pnl_card.html", _pnl_data(5.0, 50), lang="en", profile="jpeg"))
+    img = Image.open(io.BytesIO(buf.getvalue()))
+    assert img.format == "JPEG"
+    assert img.size == (1600, 1600)
+
+
+def test_card_diff_ignores_glyph_noise_but_not_layout():
+    base = paint_pnl_card(_pnl_data(12.5, 100), lang="en", scale=1)
+    assert bench_render.card_diff_pct(base, base.copy()) == 0
+    other_lang = paint_pnl_card(_pnl_data(12.5, 100), lang="ru", scale=1)
+    flipped = paint_pnl_card(_pnl_data(-12.5, -100), lang="en", scale=1)
+    assert bench_render.card_diff_pct(base, other_lang) < bench_render.card_diff_pct(base, flipped)
+
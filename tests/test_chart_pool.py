@@ -0,0 +1,97 @@
+import asyncio
+import io
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import bot.analytics as analytics
+import bot.chart_pool as chart_pool
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(chart_pool.settings, "CHART_WORKERS", 1)
+    chart_pool.shutdown_chart_pool()
+    yield chart_pool
+    chart_pool.shutdown_chart_pool()
+
+
+def _market(n=30):
+    universe = [{"name": f"C{i}"} for i in range(n)]
+    asset_ctxs = [
+        {"markPx": str(10 + i), "prevDayPx": str(10 + i * 0.9), "funding": str(0.00001 * i), "dayNtlVlm": str(1e6 * (n - i)), "openInterest": str(1000 + i), "impactPxs": [str(9.99 + i), str(10.01 + i)]}
+        for i in range(n)
+    ]
+    return universe, asset_ctxs
+
+
+def test_charts_render_in_worker_process_and_are_memoized(pool):
+    universe, asset_ctxs = _market()
+    history = [[1_700_000_000_000 + i * 3_600_000, 1000 + i * (-1) ** i] for i in range(48)]
+
+    async def scenario():
+        await pool.start_chart_pool()
+        first = await pool.run_in_chart_pool("generate_market_overview_image", asset_ctxs, universe, sort_by="oi")
+        second = await pool.run_in_chart_pool("generate_market_overview_image", asset_ctxs, universe, sort_by="oi")
+        pnl = await pool.run_in_chart_pool("generate_pnl_chart", history, "Main")
+        return first, second, pnl
+
+    first, second, pnl = asyncio.run(scenario())
+    assert first.getvalue()[:8] == b"\x89PNG\r\n\x1a\n"
+    assert second is not first
+    assert second.getvalue() == first.getvalue()
+    assert pnl.getvalue()[:8] == b"\x89PNG\r\n\x1a\n"
+    assert len(pool._memo) == 2
+
+
+def test_thread_fallback_memoizes_by_input(monkeypatch, pool):
+    calls = []
+
+    def fake_portfolio_pie(assets):
+        calls.append(list(assets))
+        return io.BytesIO(repr(assets).encode())
+
+    monkeypatch.setattr(chart_pool.settings, "CHART_WORKERS", 0)
+    monkeypatch.setattr(analytics, "generate_portfolio_pie", fake_portfolio_pie)
+
+    async def scenario():
+        a = await pool.run_in_chart_pool("generate_portfolio_pie", [{"name": "BTC", "value": 1}])
+        a.read()
+        b = await pool.run_in_chart_pool("generate_portfolio_pie", [{"name": "BTC", "value": 1}])
+        c = await pool.run_in_chart_pool("generate_portfolio_pie", [{"name": "ETH", "value": 1}])
+        return a, b, c
+
+    a, b, c = asyncio.run(scenario())
+    # Every hit gets its own buffer, so a consumed one does not leak into the next
+    assert b is not a and b.read() == a.getvalue() != c.getvalue()
+    assert len(calls) == 2
+
+
+def test_broken_pool_is_shut_down_before_it_is_replaced(monkeypatch, pool):
+    class BrokenExecutor:
+        shutdowns = []
+
+        def submit(self, *args, **kwargs):
+            raise BrokenProcessPool("worker died")
+
+        def shutdown(self, wait=True, cancel_futures=False):
+            self.shutdowns.append((wait, cancel_futures))
+
+    broken = BrokenExecutor()
+    monkeypatch.setattr(chart_pool, "_executor", broken)
+    monkeypatch.setattr(analytics, "generate_portfolio_pie", lambda assets: io.BytesIO(b"pie"))
+
+    buf = asyncio.run(pool.run_in_chart_pool("generate_portfolio_pie", []))
+    assert buf.getvalue() == b"pie"
+    assert broken.shutdowns == [(False, True)]
+    assert chart_pool._executor is None
+
+
+def test_liquidity_data_is_not_a_pool_function(pool):
+    with pytest.raises(ValueError):
+        asyncio.run(pool.run_in_chart_pool("prepare_liquidity_data", [], []))
+
+
+def test_unknown_function_rejected(pool):
+    with pytest.raises(ValueError):
+        asyncio.run(pool.run_in_chart_pool("calculate_trade_stats", []))
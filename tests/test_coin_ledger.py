@@ -0,0 +1,183 @@
+import asyncio
+import datetime
+import random
+
+import pytest
+
+import bot.scheduler as scheduler
+from bot.database import Database
+from bot.services import (
+    LEDGER_DAYS_KEEP,
+    apply_fill_to_ledger,
+    calc_avg_entry_from_fills,
+    ledger_avg_entry,
+    new_ledger_position,
+    replay_fills,
+)
+from conftest import FakeCollection
+
+DAY_MS = 86_400_000
+WALLET = "0xabc"
+
+
+def _fill(oid, side, sz, px, t, coin="HYPE", user=WALLET):
+    return {"oid": oid, "user": user, "coin": coin, "side": side, "sz": str(sz), "px": str(px), "time": t}
+
+
+def _reference(fills):
+    """Moving-average cost replay the ledger has to reproduce."""
+    qty = cost = realized = 0.0
+    for f in sorted(fills, key=lambda x: x["time"]):
+        sz, px = float(f["sz"]), float(f["px"])
+        if f["side"] == "B":
+            qty += sz
+            cost += sz * px
+        elif qty > 0:
+            sell = min(sz, qty)
+            avg = cost / qty
+            realized += sell * (px - avg)
+            qty -= sell
+            cost -= avg * sell
+    return qty, cost, realized
+
+
+def test_replay_matches_moving_average_reference():
+    rng = random.Random(3)
+    fills = [_fill(i, rng.choice("BBA"), rng.uniform(0.1, 5), rng.uniform(10, 20), rng.randint(0, 10 * DAY_MS)) for i in range(300)]
+    qty, cost, realized = _reference(fills)
+    pos = replay_fills(fills)
+    assert pos["qty"] == pytest.approx(qty)
+    assert pos["realized_pnl"] == pytest.approx(realized)
+    assert sum(d["realized"] for d in pos["days"].values()) == pytest.approx(realized)
+    assert calc_avg_entry_from_fills(fills) == pytest.approx(cost / qty if qty > 0 else 0.0)
+
+
+def test_apply_fill_tracks_realized_and_prunes_days():
+    pos = new_ledger_position()
+    apply_fill_to_ledger(pos, _fill(1, "B", 2, 10, 0))
+    apply_fill_to_ledger(pos, _fill(2, "B", 2, 20, 1))
+    assert ledger_avg_entry(pos) == 15
+    assert apply_fill_to_ledger(pos, _fill(3, "A", 1, 25, 2)) == 10
+    # Selling more than is held only realizes the held part
+    assert apply_fill_to_ledger(pos, _fill(4, "A", 10, 5, 3)) == -30
+    assert pos["qty"] == 0 and ledger_avg_entry(pos) == 0.0
+
+    for day in range(LEDGER_DAYS_KEEP + 10):
+        apply_fill_to_ledger(pos, _fill(10 + day, "B", 1, 1, day * DAY_MS))
+    assert len(pos["days"]) == LEDGER_DAYS_KEEP
+
+
+@pytest.fixture
+def ledger_db():
+    database = Database("mongodb://localhost:1", "test")
+    database.fills = FakeCollection()
+    database.coin_ledgers = FakeCollection()
+    database.fill_archives = FakeCollection()
+    database.migrations = FakeCollection()
+    return database
+
+
+def test_save_fill_updates_ledger_incrementally(ledger_db):
+    async def scenario():
+        await ledger_db.save_fill(_fill(1, "B", 2, 10, 1000))
+        await ledger_db.save_fill(_fill(2, "B", 2, 20, 2000))
+        await ledger_db.save_fill(_fill(2, "B", 2, 20, 2000))  # replayed snapshot fill
+        await ledger_db.save_fill(_fill(3, "A", 1, 25, 3000))
+        return await ledger_db.get_coin_ledger(WALLET, "HYPE")
+
+    doc = asyncio.run(scenario())
+    assert doc["fills"] == 3
+    assert doc["qty"] == 3
+    assert doc["realized_pnl"] == 10
+    assert asyncio.run(ledger_db.get_avg_entry(WALLET, "HYPE")) == 15
+
+
+def test_out_of_order_fill_triggers_replay(ledger_db):
+    async def scenario():
+        await ledger_db.save_fill(_fill(1, "B", 1, 10, 1000))
+        await ledger_db.save_fill(_fill(2, "A", 1, 30, 3000))
+        await ledger_db.save_fill(_fill(3, "B", 1, 20, 2000))  # arrives late
+        return await ledger_db.get_coin_ledger(WALLET, "HYPE")
+
+    doc = asyncio.run(scenario())
+    expected = replay_fills(ledger_db.fills.docs)
+    assert doc["realized_pnl"] == pytest.approx(expected["realized_pnl"]) == 15
+    assert doc["qty"] == pytest.approx(1)
+
+
+def test_wallet_ledgers_backfill_from_existing_fills(ledger_db):
+    ledger_db.fills.docs = [_fill(1, "B", 1, 10, 0), _fill(2, "B", 4, 2, 0, coin="BTC")]
+    docs = asyncio.run(ledger_db.get_wallet_ledgers(WALLET))
+    assert {d["coin"]: d["qty"] for d in docs} == {"BTC": 4, "HYPE": 1}
+    assert len(ledger_db.coin_ledgers.docs) == 2
+
+
+def test_missing_coin_ledgers_are_backfilled_next_to_existing_ones(ledger_db):
+    asyncio.run(ledger_db.save_fill(_fill(1, "B", 1, 10, 0)))
+    # Fills stored before the ledger existed, or written around it
+    ledger_db.fills.docs.append(_fill(2, "B", 4, 2, 0, coin="BTC"))
+    docs = asyncio.run(ledger_db.get_wallet_ledgers(WALLET))
+    assert {d["coin"]: d["qty"] for d in docs} == {"BTC": 4, "HYPE": 1}
+
+
+def test_newest_first_snapshot_replays_each_coin_once(ledger_db, monkeypatch):
+    rebuilds = []
+    rebuild = ledger_db.rebuild_coin_ledger
+
+    async def counting_rebuild(wallet, coin):
+        rebuilds.append(coin)
+        return await rebuild(wallet, coin)
+
+    monkeypatch.setattr(ledger_db, "rebuild_coin_ledger", counting_rebuild)
+
+    async def scenario():
+        await ledger_db.save_fill(_fill(0, "B", 1, 10, 1000))  # live fill seen first
+        rebuilds.clear()
+        snapshot = [_fill(i, "B" if i % 3 else "A", 1, 10 + i, 1000 - i, coin="BTC" if i % 2 else "HYPE") for i in range(1, 41)]
+        assert await ledger_db.save_fills(snapshot) == 40
+
+    asyncio.run(scenario())
+    # One replay per coin, not one per out-of-order fill
+    assert sorted(rebuilds) == ["BTC", "HYPE"]
+    ledgers = {d["coin"]: d for d in ledger_db.coin_ledgers.docs}
+    for coin, doc in ledgers.items():
+        expected = replay_fills([f for f in ledger_db.fills.docs if f["coin"] == coin])
+        assert doc["qty"] == pytest.approx(expected["qty"])
+        assert doc["cost"] == pytest.approx(expected["cost"])
+
+
+def test_fills_are_stored_with_numeric_amounts(ledger_db):
+    fill = {**_fill(1, "B", "0.5", "12.25", "1700000000000"), "fee": "0.01", "closedPnl": "", "hash": "0x1"}
+    asyncio.run(ledger_db.save_fill(fill))
+    stored = ledger_db.fills.docs[0]
+    assert stored["sz"] == 0.5 and stored["px"] == 12.25 and stored["fee"] == 0.01
+    assert stored["closedPnl"] == 0.0
+    assert stored["time"] == 1700000000000 and stored["hash"] == "0x1"
+    assert fill["sz"] == "0.5"  # caller's dict is left untouched
+
+
+def test_fill_number_migration_runs_once(ledger_db, monkeypatch):
+    scans = []
+
+    async def update_many(flt, update):
+        scans.append(flt)
+        return type("Result", (), {"modified_count": 1})()
+
+    monkeypatch.setattr(ledger_db.fills, "update_many", update_many)
+    assert asyncio.run(ledger_db.migrate_fill_numbers()) == len(scans) > 0
+    runs = len(scans)
+    # Every later start finds the marker and skips the scans
+    assert asyncio.run(ledger_db.migrate_fill_numbers()) == 0
+    assert len(scans) == runs
+
+
+def test_weekly_flow_and_realized_share_one_window():
+    now = datetime.datetime(2026, 3, 10, 15, 30, tzinfo=datetime.timezone.utc)
+    since_day, start_ms, end_ms = scheduler._weekly_window(now)
+    pos = new_ledger_position()
+    for t in range(start_ms - DAY_MS, end_ms, 3_600_000):
+        apply_fill_to_ledger(pos, _fill(t, "B", 1, 1, t))
+    in_buckets = sum(d["bought"] for day, d in pos["days"].items() if day > since_day)
+    in_range = sum(1 for t in range(start_ms - DAY_MS, end_ms, 3_600_000) if start_ms <= t < end_ms)
+    assert in_buckets == in_range
+    assert since_day == "2026-03-03" and end_ms - start_ms == 6 * DAY_MS + int(15.5 * 3_600_000)
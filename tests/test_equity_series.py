@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+import bot.account_state as account_state
+import bot.equity_series as equity_series
+from bot.database import Database
+from bot.equity_series import DAY_MS, HOUR_MS
+from conftest import FakeCollection
+
+WALLET = "0xabc"
+
+
+@pytest.fixture
+def sample_db(monkeypatch):
+    database = Database("mongodb://localhost:1", "test")
+    database.equity_samples = FakeCollection()
+    monkeypatch.setattr(equity_series, "db", database)
+    return database
+
+
+def _fill_series(database, start_ms, end_ms, step_ms, wallet=WALLET):
+    async def fill():
+        for i, ts in enumerate(range(start_ms, end_ms + 1, step_ms)):
+            await database.save_equity_sample(wallet, ts, 1000.0 + i)
+    asyncio.run(fill())
+
+
+def test_compaction_keeps_last_point_per_bucket(sample_db):
+    _fill_series(sample_db, 0, 3 * DAY_MS, 5 * 60_000)
+    raw = {d["ts"]: d["equity"] for d in sample_db.equity_samples.docs}
+    now = 3 * DAY_MS
+
+    async def compact():
+        hourly = await sample_db.compact_equity_samples(WALLET, now - 2 * DAY_MS, HOUR_MS)
+        again = await sample_db.compact_equity_samples(WALLET, now - 2 * DAY_MS, HOUR_MS)
+        daily = await sample_db.compact_equity_samples(WALLET, now - DAY_MS - HOUR_MS // 2, DAY_MS)
+        return hourly, again, daily
+
+    hourly, again, daily = asyncio.run(compact())
+    assert hourly == 24 * 11 and again == 0
+    assert daily == 23
+    docs = sorted(sample_db.equity_samples.docs, key=lambda d: d["ts"])
+    # Day 0 collapsed to its last sample; day 1 is still at 5 minute resolution
+    assert [d["ts"] for d in docs[:2]] == [DAY_MS - 5 * 60_000, DAY_MS]
+    assert docs[0]["res"] == DAY_MS and docs[0]["equity"] == raw[docs[0]["ts"]]
+    assert len([d for d in docs if d["res"] == 0]) == 2 * 24 * 12 + 1
+
+
+def test_equity_changes_read_local_windows(sample_db, monkeypatch):
+    now = 40 * DAY_MS
+    monkeypatch.setattr(equity_series, "_now_ms", lambda: now)
+    _fill_series(sample_db, now - 31 * DAY_MS, now, HOUR_MS)
+
+    current, changes = asyncio.run(equity_series.equity_changes(WALLET, [DAY_MS, 30 * DAY_MS]))
+    assert current == 1000.0 + 31 * 24
+    assert changes == {DAY_MS: 24.0, 30 * DAY_MS: 30 * 24.0}
+
+    series = asyncio.run(equity_series.equity_history(WALLET))
+    assert len(series) == 31 * 24 + 1 and series[0][0] == now - 31 * DAY_MS
+    assert asyncio.run(equity_series.equity_history(WALLET, min_span_ms=60 * DAY_MS)) is None
+
+    # A stale sampler or a missing window falls back to REST (None)
+    assert asyncio.run(equity_series.equity_changes(WALLET, [60 * DAY_MS])) is None
+    monkeypatch.setattr(equity_series, "_now_ms", lambda: now + DAY_MS)
+    assert asyncio.run(equity_series.equity_changes(WALLET, [DAY_MS])) is None
+
+
+def test_equity_as_of_picks_the_nearest_sample_for_its_age(sample_db, monkeypatch):
+    now = 40 * DAY_MS
+    monkeypatch.setattr(equity_series, "_now_ms", lambda: now)
+    for ts, equity in ((now - 7 * DAY_MS, 700.0), (now - 6 * DAY_MS, 800.0), (now - HOUR_MS, 990.0)):
+        asyncio.run(sample_db.save_equity_sample(WALLET, ts, equity))
+
+    as_of = lambda ts: asyncio.run(equity_series.equity_as_of(WALLET, ts))
+    assert as_of(now - 7 * DAY_MS + 3 * HOUR_MS) == 700.0
+    assert as_of(now - int(6.1 * DAY_MS)) == 800.0
+    # A day back the tolerance is two hours, so the hour-old sample is too far
+    assert as_of(now - DAY_MS) is None
+    assert as_of(now - 20 * DAY_MS) is None
+
+
+def test_account_equity_values_perps_and_spot(monkeypatch):
+    perps = {
+        "marginSummary": {"accountValue": "500"},
+        "assetPositions": [{"position": {"coin": "BTC", "unrealizedPnl": "-20"}}],
+    }
+    spot = [{"coin": "USDC", "total": "100"}, {"coin": "HYPE", "total": "10", "entryNtl": "150"}]
+
+    async def fake_perps(wallet, max_age=None):
+        return perps
+
+    async def fake_spot(wallet, max_age=None):
+        return spot
+
+    async def fake_symbol(coin, is_spot=False):
+        return coin
+
+    async def fake_mid(sym, coin=None):
+        return {"USDC": 1.0, "HYPE": 20.0}[sym]
+
+    monkeypatch.setattr(account_state, "get_account_perps_state", fake_perps)
+    monkeypatch.setattr(account_state, "get_account_spot_balances", fake_spot)
+    monkeypatch.setattr(account_state, "get_symbol_name", fake_symbol)
+    monkeypatch.setattr(account_state, "get_mid_price", fake_mid)
+
+    equity, upnl = asyncio.run(account_state.account_equity(WALLET))
+    assert equity == 500 + 100 + 200
+    assert upnl == pytest.approx(-20 + (20 - 15) * 10)
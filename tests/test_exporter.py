@@ -0,0 +1,160 @@
+import asyncio
+import csv
+import gzip
+import os
+
+import pytest
+
+import bot.exporter as exporter
+from bot.exporter import ExportJob, ExportQueue
+
+
+def _fills(n):
+    return [
+        {"time": 1_700_000_000_000 + i * 1000, "coin": "@107" if i % 2 else "BTC", "side": "B" if i % 3 else "A",
+         "px": "10.5", "sz": "2", "fee": "0.01", "closedPnl": "0", "tid": i, "liquidity": "", "dir": ""}
+        for i in range(n)
+    ]
+
+
+def test_fill_rows_resolve_symbols_from_preloaded_map():
+    funding = [{"time": 1_700_000_500_000, "hash": "0xf", "delta": {"coin": "ETH", "fundingRate": "0.0001", "szi": "-1", "amount": "0.5"}}]
+    rows = list(exporter.fill_rows(_fills(3), funding, {"@107": "HYPE/USDC"}))
+    assert [r[1] for r in rows] == ["ETH", "BTC", "HYPE/USDC", "BTC"]
+    assert rows[0][-1] == "Funding" and rows[0][5] == "0.00"
+    assert rows[1][2] == "Buy" and rows[1][5] == "21.00"
+
+
+def test_write_rows_streams_csv_and_gzip_in_chunks(tmp_path):
+    rows = list(exporter.fill_rows(_fills(25), [], {}))
+    plain, packed = tmp_path / "f.csv", tmp_path / "f.csv.gz"
+    assert exporter.write_rows(str(plain), exporter.FILLS_COLUMNS, iter(rows), "csv", chunk_rows=4) == 25
+    assert exporter.write_rows(str(packed), exporter.FILLS_COLUMNS, iter(rows), "gz", chunk_rows=4) == 25
+
+    with open(plain, newline="") as fh:
+        plain_rows = list(csv.reader(fh))
+    with gzip.open(packed, "rt", newline="") as fh:
+        assert list(csv.reader(fh)) == plain_rows
+    assert plain_rows[0][0] == "Time" and len(plain_rows) == 26
+
+
+def test_large_csv_is_compressed_and_parquet_falls_back(monkeypatch):
+    monkeypatch.setattr(exporter.settings, "EXPORT_GZIP_MIN_ROWS", 10)
+    monkeypatch.setattr(exporter, "parquet_available", lambda: False)
+    assert exporter._resolve_format("csv", 5) == "csv"
+    assert exporter._resolve_format("csv", 11) == "gz"
+    assert exporter._resolve_format("parquet", 1) == "gz"
+
+
+def test_parquet_output_when_pyarrow_installed(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = tmp_path / "f.parquet"
+    exporter.write_rows(str(path), exporter.FILLS_COLUMNS, exporter.fill_rows(_fills(9), [], {}), "parquet", chunk_rows=4)
+    table = pq.read_table(path)
+    assert table.num_rows == 9
+    assert table.column("Price").to_pylist()[0] == 10.5
+
+
+class _Status:
+    def __init__(self):
+        self.texts = []
+
+    async def edit_text(self, text):
+        self.texts.append(text)
+
+    async def delete(self):
+        self.texts.append(None)
+
+
+class _Bot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_document(self, chat_id, document, caption=None):
+        assert os.path.exists(document.path)
+        self.sent.append((chat_id, document.filename))
+
+
+def test_queue_runs_jobs_in_background_with_per_user_limit(monkeypatch):
+    monkeypatch.setattr(exporter.settings, "EXPORT_MAX_PER_USER", 1)
+    monkeypatch.setattr(exporter.settings, "EXPORT_WORKERS", 2)
+
+    async def fake_symbols():
+        return {}
+
+    async def fake_build(wallet, workdir, fmt="csv", symbols=None):
+        await asyncio.sleep(0.01)
+        path = os.path.join(workdir, f"{wallet}.{fmt}")
+        with open(path, "w") as fh:
+            fh.write("x")
+        return [(path, os.path.basename(path), wallet)]
+
+    monkeypatch.setattr(exporter, "get_symbol_map", fake_symbols)
+    monkeypatch.setattr(exporter, "build_wallet_export", fake_build)
+
+    async def scenario():
+        queue, bot = ExportQueue(), _Bot()
+        status = _Status()
+        first = await queue.submit(bot, ExportJob(chat_id=1, user_id=1, wallets=["0xa", "0xb"], status_msg=status))
+        second = await queue.submit(bot, ExportJob(chat_id=1, user_id=1, wallets=["0xc"]))
+        other = await queue.submit(bot, ExportJob(chat_id=2, user_id=2, wallets=["0xd"], fmt="gz"))
+        await queue.join()
+        again = queue.has_capacity(1)
+        queue.shutdown()
+        return first, second, other, again, bot.sent, status.texts
+
+    first, second, other, again, sent, texts = asyncio.run(scenario())
+    assert (first, second, other, again) == (True, False, True, True)
+    assert sorted(sent) == [(1, "0xa.csv"), (1, "0xb.csv"), (2, "0xd.gz")]
+    assert texts[-1] is None
+
+
+def test_export_slot_is_reserved_before_billing(monkeypatch):
+    import bot.handlers.export as export_handlers
+
+    monkeypatch.setattr(exporter.settings, "EXPORT_MAX_PER_USER", 1)
+    queue, billed, submitted = ExportQueue(), [], []
+    monkeypatch.setattr(export_handlers, "export_queue", queue)
+
+    async def allowed(*args, **kwargs):
+        return True
+
+    async def consume(target, chat_id, *args, **kwargs):
+        billed.append(chat_id)
+        return chat_id != 3  # chat 3 is out of quota
+
+    async def wallets(chat_id):
+        return [] if chat_id == 2 else ["0xa"]
+
+    async def lang(chat_id):
+        return "en"
+
+    async def submit(bot, job, reserved=False):
+        submitted.append((job.user_id, reserved))
+        return True
+
+    class _Message:
+        def __init__(self, chat_id):
+            self.chat = type("Chat", (), {"id": chat_id})()
+            self.bot, self.answers = None, []
+
+        async def answer(self, text, **kwargs):
+            self.answers.append(text)
+            return _Status()
+
+    monkeypatch.setattr(export_handlers, "_ensure_billing_feature", allowed)
+    monkeypatch.setattr(export_handlers, "_consume_billing_usage", consume)
+    monkeypatch.setattr(export_handlers.db, "list_wallets", wallets)
+    monkeypatch.setattr(export_handlers.db, "get_lang", lang)
+    monkeypatch.setattr(queue, "submit", submit)
+
+    async def scenario():
+        for chat_id in (1, 1, 2, 3):
+            await export_handlers.cmd_export(_Message(chat_id))
+
+    asyncio.run(scenario())
+    # The second export of chat 1 finds the slot taken and is never billed
+    assert billed == [1, 2, 3]
+    assert submitted == [(1, True)]
+    # Slots of exports that were not queued are given back
+    assert not queue.has_capacity(1) and queue.has_capacity(2) and queue.has_capacity(3)
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+import bot.fill_archive as fill_archive
+from bot.database import Database
+from bot.services import replay_fills
+from conftest import FakeCollection
+
+WALLET = "0xabc"
+DAY_MS = 86_400_000
+
+
+def _fill(oid, coin, side, sz, px, ts):
+    return {"oid": oid, "tid": oid * 10, "user": WALLET, "coin": coin, "side": side, "sz": str(sz),
+            "px": str(px), "fee": "0.1", "closedPnl": "0", "time": ts, "crossed": True, "hash": f"0x{oid}"}
+
+
+@pytest.fixture
+def archive_db():
+    database = Database("mongodb://localhost:1", "test")
+    database.fills = FakeCollection()
+    database.coin_ledgers = FakeCollection()
+    database.fill_archives = FakeCollection()
+    return database
+
+
+def test_month_file_round_trips_and_merges(tmp_path):
+    path = str(tmp_path / "w" / "2024-01.npz")
+    first = [{"oid": 1, "coin": "BTC", "sz": 1.5, "px": 100.0, "time": 10, "crossed": True, "builder": None},
+             {"oid": 2, "coin": "@107", "sz": 2.0, "px": 5.0, "time": 20, "feeToken": "USDC"}]
+    stats = fill_archive.write_month(path, first)
+    assert stats == {"rows": 2, "min_time": 10, "max_time": 20, "coins": ["@107", "BTC"]}
+    assert fill_archive.read_month(path) == first
+
+    stats = fill_archive.write_month(path, [{"oid": 2, "coin": "@107", "sz": 3.0, "px": 5.0, "time": 20},
+                                            {"oid": 3, "coin": "ETH", "sz": 1.0, "px": 9.0, "time": 5}])
+    rows = fill_archive.read_month(path)
+    assert stats["rows"] == 3 and [r["oid"] for r in rows] == [3, 1, 2]
+    assert rows[2] == {"oid": 2, "coin": "@107", "sz": 3.0, "px": 5.0, "time": 20}
+
+
+def test_archived_fills_read_through_both_tiers(archive_db, tmp_path):
+    fills = [_fill(i, "BTC" if i % 3 else "HYPE", "B" if i % 4 else "A", 1 + i % 5, 10 + i, i * 5 * DAY_MS) for i in range(40)]
+    cutoff = 100 * DAY_MS
+
+    async def scenario():
+        for f in fills:
+            await archive_db.save_fill(f)
+        before = await archive_db.get_coin_ledger(WALLET, "BTC")
+        moved = await archive_db.archive_wallet_fills(WALLET, cutoff, str(tmp_path))
+        await archive_db.save_fill(fills[3])  # replayed fill that now lives in the archive
+        after = await archive_db.rebuild_coin_ledger(WALLET, "BTC")
+        window = await archive_db.get_fills_range(WALLET, 90 * DAY_MS // 1000, 110 * DAY_MS // 1000)
+        older = await archive_db.get_fills_before(WALLET, 50 * DAY_MS // 1000)
+        return before, moved, after, window, older
+
+    before, moved, after, window, older = asyncio.run(scenario())
+    assert moved == 20 and len(archive_db.fills.docs) == 20
+    assert {m["month"] for m in archive_db.fill_archives.docs} == {"1970-01", "1970-02", "1970-03", "1970-04"}
+    assert (tmp_path / WALLET / "1970-01.npz").exists()
+
+    assert after["qty"] == pytest.approx(before["qty"]) and after["fills"] == before["fills"]
+    assert after["realized_pnl"] == pytest.approx(before["realized_pnl"])
+    assert after["realized_pnl"] == pytest.approx(replay_fills([f for f in fills if f["coin"] == "BTC"])["realized_pnl"])
+    assert [f["oid"] for f in sorted(window, key=lambda f: f["time"])] == [18, 19, 20, 21]
+    assert sorted(f["oid"] for f in older) == list(range(10))
+
+
+def test_missing_archive_file_is_an_error(archive_db, tmp_path, caplog):
+    assert fill_archive.read_month(str(tmp_path / "none.npz"), missing_ok=True) == []
+    with pytest.raises(FileNotFoundError):
+        fill_archive.read_month(str(tmp_path / "none.npz"))
+
+    # Manifest written by a replica whose FILL_ARCHIVE_DIR this one cannot see
+    archive_db.fill_archives.docs.append({"wallet": WALLET, "month": "1970-01", "path": str(tmp_path / "elsewhere.npz"),
+                                          "min_time": 0, "max_time": DAY_MS, "coins": ["BTC"]})
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(archive_db.rebuild_coin_ledger(WALLET, "BTC"))
+    assert "missing" in caplog.text and not archive_db.coin_ledgers.docs
+
+
+def test_archiving_needs_shared_storage_with_leases(monkeypatch):
+    import bot.scheduler as scheduler
+
+    scans = []
+
+    async def wallets(before_ms):
+        scans.append(before_ms)
+        return []
+
+    monkeypatch.setattr(scheduler.db, "list_wallets_with_fills_before", wallets)
+    monkeypatch.setattr(scheduler.settings, "LEASES_ENABLED", True)
+    monkeypatch.setattr(scheduler.settings, "FILL_ARCHIVE_SHARED", False)
+    asyncio.run(scheduler.archive_old_fills())
+    assert scans == []
+    monkeypatch.setattr(scheduler.settings, "FILL_ARCHIVE_SHARED", True)
+    asyncio.run(scheduler.archive_old_fills())
+    assert len(scans) == 1
@@ -0,0 +1,175 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import bot.ws_manager as ws_manager
+from bot.fill_cursors import FillCursor
+from bot.ws_manager import WSManager
+
+WALLET = "0xabc"
+
+
+def _fill(tid, ts, sz=1.0):
+    return {"coin": "BTC", "side": "B", "px": "100", "sz": str(sz), "time": ts, "tid": tid, "oid": tid, "hash": f"h{tid}"}
+
+
+class FakeDb:
+    def __init__(self):
+        self.cursors = {}
+        self.saved = []
+        self.cursor_writes = 0
+
+    async def get_fill_cursor(self, wallet):
+        return self.cursors.get(wallet)
+
+    async def set_fill_cursor(self, wallet, cursor):
+        self.cursor_writes += 1
+        self.cursors[wallet] = dict(cursor)
+
+    async def save_fill(self, fill):
+        self.saved.append(fill["tid"])
+
+    async def save_fills(self, fills):
+        for fill in fills:
+            await self.save_fill(fill)
+
+    async def get_users_by_wallet(self, wallet):
+        return [{"chat_id": 1, "threshold": 0.0}]
+
+    async def get_lang(self, chat_id):
+        return "en"
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(text)
+        return None
+
+
+@pytest.fixture
+def rest():
+    """Fills the REST history holds (tid -> time) and the page number that fails, if any."""
+    return SimpleNamespace(fills={t: 1000 + t for t in range(4, 8)}, fail_page=None)
+
+
+@pytest.fixture
+def fills_env(monkeypatch, rest):
+    fake_db, gap_calls = FakeDb(), []
+
+    async def symbol_name(coin, is_spot=False):
+        return coin
+
+    async def fills_by_time(wallet, start, end=None):
+        gap_calls.append((start, end))
+        if len(gap_calls) == rest.fail_page:
+            return None
+        page = sorted((ts, tid) for tid, ts in rest.fills.items() if start <= ts <= end)
+        return [_fill(tid, ts) for ts, tid in page[:ws_manager.USER_FILLS_PAGE_SIZE]]
+
+    monkeypatch.setattr(ws_manager, "db", fake_db)
+    monkeypatch.setattr(ws_manager, "get_symbol_name", symbol_name)
+    monkeypatch.setattr(ws_manager, "get_user_fills_by_time", fills_by_time)
+    monkeypatch.setattr(ws_manager.settings, "WS_FILL_GAP_ALERT_MAX_AGE_MIN", 10**9)
+    ws = WSManager(bot=FakeBot())
+    ws.all_coins = {"BTC"}
+    return ws, fake_db, gap_calls
+
+
+def _frame(fills, snapshot=False):
+    data = {"user": WALLET, "fills": fills}
+    if snapshot:
+        data["isSnapshot"] = True
+    return data
+
+
+def test_cursor_orders_fills_sharing_a_timestamp():
+    cursor = FillCursor()
+    cursor.advance([_fill(1, 10), _fill(2, 10)])
+    assert cursor.new_fills([_fill(1, 10), _fill(3, 10), _fill(3, 10), _fill(0, 9), _fill(4, 11)]) == [_fill(3, 10), _fill(4, 11)]
+    assert FillCursor.from_doc(cursor.to_doc()) == cursor
+
+
+def test_replayed_snapshots_write_nothing_and_never_realert(fills_env):
+    ws, fake_db, gap_calls = fills_env
+
+    async def scenario():
+        await ws.handle_fills(_frame([_fill(1, 1001), _fill(2, 1002)], snapshot=True))
+        await ws.handle_fills(_frame([_fill(3, 1003)]))
+        writes = (len(fake_db.saved), fake_db.cursor_writes)
+        # Reconnect: the snapshot replays everything already seen
+        await ws.handle_fills(_frame([_fill(1, 1001), _fill(2, 1002), _fill(3, 1003)], snapshot=True))
+        await ws.handle_fills(_frame([_fill(3, 1003)]))
+        return writes
+
+    writes = asyncio.run(scenario())
+    assert (len(fake_db.saved), fake_db.cursor_writes) == writes
+    assert fake_db.saved == [1, 2, 3]
+    assert len(ws.bot.sent) == 1
+    assert gap_calls == []
+
+
+def test_reconnect_processes_only_the_gap(fills_env):
+    ws, fake_db, gap_calls = fills_env
+    fake_db.cursors[WALLET] = FillCursor(1003, {"t3"}).to_doc()  # stored by an earlier run
+
+    async def scenario():
+        # The snapshot starts after the cursor: fills 4..7 were missed, 6..9 are in it
+        await ws.handle_fills(_frame([_fill(t, 1000 + t) for t in range(6, 10)], snapshot=True))
+        await ws.handle_fills(_frame([_fill(t, 1000 + t) for t in range(8, 11)]))
+
+    asyncio.run(scenario())
+    assert gap_calls == [(1003, 1006)]
+    assert fake_db.saved == [4, 5, 6, 7, 8, 9, 10]
+    assert len(ws.bot.sent) == 7
+    assert fake_db.cursors[WALLET]["time"] == 1010
+
+
+def test_gap_is_fetched_page_by_page(fills_env, rest, monkeypatch):
+    ws, fake_db, gap_calls = fills_env
+    monkeypatch.setattr(ws_manager, "USER_FILLS_PAGE_SIZE", 2)
+    rest.fills = {t: 1000 + t for t in range(4, 9)} | {9: 1008}  # 8 and 9 share a timestamp
+    fake_db.cursors[WALLET] = FillCursor(1003, {"t3"}).to_doc()
+
+    asyncio.run(ws.handle_fills(_frame([_fill(t, 1000 + t) for t in range(10, 12)], snapshot=True)))
+    # startTime is inclusive, so each page repeats the newest fills of the last one
+    assert gap_calls == [(1003, 1010), (1005, 1010), (1006, 1010), (1007, 1010), (1008, 1010), (1009, 1010)]
+    assert fake_db.saved == [4, 5, 6, 7, 8, 9, 10, 11]
+    assert len(ws.bot.sent) == 8
+    assert fake_db.cursors[WALLET]["time"] == 1011
+
+
+def test_failed_page_keeps_the_cursor_at_the_contiguous_window(fills_env, rest, monkeypatch):
+    ws, fake_db, gap_calls = fills_env
+    monkeypatch.setattr(ws_manager, "USER_FILLS_PAGE_SIZE", 2)
+    rest.fail_page = 2
+    fake_db.cursors[WALLET] = FillCursor(1003, {"t3"}).to_doc()
+
+    async def scenario():
+        await ws.handle_fills(_frame([_fill(t, 1000 + t) for t in range(8, 10)], snapshot=True))
+        stalled = (list(fake_db.saved), fake_db.cursors[WALLET]["time"])
+        # The next live frame picks the gap up where the first fetch stopped
+        await ws.handle_fills(_frame([_fill(10, 1010)]))
+        return stalled
+
+    stalled = asyncio.run(scenario())
+    assert stalled == ([4, 5], 1005)
+    assert gap_calls[2] == (1005, 1010)
+    assert fake_db.saved == [4, 5, 6, 7, 10]  # 8 and 9 were only in the snapshot frame
+    assert fake_db.cursors[WALLET]["time"] == 1010
+    assert WALLET not in ws._fill_gaps
+
+
+def test_old_gap_fills_are_stored_without_alerts(fills_env, monkeypatch):
+    ws, fake_db, _ = fills_env
+    monkeypatch.setattr(ws_manager.settings, "WS_FILL_GAP_ALERT_MAX_AGE_MIN", 60)
+    now = int(time.time() * 1000)
+    fake_db.cursors[WALLET] = FillCursor(now - 3 * 3600_000, set()).to_doc()
+
+    asyncio.run(ws.handle_fills(_frame([_fill(1, now - 2 * 3600_000), _fill(2, now - 60_000)], snapshot=True)))
+    assert fake_db.saved == [1, 2]
+    assert len(ws.bot.sent) == 1
@@ -0,0 +1,370 @@
+import asyncio
+import collections
+import multiprocessing
+import random
+import threading
+import time
+from multiprocessing.managers import SyncManager
+from types import SimpleNamespace
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+import bot.leases as leases
+import bot.scheduler as scheduler
+from bot.database import Database
+from conftest import FakeCursor, apply_update, match_filter
+
+_DUPLICATE = "duplicate"
+
+
+class SharedStore:
+    """
+    Single-document atomic updates over named collections, like Mongo's, for
+    one or many processes. Synchronous so a manager can serve it to forked
+    replicas; the filter and update semantics are conftest's.
+    """
+
+    def __init__(self):
+        self.collections = {}
+        self.lock = threading.Lock()
+
+    def _find(self, name, flt):
+        return next((d for d in self.collections.setdefault(name, []) if match_filter(d, flt)), None)
+
+    def find_one_and_update(self, name, flt, update, upsert=False):
+        with self.lock:
+            doc = self._find(name, flt)
+            if doc is None:
+                if not upsert:
+                    return None
+                key = {k: v for k, v in flt.items() if not k.startswith("$") and not isinstance(v, dict)}
+                if self._find(name, key) is not None:
+                    # An upsert would insert a second document with the same key
+                    return _DUPLICATE
+                doc = dict(key)
+                self.collections[name].append(doc)
+            apply_update(doc, update)
+            return dict(doc)
+
+    def update_one(self, name, flt, update):
+        with self.lock:
+            doc = self._find(name, flt)
+            if doc is None:
+                return 0
+            apply_update(doc, update)
+            return 1
+
+    def find_one(self, name, flt):
+        with self.lock:
+            doc = self._find(name, flt)
+            return dict(doc) if doc is not None else None
+
+    def find(self, name, flt):
+        with self.lock:
+            return [dict(d) for d in self.collections.get(name, []) if match_filter(d, flt)]
+
+    def insert(self, name, doc):
+        with self.lock:
+            self.collections.setdefault(name, []).append(dict(doc))
+
+
+class _Collection:
+    """Motor-shaped adapter over one collection of a SharedStore (local or a manager proxy)."""
+
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+
+    async def find_one_and_update(self, flt, update, upsert=False, return_document=None):
+        result = self.store.find_one_and_update(self.name, flt, update, upsert)
+        if result == _DUPLICATE:
+            raise DuplicateKeyError("E11000 duplicate key error")
+        return result
+
+    async def update_one(self, flt, update, upsert=False):
+        return SimpleNamespace(matched_count=self.store.update_one(self.name, flt, update))
+
+    async def find_one(self, flt):
+        return self.store.find_one(self.name, flt)
+
+    def find(self, flt=None):
+        return FakeCursor(self.store.find(self.name, flt))
+
+
+class _Manager(SyncManager):
+    pass
+
+
+_Manager.register("SharedStore", SharedStore)
+
+
+def _lease_db(store):
+    database = Database("mongodb://localhost:1", "test")
+    database.job_leases = _Collection(store, "job_leases")
+    database.users = _Collection(store, "users")
+    return database
+
+
+@pytest.fixture
+def lease_db(monkeypatch):
+    database = _lease_db(SharedStore())
+    monkeypatch.setattr(leases, "db", database)
+    monkeypatch.setattr(leases.settings, "LEASES_ENABLED", True)
+    return database
+
+
+def test_lease_grant_extend_release_and_slot(lease_db):
+    async def scenario():
+        a = await lease_db.acquire_lease("job", "a", 1000, now_ms=0)
+        held_by_a = await lease_db.acquire_lease("job", "b", 1000, now_ms=500)
+        extended = await lease_db.acquire_lease("job", "a", 1000, now_ms=600)
+        b = await lease_db.acquire_lease("job", "b", 1000, now_ms=1700)  # a's lease expired
+        stale_renew = await lease_db.renew_lease("job", "a", a["token"], 1000)
+        stale_release = await lease_db.release_lease("job", "a", a["token"], done_slot=1)
+        released = await lease_db.release_lease("job", "b", b["token"], done_slot=1)
+        same_slot = await lease_db.acquire_lease("job", "a", 1000, slot=1, now_ms=1800)
+        next_slot = await lease_db.acquire_lease("job", "a", 1000, slot=2, now_ms=1800)
+        return a, held_by_a, extended, b, stale_renew, stale_release, released, same_slot, next_slot
+
+    a, held_by_a, extended, b, stale_renew, stale_release, released, same_slot, next_slot = asyncio.run(scenario())
+    assert a["token"] == 1 and held_by_a is None
+    assert extended["token"] == 1 and extended["expires_at"] == 1600
+    assert b["owner"] == "b" and b["token"] == 2
+    assert not stale_renew and not stale_release and released
+    assert same_slot is None
+    assert next_slot["token"] == 3
+
+
+def test_superseded_holder_is_cancelled(lease_db):
+    events = []
+
+    async def slow_job():
+        events.append(("start", await leases.lease_is_current()))
+        # Another replica takes over while this one is stalled
+        lease_db.job_leases.store.update_one("job_leases", {"_id": "job"}, {"$set": {"expires_at": 0}})
+        await lease_db.acquire_lease("job", "other", 60_000)
+        events.append(("after takeover", await leases.lease_is_current()))
+        await asyncio.sleep(5)
+        events.append(("finished", True))
+
+    ran = asyncio.run(leases.run_leased("job", slow_job, ttl_sec=0.06, owner="me"))
+    assert ran is False
+    assert events == [("start", True), ("after takeover", False)]
+    assert lease_db.job_leases.store.find_one("job_leases", {"_id": "job"})["owner"] == "other"
+
+
+class FakeBot:
+    def __init__(self, sends=None, label="bot"):
+        self.sends = [] if sends is None else sends
+        self.label = label
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sends.append((self.label, text))
+        return SimpleNamespace(message_id=len(self.sends))
+
+
+def test_fenced_bot_drops_sends_after_takeover(lease_db):
+    bot = FakeBot()
+    fenced = leases.FencedBot(bot)
+    sent = []
+
+    async def job():
+        sent.append(await fenced.send_message(1, "before"))
+        lease_db.job_leases.store.update_one("job_leases", {"_id": "job"}, {"$set": {"expires_at": 0}})
+        await lease_db.acquire_lease("job", "other", 60_000)
+        sent.append(await fenced.send_message(1, "after"))
+
+    asyncio.run(leases.run_leased("job", job, ttl_sec=60, owner="me"))
+    assert bot.sends == [("bot", "before")]
+    assert sent[0].message_id == 1 and sent[1] is None
+    # Outside a lease nothing is fenced
+    asyncio.run(fenced.send_message(1, "direct"))
+    assert bot.sends[-1] == ("bot", "direct")
+
+
+def test_fenced_writes_reject_older_grants(lease_db):
+    lease_db.users.store.insert("users", {"user_id": 1})
+
+    async def scenario():
+        first = await lease_db.save_delta_state(1, {"run": 1}, fence=("delta", 1))
+        newer = await lease_db.save_delta_state(1, {"run": 2}, fence=("delta", 2))
+        stale = await lease_db.save_delta_state(1, {"run": "stale"}, fence=("delta", 1))
+        other_lease = await lease_db.save_delta_state(1, {"run": 3}, fence=("other", 1))
+        return first, newer, stale, other_lease
+
+    assert asyncio.run(scenario()) == (True, True, False, True)
+    doc = lease_db.users.store.find_one("users", {"user_id": 1})
+    assert doc["delta_state"] == {"run": 3} and doc["fences"] == {"delta": 2, "other": 1}
+
+
+def test_health_check_skips_ws_on_standby_replicas(lease_db, monkeypatch, caplog):
+    async def ping(command):
+        return {"ok": 1}
+
+    monkeypatch.setattr(scheduler, "db", SimpleNamespace(client=SimpleNamespace(admin=SimpleNamespace(command=ping))))
+    monkeypatch.setattr(scheduler.settings, "WS_PROCESS_INDEX", 0)
+    bot = SimpleNamespace(ws_manager=SimpleNamespace(running=False))
+
+    asyncio.run(scheduler.health_check(bot))
+    assert not [r for r in caplog.records if r.levelname == "CRITICAL"]
+
+    monkeypatch.setitem(leases._held, "ws:p0", leases.Lease("ws:p0", "me", 1))
+    asyncio.run(scheduler.health_check(bot))
+    assert [r.getMessage() for r in caplog.records if r.levelname == "CRITICAL"] == ["Health Check: WS Manager NOT RUNNING"]
+
+
+def test_sticky_service_runs_on_one_replica_and_fails_over(lease_db, monkeypatch):
+    monkeypatch.setattr(leases.settings, "LEASE_TTL_SEC", 0.06)
+    started = []
+
+    async def service(owner):
+        started.append(owner)
+        await asyncio.sleep(10)  # polling / WS manager
+
+    def replica(owner):
+        return asyncio.create_task(leases.hold_sticky("ws:p0", lambda: service(owner), retry_sec=0.02, owner=owner))
+
+    async def scenario():
+        a, b = replica("a"), replica("b")
+        await asyncio.sleep(0.2)
+        first = list(started)
+        a.cancel()  # replica a dies without releasing its lease
+        await asyncio.sleep(0.3)
+        b.cancel()
+        return first
+
+    first = asyncio.run(scenario())
+    assert first == ["a"]
+    assert started == ["a", "b"]
+
+
+def test_partitions_spread_over_replicas(lease_db, monkeypatch):
+    monkeypatch.setattr(leases.settings, "LEASE_PARTITIONS", 4)
+    seen = []
+
+    async def work(part):
+        await asyncio.sleep(0.01)
+        seen.extend(part)
+
+    async def scenario():
+        return await asyncio.gather(*(
+            leases.run_partitioned("sample", list(range(40)), work, 3600, key=str, owner=owner)
+            for owner in ("r1", "r2", "r3")
+        ))
+
+    done = asyncio.run(scenario())
+    assert sorted(seen) == list(range(40))
+    assert sum(done) == 40
+    assert sum(1 for n in done if n) >= 2
+
+
+def _replica(store, sends, stop_at):
+    """One bot replica: fires the leased job every ~50ms (like jittered APScheduler triggers on each replica)."""
+    leases.db = _lease_db(store)
+    leases.settings.LEASES_ENABLED = True
+    leases.settings.LEASE_TTL_SEC = 5
+
+    async def send_digests(bot):
+        slot = leases._current_lease.get().slot
+        await asyncio.sleep(random.uniform(0, 0.03))
+        sends.append((slot, leases.replica_id()))
+
+    job = leases.leased_job(send_digests, 1)
+
+    async def loop():
+        while time.time() < stop_at:
+            await job(None)
+            await asyncio.sleep(random.uniform(0.02, 0.08))
+
+    asyncio.run(loop())
+
+
+def test_replicas_in_separate_processes_send_once_per_interval():
+    ctx = multiprocessing.get_context("fork")
+    with _Manager(ctx=ctx) as manager:
+        store, sends = manager.SharedStore(), manager.list()
+        stop_at = time.time() + 3.5
+        procs = [ctx.Process(target=_replica, args=(store, sends, stop_at)) for _ in range(4)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join(30)
+        assert all(p.exitcode == 0 for p in procs)
+        sends = list(sends)
+
+    per_slot = collections.Counter(slot for slot, _ in sends)
+    assert len(per_slot) >= 3
+    assert set(per_slot.values()) == {1}, per_slot
+    # Consecutive intervals have no gaps
+    assert sorted(per_slot) == list(range(min(per_slot), max(per_slot) + 1))
+
+
+def _delta_replica(store, sends, label, start_at, stall_in, stall_sec):
+    """
+    One replica running the real delta-neutral job once at `start_at`. With
+    `stall_in` set it blocks its event loop there (a GC pause, a stuck call)
+    for `stall_sec`, well past the lease TTL, so its renewals stop too.
+    """
+    database = _lease_db(store)
+    leases.db = scheduler.db = database
+    leases.settings.LEASES_ENABLED = True
+    leases.settings.LEASE_TTL_SEC = 0.3
+
+    def stall(step):
+        if step == stall_in:
+            time.sleep(stall_sec)
+
+    async def wallet_pairs():
+        return [(1, "0xa")]
+
+    async def market_state():
+        return None
+
+    async def snapshot(wallets, ws=None, market_state=None):
+        stall("snapshot")
+        return {}
+
+    def monitor(snapshot, previous_state, now_ts, interval_hours, emit_alerts):
+        return ["alert"], {"runs": previous_state.get("runs", 0) + 1, "by": label}
+
+    def digest(alerts, lang="en"):
+        stall("send")
+        return f"alert from {label}"
+
+    scheduler._get_user_wallet_pairs = wallet_pairs
+    scheduler.get_market_state = market_state
+    scheduler.collect_delta_neutral_snapshot = snapshot
+    scheduler.apply_delta_monitoring = monitor
+    scheduler.format_alert_digest = digest
+
+    job = leases.leased_job(scheduler.run_delta_neutral_alerts, 3600)
+    time.sleep(max(0.0, start_at - time.time()))
+    asyncio.run(job(FakeBot(sends, label)))
+
+
+@pytest.mark.parametrize("stall_in", ["snapshot", "send"])
+def test_holder_stalled_past_its_ttl_neither_writes_nor_sends(stall_in):
+    ctx = multiprocessing.get_context("fork")
+    with _Manager(ctx=ctx) as manager:
+        store, sends = manager.SharedStore(), manager.list()
+        store.insert("users", {"user_id": 1, "lang": "en"})
+        t0 = time.time() + 0.5
+        # "a" takes the lease and stalls; "b" finds it expired and takes over before "a" wakes up
+        procs = [
+            ctx.Process(target=_delta_replica, args=(store, sends, "a", t0, stall_in, 1.5)),
+            ctx.Process(target=_delta_replica, args=(store, sends, "b", t0 + 0.7, None, 0)),
+        ]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join(30)
+        assert all(p.exitcode == 0 for p in procs)
+        sends = list(sends)
+        user = store.find_one("users", {"user_id": 1})
+        lease = store.find_one("job_leases", {"_id": "run_delta_neutral_alerts"})
+
+    assert sends == [("b", "alert from b")]
+    assert user["delta_state"]["by"] == "b" and user["fences"]["run_delta_neutral_alerts"] == lease["token"] == 2
+    # Stalled before its write, "a" never stored state; stalled after it, "b" built on it
+    assert user["delta_state"]["runs"] == (1 if stall_in == "snapshot" else 2)
@@ -0,0 +1,93 @@
+import asyncio
+import io
+
+import pytest
+
+import bot.market_state as market_state
+import bot.scheduler as scheduler
+from bot.market_state import MarketState
+
+
+def _ctx(btc_mark="100000", eth_funding="0.0000125"):
+    universe = [{"name": "BTC"}, {"name": "ETH"}]
+    asset_ctxs = [
+        {"markPx": btc_mark, "prevDayPx": "99000", "funding": "0.00001", "dayNtlVlm": "1500000000", "openInterest": "12000"},
+        {"markPx": "3000", "prevDayPx": "3100", "funding": eth_funding, "dayNtlVlm": "800000000", "openInterest": "250000"},
+    ]
+    return [{"universe": universe}, asset_ctxs]
+
+
+@pytest.fixture
+def market(monkeypatch):
+    state = {"ctx": _ctx(), "renders": 0}
+
+    async def fake_get_perps_context():
+        return state["ctx"]
+
+    async def fake_get_hlp_info():
+        return None
+
+    async def fake_render_bundle(jobs, width=800, height=800, lang="ru", profile="png"):
+        state["renders"] += 1
+        return {name: io.BytesIO(f"{template}:{state['renders']}".encode()) for name, (template, _) in jobs.items()}
+
+    monkeypatch.setattr(market_state, "get_perps_context", fake_get_perps_context)
+    monkeypatch.setattr(market_state, "_state", None)
+    monkeypatch.setattr(market_state, "_state_lock", asyncio.Lock())
+    monkeypatch.setattr(scheduler.settings, "MARKET_STATE_TTL_SEC", 0)
+    monkeypatch.setattr(scheduler, "get_hlp_info", fake_get_hlp_info)
+    monkeypatch.setattr(scheduler, "render_bundle", fake_render_bundle)
+    monkeypatch.setattr(scheduler, "_market_images_cache", {})
+    monkeypatch.setattr(scheduler, "_market_images_ts", 0)
+    monkeypatch.setattr(scheduler, "_market_images_lock", asyncio.Lock())
+    return state
+
+
+def _version(ctx):
+    return scheduler._market_images_version(MarketState.from_context(ctx))
+
+
+def test_version_ignores_sub_display_ticks():
+    base = _version(_ctx())
+    assert _version(_ctx(btc_mark="100001")) == base
+    assert _version(_ctx(btc_mark="103000")) != base
+    assert _version(_ctx(eth_funding="0.0001")) != base
+
+
+def test_refresh_renders_only_on_new_version(market):
+    asyncio.run(scheduler.refresh_market_images(None))
+    first = scheduler._market_images_cache
+    assert market["renders"] == 1
+    assert first["img_alpha"] == b"market_stats.html:1"
+
+    market["ctx"] = _ctx(btc_mark="100001")
+    asyncio.run(scheduler.refresh_market_images(None))
+    assert market["renders"] == 1
+    assert scheduler._market_images_cache is first
+
+    market["ctx"] = _ctx(btc_mark="103000")
+    asyncio.run(scheduler.refresh_market_images(None))
+    assert market["renders"] == 2
+    swapped = scheduler._market_images_cache
+    assert swapped is not first
+    assert swapped["img_alpha"] == b"market_stats.html:2"
+    assert swapped["version"] != first["version"]
+    # The previous set is left intact for readers still holding it
+    assert first["img_alpha"] == b"market_stats.html:1"
+
+
+def test_refresh_rerenders_after_max_age(market, monkeypatch):
+    asyncio.run(scheduler.refresh_market_images(None))
+    monkeypatch.setattr(scheduler, "_market_images_ts", scheduler._market_images_ts - scheduler.settings.MARKET_IMAGES_MAX_AGE_SEC - 1)
+    asyncio.run(scheduler.refresh_market_images(None))
+    assert market["renders"] == 2
+
+
+def test_get_market_images_serves_warm_cache(market):
+    cold = asyncio.run(scheduler._get_market_images())
+    assert market["renders"] == 1
+
+    market["ctx"] = _ctx(btc_mark="103000")
+    warm = asyncio.run(scheduler._get_market_images())
+    assert warm is cold
+    assert market["renders"] == 1
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+import bot.market_state as market_state
+from bot.market_state import MarketState
+
+
+def _raw():
+    universe = [{"name": "BTC"}, {"name": "ETH"}, {"name": "kPEPE"}]
+    asset_ctxs = [
+        {"markPx": "100000", "oraclePx": "99900", "prevDayPx": "95000", "funding": "0.00001", "dayNtlVlm": "2000000000", "openInterest": "10000", "impactPxs": ["99990", "100010"]},
+        {"markPx": "3000", "prevDayPx": "0", "funding": "-0.00002", "dayNtlVlm": "900000000", "openInterest": "300000"},
+        {"markPx": "0.01", "prevDayPx": "0.0125", "funding": "bad", "dayNtlVlm": "5000000", "openInterest": "1e9"},
+    ]
+    return universe, asset_ctxs
+
+
+def _ctx():
+    universe, asset_ctxs = _raw()
+    return [{"universe": universe}, asset_ctxs]
+
+
+def test_from_context_accepts_both_response_shapes():
+    universe, asset_ctxs = _raw()
+    as_list = MarketState.from_context([{"universe": universe}, asset_ctxs])
+    as_dict = MarketState.from_context({"universe": universe, "assetCtxs": asset_ctxs})
+    assert as_list.names == as_dict.names == ("BTC", "ETH", "kPEPE")
+    assert MarketState.from_context(None) is None
+    assert MarketState.from_context([{"universe": []}, []]) is None
+
+
+def test_columns_and_lookup():
+    state = MarketState.from_context(_ctx())
+    btc = state.get("BTC")
+    assert btc["mark"] == 100000
+    assert btc["oi_usd"] == 100000 * 10000
+    assert btc["funding_apr"] == pytest.approx(0.00001 * 24 * 365 * 100)
+    assert btc["change_24h"] == pytest.approx((100000 - 95000) / 95000 * 100)
+    assert btc["premium"] == pytest.approx((100000 - 99900) / 99900 * 100)
+
+    # Missing previous-day and oracle prices fall back to mark
+    eth = state.get("ETH")
+    assert eth["change_24h"] == 0.0
+    assert eth["premium"] == 0.0
+
+    # Unparseable numbers become zero; lookups fall back to case-insensitive
+    assert state.get("KPEPE")["funding"] == 0.0
+    assert state.get("KPEPE")["change_24h"] == pytest.approx(-20.0)
+    assert state.get("DOGE") is None
+    assert "BTC" in state and len(state) == 3
+    assert [state.names[i] for i in state.top("volume", 2)] == ["BTC", "ETH"]
+
+
+def test_shared_state_is_fetched_once_and_versioned(monkeypatch):
+    calls = []
+
+    async def fake_get_perps_context():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return _ctx()
+
+    monkeypatch.setattr(market_state, "get_perps_context", fake_get_perps_context)
+    monkeypatch.setattr(market_state, "_state", None)
+    monkeypatch.setattr(market_state, "_state_lock", asyncio.Lock())
+
+    async def scenario():
+        states = await asyncio.gather(*(market_state.get_market_state(max_age=60) for _ in range(5)))
+        refreshed = await market_state.get_market_state(max_age=0)
+        return states, refreshed
+
+    states, refreshed = asyncio.run(scenario())
+    assert len(calls) == 2
+    assert all(s is states[0] for s in states)
+    assert states[0].version == 1
+    assert refreshed.version == 2
+
+
+def test_failed_refresh_keeps_previous_state(monkeypatch):
+    previous = MarketState.from_context(_ctx(), version=7, fetched_at=0)
+
+    async def failing_get_perps_context():
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(market_state, "get_perps_context", failing_get_perps_context)
+    monkeypatch.setattr(market_state, "_state", previous)
+    monkeypatch.setattr(market_state, "_state_lock", asyncio.Lock())
+
+    assert asyncio.run(market_state.get_market_state()) is previous
+
+
+def test_metrics_and_stable_ranks():
+    state = MarketState.from_context(_ctx())
+    m = state.metrics
+    assert m.slippage[0] == pytest.approx(0.01)
+    assert m.slippage[1] == m.slippage[2] == 99.9
+    assert m.total_oi == pytest.approx(float(state.oi_usd.sum()))
+    assert state.metrics is m
+
+    # ETH and kPEPE tie on slippage and keep universe order in both directions
+    assert [state.names[i] for i in state.rank("slippage")] == ["ETH", "kPEPE", "BTC"]
+    assert [state.names[i] for i in state.rank("slippage", descending=False)] == ["BTC", "ETH", "kPEPE"]
+    assert state.rank("volume") is state.rank("volume")
@@ -0,0 +1,27 @@
+import importlib.util
+import os
+
+_BENCH_PATH = os.path.join(os.path.dirname(__file__), "..", "scripts", "bench_market_tables.py")
+_spec = importlib.util.spec_from_file_location("bench_market_tables", _BENCH_PATH)
+bench_market_tables = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(bench_market_tables)
+
+
+def test_bench_reports_every_case():
+    rows = bench_market_tables.bench(220, iterations=2)
+    cases = [r["case"] for r in rows]
+    assert "all tables, shared snapshot" in cases
+    assert "all tables, re-parse per builder" in cases
+    assert all(f"{name} (warm state)" in cases for name in bench_market_tables.BUILDERS)
+    assert all(r["assets"] == 220 and r["p95_ms"] >= 0 for r in rows)
+
+
+def test_builders_agree_on_shared_and_raw_input():
+    universe, ctxs = bench_market_tables.synthetic_market(220)
+    state = bench_market_tables.MarketState.from_context([{"universe": universe}, ctxs])
+    for builder in bench_market_tables.BUILDERS.values():
+        shared, raw = builder(state), builder(ctxs, universe)
+        if isinstance(shared, dict):
+            shared.pop("date")
+            raw.pop("date")
+        assert shared == raw
@@ -0,0 +1,20 @@
+from bot.services import history_value_at, portfolio_window
+
+
+def test_history_value_at_bisects_with_tolerance():
+    points = [[0, 1.0], [10, 2.0], [20, 3.0], [40, 4.0]]
+    assert history_value_at(points, 12) == [10, 2.0]
+    assert history_value_at(points, 15) == [10, 2.0]  # ties keep the earlier point
+    assert history_value_at(points, 33) == [40, 4.0]
+    assert history_value_at(points, -100) == [0, 1.0]
+    assert history_value_at(points, 30, tolerance_ms=5) is None
+    assert history_value_at([], 5) is None
+
+
+def test_portfolio_window_handles_both_shapes():
+    listed = [["day", {"accountValueHistory": [[1, "5"]]}], ["allTime", {"pnlHistory": [[1, "2"]]}]]
+    assert portfolio_window(listed, "allTime") == {"pnlHistory": [[1, "2"]]}
+    assert portfolio_window(listed, "week") == {"accountValueHistory": [[1, "5"]]}
+    assert portfolio_window({"data": {"x": 1}}) == {"x": 1}
+    assert portfolio_window(None) == {}
+
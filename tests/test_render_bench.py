@@ -0,0 +1,31 @@
+import importlib.util
+import os
+
+from bot.renderer import TEMPLATE_DIR, render_template_html
+
+_BENCH_PATH = os.path.join(os.path.dirname(__file__), "..", "scripts", "bench_render.py")
+_spec = importlib.util.spec_from_file_location("bench_render", _BENCH_PATH)
+bench_render = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(bench_render)
+
+
+def test_bench_covers_every_template():
+    on_disk = {name for name in os.listdir(TEMPLATE_DIR) if name.endswith(".html")}
+    assert set(bench_render.TEMPLATES) == on_disk
+
+
+def test_fixtures_render_through_jinja_at_every_size():
+    for size in bench_render.SIZES:
+        fixtures = bench_render.build_fixtures(size)
+        assert set(fixtures) == set(bench_render.TEMPLATES)
+        for template, data in fixtures.items():
+            html = render_template_html(template, dict(data), lang="en")
+            assert "<html" in html.lower(), template
+
+
+def test_percentile_nearest_rank():
+    values = [float(v) for v in range(1, 101)]
+    assert bench_render.percentile(values, 50) == 50.0
+    assert bench_render.percentile(values, 95) == 95.0
+    assert bench_render.percentile(values, 99) == 99.0
+    assert bench_render.percentile([], 50) == 0.0
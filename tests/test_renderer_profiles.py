@@ -0,0 +1,76 @@
+import asyncio
+import io
+import time
+
+import pytest
+from PIL import Image
+
+import bot.renderer as renderer
+from bot.renderer import OUTPUT_PROFILES, _encode_image, get_output_profile, image_filename
+
+
+def _png_bytes() -> bytes:
+    img = Image.new("RGB", (64, 32))
+    for x in range(64):
+        for y in range(32):
+            img.putpixel((x, y), (x * 4, y * 8, 128))
+    out = io.BytesIO()
+    img.save(out, format="PNG")
+    return out.getvalue()
+
+
+def test_webp_profile_reencodes_screenshot():
+    data = _encode_image(_png_bytes(), OUTPUT_PROFILES["webp"])
+    assert data[:4] == b"RIFF" and data[8:12] == b"WEBP"
+    assert Image.open(io.BytesIO(data)).size == (64, 32)
+
+
+def test_png8_profile_produces_palette_png():
+    data = _encode_image(_png_bytes(), OUTPUT_PROFILES["png8"])
+    img = Image.open(io.BytesIO(data))
+    assert img.format == "PNG"
+    assert img.mode == "P"
+
+
+def test_lossless_png_is_passed_through():
+    raw = _png_bytes()
+    assert _encode_image(raw, OUTPUT_PROFILES["png"]) is raw
+
+
+def test_filenames_follow_profile_format():
+    assert image_filename("alpha") == "alpha.png"
+    assert image_filename("alpha", "png8") == "alpha.png"
+    assert image_filename("alpha", "jpeg") == "alpha.jpg"
+    assert image_filename("alpha", "preview") == "alpha.jpg"
+    assert image_filename("alpha", "webp") == "alpha.webp"
+
+
+def test_unknown_profile_rejected():
+    with pytest.raises(ValueError):
+        get_output_profile("gif")
+
+
+def test_render_bundle_runs_jobs_concurrently(monkeypatch):
+    calls = []
+
+    async def fake_render(template_name, data, width=800, height=800, lang="ru", profile="png"):
+        calls.append((template_name, profile))
+        await asyncio.sleep(0.2)
+        return io.BytesIO(template_name.encode())
+
+    monkeypatch.setattr(renderer, "render_html_to_image", fake_render)
+    shared = {"x": 1}
+    start = time.perf_counter()
+    images = asyncio.run(renderer.render_bundle({
+        "a": ("market_stats.html", shared),
+        "b": ("liquidity_stats.html", {}),
+        "c": ("funding_heatmap.html", shared),
+        "d": ("coin_prices.html", {}),
+    }, profile="jpeg"))
+    elapsed = time.perf_counter() - start
+
+    assert list(images) == ["a", "b", "c", "d"]
+    assert images["c"].getvalue() == b"funding_heatmap.html"
+    assert all(profile == "jpeg" for _, profile in calls)
+    assert elapsed < 0.6
+    assert shared == {"x": 1}
@@ -0,0 +1,160 @@
+import asyncio
+import datetime
+
+import pytest
+
+import bot.database as database_module
+import bot.scheduler as scheduler
+from bot.database import Database
+from bot.schedules import (
+    SCHEDULE_DIGEST, SCHEDULE_MARKET_REPORT, SCHEDULE_OVERVIEW, dispatch_offset_ms, next_due, next_due_ms
+)
+from conftest import FakeCollection
+
+UTC = datetime.timezone.utc
+
+
+def _ms(*args):
+    return int(datetime.datetime(*args, tzinfo=UTC).timestamp() * 1000)
+
+
+@pytest.fixture
+def sched_db(monkeypatch):
+    monkeypatch.setattr(database_module.settings, "DISPATCH_WINDOW_SEC", 0)
+    database = Database("mongodb://localhost:1", "test")
+    database.users = FakeCollection()
+    database.schedules = FakeCollection()
+    return database
+
+
+def test_next_due_daily_weekly_and_monthly():
+    after = datetime.datetime(2024, 1, 31, 9, 0, tzinfo=UTC)  # a Wednesday
+    assert next_due({"time": "09:00"}, after) == datetime.datetime(2024, 2, 1, 9, 0, tzinfo=UTC)
+    assert next_due({"time": "09:01"}, after) == datetime.datetime(2024, 1, 31, 9, 1, tzinfo=UTC)
+    assert next_due({"time": "23:59", "day_of_week": "sun"}, after) == datetime.datetime(2024, 2, 4, 23, 59, tzinfo=UTC)
+    # Day 31 skips February
+    assert next_due({"time": "00:20", "day": 31}, after) == datetime.datetime(2024, 3, 31, 0, 20, tzinfo=UTC)
+    assert next_due({"time": "25:00"}, after) is None
+    assert next_due({"time": "09:00", "day_of_week": "xyz"}, after) is None
+
+
+def test_sync_and_claim_only_touch_due_rows(sched_db, caplog):
+    now = _ms(2024, 1, 1, 8, 0)
+    sched_db.users.docs = [
+        {"user_id": 1, "digest_settings": {"portfolio_daily": {"enabled": True, "time": "09:00"}},
+         "market_alert_times": [{"t": "09:00", "r": False}, "12:00"], "overview": {"enabled": False}},
+        {"user_id": 2, "overview": {"enabled": True, "schedules": ["09:00"]}},
+        {"user_id": 3},  # default overview slots
+    ]
+
+    async def scenario():
+        for uid in (1, 2, 3):
+            await sched_db.sync_user_schedules(uid, now_ms=now)
+        rows = {(d["user_id"], d["kind"], d["key"]): d["next_due"] for d in sched_db.schedules.docs}
+
+        at_nine = _ms(2024, 1, 1, 9, 0, 30)
+        early = await sched_db.claim_due_schedules(SCHEDULE_OVERVIEW, now, 60_000)
+        overview = await sched_db.claim_due_schedules(SCHEDULE_OVERVIEW, at_nine, 60_000)
+        again = await sched_db.claim_due_schedules(SCHEDULE_OVERVIEW, at_nine, 60_000)
+        reports = await sched_db.claim_due_schedules(SCHEDULE_MARKET_REPORT, at_nine, 60_000)
+        # Digest slot missed by hours (downtime) is advanced but not sent
+        late = await sched_db.claim_due_schedules(SCHEDULE_DIGEST, _ms(2024, 1, 1, 15, 0), 5 * 60_000)
+        return rows, early, overview, again, reports, late
+
+    rows, early, overview, again, reports, late = asyncio.run(scenario())
+    assert rows == {
+        (1, SCHEDULE_DIGEST, "portfolio_daily"): _ms(2024, 1, 1, 9, 0),
+        (1, SCHEDULE_MARKET_REPORT, "09:00"): _ms(2024, 1, 1, 9, 0),
+        (1, SCHEDULE_MARKET_REPORT, "12:00"): _ms(2024, 1, 1, 12, 0),
+        (2, SCHEDULE_OVERVIEW, "09:00"): _ms(2024, 1, 1, 9, 0),
+        (3, SCHEDULE_OVERVIEW, "06:00"): _ms(2024, 1, 2, 6, 0),
+        (3, SCHEDULE_OVERVIEW, "18:00"): _ms(2024, 1, 1, 18, 0),
+    }
+    assert early == [] and again == []
+    assert [d["user_id"] for d in overview] == [2]
+    assert [(d["user_id"], d["key"], d["repeat"]) for d in reports] == [(1, "09:00", False)]
+    assert f"Dropped 1 {SCHEDULE_DIGEST} slots" in caplog.text
+    assert late == []
+
+    remaining = {(d["user_id"], d["kind"], d["key"]): d["next_due"] for d in sched_db.schedules.docs}
+    assert (1, SCHEDULE_MARKET_REPORT, "09:00") not in remaining  # one-off slot consumed
+    assert remaining[(2, SCHEDULE_OVERVIEW, "09:00")] == _ms(2024, 1, 2, 9, 0)
+    assert remaining[(1, SCHEDULE_DIGEST, "portfolio_daily")] == _ms(2024, 1, 2, 9, 0)
+
+
+def test_sync_keeps_unchanged_rows_and_drops_disabled(sched_db):
+    now = _ms(2024, 1, 1, 8, 0)
+    sched_db.users.docs = [{"user_id": 1, "overview": {"enabled": True, "schedules": ["09:00", "10:00"]}}]
+
+    async def scenario():
+        await sched_db.sync_user_schedules(1, now_ms=now)
+        sched_db.schedules.docs[0]["next_due"] = 123  # already advanced by a claim
+        sched_db.users.docs[0]["overview"]["schedules"] = ["09:00"]
+        await sched_db.sync_user_schedules(1, now_ms=now)
+        kept = [(d["key"], d["next_due"]) for d in sched_db.schedules.docs]
+        sched_db.users.docs[0]["overview"]["enabled"] = False
+        await sched_db.sync_user_schedules(1, now_ms=now)
+        return kept, list(sched_db.schedules.docs)
+
+    kept, after_disable = asyncio.run(scenario())
+    assert kept == [("09:00", 123)]
+    assert after_disable == []
+    assert next_due_ms({"time": "09:00"}, now) == _ms(2024, 1, 1, 9, 0)
+
+
+def test_offsets_spread_one_slot_across_the_window(sched_db, monkeypatch):
+    monkeypatch.setattr(database_module.settings, "DISPATCH_WINDOW_SEC", 300)
+    now = _ms(2024, 1, 1, 8, 0)
+    nine = _ms(2024, 1, 1, 9, 0)
+    sched_db.users.docs = [{"user_id": uid, "overview": {"enabled": True, "schedules": ["09:00"]}} for uid in range(200)]
+
+    async def scenario():
+        for uid in range(200):
+            await sched_db.sync_user_schedules(uid, now_ms=now)
+        first_minute = await sched_db.claim_due_schedules(SCHEDULE_OVERVIEW, nine + 60_000, 60_000)
+        return first_minute
+
+    first_minute = asyncio.run(scenario())
+    dues = sorted(d["next_due"] for d in sched_db.schedules.docs)
+    assert nine <= dues[0] and dues[-1] < _ms(2024, 1, 2, 9, 5)
+    # About a fifth of the users land in each minute of the five minute window
+    assert 20 <= len(first_minute) <= 60
+    for doc in first_minute:
+        assert doc["next_due"] == nine + doc["offset_ms"]
+    advanced = {d["user_id"]: d["next_due"] for d in sched_db.schedules.docs}
+    for doc in first_minute:
+        assert advanced[doc["user_id"]] == _ms(2024, 1, 2, 9, 0) + doc["offset_ms"]
+
+    assert dispatch_offset_ms(7, SCHEDULE_OVERVIEW, "09:00", 300_000) == dispatch_offset_ms(7, SCHEDULE_OVERVIEW, "09:00", 300_000)
+    assert next_due_ms({"time": "09:00"}, nine + 1_000, 2_000) == nine + 2_000
+
+
+def test_dispatch_pacer_spaces_sends(monkeypatch):
+    monkeypatch.setattr(scheduler.settings, "DISPATCH_SENDS_PER_SEC", 50.0)
+
+    async def scenario():
+        pacer = scheduler._DispatchPacer()
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await asyncio.gather(*(pacer.wait() for _ in range(6)))
+        return loop.time() - start
+
+    assert asyncio.run(scenario()) >= 5 / 50 * 0.9
+
+
+def test_claim_grace_covers_the_longest_paced_run(monkeypatch):
+    monkeypatch.setattr(scheduler.settings, "DISPATCH_SENDS_PER_SEC", 100.0)
+    pacer = scheduler._DispatchPacer()
+    monkeypatch.setattr(scheduler, "_dispatch_pacer", pacer)
+    assert pacer.grace_ms(5) == 5 * 60_000
+
+    @scheduler.paced_dispatch
+    async def dispatch(users):
+        for _ in range(users):
+            await pacer.wait()
+
+    asyncio.run(dispatch(30))
+    assert 0.25 < pacer.recent_runs[-1] < 2
+    # A backlog that takes longer to pace than the configured grace stretches it
+    pacer.recent_runs.append(900.0)
+    assert pacer.grace_ms(5) == 960_000
@@ -0,0 +1,374 @@
+import asyncio
+import collections
+import json
+import time
+
+import pytest
+
+import bot.ws_manager as ws_manager
+import bot.ws_shards as ws_shards
+from bot.ws_manager import WSManager
+from bot.ws_shards import FrameLimiter, Freshness, HashRing, WalletShard, node_name, node_process, watch_freshness
+from conftest import FakeCollection
+
+WALLETS = {f"0x{i:040x}" for i in range(600)}
+
+
+@pytest.fixture(autouse=True)
+def idle_shards(monkeypatch):
+    # Shards keep their wallet sets but never open a connection
+    monkeypatch.setattr(WalletShard, "start", lambda self: None)
+    monkeypatch.setattr(ws_manager.settings, "WS_WALLET_SHARDS", 2)
+    monkeypatch.setattr(ws_manager.settings, "WS_MAX_WALLETS_PER_SHARD", 300)
+    monkeypatch.setattr(ws_manager.settings, "WS_PROCESS_COUNT", 1)
+    monkeypatch.setattr(ws_manager.settings, "WS_PROCESS_INDEX", 0)
+    monkeypatch.setattr(ws_manager.db, "ws_ring", FakeCollection())  # shared by every manager of a test
+
+
+def _manager(process_index=0, process_count=1):
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(ws_manager.settings, "WS_PROCESS_INDEX", process_index)
+        mp.setattr(ws_manager.settings, "WS_PROCESS_COUNT", process_count)
+        return WSManager(bot=None)
+
+
+def test_ring_is_balanced_and_growth_moves_few_wallets():
+    before = HashRing([node_name(0, i) for i in range(4)])
+    after = HashRing([node_name(0, i) for i in range(5)])
+
+    load = collections.Counter(before.node_for(w) for w in WALLETS)
+    assert max(load.values()) < 2 * len(WALLETS) / 4
+
+    moved = [w for w in WALLETS if before.node_for(w) != after.node_for(w)]
+    # Only wallets taken over by the new shard move
+    assert all(after.node_for(w) == "0:4" for w in moved)
+    assert len(moved) < len(WALLETS) / 3
+
+
+def test_sync_wallets_assigns_grows_and_removes():
+    ws = _manager()
+
+    async def scenario():
+        await ws.sync_wallets(set(list(WALLETS)[:400]))
+        first = dict(ws.wallet_nodes)
+        await ws.sync_wallets({w.upper() for w in WALLETS - {next(iter(first))}})
+        return first
+
+    first = asyncio.run(scenario())
+    removed = next(iter(first))
+
+    assert ws.shard_count == 2
+    assert removed not in ws.tracked_wallets and removed not in ws.wallet_nodes
+    assert set(ws.wallet_nodes) == WALLETS - {removed}
+    for node, shard in ws.shards.items():
+        assert shard.wallets == {w for w, n in ws.wallet_nodes.items() if n == node}
+    # Wallets kept their shard between syncs
+    assert all(ws.wallet_nodes[w] == n for w, n in first.items() if w != removed)
+
+
+def test_ring_grows_with_wallet_count():
+    ws = _manager()
+    asyncio.run(ws.sync_wallets({f"0x{i:040x}" for i in range(1000)}))
+    assert ws.shard_count == 4
+    assert max(len(s.wallets) for s in ws.shards.values()) < 500
+
+
+def test_processes_split_wallets_without_overlap():
+    managers = [_manager(index, 2) for index in range(2)]
+    for ws in managers:
+        asyncio.run(ws.sync_wallets(WALLETS))
+
+    owned = [set(ws.wallet_nodes) for ws in managers]
+    assert owned[0] and owned[1]
+    assert not owned[0] & owned[1]
+    assert owned[0] | owned[1] == WALLETS
+    for index, ws in enumerate(managers):
+        assert all(node_process(node) == index for node in ws.shards)
+        assert all(ws.owns(w) for w in owned[index])
+        assert ws.tracked_wallets == owned[index]
+    assert managers[0].is_primary_process and not managers[1].is_primary_process
+
+
+def test_processes_share_one_ring_size():
+    big, small = _manager(0, 2), _manager(1, 2)
+    many = {f"0x{i:040x}" for i in range(2000)}
+
+    async def scenario():
+        await big.sync_wallets(many)
+        # A process that saw fewer wallets still builds the stored ring
+        await small.sync_wallets(set(list(many)[:100]))
+        # Subscribing between syncs places the wallet without resizing
+        await small.subscribe_user("0x" + "f" * 40)
+
+    asyncio.run(scenario())
+    assert big.shard_count == small.shard_count == 4
+    assert big.ring.node_for("0x" + "f" * 40) == small.ring.node_for("0x" + "f" * 40)
+
+
+def test_ring_shrinks_with_hysteresis_and_other_processes_follow():
+    primary, other = _manager(0, 2), _manager(1, 2)
+    many = sorted(f"0x{i:040x}" for i in range(2000))
+
+    async def scenario():
+        sizes = []
+        for ws, wallets in ((primary, many), (other, many), (primary, many[:1400]), (other, many[:500])):
+            await ws.sync_wallets(set(wallets))
+            sizes.append(ws.shard_count)
+        # 250 wallets per process fit two shards at most 60% full
+        await primary.sync_wallets(set(many[:500]))
+        await other.sync_wallets(set(many[:500]))
+        return sizes
+
+    sizes = asyncio.run(scenario())
+    # 700 per process would need 3 shards, but 4 are not yet empty enough to drop one; only process 0 shrinks
+    assert sizes == [4, 4, 4, 4]
+    assert primary.shard_count == other.shard_count == 2
+    assert set(primary.shards) == {"0:0", "0:1"} and set(other.shards) == {"1:0", "1:1"}
+    assert set(primary.wallet_nodes) | set(other.wallet_nodes) == set(many[:500])
+    for ws in (primary, other):
+        for node, shard in ws.shards.items():
+            assert shard.wallets == {w for w, n in ws.wallet_nodes.items() if n == node}
+
+
+class _FakeSocket:
+    """Connection that answers the first userFills subscription with a frame."""
+
+    def __init__(self):
+        self.sent = []
+        self.inbox = asyncio.Queue()
+        self.closed = False
+
+    async def send(self, frame):
+        frame = json.loads(frame)
+        self.sent.append(frame)
+        sub = frame.get("subscription", {})
+        if sub.get("type") == "userFills" and self.inbox.empty():
+            self.inbox.put_nowait(json.dumps({"channel": "userFills", "data": {"user": sub["user"], "fills": []}}))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self.inbox.get()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+    async def close(self):
+        self.closed = True
+        self.inbox.put_nowait(None)
+
+
+def test_processes_split_the_frame_budget(monkeypatch):
+    monkeypatch.setattr(ws_manager.settings, "WS_SUBSCRIBE_RATE_PER_MIN", 1800)
+    monkeypatch.setattr(ws_manager.settings, "WS_SUBSCRIBE_BURST", 60)
+    limiters = [_manager(index, 3).frame_limiter for index in range(3)]
+    assert sum(l.rate for l in limiters) * 60 == 1800
+    assert sum(l.burst for l in limiters) == 60
+
+
+def test_limiter_paces_frames_after_burst():
+    limiter = FrameLimiter(per_min=6000, burst=6)  # 100 frames/s
+
+    async def scenario():
+        started = time.monotonic()
+        for _ in range(12):
+            await limiter.acquire(3)
+        return time.monotonic() - started
+
+    # 36 frames, 6 free: 30 paced frames take ~0.3s
+    assert 0.25 < asyncio.run(scenario()) < 1.5
+
+
+def test_shard_brings_wallets_up_concurrently(monkeypatch):
+    socket = _FakeSocket()
+    monkeypatch.setattr(ws_shards.websockets, "connect", lambda url: socket)
+    seeding = asyncio.Semaphore(8)
+    seeded, received = [], []
+
+    async def prepare(wallet):
+        async with seeding:
+            await asyncio.sleep(0.02)  # REST round trip
+            seeded.append(wallet)
+
+    async def on_message(data):
+        received.append(data["channel"])
+
+    async def scenario():
+        shard = WalletShard("0:0", "wss://test", on_message, prepare=prepare, limiter=FrameLimiter(60_000, 100))
+        shard.wallets = {f"0x{i:040x}" for i in range(200)}
+        shard.running = True
+        task = asyncio.create_task(shard._run())
+        while shard.ready_sec is None:
+            await asyncio.sleep(0.01)
+        await shard.stop()
+        task.cancel()
+        return shard
+
+    shard = asyncio.run(scenario())
+    # One at a time this was 200 x (seed + 50ms) = 14s
+    assert shard.ready_sec < 3
+    assert len(seeded) == 200 and shard.subscribed == shard.wallets
+    assert len(socket.sent) == 600
+    # Snapshots started arriving before the last wallet was subscribed
+    assert received and shard.first_snapshot_sec < shard.ready_sec
+
+
+def test_first_alert_is_timed_per_connection(monkeypatch):
+    sockets = [_FakeSocket(), _FakeSocket()]
+    connects = iter(sockets)
+    monkeypatch.setattr(ws_shards.websockets, "connect", lambda url: next(connects))
+
+    async def users_by_wallet(wallet):
+        return [{"chat_id": 1, "wallet_address": wallet}]
+
+    async def lang(chat_id):
+        return "en"
+
+    monkeypatch.setattr(ws_manager.db, "get_users_by_wallet", users_by_wallet)
+    monkeypatch.setattr(ws_manager.db, "get_lang", lang)
+
+    class Bot:
+        sent = []
+
+        async def send_message(self, chat_id, text, **kwargs):
+            self.sent.append(chat_id)
+
+    ws = _manager()
+    ws.bot = Bot()
+    fill = {"coin": "BTC", "side": "B", "px": "100", "sz": "1", "time": 1}
+
+    async def on_message(data):
+        fills = data["data"]["fills"]
+        if fills:
+            # Sent from a spawned task, as handle_fills' callers may do
+            await asyncio.create_task(ws._notify_fills(data["data"]["user"], [(f, "BTC") for f in fills]))
+
+    async def until(check):
+        while not check():
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        shard = WalletShard("0:0", "wss://test", on_message)
+        shard.wallets = {"0x" + "1" * 40}
+        shard.running = True
+        task = asyncio.create_task(shard._run())
+        # The subscription snapshot is not an alert
+        await until(lambda: shard.first_snapshot_sec is not None)
+        await asyncio.sleep(0.05)
+        assert shard.alerts.first_alert_sec is None and not Bot.sent
+
+        sockets[0].inbox.put_nowait(json.dumps({"channel": "userFills", "data": {"user": "0x" + "1" * 40, "fills": [fill]}}))
+        await until(lambda: shard.alerts.first_alert_sec is not None)
+        first = shard.alerts.first_alert_sec
+        assert Bot.sent == [1] and first >= shard.first_snapshot_sec
+
+        # A reconnect starts a new measurement
+        await sockets[0].close()
+        await until(lambda: shard.connects == 2 and shard.first_snapshot_sec is not None)
+        assert shard.alerts.first_alert_sec is None
+        sockets[1].inbox.put_nowait(json.dumps({"channel": "userFills", "data": {"user": "0x" + "1" * 40, "fills": [fill]}}))
+        await until(lambda: shard.alerts.first_alert_sec is not None)
+
+        ws.shards = {shard.node: shard}
+        stats = ws.bringup_stats()
+        await shard.stop()
+        task.cancel()
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert stats["shards"]["0:0"]["first_alert"] is not None
+    # Nothing was sent on the price connection's behalf
+    assert stats["first_alert"] is None and stats["standby_first_alert"] is None
+
+
+def test_reconnect_keeps_cached_orders_as_seed(monkeypatch):
+    calls = []
+
+    async def fake_open_orders(wallet):
+        calls.append(wallet)
+        return {"orders": [{"oid": 1}]}
+
+    monkeypatch.setattr(ws_manager, "get_open_orders", fake_open_orders)
+    ws = _manager()
+
+    async def scenario():
+        await ws._prepare_wallet("0xa")
+        await ws._prepare_wallet("0xa")  # reconnect
+
+    asyncio.run(scenario())
+    assert calls == ["0xa"]
+    assert ws.open_orders["0xa"] == [{"oid": 1}]
+
+
+def test_watchdog_closes_only_a_silent_channel():
+    async def scenario(feed: bool):
+        socket, freshness = _FakeSocket(), Freshness()
+        watchdog = asyncio.create_task(watch_freshness(socket, freshness, {"allMids": 0.15}, "test"))
+        for _ in range(20):
+            if feed:
+                freshness.touch("allMids")
+            await asyncio.sleep(0.02)
+        watchdog.cancel()
+        return socket.closed
+
+    assert asyncio.run(scenario(feed=False)) is True
+    assert asyncio.run(scenario(feed=True)) is False
+
+
+def test_stalled_shard_reconnects_without_backoff(monkeypatch):
+    sockets = []
+
+    def connect(url):
+        sockets.append(_FakeSocket())
+        return sockets[-1]
+
+    monkeypatch.setattr(ws_shards.websockets, "connect", connect)
+
+    async def on_message(data):
+        pass
+
+    async def scenario():
+        shard = WalletShard("0:0", "wss://test", on_message, stale_sec=0.1)
+        shard.wallets = {"0xa"}
+        shard.running = True
+        task = asyncio.create_task(shard._run())
+        started = time.monotonic()
+        # Frames stop after the subscription snapshot; the error backoff would be 5s
+        while shard.connects < 2 and time.monotonic() - started < 3:
+            await asyncio.sleep(0.02)
+        await shard.stop()
+        task.cancel()
+        return shard, time.monotonic() - started
+
+    shard, elapsed = asyncio.run(scenario())
+    assert shard.connects >= 2 and elapsed < 1.5
+    assert sockets[0].closed
+
+
+def test_standby_mids_are_deduplicated_against_primary(monkeypatch):
+    monkeypatch.setattr(ws_manager.settings, "WS_PRICE_STANDBY", True)
+    ws = _manager()
+    handled = []
+
+    async def handle_mids(mids):
+        handled.append(mids["BTC"])
+
+    ws.handle_mids = handle_mids
+
+    def frame(px):
+        return {"channel": "allMids", "data": {"mids": {"BTC": px, "ETH": "2000"}}}
+
+    async def scenario():
+        for px in ("1", "1", "2", "1", "2",  # primary and standby interleaved, standby lagging
+                   "3", "4"):  # primary stalled, standby carries on
+            await ws.handle_message(frame(px))
+
+    asyncio.run(scenario())
+    assert handled == ["1", "2", "3", "4"]